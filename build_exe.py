@@ -4,11 +4,16 @@
 """
 
 import PyInstaller.__main__
+import argparse
 import os
 import sys
 
-def build_exe():
-    """使用PyInstaller打包HTTP版本"""
+def build_exe(onedir=False):
+    """使用PyInstaller打包HTTP版本
+
+    onedir=True 时输出为目录而不是单文件：单文件版本每次启动都要先把
+    依赖解包到临时目录，频繁启动服务器的场景下目录版本冷启动明显更快。
+    """
     
     current_dir = os.path.dirname(os.path.abspath(__file__))
     server_script = os.path.join(current_dir, "pymol_mcp_server.py")
@@ -16,7 +21,7 @@ def build_exe():
     args = [
         server_script,
         '--name=pymol-mcp-server',
-        '--onefile',
+        '--onedir' if onedir else '--onefile',
         '--console',
         '--clean',
         '--noconfirm',
@@ -39,7 +44,10 @@ def build_exe():
     
     print("\n打包完成!")
     print(f"输出目录: {os.path.join(current_dir, 'dist')}")
-    print(f"可执行文件: {os.path.join(current_dir, 'dist', 'pymol-mcp-server.exe')}")
+    if onedir:
+        print(f"可执行文件: {os.path.join(current_dir, 'dist', 'pymol-mcp-server', 'pymol-mcp-server.exe')}")
+    else:
+        print(f"可执行文件: {os.path.join(current_dir, 'dist', 'pymol-mcp-server.exe')}")
     print("\n使用方法:")
     print("  pymol-mcp-server.exe --host 127.0.0.1 --port 3000")
     print("\n在MCP客户端中配置URL:")
@@ -53,4 +61,7 @@ if __name__ == "__main__":
         print("  pip install pyinstaller")
         sys.exit(1)
     
-    build_exe()
+    parser = argparse.ArgumentParser(description="打包 PyMOL MCP HTTP Server")
+    parser.add_argument("--onedir", action="store_true",
+                        help="输出为目录而不是单文件（启动时无需解包，冷启动更快）")
+    build_exe(onedir=parser.parse_args().onedir)
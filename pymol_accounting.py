@@ -0,0 +1,201 @@
+"""
+PyMOL MCP 资源用量统计
+
+每次工具调用前后采样PyMOL后端进程的常驻内存和CPU时间，把差值记到
+会话、工具和后端名下，通过 /admin/usage 端点查看：
+
+    - 后端进程在本机时直接读取进程信息（psutil 或 /proc），不需要额外RPC
+    - 远程后端通过PyMOL端的 mcp_resource_usage 探针采样，每次多一次RPC，
+      默认只记录耗时（--remote-accounting 开启）
+
+CostGuard 根据缓存的原子数判断调用是否可能很昂贵（例如对几十万个原子
+生成表面），按策略自动降低细节、给出警告或拒绝。
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from dataclasses import asdict, dataclass
+from typing import Any, Callable, Deque, Dict, Iterable, List, Optional, Tuple
+
+# 各表示方式允许的原子数上限（超过即视为昂贵调用）；
+# render 为渲染时以 surface/mesh/spheres/dots 显示的原子数上限
+DEFAULT_REP_LIMITS = {
+    "surface": 150000,
+    "mesh": 150000,
+    "dots": 300000,
+    "spheres": 300000,
+    "cartoon": 1000000,
+    "render": 300000,
+}
+
+
+def process_usage(pid: int) -> Optional[Dict[str, float]]:
+    """读取本机进程的常驻内存（MB）和累计CPU时间（秒），无法读取时返回 None"""
+    try:
+        import psutil
+    except ImportError:
+        pass
+    else:
+        try:
+            process = psutil.Process(pid)
+            cpu = process.cpu_times()
+            return {"rss_mb": process.memory_info().rss / 2**20, "cpu_s": cpu.user + cpu.system}
+        except Exception:
+            return None
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            # 第2个字段（进程名）可能含空格，从右括号之后开始拆分
+            fields = f.read().rpartition(")")[2].split()
+        with open(f"/proc/{pid}/statm") as f:
+            pages = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    ticks = os.sysconf("SC_CLK_TCK")
+    return {
+        "rss_mb": pages * os.sysconf("SC_PAGE_SIZE") / 2**20,
+        "cpu_s": (int(fields[11]) + int(fields[12])) / ticks,
+    }
+
+
+@dataclass
+class UsageTotals:
+    """一组调用的累计资源用量"""
+    calls: int = 0
+    wall_s: float = 0.0
+    cpu_s: float = 0.0
+    # 内存增长只累计正的差值；max_rss_delta_mb 为单次调用的最大增长
+    rss_growth_mb: float = 0.0
+    max_rss_delta_mb: float = 0.0
+    peak_rss_mb: float = 0.0
+
+    def add(self, wall_s: float, cpu_s: Optional[float], rss_delta: Optional[float],
+            rss_after: Optional[float]) -> None:
+        self.calls += 1
+        self.wall_s += wall_s
+        if cpu_s is not None:
+            self.cpu_s += cpu_s
+        if rss_delta is not None:
+            self.rss_growth_mb += max(rss_delta, 0.0)
+            self.max_rss_delta_mb = max(self.max_rss_delta_mb, rss_delta)
+        if rss_after is not None:
+            self.peak_rss_mb = max(self.peak_rss_mb, rss_after)
+
+    def merge(self, other: "UsageTotals") -> None:
+        self.calls += other.calls
+        self.wall_s += other.wall_s
+        self.cpu_s += other.cpu_s
+        self.rss_growth_mb += other.rss_growth_mb
+        self.max_rss_delta_mb = max(self.max_rss_delta_mb, other.max_rss_delta_mb)
+        self.peak_rss_mb = max(self.peak_rss_mb, other.peak_rss_mb)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {key: round(value, 3) if isinstance(value, float) else value
+                for key, value in asdict(self).items()}
+
+
+class UsageLedger:
+    """按会话、工具和后端汇总的资源用量账本
+
+    按会话的表最多保留 max_sessions 个最近活动的会话，更早的会话合并到
+    "(evicted)" 一行，长时间运行时账本不会随会话数无限增长。
+    """
+
+    EVICTED = "(evicted)"
+
+    def __init__(self, recent: int = 200, max_sessions: int = 1000):
+        self._lock = threading.Lock()
+        self.max_sessions = max_sessions
+        self.by_session: "OrderedDict[str, UsageTotals]" = OrderedDict()
+        self.by_tool: Dict[str, UsageTotals] = {}
+        self.by_backend: Dict[str, UsageTotals] = {}
+        self.recent: Deque[Dict[str, Any]] = deque(maxlen=recent)
+        self.started = time.time()
+
+    def record(self, session_id: str, tool: str, backend: str, wall_s: float,
+               before: Optional[Dict[str, float]], after: Optional[Dict[str, float]]) -> Dict[str, Any]:
+        """记录一次调用，before/after 为调用前后的采样（可能为 None）"""
+        cpu_s = rss_delta = rss_after = None
+        if before and after:
+            cpu_s = max(after["cpu_s"] - before["cpu_s"], 0.0)
+            if before.get("rss_mb") is not None and after.get("rss_mb") is not None:
+                rss_delta = after["rss_mb"] - before["rss_mb"]
+        if after:
+            rss_after = after.get("rss_mb")
+        entry = {
+            "time": time.time(),
+            "session_id": session_id,
+            "tool": tool,
+            "backend": backend,
+            "wall_s": round(wall_s, 4),
+            "cpu_s": round(cpu_s, 4) if cpu_s is not None else None,
+            "rss_delta_mb": round(rss_delta, 2) if rss_delta is not None else None,
+            "rss_mb": round(rss_after, 1) if rss_after is not None else None,
+        }
+        with self._lock:
+            for table, key in ((self.by_session, session_id), (self.by_tool, tool), (self.by_backend, backend)):
+                totals = table.get(key)
+                if totals is None:
+                    totals = table[key] = UsageTotals()
+                totals.add(wall_s, cpu_s, rss_delta, rss_after)
+            self.by_session.move_to_end(session_id)
+            while len(self.by_session) > self.max_sessions:
+                self._evict_session()
+            self.recent.append(entry)
+        return entry
+
+    def _evict_session(self) -> None:
+        key = next(iter(self.by_session))
+        if key == self.EVICTED:
+            self.by_session.move_to_end(key)
+            key = next(iter(self.by_session))
+        old = self.by_session.pop(key)
+        self.by_session.setdefault(self.EVICTED, UsageTotals()).merge(old)
+
+    def snapshot(self, top: Optional[int] = None) -> Dict[str, Any]:
+        """返回账本快照，各表按CPU时间降序；top 限制每个表的条目数"""
+        def table(rows: Dict[str, UsageTotals]) -> Dict[str, Any]:
+            ordered = sorted(rows.items(), key=lambda kv: (kv[1].cpu_s, kv[1].wall_s), reverse=True)
+            return {key: totals.as_dict() for key, totals in ordered[:top]}
+
+        with self._lock:
+            return {
+                "since": self.started,
+                "by_session": table(self.by_session),
+                "by_tool": table(self.by_tool),
+                "by_backend": table(self.by_backend),
+                "recent": list(self.recent),
+            }
+
+
+class CostGuard:
+    """根据目标选择的原子数判断表示方式请求是否昂贵
+
+    policy 为 "lod"（pymol_show 和渲染自动降低细节，见 pymol_lod；其他调用附加警告）、
+    "warn"（照常执行并附加警告）或 "reject"（拒绝执行）。
+    """
+
+    POLICIES = ("lod", "warn", "reject")
+
+    def __init__(self, rep_limits: Optional[Dict[str, int]] = None, policy: str = "lod"):
+        if policy not in self.POLICIES:
+            raise ValueError(f"未知的昂贵调用策略: {policy}（可用: {', '.join(self.POLICIES)}）")
+        self.rep_limits = dict(DEFAULT_REP_LIMITS if rep_limits is None else rep_limits)
+        self.policy = policy
+        self.flagged = 0
+
+    def check(self, requests: Iterable[Tuple[str, str]],
+              count_atoms: Callable[[str], int]) -> List[str]:
+        """检查 (表示方式, 选择) 请求，返回超限说明（为空表示不昂贵）"""
+        problems = []
+        for rep, selection in requests:
+            limit = self.rep_limits.get(rep)
+            if limit is None:
+                continue
+            atoms = count_atoms(selection)
+            if atoms > limit:
+                problems.append(f"{rep} 作用于 {selection} 的 {atoms} 个原子，超过上限 {limit}")
+        if problems:
+            self.flagged += 1
+        return problems
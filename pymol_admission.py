@@ -0,0 +1,264 @@
+"""
+PyMOL MCP 准入控制
+
+在 call_tool 之前限制并发和速率，保证过载时延迟仍然有界：
+
+    - 全局并发上限：同时执行的工具调用数
+    - 按工具的并发上限：例如同一后端同时只做一次 pymol_ray；调用方给出后端
+      （工作进程池模式下会话绑定的PyMOL进程）时按后端分别计算，否则所有调用共用
+    - 有界排队：全局排队或单个工具排队已满时立即拒绝，排队超时也拒绝
+    - 按会话的令牌桶限速
+
+被拒绝的调用抛出 AdmissionRejected，附带 429 风格的错误码和建议重试时间。
+"""
+
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, Optional, Tuple
+
+
+# 默认的按工具并发上限（未列出的工具只受全局上限约束）
+DEFAULT_TOOL_LIMITS = {
+    "pymol_ray": 1,
+    "pymol_png": 1,
+    "pymol_sasa_summary": 2,
+    "pymol_align_many": 2,
+    "pymol_convert_many": 1,
+    "pymol_gallery": 1,
+}
+
+
+class AdmissionRejected(Exception):
+    """工具调用被准入控制拒绝"""
+
+    def __init__(self, reason: str, retry_after: float, detail: str):
+        super().__init__(detail)
+        self.reason = reason
+        self.retry_after = max(retry_after, 0.0)
+        self.detail = detail
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "error": self.reason,
+            "status": 429,
+            "retry_after": round(self.retry_after, 2),
+            "detail": self.detail,
+        }
+
+
+class _Slots:
+    """FIFO计数信号量，可以查询排队长度
+
+    不使用 asyncio.Semaphore，因为它会绑定到第一次使用它的事件循环。
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.active = 0
+        self.waiters: Deque[asyncio.Future] = deque()
+        # 正在使用（排队、持有或即将排队）的调用数，为0时按后端的名额可以丢弃
+        self.users = 0
+
+    @property
+    def queued(self) -> int:
+        return len(self.waiters)
+
+    async def acquire(self) -> None:
+        if self.active < self.limit and not self.waiters:
+            self.active += 1
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # 名额已经转交给我们，但调用方放弃了：还回去
+                self.release()
+            else:
+                self.waiters.remove(waiter)
+            raise
+
+    def release(self) -> None:
+        # 名额直接转交给下一个等待者，保持 FIFO
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+
+@dataclass
+class _TokenBucket:
+    rate: float
+    burst: float
+    tokens: float
+    updated: float = field(default_factory=time.monotonic)
+
+    def take(self) -> float:
+        """取一个令牌，成功返回0，否则返回需要等待的秒数"""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            return 0.0
+        return (1.0 - self.tokens) / self.rate
+
+
+class AdmissionController:
+    """全局/按工具并发控制、有界排队和按会话限速"""
+
+    def __init__(self, max_in_flight: int = 4, max_queue: int = 32, tool_queue: int = 8,
+                 max_wait: float = 30.0, tool_limits: Optional[Dict[str, int]] = None,
+                 rate: Optional[float] = 10.0, burst: float = 20.0):
+        self.max_queue = max_queue
+        self.tool_queue = tool_queue
+        self.max_wait = max_wait
+        self.rate = rate
+        self.burst = burst
+        self.tool_limits = dict(DEFAULT_TOOL_LIMITS if tool_limits is None else tool_limits)
+        self._global = _Slots(max_in_flight)
+        self._tools: Dict[Tuple[str, Optional[str]], _Slots] = {}
+        self._buckets: Dict[str, _TokenBucket] = {}
+        self._prune_at = 256
+        # 每个工具最近调用耗时的指数移动平均（秒），用于估算重试时间
+        self._service_time: Dict[str, float] = {}
+        self.admitted = 0
+        self.rejected: Dict[str, int] = {}
+
+    def _tool_slots(self, tool: str, backend: Optional[str]) -> Optional[_Slots]:
+        limit = self.tool_limits.get(tool)
+        if limit is None:
+            return None
+        slots = self._tools.get((tool, backend))
+        if slots is None:
+            slots = self._tools[(tool, backend)] = _Slots(limit)
+        slots.users += 1
+        return slots
+
+    def _done_with(self, tool: str, backend: Optional[str], slots: _Slots) -> None:
+        slots.users -= 1
+        if backend is not None and slots.users == 0 and self._tools.get((tool, backend)) is slots:
+            # 后端（工作进程）会被回收和替换，不保留空闲的按后端名额
+            del self._tools[(tool, backend)]
+
+    def queued(self) -> int:
+        """排队等待的调用总数（包括在按工具上限处排队的）"""
+        return self._global.queued + sum(s.queued for s in self._tools.values())
+
+    def _estimate_wait(self, tool: str, queued: int, parallel: int) -> float:
+        service = self._service_time.get(tool, 1.0)
+        return service * (queued / max(parallel, 1) + 1)
+
+    def _reject(self, reason: str, retry_after: float, detail: str):
+        self.rejected[reason] = self.rejected.get(reason, 0) + 1
+        raise AdmissionRejected(reason, retry_after, detail)
+
+    def _prune_buckets(self) -> None:
+        """丢弃已经回满的令牌桶（与新建的桶等价，不影响限速），避免会话很多时无限增长"""
+        now = time.monotonic()
+        full = [key for key, bucket in self._buckets.items()
+                if bucket.tokens + (now - bucket.updated) * self.rate >= self.burst]
+        for key in full:
+            del self._buckets[key]
+        if len(self._buckets) > 10000:
+            # 仍然太多时丢弃最久未使用的
+            for key in sorted(self._buckets, key=lambda k: self._buckets[k].updated)[:len(self._buckets) - 10000]:
+                del self._buckets[key]
+        self._prune_at = max(256, 2 * len(self._buckets))
+
+    def _check_rate(self, session_id: str) -> None:
+        if not self.rate:
+            return
+        bucket = self._buckets.get(session_id)
+        if bucket is None:
+            if len(self._buckets) >= self._prune_at:
+                self._prune_buckets()
+            bucket = self._buckets[session_id] = _TokenBucket(self.rate, self.burst, self.burst)
+        wait = bucket.take()
+        if wait > 0:
+            self._reject("rate_limited", wait, f"会话 {session_id} 超过速率限制 ({self.rate:g} 次/秒)")
+
+    def _check_queue(self, tool: str, backend: Optional[str]) -> None:
+        queued = self.queued()
+        if queued >= self.max_queue:
+            self._reject("queue_full", self._estimate_wait(tool, queued, self._global.limit),
+                         f"服务器繁忙，排队请求已达上限 ({self.max_queue})")
+        tool_slots = self._tools.get((tool, backend))
+        if tool_slots is not None and tool_slots.queued >= self.tool_queue:
+            self._reject("tool_queue_full", self._estimate_wait(tool, tool_slots.queued, tool_slots.limit),
+                         f"{tool} 排队请求已达上限 ({self.tool_queue})")
+
+    @asynccontextmanager
+    async def admit(self, session_id: str, tool: str, backend: Optional[str] = None):
+        """准入一次工具调用；被拒绝时抛出 AdmissionRejected
+
+        backend 不为空时按工具的并发上限只在发往同一后端的调用之间计算。
+        """
+        # 先检查排队容量再取令牌：因排队已满被拒绝的调用不消耗会话的令牌，
+        # 客户端按 retry_after 重试时不会再被限速拒绝
+        self._check_queue(tool, backend)
+        self._check_rate(session_id)
+
+        tool_slots = self._tool_slots(tool, backend)
+        try:
+            async with self._admit(tool, tool_slots):
+                yield
+        finally:
+            if tool_slots is not None:
+                self._done_with(tool, backend, tool_slots)
+
+    @asynccontextmanager
+    async def _admit(self, tool: str, tool_slots: Optional[_Slots]):
+        acquired = []
+        deadline = time.monotonic() + self.max_wait
+        try:
+            for slots in (tool_slots, self._global):
+                if slots is None:
+                    continue
+                try:
+                    await asyncio.wait_for(slots.acquire(), max(deadline - time.monotonic(), 0.0))
+                except asyncio.TimeoutError:
+                    self._reject("queue_timeout", self._estimate_wait(tool, slots.queued, slots.limit),
+                                 f"排队超过 {self.max_wait:g} 秒")
+                acquired.append(slots)
+        except BaseException:
+            for slots in reversed(acquired):
+                slots.release()
+            raise
+
+        self.admitted += 1
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            elapsed = time.monotonic() - start
+            previous = self._service_time.get(tool)
+            self._service_time[tool] = elapsed if previous is None else 0.8 * previous + 0.2 * elapsed
+            for slots in reversed(acquired):
+                slots.release()
+
+    def stats(self) -> Dict[str, Any]:
+        tools: Dict[str, Dict[str, Any]] = {}
+        for (tool, backend), s in self._tools.items():
+            entry = tools.setdefault(tool, {"in_flight": 0, "queued": 0, "limit": s.limit})
+            entry["in_flight"] += s.active
+            entry["queued"] += s.queued
+            if backend is not None:
+                entry["backends"] = entry.get("backends", 0) + 1
+        return {
+            "in_flight": self._global.active,
+            "queued": self.queued(),
+            "max_in_flight": self._global.limit,
+            "max_queue": self.max_queue,
+            "admitted": self.admitted,
+            "rejected": dict(self.rejected),
+            # 按后端计算时 limit 是每个后端的上限，backends 是当前有调用的后端数
+            "tools": tools,
+            "rate_limit": {"rate": self.rate, "burst": self.burst, "sessions": len(self._buckets)},
+        }
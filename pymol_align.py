@@ -0,0 +1,116 @@
+"""
+PyMOL MCP 多结构比对
+
+pymol_align_many 把一个参考结构与一组目标（名称列表或通配符）逐一比对，
+一次返回按RMSD排序、分页的结果表，而不是每对结构一次 pymol_do "align"、
+结果只打印在PyMOL控制台：
+
+    - align / super：在PyMOL端由 mcp_align_many 辅助函数一次RPC完成一批比对；
+      工作进程池模式下目标分块，借用空闲的备用进程并行比对
+    - fit：原子已对应的情况（同一体系的多个构象、NMR模型等）不做序列比对，
+      直接在服务器端对缓存的坐标数组做批量Kabsch叠合
+"""
+
+import fnmatch
+from typing import Any, Dict, List, Optional, Sequence
+
+METHODS = ("align", "super", "fit")
+SORT_KEYS = ("rmsd", "atoms", "target")
+
+# 每个借用的工作进程至少分到的目标数，目标更少时不值得传输结构
+MIN_CHUNK = 8
+
+
+def atom_selection(atoms: Sequence[str]) -> str:
+    """原子名列表转换为PyMOL选择表达式，空列表表示全部原子"""
+    return "name " + "+".join(atoms) if atoms else ""
+
+
+def restrict(selection: str, atoms: Sequence[str]) -> str:
+    names = atom_selection(atoms)
+    return f"({selection}) and {names}" if names else selection
+
+
+def resolve_targets(object_names: Sequence[str], reference: str, targets: Optional[Sequence[str]],
+                    pattern: Optional[str]) -> List[str]:
+    """目标列表：显式给出的名称加上匹配通配符的对象（保持顺序、去重、排除参考结构）"""
+    resolved: List[str] = []
+    for name in list(targets or []) + (fnmatch.filter(object_names, pattern) if pattern else []):
+        if name != reference and name not in resolved:
+            resolved.append(name)
+    return resolved
+
+
+def split(targets: Sequence[str], parts: int) -> List[List[str]]:
+    """把目标均分为 parts 块（顺序分块，块间大小最多相差1）"""
+    parts = max(min(parts, len(targets)), 1)
+    size, extra = divmod(len(targets), parts)
+    chunks, start = [], 0
+    for k in range(parts):
+        end = start + size + (1 if k < extra else 0)
+        chunks.append(list(targets[start:end]))
+        start = end
+    return chunks
+
+
+def _align_result(target: str, result) -> Dict[str, Any]:
+    # cmd.align / cmd.super 返回 [RMSD, 原子数, 循环次数, 剔除前RMSD, 剔除前原子数, 得分, 残基数]
+    return {
+        "target": target,
+        "rmsd": round(float(result[0]), 3),
+        "atoms": int(result[1]),
+        "cycles": int(result[2]),
+        "rmsd_pre": round(float(result[3]), 3),
+        "atoms_pre": int(result[4]),
+    }
+
+
+def align_batch(cmd, reference: str, targets: Sequence[str], method: str = "align",
+                atoms: Sequence[str] = (), cycles: int = 5, transform: bool = False,
+                use_helper: bool = True) -> List[Dict[str, Any]]:
+    """在一个PyMOL后端上依次比对，有 mcp_align_many 辅助函数时只需一次RPC"""
+    import xmlrpc.client
+    target_sel = restrict(reference, atoms)
+    if use_helper:
+        try:
+            return cmd.mcp_align_many(target_sel, list(targets), method, atom_selection(atoms),
+                                      cycles, int(transform))
+        except xmlrpc.client.Fault as e:
+            if "mcp_align_many" not in str(e):
+                raise
+            # 旧版本服务器注入的辅助函数中没有 mcp_align_many
+
+    func = getattr(cmd, method)
+    results = []
+    for target in targets:
+        try:
+            # XML-RPC只能按位置传参: mobile, target, cutoff, cycles, gap, extend, max_gap, object,
+            # matrix, mobile_state, target_state, quiet, max_skip, transform
+            result = func(restrict(target, atoms), target_sel, 2.0, cycles, -10.0, -0.5, 50, "",
+                          "BLOSUM62", 0, 0, 1, 0, int(transform))
+            results.append(_align_result(target, result))
+        except Exception as e:
+            results.append({"target": target, "error": str(e)})
+    return results
+
+
+def page(results: List[Dict[str, Any]], sort: str = "rmsd", descending: bool = False,
+         offset: int = 0, limit: int = 50) -> Dict[str, Any]:
+    """排序并分页；出错的目标单独列出，不参与排序"""
+    if sort not in SORT_KEYS:
+        raise ValueError(f"未知排序字段: {sort}（可选 {', '.join(SORT_KEYS)}）")
+    if limit < 1:
+        # limit 为 0 时 next_offset 不前进，按 next_offset 翻页的客户端会一直取同一页
+        raise ValueError(f"limit 至少为 1: {limit}")
+    ok = [r for r in results if "error" not in r]
+    failed = [r for r in results if "error" in r]
+    ok.sort(key=lambda r: r[sort], reverse=descending)
+    offset = max(offset, 0)
+    return {
+        "total": len(ok),
+        "offset": offset,
+        "limit": limit,
+        "next_offset": offset + limit if offset + limit < len(ok) else None,
+        "results": ok[offset:offset + limit],
+        "failed": failed,
+    }
@@ -0,0 +1,602 @@
+"""
+PyMOL 几何分析 - 在MCP服务器端用NumPy向量化计算
+
+坐标通过一次 get_pdbstr 调用以数组形式取回，之后的接触、近邻、
+RMSD 和溶剂可及表面积（SASA）计算全部在服务器端完成，
+结果以紧凑的结构化数据返回，而不是打印到PyMOL控制台。
+
+空间索引使用均匀网格（cell list），所有查询均为向量化实现，
+5万原子体系的全原子接触图可在1秒内完成。
+"""
+
+import math
+from dataclasses import dataclass
+from itertools import product
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+# Bondi 范德华半径（Å），未列出的元素使用默认值
+VDW_RADII = {
+    "H": 1.20, "C": 1.70, "N": 1.55, "O": 1.52, "S": 1.80, "P": 1.80,
+    "F": 1.47, "CL": 1.75, "BR": 1.85, "I": 1.98, "SE": 1.90,
+}
+DEFAULT_RADIUS = 1.80
+POLAR_ELEMENTS = {"N", "O"}
+
+
+def _positive(name: str, value: float) -> float:
+    """检查距离类参数为有限的正数"""
+    value = float(value)
+    if not (math.isfinite(value) and value > 0):
+        raise ValueError(f"{name} 必须是有限的正数: {value:g}")
+    return value
+
+
+def _count(name: str, value: int) -> int:
+    """检查条目数类参数为非负整数"""
+    value = int(value)
+    if value < 0:
+        raise ValueError(f"{name} 不能为负数: {value}")
+    return value
+
+
+@dataclass
+class AtomTable:
+    """一个选择中所有原子的列式数据"""
+    coords: np.ndarray   # (N, 3) float64
+    name: np.ndarray     # 原子名
+    resn: np.ndarray     # 残基名
+    resi: np.ndarray     # 残基编号（含插入码）
+    chain: np.ndarray    # 链标识符
+    elem: np.ndarray     # 元素符号（大写）
+
+    def __len__(self) -> int:
+        return len(self.coords)
+
+    def subset(self, rows: np.ndarray) -> "AtomTable":
+        """按行号或布尔掩码取出部分原子"""
+        return AtomTable(self.coords[rows], self.name[rows], self.resn[rows], self.resi[rows],
+                         self.chain[rows], self.elem[rows])
+
+    def with_names(self, names) -> "AtomTable":
+        """只保留给定原子名的原子"""
+        return self.subset(np.isin(self.name, list(names)))
+
+    def residue_labels(self) -> np.ndarray:
+        """每个原子所属残基的标签，如 A/LYS`45"""
+        return np.char.add(
+            np.char.add(np.char.add(self.chain, "/"), np.char.add(self.resn, "`")),
+            self.resi,
+        )
+
+    def atom_labels(self) -> np.ndarray:
+        """每个原子的标签，如 A/LYS`45/NZ"""
+        return np.char.add(np.char.add(self.residue_labels(), "/"), self.name)
+
+    def radii(self) -> np.ndarray:
+        """按元素查表得到的范德华半径"""
+        return np.array([VDW_RADII.get(e, DEFAULT_RADIUS) for e in self.elem], dtype=np.float64)
+
+
+def parse_pdb_atoms(pdb_str: str) -> AtomTable:
+    """把PDB文本解析为 AtomTable（按固定列宽向量化切片）"""
+    lines = [
+        line for line in pdb_str.splitlines()
+        if line.startswith("ATOM") or line.startswith("HETATM")
+    ]
+    if not lines:
+        empty = np.array([], dtype=str)
+        return AtomTable(np.zeros((0, 3)), empty, empty, empty, empty, empty)
+
+    buf = "".join(line[:80].ljust(80) for line in lines).encode("ascii", "replace")
+    grid = np.frombuffer(buf, dtype="S1").reshape(-1, 80)
+
+    def column(start: int, end: int) -> np.ndarray:
+        return grid[:, start:end].copy().view(f"S{end - start}").ravel()
+
+    def text(start: int, end: int) -> np.ndarray:
+        return np.char.strip(np.char.decode(column(start, end), "ascii"))
+
+    coords = np.stack([column(30, 38), column(38, 46), column(46, 54)], axis=1).astype(np.float64)
+    name = text(12, 16)
+    elem = np.char.upper(text(76, 78))
+    # 元素列缺失时由原子名首字母推断
+    missing = elem == ""
+    if missing.any():
+        elem[missing] = [n.lstrip("0123456789")[:1].upper() for n in name[missing]]
+    return AtomTable(
+        coords=coords,
+        name=name,
+        resn=text(17, 20),
+        resi=text(22, 27),
+        chain=text(21, 22),
+        elem=elem,
+    )
+
+
+def model_atoms(model) -> AtomTable:
+    """把 cmd.get_model 返回的 chempy 模型转换为 AtomTable（不经过PDB文本）"""
+    atoms = model.atom
+    if not atoms:
+        empty = np.array([], dtype=str)
+        return AtomTable(np.zeros((0, 3)), empty, empty, empty, empty, empty)
+    return AtomTable(
+        coords=np.array([atom.coord for atom in atoms], dtype=np.float64),
+        name=np.array([atom.name for atom in atoms]),
+        resn=np.array([atom.resn for atom in atoms]),
+        resi=np.array([atom.resi for atom in atoms]),
+        chain=np.array([atom.chain for atom in atoms]),
+        elem=np.char.upper(np.array([atom.symbol or atom.name.lstrip("0123456789")[:1] for atom in atoms])),
+    )
+
+
+def fetch_atoms(cmd, selection: str, state: int = -1) -> AtomTable:
+    """通过一次XML-RPC调用取回选择的坐标和原子属性
+
+    在PyMOL进程内运行时（cmd.in_process）直接取 chempy 模型，省去PDB文本的生成和解析。
+    """
+    # 类属性：XML-RPC代理对任意属性名都会返回远程方法
+    if getattr(type(cmd), "in_process", False):
+        return model_atoms(cmd.get_model(selection, state))
+    return parse_pdb_atoms(cmd.get_pdbstr(selection, state))
+
+
+class CellList:
+    """均匀网格空间索引
+
+    原子按所在网格单元排序，每个单元记录起点和原子数。
+    查询时对每个邻近单元偏移做一次向量化展开，不逐原子循环。
+    """
+
+    def __init__(self, coords: np.ndarray, cell_size: float):
+        self.coords = np.asarray(coords, dtype=np.float64)
+        self.cell_size = _positive("cell_size", cell_size)
+        if len(self.coords):
+            self.origin = self.coords.min(axis=0)
+        else:
+            self.origin = np.zeros(3)
+        cells = self._cells(self.coords)
+        self.dims = cells.max(axis=0) + 1 if len(cells) else np.ones(3, dtype=np.int64)
+        keys = self._keys(cells)
+        self.order = np.argsort(keys, kind="stable")
+        self.keys, self.starts, self.counts = np.unique(
+            keys[self.order], return_index=True, return_counts=True
+        )
+        # 网格不太稀疏时用稠密查找表代替二分查找
+        n_cells = int(np.prod(self.dims))
+        self._dense = n_cells <= 8 * len(self.coords) + 1_000_000
+        if self._dense:
+            self._dense_starts = np.zeros(n_cells, dtype=np.int64)
+            self._dense_counts = np.zeros(n_cells, dtype=np.int64)
+            self._dense_starts[self.keys] = self.starts
+            self._dense_counts[self.keys] = self.counts
+
+    def __len__(self) -> int:
+        return len(self.coords)
+
+    def _cells(self, points: np.ndarray) -> np.ndarray:
+        return np.floor((points - self.origin) / self.cell_size).astype(np.int64)
+
+    def _keys(self, cells: np.ndarray) -> np.ndarray:
+        return (cells[:, 0] * self.dims[1] + cells[:, 1]) * self.dims[2] + cells[:, 2]
+
+    def _lookup(self, keys: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """返回每个单元键对应的 (起点, 原子数)，空单元原子数为0"""
+        if self._dense:
+            return self._dense_starts[keys], self._dense_counts[keys]
+        pos = np.searchsorted(self.keys, keys)
+        pos[pos == len(self.keys)] = 0
+        hit = self.keys[pos] == keys
+        return self.starts[pos], np.where(hit, self.counts[pos], 0)
+
+    def _search(self, points: np.ndarray, cutoff: float, offsets) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        empty = (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0))
+        if not len(points) or not len(self.coords):
+            return empty
+
+        cutoff2 = cutoff * cutoff
+        point_cells = self._cells(points)
+        found_i, found_j, found_d2 = [], [], []
+
+        for offset in offsets:
+            cells = point_cells + np.array(offset)
+            valid = np.all((cells >= 0) & (cells < self.dims), axis=1)
+            query = np.nonzero(valid)[0]
+            starts, counts = self._lookup(self._keys(cells[query]))
+            occupied = counts > 0
+            query, starts, counts = query[occupied], starts[occupied], counts[occupied]
+            if not len(query):
+                continue
+
+            # 把 (查询点, 单元) 展开为 (查询点, 单元内每个原子)
+            total = int(counts.sum())
+            local = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+            rep_i = np.repeat(query, counts)
+            rep_j = self.order[np.repeat(starts, counts) + local]
+
+            delta = points[rep_i] - self.coords[rep_j]
+            d2 = np.einsum("ij,ij->i", delta, delta)
+            keep = d2 <= cutoff2
+            found_i.append(rep_i[keep])
+            found_j.append(rep_j[keep])
+            found_d2.append(d2[keep])
+
+        if not found_i:
+            return empty
+        return np.concatenate(found_i), np.concatenate(found_j), np.sqrt(np.concatenate(found_d2))
+
+    def query_pairs(self, points: np.ndarray, cutoff: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """返回所有距离不超过 cutoff 的 (points下标, 索引原子下标, 距离)"""
+        cutoff = _positive("cutoff", cutoff)
+        shell = int(np.ceil(cutoff / self.cell_size))
+        offsets = product(range(-shell, shell + 1), repeat=3)
+        return self._search(np.asarray(points, dtype=np.float64), cutoff, offsets)
+
+    def self_pairs(self, cutoff: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """返回索引内部所有 i < j 且距离不超过 cutoff 的原子对"""
+        cutoff = _positive("cutoff", cutoff)
+        # 只搜索半个邻域壳层：每对相邻单元只访问一次
+        shell = int(np.ceil(cutoff / self.cell_size))
+        offsets = [o for o in product(range(-shell, shell + 1), repeat=3) if o >= (0, 0, 0)]
+        i, j, d = self._search(self.coords, cutoff, offsets)
+        same_cell = np.all(self._cells(self.coords[i]) == self._cells(self.coords[j]), axis=1)
+        keep = ~same_cell | (i < j)
+        i, j, d = i[keep], j[keep], d[keep]
+        return np.minimum(i, j), np.maximum(i, j), d
+
+
+def _group_pairs(res_i: np.ndarray, res_j: np.ndarray, dist: np.ndarray, n_res_j: int):
+    """把原子对按残基对聚合，返回 (残基i, 残基j, 最短距离, 原子对数)，按最短距离排序"""
+    if not len(dist):
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, np.zeros(0), empty
+    pair_keys = res_i.astype(np.int64) * n_res_j + res_j
+    order = np.argsort(pair_keys)
+    pair_keys, dist = pair_keys[order], dist[order]
+    uniq, first, counts = np.unique(pair_keys, return_index=True, return_counts=True)
+    min_dist = np.minimum.reduceat(dist, first)
+    by_dist = np.argsort(min_dist, kind="stable")
+    uniq = uniq[by_dist]
+    return uniq // n_res_j, uniq % n_res_j, min_dist[by_dist], counts[by_dist]
+
+
+def contacts(table1: AtomTable, table2: Optional[AtomTable], cutoff: float = 4.0,
+             max_results: int = 100) -> Dict:
+    """计算两个选择之间（或一个选择内部不同残基之间）的接触"""
+    cutoff, max_results = _positive("cutoff", cutoff), _count("max_results", max_results)
+    labels1, inverse1 = np.unique(table1.residue_labels(), return_inverse=True)
+    if table2 is None:
+        index = CellList(table1.coords, cutoff)
+        i, j, d = index.self_pairs(cutoff)
+        inverse2, labels2 = inverse1, labels1
+        keep = inverse1[i] != inverse1[j]
+        i, j, d = i[keep], j[keep], d[keep]
+        # 残基对取无序形式，避免 (a,b) 和 (b,a) 重复
+        ri, rj = inverse1[i], inverse1[j]
+        ri, rj = np.minimum(ri, rj), np.maximum(ri, rj)
+    else:
+        labels2, inverse2 = np.unique(table2.residue_labels(), return_inverse=True)
+        index = CellList(table2.coords, cutoff)
+        i, j, d = index.query_pairs(table1.coords, cutoff)
+        ri, rj = inverse1[i], inverse2[j]
+
+    res_a, res_b, min_dist, n_pairs = _group_pairs(ri, rj, d, max(len(labels2), 1))
+    rows = [
+        {
+            "residue1": str(labels1[a]),
+            "residue2": str(labels2[b]),
+            "min_distance": round(float(dist), 2),
+            "atom_pairs": int(n),
+        }
+        for a, b, dist, n in zip(res_a[:max_results], res_b[:max_results],
+                                 min_dist[:max_results], n_pairs[:max_results])
+    ]
+    return {
+        "cutoff": cutoff,
+        "atoms1": len(table1),
+        "atoms2": len(table2) if table2 is not None else len(table1),
+        "atom_contacts": int(len(d)),
+        "residue_contacts": int(len(res_a)),
+        "contacts": rows,
+        "truncated": bool(len(res_a) > max_results),
+    }
+
+
+def neighbors(center: AtomTable, candidates: AtomTable, cutoff: float = 5.0,
+              max_results: int = 200) -> Dict:
+    """找出 candidates 中距离 center 任一原子不超过 cutoff 的残基"""
+    cutoff, max_results = _positive("cutoff", cutoff), _count("max_results", max_results)
+    labels, inverse = np.unique(candidates.residue_labels(), return_inverse=True)
+    index = CellList(candidates.coords, cutoff)
+    _, j, d = index.query_pairs(center.coords, cutoff)
+
+    min_dist = np.full(len(labels), np.inf)
+    np.minimum.at(min_dist, inverse[j], d)
+    hit = np.nonzero(np.isfinite(min_dist))[0]
+    hit = hit[np.argsort(min_dist[hit], kind="stable")]
+    rows = [
+        {"residue": str(labels[r]), "min_distance": round(float(min_dist[r]), 2)}
+        for r in hit[:max_results]
+    ]
+    return {
+        "cutoff": cutoff,
+        "center_atoms": len(center),
+        "atoms_within": int(len(np.unique(j))),
+        "residues_within": int(len(hit)),
+        "residues": rows,
+        "truncated": bool(len(hit) > max_results),
+    }
+
+
+def kabsch_rmsd(mobile: np.ndarray, target: np.ndarray) -> np.ndarray:
+    """Kabsch最优叠合后的RMSD，支持 (..., N, 3) 批量输入"""
+    mobile = mobile - mobile.mean(axis=-2, keepdims=True)
+    target = target - target.mean(axis=-2, keepdims=True)
+    h = np.swapaxes(mobile, -1, -2) @ target
+    u, s, vt = np.linalg.svd(h)
+    # 处理镜像：若 det(V U^T) < 0 则翻转最小奇异值的符号
+    sign = np.sign(np.linalg.det(np.swapaxes(vt, -1, -2) @ np.swapaxes(u, -1, -2)))
+    s[..., -1] *= sign
+    n = mobile.shape[-2]
+    e0 = (mobile ** 2).sum(axis=(-1, -2)) + (target ** 2).sum(axis=(-1, -2))
+    return np.sqrt(np.maximum(e0 - 2.0 * s.sum(axis=-1), 0.0) / n)
+
+
+def _pair_atoms(table1: AtomTable, table2: AtomTable) -> Tuple[np.ndarray, np.ndarray, str]:
+    """原子数相同时按顺序配对；否则按 残基编号+原子名 取交集配对"""
+    if len(table1) == len(table2):
+        idx = np.arange(len(table1))
+        return idx, idx, "order"
+    key1 = np.char.add(np.char.add(table1.resi, "/"), table1.name)
+    key2 = np.char.add(np.char.add(table2.resi, "/"), table2.name)
+    _, idx1, idx2 = np.intersect1d(key1, key2, return_indices=True)
+    return idx1, idx2, "resi+name"
+
+
+def rmsd(table1: AtomTable, table2: AtomTable, fit: bool = True) -> Dict:
+    """两个选择之间的RMSD
+
+    原子数相同时按顺序配对；否则按 残基编号+原子名 取交集配对。
+    """
+    idx1, idx2, matched_by = _pair_atoms(table1, table2)
+    if len(idx1) == 0:
+        raise ValueError("两个选择之间没有可配对的原子")
+
+    a, b = table1.coords[idx1], table2.coords[idx2]
+    result = {
+        "atoms": int(len(idx1)),
+        "matched_by": matched_by,
+        "rmsd_no_fit": round(float(np.sqrt(((a - b) ** 2).sum(axis=1).mean())), 3),
+    }
+    if fit:
+        result["rmsd_fit"] = round(float(kabsch_rmsd(a, b)), 3)
+    return result
+
+
+def rmsd_many(reference: AtomTable, targets: Dict[str, AtomTable]) -> List[Dict]:
+    """参考结构与多个目标之间的RMSD（叠合前和Kabsch叠合后），按 targets 的顺序返回
+
+    配对方式与 rmsd() 相同；配对结果相同的目标（例如同一体系的多个构象）
+    堆叠成 (k, N, 3) 数组，一次批量计算。
+    """
+    results: Dict[str, Dict] = {}
+    groups: Dict[Tuple[bytes, bytes], Tuple[np.ndarray, np.ndarray, str, List[str]]] = {}
+    for name, table in targets.items():
+        idx_ref, idx_target, matched_by = _pair_atoms(reference, table)
+        if len(idx_ref) == 0:
+            results[name] = {"target": name, "error": "与参考结构之间没有可配对的原子"}
+            continue
+        key = (idx_ref.tobytes(), idx_target.tobytes())
+        groups.setdefault(key, (idx_ref, idx_target, matched_by, []))[3].append(name)
+
+    for idx_ref, idx_target, matched_by, names in groups.values():
+        ref = reference.coords[idx_ref]
+        mobile = np.stack([targets[name].coords[idx_target] for name in names])
+        fitted = kabsch_rmsd(mobile, ref[np.newaxis])
+        raw = np.sqrt(((mobile - ref) ** 2).sum(axis=-1).mean(axis=-1))
+        for name, rmsd_fit, rmsd_raw in zip(names, fitted, raw):
+            results[name] = {
+                "target": name,
+                "rmsd": round(float(rmsd_fit), 3),
+                "atoms": int(len(idx_ref)),
+                "rmsd_pre": round(float(rmsd_raw), 3),
+                "matched_by": matched_by,
+            }
+    return [results[name] for name in targets]
+
+
+def _sphere_points(n: int) -> np.ndarray:
+    """黄金螺旋法生成单位球面上近似均匀的 n 个点"""
+    k = np.arange(n) + 0.5
+    phi = np.arccos(1.0 - 2.0 * k / n)
+    theta = np.pi * (1.0 + 5 ** 0.5) * k
+    return np.stack([np.cos(theta) * np.sin(phi), np.sin(theta) * np.sin(phi), np.cos(phi)], axis=1)
+
+
+def shrake_rupley(table: AtomTable, probe: float = 1.4, n_points: int = 100,
+                  batch: int = 512) -> np.ndarray:
+    """Shrake-Rupley 算法计算每个原子的溶剂可及表面积（Å²）"""
+    probe = float(probe)
+    if not (math.isfinite(probe) and probe >= 0):
+        raise ValueError(f"probe 必须是有限的非负数: {probe:g}")
+    if int(n_points) < 1:
+        raise ValueError(f"n_points 必须是正整数: {n_points}")
+    n_atoms = len(table)
+    if n_atoms == 0:
+        return np.zeros(0)
+    radii = table.radii() + probe
+    coords = table.coords
+
+    # 原子级近邻表：只有两球相交的原子才可能遮挡彼此的表面点
+    index = CellList(coords, 2.0 * radii.max())
+    i, j, d = index.query_pairs(coords, 2.0 * radii.max())
+    keep = (i != j) & (d < radii[i] + radii[j])
+    i, j = i[keep], j[keep]
+    order = np.argsort(i, kind="stable")
+    i, j = i[order], j[order]
+    counts = np.bincount(i, minlength=n_atoms)
+    starts = np.cumsum(counts) - counts
+    width = max(int(counts.max()) if len(counts) else 0, 1)
+
+    # 填充为定宽近邻矩阵，空位指向一个远处的虚拟原子
+    dummy = n_atoms
+    padded = np.full((n_atoms, width), dummy, dtype=np.int64)
+    padded[i, np.arange(len(i)) - starts[i]] = j
+    ext_coords = np.vstack([coords, np.full((1, 3), 1e6)])
+    ext_radii2 = np.append(radii, 0.0) ** 2
+
+    # 表面点 p = c_i + r_i*s 被近邻 j 遮挡 <=> s·(x_j - c_i) > (r_i² + |x_j - c_i|² - R_j²) / (2 r_i)
+    # 左边对所有原子共用同一组单位球面点，可写成一次矩阵乘法
+    sphere = _sphere_points(n_points)
+    exposed = np.empty(n_atoms)
+    for lo in range(0, n_atoms, batch):
+        hi = min(lo + batch, n_atoms)
+        nb = padded[lo:hi]
+        rel = ext_coords[nb] - coords[lo:hi, None, :]
+        r = radii[lo:hi, None]
+        threshold = (r * r + np.einsum("bkc,bkc->bk", rel, rel) - ext_radii2[nb]) / (2.0 * r)
+        buried = (rel @ sphere.T > threshold[:, :, None]).any(axis=1)
+        exposed[lo:hi] = (~buried).sum(axis=1)
+
+    return exposed / n_points * 4.0 * np.pi * radii ** 2
+
+
+def sasa_summary(table: AtomTable, probe: float = 1.4, n_points: int = 100,
+                 top: int = 20) -> Dict:
+    """SASA汇总：总量、极性/非极性、按链以及暴露最多的残基"""
+    top = _count("top", top)
+    area = shrake_rupley(table, probe=probe, n_points=n_points)
+    polar = np.isin(table.elem, list(POLAR_ELEMENTS))
+
+    chains, chain_inv = np.unique(table.chain, return_inverse=True)
+    per_chain = np.bincount(chain_inv, weights=area, minlength=len(chains))
+    labels, res_inv = np.unique(table.residue_labels(), return_inverse=True)
+    per_res = np.bincount(res_inv, weights=area, minlength=len(labels))
+    top_res = np.argsort(-per_res, kind="stable")[:top]
+
+    return {
+        "atoms": len(table),
+        "probe": probe,
+        "total": round(float(area.sum()), 1),
+        "polar": round(float(area[polar].sum()), 1),
+        "apolar": round(float(area[~polar].sum()), 1),
+        "chains": {str(c or "-"): round(float(a), 1) for c, a in zip(chains, per_chain)},
+        "top_residues": [
+            {"residue": str(labels[r]), "sasa": round(float(per_res[r]), 1)} for r in top_res
+        ],
+    }
+
+
+def index_ranges(indices: np.ndarray) -> str:
+    """把排序的原子index压缩为PyMOL区间写法，如 1-5+9+12-14"""
+    indices = np.unique(np.asarray(indices, dtype=np.int64))
+    if not len(indices):
+        return ""
+    breaks = np.nonzero(np.diff(indices) != 1)[0]
+    starts = np.concatenate([indices[:1], indices[breaks + 1]])
+    ends = np.concatenate([indices[breaks], indices[-1:]])
+    return "+".join(str(a) if a == b else f"{a}-{b}" for a, b in zip(starts, ends))
+
+
+@dataclass
+class ObjectIndex:
+    """一个对象在某个状态下的坐标、原子属性和空间索引"""
+    table: AtomTable
+    atom_index: np.ndarray    # 每行对应的PyMOL原子index（从1开始）
+    residue_ids: np.ndarray   # 每行所属残基的编号，用于 byres 扩展
+    grid: CellList
+
+
+class SpatialIndexCache:
+    """按 (对象, 状态) 缓存空间索引
+
+    第一次查询某个对象时取回其全部坐标并建立网格索引，之后的
+    邻近查询直接在缓存上计算。坐标可能改变时（load、旋转对象、
+    切换状态等）由调用方调用 invalidate() 丢弃缓存。
+    """
+
+    def __init__(self, cell_size: float = 5.0):
+        self.cell_size = cell_size
+        self._objects: Dict[Tuple[str, int], ObjectIndex] = {}
+        self._names: Optional[List[str]] = None
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._objects)
+
+    def invalidate(self, obj: Optional[str] = None) -> None:
+        """丢弃某个对象的缓存；obj为None时全部丢弃"""
+        self._names = None
+        if obj is None:
+            self._objects.clear()
+        else:
+            for key in [k for k in self._objects if k[0] == obj]:
+                del self._objects[key]
+
+    def get(self, cmd, obj: str, state: int = -1) -> ObjectIndex:
+        """取得对象的空间索引，未缓存时通过XML-RPC建立"""
+        key = (obj, state)
+        entry = self._objects.get(key)
+        if entry is not None:
+            self.hits += 1
+            return entry
+        self.misses += 1
+
+        table = fetch_atoms(cmd, obj, state)
+        # PDB输出与对象内部原子顺序一致，因此第k行即 index k+1
+        atom_index = np.array([idx for _, idx in cmd.identify(obj, 1)], dtype=np.int64)
+        if len(atom_index) != len(table):
+            raise ValueError(f"对象 '{obj}' 在状态 {state} 中有原子缺少坐标，无法建立索引")
+        _, residue_ids = np.unique(table.residue_labels(), return_inverse=True)
+        entry = ObjectIndex(table, atom_index, residue_ids, CellList(table.coords, self.cell_size))
+        self._objects[key] = entry
+        return entry
+
+    def select_near(self, cmd, center: str, cutoff: float, byres: bool = False,
+                    include_center: bool = False, state: int = -1) -> Dict[str, np.ndarray]:
+        """返回 {对象: 原子index数组}，为距离 center 不超过 cutoff 的原子
+
+        center 只通过一次 identify 调用解析为 (对象, index)，坐标取自缓存。
+        """
+        cutoff = _positive("cutoff", cutoff)
+        center_atoms: Dict[str, List[int]] = {}
+        for obj, idx in cmd.identify(center, 1):
+            center_atoms.setdefault(obj, []).append(idx)
+
+        points = []
+        for obj, idxs in center_atoms.items():
+            entry = self.get(cmd, obj, state)
+            rows = np.searchsorted(entry.atom_index, np.array(idxs, dtype=np.int64))
+            points.append(entry.table.coords[rows])
+        if not points:
+            return {}
+        points = np.concatenate(points)
+
+        result = {}
+        for obj, entry in self._loaded(cmd, state):
+            _, rows, _ = entry.grid.query_pairs(points, cutoff)
+            rows = np.unique(rows)
+            if byres and len(rows):
+                rows = np.nonzero(np.isin(entry.residue_ids, entry.residue_ids[rows]))[0]
+            hits = entry.atom_index[rows]
+            if not include_center and obj in center_atoms:
+                hits = np.setdiff1d(hits, center_atoms[obj])
+            if len(hits):
+                result[obj] = hits
+        return result
+
+    def _loaded(self, cmd, state: int):
+        if self._names is None:
+            self._names = list(cmd.get_names("objects", 0))
+        for obj in self._names:
+            try:
+                yield obj, self.get(cmd, obj, state)
+            except ValueError:
+                # 非分子对象（如 map、cgo）或坐标不完整的对象不参与查询
+                continue
+
+    def stats(self) -> Dict:
+        return {"objects": len(self._objects), "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,145 @@
+"""
+PyMOL MCP 写合并（视图/颜色操作）
+
+智能体经常连续发送 zoom → orient → rotate → reset，或对同一选择反复 color，
+而真正有意义的只有最终状态。开启写合并后，这些操作先在本地缓冲一小段时间，
+化简为净效果，在任何读取、渲染或其他修改之前用一次RPC发送给PyMOL。
+
+化简规则（只删除确实被后续操作覆盖的操作）：
+
+    - reset / orient 重新设置整个视图，覆盖之前所有视图操作
+    - zoom 重新设置中心、距离和裁剪面（保留旋转），覆盖之前的 zoom
+    - 相邻的同轴 turn 合并为一次，合计为 360 度整数倍时删除
+    - 对相同选择的 color 只保留最后一次；bg_color 只保留最后一次
+"""
+
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# 可以缓冲的 cmd 函数
+VIEW_FUNCS = frozenset({"zoom", "orient", "turn", "reset"})
+COMBINABLE_FUNCS = VIEW_FUNCS | {"color", "bg_color"}
+
+Op = Tuple[str, tuple]
+
+
+def reduce_ops(ops: List[Op]) -> List[Op]:
+    """把缓冲的操作序列化简为等价的净效果"""
+    out: List[Op] = []
+    for func, args in ops:
+        if func in ("reset", "orient"):
+            out = [op for op in out if op[0] not in VIEW_FUNCS]
+        elif func == "zoom":
+            out = [op for op in out if op[0] != "zoom"]
+        elif func == "turn":
+            # 颜色操作不影响视图，跳过它们找上一个视图操作
+            last = next((i for i in range(len(out) - 1, -1, -1) if out[i][0] in VIEW_FUNCS), None)
+            if last is not None and out[last][0] == "turn" and out[last][1][0] == args[0]:
+                angle = out.pop(last)[1][1] + args[1]
+                if angle % 360 == 0:
+                    continue
+                args = (args[0], angle)
+        elif func == "color":
+            out = [op for op in out if not (op[0] == "color" and op[1][1:] == args[1:])]
+        elif func == "bg_color":
+            out = [op for op in out if op[0] != "bg_color"]
+        out.append((func, args))
+    return out
+
+
+class WriteCombiner:
+    """单个PyMOL后端的写合并缓冲区
+
+    send(ops) 负责把化简后的操作发送给PyMOL，返回每个操作的错误信息
+    （成功为 None）；get_cmd() 返回当前线程可用的原始cmd代理，
+    用于窗口到期时由定时线程发送。
+    """
+
+    def __init__(self, send: Callable[[Any, List[Op]], List[Optional[str]]],
+                 get_cmd: Callable[[], Any], window: float = 0.05):
+        self.window = window
+        self._send = send
+        self._get_cmd = get_cmd
+        # RLock：flush 持锁发送期间，其他线程的新操作和读取都要等待，保证顺序
+        self._lock = threading.RLock()
+        self._ops: List[Op] = []
+        self._timer: Optional[threading.Timer] = None
+        self._errors: List[str] = []
+        self.received = 0
+        self.sent = 0
+        self.flushes = 0
+
+    def add(self, func: str, args: tuple) -> None:
+        with self._lock:
+            self._ops.append((func, args))
+            self.received += 1
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = threading.Timer(self.window, self._flush_from_timer)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _flush_from_timer(self) -> None:
+        try:
+            self.flush(self._get_cmd())
+        except Exception as e:
+            with self._lock:
+                self._errors.append(f"发送合并操作失败: {e}")
+
+    def flush(self, cmd) -> None:
+        """立即发送缓冲的操作（在读取、渲染或其他修改之前调用）"""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if not self._ops:
+                return
+            ops = reduce_ops(self._ops)
+            self._ops = []
+            if not ops:
+                return
+            self.flushes += 1
+            self.sent += len(ops)
+            errors = self._send(cmd, ops)
+            for (func, args), error in zip(ops, errors):
+                if error:
+                    self._errors.append(f"{func}{args!r}: {error}")
+
+    def take_errors(self) -> List[str]:
+        """取出延迟发送时产生的错误（之后的工具调用会把它们报告给客户端）"""
+        with self._lock:
+            errors, self._errors = self._errors, []
+        return errors
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "window_ms": round(self.window * 1000, 1),
+                "buffered": len(self._ops),
+                "received": self.received,
+                "sent": self.sent,
+                "flushes": self.flushes,
+            }
+
+
+class CoalescingCmd:
+    """包装 cmd 代理：可合并的操作进入缓冲区，访问其他任何函数前先发送缓冲区"""
+
+    def __init__(self, cmd, combiner: WriteCombiner):
+        self._cmd = cmd
+        self._combiner = combiner
+
+    def __getattr__(self, func: str):
+        if func in COMBINABLE_FUNCS:
+            cmd, combiner = self._cmd, self._combiner
+
+            def buffered(*args, **kwargs):
+                if kwargs:
+                    combiner.flush(cmd)
+                    return getattr(cmd, func)(*args, **kwargs)
+                combiner.add(func, args)
+                return None
+            return buffered
+        self._combiner.flush(self._cmd)
+        return getattr(self._cmd, func)
@@ -0,0 +1,119 @@
+"""
+PyMOL MCP 批量格式转换
+
+pymol_convert_many 把一批结构文件（列表或通配符）逐个 load -> save -> delete，
+可按链、按状态拆分输出。文件分批交给PyMOL端的 mcp_convert_files 辅助函数，
+每批一次RPC；工作进程池模式下借用空闲的备用进程并发处理各批。
+
+内存有界：PyMOL中同一时刻每个后端只载入一个文件，服务器端只保留计数和
+有限条错误，每批完成后以进度通知报告吞吐量，出错的文件逐个以错误级别日志报告。
+"""
+
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+# PyMOL 按扩展名识别的常用输出格式
+FORMATS = ("cif", "pdb", "pqr", "mol2", "sdf", "mol", "xyz", "mmtf", "fasta", "pse")
+
+# 结果中保留的错误条数（全部错误已通过日志通知报告）
+MAX_ERRORS = 50
+
+
+@dataclass
+class ConvertOptions:
+    output_dir: str
+    format: str = "cif"
+    split_chain: bool = False
+    split_state: bool = False
+    selection: str = ""
+    overwrite: bool = False
+
+    def __post_init__(self):
+        self.format = self.format.lower().lstrip(".")
+        if self.format == "mmcif":
+            self.format = "cif"
+        if self.format not in FORMATS:
+            raise ValueError(f"不支持的输出格式: {self.format}（可选 {', '.join(FORMATS)}）")
+
+    def helper_args(self) -> list:
+        return [self.output_dir, self.format, int(self.split_chain), int(self.split_state),
+                self.selection, int(self.overwrite)]
+
+
+@dataclass
+class ConvertProgress:
+    """转换进度：只累计计数和有限条错误，文件再多内存也不增长"""
+    total: int
+    done: int = 0
+    converted: int = 0
+    skipped: int = 0
+    failed: int = 0
+    outputs: int = 0
+    errors: List[Dict[str, str]] = field(default_factory=list)
+    started: float = field(default_factory=time.perf_counter)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def add(self, entries: Sequence[Dict[str, Any]]) -> List[Dict[str, str]]:
+        """累计一批结果，返回其中的错误"""
+        errors = [{"file": e["file"], "error": e["error"]} for e in entries if e.get("error")]
+        with self._lock:
+            self.done += len(entries)
+            self.failed += len(errors)
+            for entry in entries:
+                if not entry.get("error"):
+                    self.outputs += entry.get("outputs", 0)
+                    if entry.get("outputs"):
+                        self.converted += 1
+                    else:
+                        self.skipped += 1
+            self.errors.extend(errors[:max(MAX_ERRORS - len(self.errors), 0)])
+        return errors
+
+    def rate(self) -> float:
+        elapsed = time.perf_counter() - self.started
+        return self.done / elapsed if elapsed > 0 else 0.0
+
+    def message(self) -> str:
+        return (f"{self.done}/{self.total} 个文件，{self.rate():.1f} 个/秒，"
+                f"输出 {self.outputs} 个" + (f"，{self.failed} 个出错" if self.failed else ""))
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "files": self.total,
+            "converted": self.converted,
+            "skipped": self.skipped,
+            "failed": self.failed,
+            "outputs": self.outputs,
+            "elapsed_s": round(time.perf_counter() - self.started, 2),
+            "files_per_s": round(self.rate(), 2),
+            "errors": self.errors,
+            "errors_truncated": max(self.failed - len(self.errors), 0),
+        }
+
+
+def run(backends: Sequence[Callable[[], Any]], files: Sequence[str], options: ConvertOptions,
+        batch_size: int = 16, report: Optional[Callable[..., None]] = None) -> ConvertProgress:
+    """用 backends（每个为返回 cmd 代理的函数）并发转换 files
+
+    批次的分发见 pymol_workers.run_batches；report(done, total, message, level) 在每批完成后调用。
+    """
+    from pymol_workers import run_batches
+    progress = ConvertProgress(len(files))
+    batch_size = max(int(batch_size), 1)
+
+    def failed(batch: List[str], error: str) -> List[Dict[str, Any]]:
+        return [{"file": path, "outputs": 0, "error": error} for path in batch]
+
+    def record(batch: List[str], entries: List[Dict[str, Any]]) -> None:
+        errors = progress.add(entries)
+        if report is not None:
+            for error in errors:
+                report(progress.done, progress.total, f"{error['file']}: {error['error']}", "error")
+            report(progress.done, progress.total, progress.message())
+
+    run_batches(backends, [list(files[start:start + batch_size]) for start in range(0, len(files), batch_size)],
+                lambda cmd, batch: cmd.mcp_convert_files(batch, *options.helper_args()), failed, record,
+                "pymol-convert")
+    return progress
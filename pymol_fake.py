@@ -0,0 +1,390 @@
+"""
+模拟的 PyMOL XML-RPC 后端
+
+不需要安装PyMOL即可运行MCP服务器做压力测试、浸泡测试或流量回放。
+实现服务器会调用的 cmd 函数（包括注入到PyMOL端的 mcp_* 辅助函数），
+维护一个简单的场景（对象、命名选择、视图、设置），每次调用按配置的
+延迟 sleep，模拟真实PyMOL的耗时：
+
+    python pymol_fake.py --port 9123 --latency-ms 2 --ray-latency-ms 200
+
+也可以在进程内使用: serve_fake_pymol(port) 返回已在后台线程运行的服务器。
+"""
+
+import argparse
+import json
+import os
+import threading
+import time
+import zlib
+from collections import Counter
+from socketserver import ThreadingMixIn
+from typing import Any, Dict, List, Optional
+from xmlrpc.client import Binary
+from xmlrpc.server import SimpleXMLRPCServer
+
+_ATOM_NAMES = ["N", "CA", "C", "O", "CB", "CG", "OD1", "ND2"]
+
+
+def _make_pdb(atoms: int, chains: str = "AB") -> str:
+    """生成 atoms 个原子的假PDB文本（ASN残基，坐标排成网格）"""
+    lines = []
+    per_chain = max(atoms // len(chains), 1)
+    for k in range(atoms):
+        chain = chains[min(k // per_chain, len(chains) - 1)]
+        name = _ATOM_NAMES[k % len(_ATOM_NAMES)]
+        x, y, z = (k % 20) * 1.5, (k // 20 % 20) * 1.5, (k // 400) * 1.5
+        lines.append("ATOM  %5d  %-3s ASN %1s%4d    %8.3f%8.3f%8.3f  1.00  0.00           %s"
+                     % (k % 99999 + 1, name, chain, k // 8 % 9999 + 1, x, y, z, name[0]))
+    return "\n".join(lines) + "\nEND\n"
+
+
+class _ThreadingXMLRPCServer(ThreadingMixIn, SimpleXMLRPCServer):
+    daemon_threads = True
+
+
+class FakeCmd:
+    """模拟的 pymol.cmd；以下划线开头的方法不会通过XML-RPC暴露"""
+
+    def __init__(self, latency: float = 0.001, ray_latency: float = 0.05, atoms: int = 2000):
+        self._latency = latency
+        self._ray_latency = ray_latency
+        self._atoms = atoms
+        self._pdb = _make_pdb(atoms)
+        self._lock = threading.Lock()
+        self._objects: Dict[str, Dict[str, Any]] = {}
+        self._selections: set = set()
+        self._settings: Dict[str, Any] = {}
+        self._view = [1.0, 0.0, 0.0, 0.0, 1.0, 0.0, 0.0, 0.0, 1.0,
+                      0.0, 0.0, -50.0, 0.0, 0.0, 0.0, 40.0, 60.0, -20.0]
+        self._calls: Counter = Counter()
+
+    def _call(self, func: str, delay: Optional[float] = None) -> None:
+        with self._lock:
+            self._calls[func] += 1
+        time.sleep(self._latency if delay is None else delay)
+
+    def _add_object(self, name: str) -> str:
+        with self._lock:
+            self._objects[name] = {"states": 1, "atoms": self._atoms, "enabled": True}
+        return name
+
+    def _move_view(self, amount: float) -> None:
+        with self._lock:
+            self._view[11] -= amount
+
+    # ---- 连接与文件 ----
+
+    def ping(self):
+        return 1
+
+    def load(self, filename, name="", *args):
+        self._call("load")
+        if filename.endswith(".pse") and os.path.exists(filename):
+            # save 写出的会话文件：恢复对象列表（用于把会话的场景交给借来的进程）
+            with open(filename) as f, self._lock:
+                self._objects.update(json.load(f))
+            return filename
+        return self._add_object(name or os.path.splitext(os.path.basename(filename))[0])
+
+    def fetch(self, code, name="", *args):
+        self._call("fetch")
+        return self._add_object(name or code)
+
+    def save(self, filename, *args):
+        self._call("save")
+        if filename.endswith(".pse"):
+            with self._lock, open(filename, "w") as f:
+                json.dump(self._objects, f)
+        return 1
+
+    def delete(self, name, *args):
+        self._call("delete")
+        with self._lock:
+            if name in ("all", "*"):
+                self._objects.clear()
+                self._selections.clear()
+            else:
+                self._objects.pop(name, None)
+                self._selections.discard(name)
+        return None
+
+    # ---- 显示、颜色、视图 ----
+
+    def show(self, *args):
+        self._call("show")
+
+    def hide(self, *args):
+        self._call("hide")
+
+    def color(self, *args):
+        self._call("color")
+
+    def bg_color(self, *args):
+        self._call("bg_color")
+
+    def set(self, setting, value=1, *args):
+        self._call("set")
+        with self._lock:
+            self._settings[setting] = value
+
+    def get(self, setting, *args):
+        with self._lock:
+            return str(self._settings.get(setting, "0"))
+
+    def zoom(self, *args):
+        self._call("zoom")
+        self._move_view(1.0)
+
+    def orient(self, *args):
+        self._call("orient")
+        self._move_view(2.0)
+
+    def turn(self, *args):
+        self._call("turn")
+        self._move_view(0.5)
+
+    def reset(self, *args):
+        self._call("reset")
+        with self._lock:
+            self._view[11] = -50.0
+
+    def rotate(self, *args):
+        self._call("rotate")
+
+    def enable(self, name="all", *args):
+        self._call("enable")
+        with self._lock:
+            for obj, info in self._objects.items():
+                if name in ("all", obj):
+                    info["enabled"] = True
+
+    def disable(self, name="all", *args):
+        self._call("disable")
+        with self._lock:
+            for obj, info in self._objects.items():
+                if name in ("all", obj):
+                    info["enabled"] = False
+
+    def get_view(self, *args):
+        with self._lock:
+            return list(self._view)
+
+    def read_pdbstr(self, pdb, name, *args):
+        self._call("read_pdbstr")
+        self._add_object(name)
+
+    def reinitialize(self, *args):
+        self._call("reinitialize")
+        with self._lock:
+            self._objects.clear()
+            self._selections.clear()
+            self._settings.clear()
+
+    # ---- 选择与信息 ----
+
+    def select(self, name, selection="", *args):
+        self._call("select")
+        with self._lock:
+            self._selections.add(name)
+        return self._atoms
+
+    def count_atoms(self, selection="all", *args):
+        self._call("count_atoms")
+        with self._lock:
+            return self._atoms if self._objects else 0
+
+    def get_names(self, type="objects", enabled_only=0, *args):
+        with self._lock:
+            if type == "selections":
+                return sorted(self._selections)
+            return [name for name, info in self._objects.items() if info["enabled"] or not enabled_only]
+
+    def get_object_list(self, selection="all", *args):
+        with self._lock:
+            return list(self._objects)
+
+    def get_type(self, name, *args):
+        return "object:molecule" if name in self._objects else "selection"
+
+    def count_states(self, name="all", *args):
+        with self._lock:
+            info = self._objects.get(name)
+            return info["states"] if info else 0
+
+    def get_pdbstr(self, selection="all", *args):
+        self._call("get_pdbstr")
+        return self._pdb
+
+    def identify(self, selection="all", mode=0, *args):
+        with self._lock:
+            names = [selection] if selection in self._objects else list(self._objects)
+        return [[name, k + 1] for name in names for k in range(self._atoms)]
+
+    # ---- 比对 ----
+
+    def _fit(self, mobile: str) -> List[Any]:
+        # 按对象名得到稳定的假RMSD，结果表的排序才有意义
+        name = mobile.split(")")[0].lstrip("(")
+        rmsd = zlib.crc32(name.encode()) % 3000 / 1000
+        atoms = self._atoms // 8
+        return [rmsd, atoms - 3, 5, rmsd * 1.5, atoms, 100.0, atoms]
+
+    def align(self, mobile, target, *args, **kwargs):
+        self._call("align")
+        return self._fit(mobile)
+
+    def super(self, mobile, target, *args, **kwargs):
+        self._call("super", self._latency * 5)
+        return self._fit(mobile)
+
+    # ---- 渲染与脚本 ----
+
+    def ray(self, width=0, height=0, *args):
+        # 分块强制生成表面时的 1x1 光线追踪几乎不花时间
+        self._call("ray", 0 if (width, height) == (1, 1) else self._ray_latency)
+
+    def draw(self, *args):
+        self._call("draw")
+
+    def png(self, filename, *args):
+        self._call("png", self._ray_latency)
+
+    def get_viewport(self, *args):
+        return [640, 480]
+
+    def do(self, command, *args):
+        self._call("do")
+
+    # ---- 服务器注入的辅助函数 ----
+
+    def mcp_call_batch(self, calls):
+        errors = []
+        for func, args in calls:
+            try:
+                getattr(self, func)(*args)
+                errors.append(None)
+            except Exception as e:
+                errors.append("%s: %s" % (type(e).__name__, e))
+        return errors
+
+    def mcp_align_many(self, target, mobiles, method="align", atoms="", cycles=5, transform=0):
+        results = []
+        for mobile in mobiles:
+            r = getattr(self, method)(mobile, target)
+            results.append({"target": mobile, "rmsd": round(r[0], 3), "atoms": r[1], "cycles": r[2],
+                            "rmsd_pre": round(r[3], 3), "atoms_pre": r[4]})
+        return results
+
+    def mcp_helper_version(self):
+        from pymol_mcp_server import _CAPTURE_HELPER_VERSION
+        return _CAPTURE_HELPER_VERSION
+
+    def mcp_render_png(self, filename="", width=0, height=0, dpi=-1, ray=0):
+        # 不写文件：OpenGL预览按普通调用计时，ray=1 按光线追踪计时；返回PNG文件头加尺寸
+        self._call("png", self._ray_latency if ray else None)
+        return Binary(b"\x89PNG\r\n\x1a\n" + ("%dx%d" % (width, height)).encode("ascii"))
+
+    def mcp_ray_png(self, filename="", width=0, height=0, dpi=-1, antialias=-1):
+        # 不写文件，partial 为空，mcp_commit_png 无需处理
+        self._call("ray", self._ray_latency)
+        return {"image": Binary(b"\x89PNG\r\n\x1a\n" + ("%dx%d" % (width, height)).encode("ascii")),
+                "partial": ""}
+
+    def mcp_commit_png(self, partial, filename=""):
+        self._call("commit_png")
+
+    def mcp_gallery_fingerprints(self, items):
+        import hashlib
+        with self._lock:
+            objects = {name: dict(info) for name, info in self._objects.items()}
+            settings = repr(sorted(self._settings.items()))
+        return [hashlib.blake2b(repr((name, state, objects.get(name), settings)).encode(),
+                                digest_size=12).hexdigest() for name, state in items]
+
+    def mcp_render_thumbnails(self, items, width, height, ray=0):
+        # 每张缩略图按普通调用或光线追踪计时；返回以对象名决定颜色的PPM
+        import hashlib
+        results = []
+        for name, state in items:
+            self._call("png", self._ray_latency if ray else None)
+            if name not in self._objects:
+                results.append({"image": None, "error": "CmdException: 对象不存在: %s" % name})
+                continue
+            color = hashlib.blake2b(("%s/%d" % (name, state)).encode(), digest_size=3).digest()
+            header = ("P6\n%d %d\n255\n" % (width, height)).encode("ascii")
+            results.append({"image": Binary(header + color * (width * height)), "error": None})
+        return results
+
+    def mcp_list_files(self, pattern):
+        import glob
+        return sorted(glob.glob(os.path.expanduser(pattern), recursive=True)) if pattern else []
+
+    def mcp_convert_files(self, files, output_dir, fmt, split_chain=0, split_state=0, selection="", overwrite=0):
+        # 不读写文件：每个文件按 load、save、delete 三次调用计时，文件名含 bad 的文件出错
+        results = []
+        for path in files:
+            self._call("load")
+            entry = {"file": path, "outputs": 0, "error": None}
+            if "bad" in os.path.basename(path):
+                entry["error"] = "CmdException: Unable to open file '%s'" % path
+            else:
+                self._call("save")
+                entry["outputs"] = 2 if split_chain else 1
+            self._call("delete")
+            results.append(entry)
+        return results
+
+    def mcp_do_capture(self, commands, max_chars=16384):
+        results = []
+        for command in commands:
+            verb = command.replace(",", " ").split()[0] if command.strip() else ""
+            self._call("do:" + verb)
+            results.append({"command": command, "output": "", "result": None, "error": None})
+        return results
+
+    def mcp_resource_usage(self):
+        times = os.times()
+        return {"pid": os.getpid(), "cpu_s": times.user + times.system, "rss_mb": None}
+
+    def mcp_scene_snapshot(self):
+        with self._lock:
+            objects = [{"name": name, "type": "object:molecule", "states": info["states"],
+                        "atoms": info["atoms"], "enabled": info["enabled"]}
+                       for name, info in self._objects.items()]
+            return {"objects": objects, "view": list(self._view)}
+
+    def mcp_fake_stats(self):
+        """各函数的调用次数（只有模拟后端提供）"""
+        with self._lock:
+            return dict(self._calls)
+
+
+def serve_fake_pymol(port: int = 9123, host: str = "127.0.0.1", **kwargs) -> SimpleXMLRPCServer:
+    """在后台线程中启动模拟后端，kwargs 传给 FakeCmd"""
+    server = _ThreadingXMLRPCServer((host, port), allow_none=True, logRequests=False)
+    server.register_instance(FakeCmd(**kwargs))
+    threading.Thread(target=server.serve_forever, name="fake-pymol", daemon=True).start()
+    return server
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="模拟的PyMOL XML-RPC后端")
+    parser.add_argument("--host", default="127.0.0.1", help="绑定地址 (默认: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=9123, help="XML-RPC端口 (默认: 9123)")
+    parser.add_argument("--latency-ms", type=float, default=1.0, help="每次调用的延迟，毫秒 (默认: 1)")
+    parser.add_argument("--ray-latency-ms", type=float, default=50.0,
+                        help="ray/png 的延迟，毫秒 (默认: 50)")
+    parser.add_argument("--atoms", type=int, default=2000, help="每个对象的原子数 (默认: 2000)")
+    args = parser.parse_args(argv)
+    server = serve_fake_pymol(args.port, args.host, latency=args.latency_ms / 1000,
+                              ray_latency=args.ray_latency_ms / 1000, atoms=args.atoms)
+    print(f"模拟PyMOL后端已启动: http://{args.host}:{args.port}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
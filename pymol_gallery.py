@@ -0,0 +1,231 @@
+"""
+PyMOL MCP 缩略图画廊
+
+pymol_gallery 为每个对象（或每个状态）渲染一张缩略图，拼成一张联系表
+（contact sheet）PNG，连同JSON索引（每格对应的对象、状态和位置）一次返回，
+代替逐个对象 disable/enable + pymol_orient + pymol_png：
+
+    - PyMOL端的 mcp_render_thumbnails 辅助函数一次RPC渲染一批：只显示当前对象，
+      自动 orient，输出PPM原始像素，结束后恢复显示开关、状态和视图
+    - 拼图和PNG编码在服务器端用 NumPy 完成，不依赖图像库
+    - 缩略图按对象指纹（坐标、每个原子的颜色和表示方式、影响画面的全局设置）
+      缓存在服务器内存中，对象没有变化时直接复用，只渲染变化了的对象
+    - 工作进程池模式下借用空闲的备用进程，分批并行渲染未命中缓存的缩略图
+"""
+
+import fnmatch
+import math
+import re
+import struct
+import threading
+import zlib
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+MODES = ("object", "state")
+
+# 单次调用最多的缩略图数和单张缩略图的最大边长（像素）
+MAX_ITEMS = 400
+MAX_TILE = 1024
+
+# 每批交给一个PyMOL后端的缩略图数
+BATCH_SIZE = 4
+
+# 格间距和背景色（RGB）
+PADDING = 4
+SHEET_BACKGROUND = (96, 96, 96)
+
+_PPM_HEADER = re.compile(rb"P6\s+(?:#[^\n]*\n\s*)*(\d+)\s+(\d+)\s+(\d+)\s")
+
+
+@dataclass
+class GalleryItem:
+    name: str
+    state: int = 0
+    fingerprint: str = ""
+    image: Optional[np.ndarray] = field(default=None, repr=False)
+    cached: bool = False
+    error: Optional[str] = None
+
+
+def resolve_items(object_names: Sequence[str], objects: Optional[Sequence[str]], pattern: Optional[str],
+                  mode: str = "object", count_states: Optional[Callable[[str], int]] = None,
+                  max_states: int = 0) -> List[GalleryItem]:
+    """要渲染的缩略图：显式给出的对象加上匹配通配符的对象，都没有给出时为全部对象
+
+    mode 为 state 时每个对象的每个状态一张（max_states 大于0时每个对象最多这么多个状态）。
+    """
+    if mode not in MODES:
+        raise ValueError(f"未知画廊模式: {mode}（可选 {', '.join(MODES)}）")
+    names: List[str] = []
+    chosen = list(objects or []) + (fnmatch.filter(object_names, pattern) if pattern else [])
+    for name in chosen if (objects or pattern) else object_names:
+        if name not in names:
+            names.append(name)
+    if mode == "object":
+        return [GalleryItem(name) for name in names]
+    items = []
+    for name in names:
+        states = max(count_states(name) if count_states is not None else 1, 1)
+        if max_states > 0:
+            states = min(states, max_states)
+        items.extend(GalleryItem(name, state) for state in range(1, states + 1))
+    return items
+
+
+def parse_ppm(data: bytes) -> np.ndarray:
+    """解析二进制PPM（P6，每通道8位），返回 (高, 宽, 3) 的 uint8 数组"""
+    match = _PPM_HEADER.match(data)
+    if match is None:
+        raise ValueError("PyMOL返回的不是PPM图像（该版本的 cmd.png 可能不支持 format=1）")
+    width, height, maxval = (int(value) for value in match.groups())
+    if maxval != 255:
+        raise ValueError(f"不支持的PPM最大值: {maxval}")
+    pixels = np.frombuffer(data, dtype=np.uint8, count=width * height * 3, offset=match.end())
+    return pixels.reshape(height, width, 3)
+
+
+def encode_png(image: np.ndarray, level: int = 6) -> bytes:
+    """把 (高, 宽, 3) 的 uint8 数组编码为PNG（每行 Up 滤波，压缩率接近PyMOL输出）"""
+    height, width, _ = image.shape
+    rows = np.ascontiguousarray(image, dtype=np.uint8).reshape(height, width * 3)
+    filtered = np.empty((height, width * 3 + 1), dtype=np.uint8)
+    filtered[:, 0] = 2
+    filtered[0, 1:] = rows[0]
+    # uint8 相减即按 256 取模
+    np.subtract(rows[1:], rows[:-1], out=filtered[1:, 1:])
+
+    def chunk(kind: bytes, payload: bytes) -> bytes:
+        return (struct.pack(">I", len(payload)) + kind + payload
+                + struct.pack(">I", zlib.crc32(kind + payload) & 0xFFFFFFFF))
+
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header)
+            + chunk(b"IDAT", zlib.compress(filtered.tobytes(), level)) + chunk(b"IEND", b""))
+
+
+def layout(count: int, tile_width: int, tile_height: int, columns: int = 0) -> Tuple[int, int]:
+    """(列数, 行数)：未指定列数时让联系表接近正方形"""
+    if count <= 0:
+        return 0, 0
+    if columns <= 0:
+        columns = math.ceil(math.sqrt(count * tile_height / max(tile_width, 1)))
+    columns = min(max(columns, 1), count)
+    return columns, math.ceil(count / columns)
+
+
+def tile(items: Sequence[GalleryItem], tile_width: int, tile_height: int,
+         columns: int = 0) -> Tuple[np.ndarray, List[Dict[str, Any]]]:
+    """把缩略图按行拼成联系表，返回 (图像, 每格的索引)；渲染失败的格子留空"""
+    columns, rows = layout(len(items), tile_width, tile_height, columns)
+    sheet = np.empty((rows * (tile_height + PADDING) + PADDING, columns * (tile_width + PADDING) + PADDING, 3),
+                     dtype=np.uint8)
+    sheet[:] = SHEET_BACKGROUND
+    index = []
+    for k, item in enumerate(items):
+        row, col = divmod(k, columns)
+        x, y = PADDING + col * (tile_width + PADDING), PADDING + row * (tile_height + PADDING)
+        if item.image is not None:
+            # PyMOL 偶尔给出与请求相差一两个像素的图像：居中放置，超出的部分裁掉
+            h, w = min(item.image.shape[0], tile_height), min(item.image.shape[1], tile_width)
+            dy, dx = (tile_height - h) // 2, (tile_width - w) // 2
+            sheet[y + dy:y + dy + h, x + dx:x + dx + w] = item.image[:h, :w]
+        entry = {"index": k, "name": item.name, "row": row, "col": col, "x": x, "y": y}
+        if item.state:
+            entry["state"] = item.state
+        entry["cached"] = item.cached
+        if item.error:
+            entry["error"] = item.error
+        index.append(entry)
+    return sheet, index
+
+
+class ThumbnailCache:
+    """按 (指纹, 宽, 高, 是否光线追踪) 缓存缩略图像素，总大小超过 max_bytes 时淘汰最久未用的"""
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Tuple[str, int, int, bool], np.ndarray]" = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Tuple[str, int, int, bool]) -> Optional[np.ndarray]:
+        with self._lock:
+            image = self._entries.get(key)
+            if image is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return image
+
+    def put(self, key: Tuple[str, int, int, bool], image: np.ndarray) -> None:
+        if image.nbytes > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old.nbytes
+            self._entries[key] = image
+            self._bytes += image.nbytes
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.nbytes
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "mb": round(self._bytes / 1048576, 2),
+                "max_mb": round(self.max_bytes / 1048576, 2),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+            }
+
+
+def render(backends: Sequence[Callable[[], Any]], items: Sequence[GalleryItem], width: int, height: int,
+           ray: bool = False, batch_size: int = BATCH_SIZE,
+           report: Optional[Callable[..., None]] = None) -> None:
+    """用 backends（每个为返回 cmd 代理的函数）并发渲染 items，结果写回每个条目
+
+    批次的分发见 pymol_workers.run_batches；report(done, total, message) 在每批完成后调用。
+    多个后端时每个后端至少分到两批，先完成的后端可以分担剩下的批次。
+    """
+    from pymol_workers import run_batches
+    batch_size = max(int(batch_size), 1)
+    if len(backends) > 1:
+        batch_size = min(batch_size, max(math.ceil(len(items) / (2 * len(backends))), 1))
+    lock = threading.Lock()
+    rendered = [0]
+
+    def call(cmd, batch: List[GalleryItem]) -> List[Dict[str, Any]]:
+        return cmd.mcp_render_thumbnails([[item.name, item.state] for item in batch], width, height, int(ray))
+
+    def failed(batch: List[GalleryItem], error: str) -> List[Dict[str, Any]]:
+        return [{"error": error}] * len(batch)
+
+    def record(batch: List[GalleryItem], entries: List[Dict[str, Any]]) -> None:
+        for item, entry in zip(batch, entries):
+            if entry.get("error"):
+                item.error = entry["error"]
+                continue
+            try:
+                # XML-RPC 返回 xmlrpc.client.Binary，进程内模式直接得到 bytes
+                item.image = parse_ppm(getattr(entry["image"], "data", entry["image"]))
+            except ValueError as e:
+                item.error = str(e)
+        with lock:
+            rendered[0] += len(batch)
+            count = rendered[0]
+        if report is not None:
+            report(count, len(items), f"已渲染 {count}/{len(items)} 张缩略图")
+
+    run_batches(backends, [list(items[start:start + batch_size]) for start in range(0, len(items), batch_size)],
+                call, failed, record, "pymol-gallery")
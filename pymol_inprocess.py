@@ -0,0 +1,157 @@
+"""
+PyMOL 进程内 MCP 服务器
+
+由 PyMOL 插件（pymol_rpc_launcher.py）在PyMOL进程中启动，MCP服务器运行在
+后台线程里，工具调用直接调用 pymol.cmd，不经过XML-RPC：省去每次调用的
+XML编码/解码和一次本地HTTP往返，大的返回值（PDB文本、坐标、对象列表）
+直接以Python对象传递，几何分析通过 cmd.get_model 取坐标而不必解析PDB文本。
+
+cmd 调用统一交给调度器执行：PyMOL图形界面（Qt）在运行时转到GUI线程执行，
+无界面运行时在一个专用线程中串行执行，与PyMOL自带的XML-RPC服务器一致。
+外部的 pymol_mcp_server.py 仍可照常通过XML-RPC连接，两种方式可以并存。
+"""
+
+import concurrent.futures
+import threading
+import time
+import xmlrpc.client
+from typing import Any, Callable, Dict, Optional
+
+
+class ThreadDispatcher:
+    """在一个专用线程中串行执行 cmd 调用（无界面PyMOL）"""
+
+    def __init__(self):
+        self._executor = concurrent.futures.ThreadPoolExecutor(1, thread_name_prefix="pymol-cmd")
+
+    def call(self, func: Callable, *args, **kwargs) -> Any:
+        return self._executor.submit(func, *args, **kwargs).result()
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False)
+
+
+def _qt_dispatcher():
+    """PyMOL图形界面正在运行时，返回把调用转到GUI线程执行的调度器，否则返回 None
+
+    必须在GUI线程中调用（插件菜单回调即在GUI线程中），调度对象才属于GUI线程。
+    """
+    try:
+        from pymol.Qt import QtCore, QtWidgets
+    except ImportError:
+        return None
+    app = QtWidgets.QApplication.instance()
+    if app is None:
+        return None
+
+    class QtDispatcher(QtCore.QObject):
+        _request = QtCore.Signal(object)
+
+        def __init__(self):
+            super().__init__()
+            self._gui_thread = threading.current_thread()
+            # 跨线程发出的信号排队到GUI线程的事件循环中执行
+            self._request.connect(self._run, QtCore.Qt.QueuedConnection)
+
+        def _run(self, job) -> None:
+            future, func, args, kwargs = job
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(func(*args, **kwargs))
+                except BaseException as e:
+                    future.set_exception(e)
+
+        def call(self, func: Callable, *args, **kwargs) -> Any:
+            if threading.current_thread() is self._gui_thread:
+                return func(*args, **kwargs)
+            future = concurrent.futures.Future()
+            self._request.emit((future, func, args, kwargs))
+            return future.result()
+
+        def close(self) -> None:
+            pass
+
+    return QtDispatcher()
+
+
+def make_dispatcher():
+    """按PyMOL的运行方式选择调度器"""
+    return _qt_dispatcher() or ThreadDispatcher()
+
+
+class InProcessCmd:
+    """代替XML-RPC代理的 cmd 对象：同名方法经调度器直接调用 pymol.cmd
+
+    PyMOL端抛出的异常与XML-RPC一样转换成 xmlrpc.client.Fault，服务器中检测
+    辅助函数是否已安装等逻辑无需区分两种模式。
+    """
+
+    in_process = True
+
+    def __init__(self, cmd, dispatcher):
+        self._cmd = cmd
+        self._dispatcher = dispatcher
+
+    def __getattr__(self, name: str):
+        if name.startswith("_"):
+            raise AttributeError(name)
+
+        def call(*args, **kwargs):
+            # 每次调用时再查找：mcp_* 辅助函数是运行中注入到 cmd 上的
+            func = getattr(self._cmd, name, None)
+            if not callable(func):
+                raise xmlrpc.client.Fault(1, f'<class \'Exception\'>:method "{name}" is not supported')
+            try:
+                return self._dispatcher.call(func, *args, **kwargs)
+            except Exception as e:
+                raise xmlrpc.client.Fault(1, f"{type(e)}:{e}") from e
+
+        call.__name__ = name
+        return call
+
+
+class InProcessServer:
+    """在PyMOL进程的后台线程中运行的MCP HTTP服务器"""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 3000, config: Optional[Dict[str, Any]] = None,
+                 cmd=None):
+        if cmd is None:
+            from pymol import cmd
+        self.host = host
+        self.port = port
+        self.dispatcher = make_dispatcher()
+        self.config = dict(config or {}, pymol_cmd=InProcessCmd(cmd, self.dispatcher))
+        self._uvicorn = None
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def start(self, startup_timeout: float = 10.0) -> None:
+        import uvicorn
+        import pymol_mcp_server
+        app = pymol_mcp_server.create_app(self.config)
+        self._uvicorn = uvicorn.Server(uvicorn.Config(app, host=self.host, port=self.port, log_level="warning"))
+        # 非主线程中 uvicorn 不安装信号处理，由 stop() 结束
+        self._thread = threading.Thread(target=self._uvicorn.run, name="pymol-mcp-server", daemon=True)
+        self._thread.start()
+        # 等待端口绑定完成，端口被占用等启动错误在这里报告
+        deadline = time.monotonic() + startup_timeout
+        while not self._uvicorn.started:
+            if not self._thread.is_alive():
+                raise RuntimeError(f"MCP服务器启动失败（端口 {self.port} 是否已被占用？）")
+            if time.monotonic() > deadline:
+                raise RuntimeError("MCP服务器启动超时")
+            time.sleep(0.05)
+
+    def stop(self, timeout: float = 5.0) -> None:
+        if self._uvicorn is not None:
+            self._uvicorn.should_exit = True
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self.dispatcher.close()
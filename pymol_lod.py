@@ -0,0 +1,93 @@
+"""
+PyMOL MCP 细节层次（LOD）策略
+
+对核糖体、病毒衣壳这类超大结构，直接 show surface/mesh/spheres 或光线追踪
+会让PyMOL卡住数分钟并阻塞所有会话。这里根据目标选择的原子数决定降低多少精度：
+
+    原子数 / 上限      surface, mesh         spheres               cartoon
+    ≤ 1               原样显示              原样显示               原样显示
+    ≤ 4               质量 -1，按对象分块    sphere_quality 0      cartoon_sampling 3
+    ≤ 16              质量 -2，按对象分块    只显示 CA/P            CA 骨架（trace）
+    > 16              质量 -4，按对象分块    只显示 CA/P            CA 骨架（trace）
+
+渲染时如果以重表示方式显示的原子数超限，临时关闭抗锯齿和阴影。
+所有降级都可以用工具参数 force=true 跳过。
+"""
+
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+# 只保留主链骨架原子（蛋白质 CA、核酸 P）
+BACKBONE_TRACE = "(name CA or name P)"
+
+# 用于判断渲染负载的重表示方式
+HEAVY_REPS_SELECTION = "rep surface or rep mesh or rep spheres or rep dots"
+
+# 渲染降级时临时修改的设置
+RENDER_LOD_SETTINGS = {"antialias": 0, "ray_shadows": 0}
+
+
+@dataclass
+class LodPlan:
+    """一次 show 请求的降级方案"""
+    rep: str
+    selection: str
+    # 对目标对象设置的对象级设置
+    settings: Dict[str, Any] = field(default_factory=dict)
+    # 是否按对象分块生成（每块完成后报告进度）
+    chunked: bool = False
+    notes: List[str] = field(default_factory=list)
+
+
+def _tier(atoms: int, limit: int) -> int:
+    ratio = atoms / limit
+    if ratio <= 1:
+        return 0
+    if ratio <= 4:
+        return 1
+    if ratio <= 16:
+        return 2
+    return 3
+
+
+def plan_show(rep: str, selection: str, atoms: int, limit: Optional[int]) -> Optional[LodPlan]:
+    """为 show 请求生成降级方案，不需要降级时返回 None"""
+    if not limit:
+        return None
+    tier = _tier(atoms, limit)
+    if tier == 0:
+        return None
+
+    plan = LodPlan(rep, selection)
+    if rep in ("surface", "mesh"):
+        quality = {1: -1, 2: -2, 3: -4}[tier]
+        plan.settings[f"{rep}_quality"] = quality
+        plan.chunked = True
+        plan.notes.append(f"{rep}_quality 设为 {quality}")
+    elif rep == "dots":
+        plan.settings["dot_density"] = 0
+        plan.notes.append("dot_density 设为 0")
+    elif rep == "spheres":
+        plan.settings["sphere_quality"] = 0
+        plan.notes.append("sphere_quality 设为 0")
+        if tier >= 2:
+            plan.selection = f"({selection}) and {BACKBONE_TRACE}"
+            plan.notes.append("只显示 CA/P 原子")
+    elif rep == "cartoon":
+        if tier == 1:
+            plan.settings["cartoon_sampling"] = 3
+            plan.notes.append("cartoon_sampling 设为 3")
+        else:
+            plan.settings["cartoon_trace_atoms"] = 1
+            plan.selection = f"({selection}) and {BACKBONE_TRACE}"
+            plan.notes.append("只显示 CA/P 骨架")
+    else:
+        return None
+    return plan
+
+
+def plan_render(heavy_atoms: int, limit: Optional[int]) -> Dict[str, Any]:
+    """渲染前需要临时修改的设置，不需要降级时为空"""
+    if not limit or heavy_atoms <= limit:
+        return {}
+    return dict(RENDER_LOD_SETTINGS)
@@ -14,33 +14,103 @@ API端点:
     - GET /sse          - SSE连接端点（客户端连接到此获取事件流）
     - POST /messages/   - 消息发送端点（客户端发送JSON-RPC消息）
     - GET /health       - 健康检查端点
+    - GET /metrics      - 传输统计端点（含压缩节省的字节数）
+    - GET /sessions     - 会话列表端点（仅限本机或携带管理令牌）
+    - POST /mcp         - Streamable HTTP端点（无状态，可多worker运行）
+    - GET /admin/usage  - 资源用量端点（按会话/工具/后端，仅限本机或携带管理令牌）
+    - GET /admin/profile - 采样分析端点（仅限本机或携带管理令牌）
 """
 
-import asyncio
+from __future__ import annotations
+
 import argparse
+import base64
+import contextvars
+import gzip
 import json
+import os
 import sys
+import threading
+import time
 import xmlrpc.client
-from contextlib import asynccontextmanager
-from dataclasses import dataclass
-from typing import AsyncIterator, Dict, List, Optional, Any
-
-# MCP SDK
-from mcp.server import Server
-from mcp.server.sse import SseServerTransport
-from mcp.types import (
-    Tool,
-    TextContent,
-    ImageContent,
-    LoggingLevel,
-)
-
-# HTTP服务器
-from starlette.applications import Starlette
-from starlette.routing import Route, Mount
-from starlette.responses import Response, JSONResponse
-from starlette.requests import Request
-import uvicorn
+import zlib
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Dict, List, Optional, Any, Tuple
+
+# MCP SDK、Starlette 和 Uvicorn 的导入开销远大于本模块其余部分，
+# 因此只在真正启动服务器或处理请求时才导入（见 get_mcp_server / main），
+# 使 --check 等快速路径和被其他程序导入时不必为它们付出启动时间。
+if TYPE_CHECKING:
+    from mcp.server import Server
+    from mcp.server.sse import SseServerTransport
+    from mcp.types import Resource, Tool, TextContent
+    from starlette.applications import Starlette
+
+
+@dataclass
+class TransportStats:
+    """一类传输的字节统计（压缩前 raw，实际传输 wire）"""
+    messages: int = 0
+    compressed: int = 0
+    raw_bytes: int = 0
+    wire_bytes: int = 0
+
+    def record(self, raw: int, wire: int) -> None:
+        self.messages += 1
+        if wire < raw:
+            self.compressed += 1
+        self.raw_bytes += raw
+        self.wire_bytes += wire
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "messages": self.messages,
+            "compressed": self.compressed,
+            "raw_bytes": self.raw_bytes,
+            "wire_bytes": self.wire_bytes,
+            "saved_bytes": self.raw_bytes - self.wire_bytes,
+        }
+
+
+# 各传输通道的字节统计，通过 /metrics 端点查看
+transport_stats: Dict[str, TransportStats] = {
+    "http_request": TransportStats(),
+    "http_response": TransportStats(),
+    "xmlrpc_request": TransportStats(),
+    "xmlrpc_response": TransportStats(),
+}
+
+
+class CompressingTransport(xmlrpc.client.Transport):
+    """XML-RPC传输：请求体超过阈值时gzip压缩，并统计收发字节
+
+    PyMOL使用的 SimpleXMLRPCServer 本身支持gzip请求体，
+    并会对接受gzip的客户端压缩较大的响应。
+    """
+
+    def __init__(self, encode_threshold: Optional[int] = 4096):
+        super().__init__()
+        self.encode_threshold = encode_threshold
+
+    def send_content(self, connection, request_body):
+        raw = len(request_body)
+        if self.encode_threshold is not None and raw > self.encode_threshold:
+            connection.putheader("Content-Encoding", "gzip")
+            request_body = gzip.compress(request_body)
+        transport_stats["xmlrpc_request"].record(raw, len(request_body))
+        connection.putheader("Content-Length", str(len(request_body)))
+        connection.endheaders(request_body)
+
+    def parse_response(self, response):
+        body = response.read()
+        wire = len(body)
+        if response.getheader("Content-Encoding", "") == "gzip":
+            body = gzip.decompress(body)
+        transport_stats["xmlrpc_response"].record(len(body), wire)
+        parser, unmarshaller = self.getparser()
+        parser.feed(body)
+        parser.close()
+        return unmarshaller.close()
 
 
 @dataclass
@@ -48,22 +118,66 @@ class PyMOLConnection:
     """PyMOL XML-RPC连接管理"""
     host: str = "localhost"
     port: int = 9123
+    # XML-RPC请求体gzip压缩阈值（字节），None表示不压缩
+    compress_threshold: Optional[int] = 4096
     _server: Optional[xmlrpc.client.Server] = None
+    _url: Optional[str] = None
+    # ServerProxy 不是线程安全的，工具调用在线程池中执行，每个线程使用自己的代理
+    _local: threading.local = field(default_factory=threading.local, repr=False)
+    # 依次尝试的端口数（工作进程池中的连接只尝试分配的端口）
+    port_attempts: int = 5
+    # PyMOL端是否已安装输出捕获函数（None表示尚未检测）
+    capture_ready: Optional[bool] = None
+    # 该PyMOL实例的空间索引缓存（首次使用时创建）和写合并缓冲区
+    spatial_cache: Any = None
+    write_combiner: Any = None
+    # 按选择表达式缓存的原子数（用于判断昂贵调用）
+    atom_counts: Dict[str, int] = field(default_factory=dict, repr=False)
+    # 常用选择表达式物化成的隐藏命名选择（首次使用时创建）
+    selection_cache: Any = None
+    # 最近一次场景快照（pymol_scene.SceneState，有资源订阅时由 SceneWatcher 维护）
+    scene: Any = None
+    # 资源采样方式: None 尚未检测, "local" 读取本机进程信息, "rpc" 通过探针, "none" 不可用
+    usage_mode: Optional[str] = None
+    usage_pid: Optional[int] = None
+    # 渲染锁：前台渲染工具和后台精细渲染共用该PyMOL的图像缓冲区和渲染设置，依次进行
+    render_lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
     
     def connect(self) -> bool:
         """尝试连接到PyMOL XML-RPC服务器"""
-        for offset in range(5):  # 尝试5个端口
+        for offset in range(self.port_attempts):
             try:
                 url = f"http://{self.host}:{self.port + offset}"
-                self._server = xmlrpc.client.Server(url, allow_none=True)
+                self._server = xmlrpc.client.Server(
+                    url, allow_none=True, transport=CompressingTransport(self.compress_threshold)
+                )
+                self.capture_ready = None
+                self.spatial_cache = None
+                self.selection_cache = None
+                self.atom_counts.clear()
+                self.usage_mode = None
                 # 测试连接
                 self._server.ping()
+                self._url = url
                 print(f"已连接到PyMOL XML-RPC服务器: {url}", file=sys.stderr)
                 return True
             except Exception:
                 continue
+        self._server = self._url = None
         return False
     
+    def attach(self, cmd) -> None:
+        """直接使用给定的 cmd 对象（进程内模式，见 pymol_inprocess），不建立XML-RPC连接"""
+        self._server = cmd
+        self._url = None
+        self.host = "localhost"
+        self.capture_ready = None
+        self.spatial_cache = None
+        self.selection_cache = None
+        self.atom_counts.clear()
+        self.usage_mode = None
+        print("已在PyMOL进程内运行，直接调用 pymol.cmd", file=sys.stderr)
+
     @property
     def server(self) -> xmlrpc.client.Server:
         if self._server is None:
@@ -71,20 +185,1389 @@ class PyMOLConnection:
         return self._server
     
     def get_cmd(self):
-        """获取cmd代理对象，可以直接调用PyMOL命令"""
-        return self.server
+        """获取当前线程的cmd代理对象，可以直接调用PyMOL命令"""
+        server = self.server
+        if self._url is None:
+            return server
+        local = self._local
+        if getattr(local, "url", None) != self._url:
+            local.proxy = xmlrpc.client.Server(
+                self._url, allow_none=True, transport=CompressingTransport(self.compress_threshold)
+            )
+            local.url = self._url
+        return local.proxy
 
 
 # 全局连接实例
 pymol_conn = PyMOLConnection()
 
-# MCP服务器实例
-app = Server("pymol-controller")
+# 无界面PyMOL工作进程池（--pymol-workers 大于0时由 create_app 创建）
+worker_pool = None
+
+# 当前工具调用使用的PyMOL连接（工作进程池模式下按会话选择）
+_backend: contextvars.ContextVar[Optional[PyMOLConnection]] = contextvars.ContextVar("pymol_backend", default=None)
+
+
+def _current_conn() -> PyMOLConnection:
+    return _backend.get() or pymol_conn
+
+
+def _connections() -> List[PyMOLConnection]:
+    """所有PyMOL后端连接"""
+    if worker_pool is not None:
+        return worker_pool.connections()
+    return [pymol_conn]
+
+
+def _pymol_connected() -> bool:
+    return any(conn._server is not None for conn in _connections())
+
+def _load_sessions():
+    """导入会话存储模块"""
+    import pymol_sessions
+    return pymol_sessions
+
+
+# 会话状态存储（create_app 按配置替换，默认进程内存储）
+session_store = _load_sessions().MemorySessionStore()
+
+
+def _current_session_id() -> str:
+    """当前请求所属会话的标识
+
+    SSE 使用 session_id 查询参数，有状态的 Streamable HTTP 使用
+    Mcp-Session-Id 头；无状态请求可以通过 X-Client-Id 头自报身份，
+    否则退化为客户端地址。
+    """
+    try:
+        request = get_mcp_server().request_context.request
+    except LookupError:
+        return "local"
+    if request is None:
+        return "local"
+    session_id = (
+        request.query_params.get("session_id")
+        or request.headers.get("mcp-session-id")
+        or request.headers.get("x-client-id")
+    )
+    if session_id:
+        return session_id
+    return request.client.host if request.client else "unknown"
+
+
+def _load_admission():
+    """导入准入控制模块"""
+    import pymol_admission
+    return pymol_admission
+
+
+# 准入控制器（create_app 按配置创建，直接调用 call_tool 时使用默认配置）
+admission = None
+
+
+def _get_admission():
+    global admission
+    if admission is None:
+        admission = _load_admission().AdmissionController()
+    return admission
+
+
+# MCP服务器实例（首次使用时由 get_mcp_server 创建）
+_mcp_server: Optional[Server] = None
+
+
+def get_mcp_server() -> Server:
+    """创建（或返回已创建的）MCP服务器实例并注册工具处理函数"""
+    global _mcp_server
+    if _mcp_server is None:
+        from mcp.server import Server
+
+        server = Server("pymol-controller")
+        server.list_tools()(list_tools)
+        server.call_tool()(call_tool)
+        server.list_resources()(list_resources)
+        server.read_resource()(read_resource)
+        server.subscribe_resource()(subscribe_resource)
+        server.unsubscribe_resource()(unsubscribe_resource)
+        _mcp_server = server
+    return _mcp_server
+
+
+def _initialization_options(mcp_server: Server):
+    """MCP初始化选项：开启场景推送时声明支持资源订阅"""
+    options = mcp_server.create_initialization_options()
+    if scene_poll_interval > 0 and options.capabilities.resources is not None:
+        # 低层 Server 总是声明 subscribe=False，订阅由 SceneWatcher 实现
+        options.capabilities.resources.subscribe = True
+    return options
+
+
+def __getattr__(name: str):
+    # 兼容旧代码中的 pymol_mcp_server.app
+    if name == "app":
+        return get_mcp_server()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def _load_analysis():
+    """按需导入几何分析模块（依赖NumPy）"""
+    try:
+        import pymol_analysis
+    except ImportError as e:
+        raise RuntimeError(f"分析工具需要NumPy，请先安装: pip install numpy ({e})")
+    return pymol_analysis
+
+
+# 视图/颜色操作写合并窗口（秒），0 表示关闭
+coalesce_window = 0.0
+
+# 每个PyMOL后端缓存的选择表达式数（隐藏命名选择数），0 表示关闭
+selection_cache_size = 32
+
+# pymol_do 中不会改变坐标、状态或对象集合的命令，执行它们时保留空间索引缓存
+_COORD_SAFE_COMMANDS = {
+    "select", "deselect", "color", "bg_color", "show", "hide", "as", "zoom",
+    "orient", "center", "turn", "move", "reset", "label", "enable", "disable",
+    "ray", "draw", "png", "distance", "angle", "dihedral", "get_area",
+    "count_atoms", "iterate", "cartoon", "set_bond", "set_view", "view", "scene",
+    "util.cbc", "util.chainbow", "util.rainbow", "util.ss", "util.cbag",
+    "preset.simple", "preset.ball_and_stick", "preset.ligands", "preset.pretty",
+    "preset.publication", "preset.technical", "preset.b_factor_putty",
+}
+
+
+def _get_spatial_cache():
+    """取得当前PyMOL后端的空间索引缓存"""
+    conn = _current_conn()
+    if conn.spatial_cache is None:
+        conn.spatial_cache = _load_analysis().SpatialIndexCache()
+    return conn.spatial_cache
+
+
+def _split_commands(command: str) -> List[str]:
+    """把 pymol_do 的脚本拆分为单条命令
+
+    按行拆分，普通命令行再按分号拆分；Python行（以 / 开头）保持原样。
+    含 python ... python end 代码块的脚本无法安全拆分，整体作为一条命令。
+    """
+    lines = [line.strip() for line in command.splitlines() if line.strip()]
+    if any(line == "python" for line in lines):
+        return [command]
+    commands = []
+    for line in lines:
+        if line.startswith("/") or line.startswith("#"):
+            commands.append(line)
+        else:
+            commands.extend(c.strip() for c in line.split(";") if c.strip())
+    return commands
+
+
+def _command_changes_coords(command: str) -> bool:
+    """判断一条PyMOL命令是否可能改变坐标、状态或对象集合"""
+    words = command.replace(",", " ").split()
+    verb = words[0].lower()
+    if verb == "set":
+        # set state/frame 会切换当前状态
+        return len(words) > 1 and words[1].lower() in ("state", "frame")
+    return verb not in _COORD_SAFE_COMMANDS
+
+
+def _invalidate_spatial_cache(name: str, arguments: Dict[str, Any]) -> None:
+    """在可能改变坐标的工具调用前丢弃受影响的空间索引"""
+    spatial_cache = _current_conn().spatial_cache
+    if spatial_cache is None:
+        return
+    if name in ("pymol_load", "pymol_fetch"):
+        spatial_cache.invalidate()
+    elif name == "pymol_delete":
+        spatial_cache.invalidate(arguments.get("name"))
+    elif name == "pymol_rotate" and arguments.get("selection"):
+        spatial_cache.invalidate()
+    elif name == "pymol_align_many" and arguments.get("transform"):
+        spatial_cache.invalidate()
+    elif name == "pymol_do":
+        if any(_command_changes_coords(c) for c in _split_commands(arguments.get("command", ""))):
+            spatial_cache.invalidate()
+
+
+def _selection_changes(command: str) -> bool:
+    """判断一条PyMOL命令是否可能改变选择表达式的结果"""
+    verb = command.replace(",", " ").split()[0].lower()
+    return verb in ("select", "deselect") or _command_changes_coords(command)
+
+
+def _invalidate_selection_cache(name: str, arguments: Dict[str, Any]) -> None:
+    """在可能改变对象、坐标或命名选择的工具调用前丢弃缓存的隐藏选择"""
+    selection_cache = _current_conn().selection_cache
+    if selection_cache is None:
+        return
+    if name in ("pymol_load", "pymol_fetch", "pymol_delete", "pymol_select", "pymol_select_near",
+                "pymol_apply_preset") or (name == "pymol_rotate" and arguments.get("selection")) or (
+            name == "pymol_align_many" and arguments.get("transform")):
+        selection_cache.invalidate()
+    elif name == "pymol_do":
+        if any(_selection_changes(c) for c in _split_commands(arguments.get("command", ""))):
+            selection_cache.invalidate()
+
+
+def _resolve_selection(conn: PyMOLConnection, cmd, selection: str) -> str:
+    """把反复使用的复杂选择表达式换成缓存的隐藏命名选择"""
+    if selection_cache_size <= 0:
+        return selection
+    if conn.selection_cache is None:
+        import pymol_selcache
+        conn.selection_cache = pymol_selcache.SelectionCache(selection_cache_size)
+    return conn.selection_cache.resolve(cmd, selection)
+
+
+def _selection_cache_stats() -> Optional[Dict[str, Any]]:
+    """所有后端选择表达式缓存的累计统计，未开启时为 None"""
+    if selection_cache_size <= 0:
+        return None
+    total = {"max_entries": selection_cache_size}
+    for conn in _connections():
+        if conn.selection_cache is not None:
+            for key, value in conn.selection_cache.stats().items():
+                total[key] = total.get(key, 0) + value
+    return total
+
+
+def _invalidate_atom_counts(name: str, arguments: Dict[str, Any]) -> None:
+    """在可能改变对象、坐标或命名选择的工具调用前丢弃缓存的原子数"""
+    if name in ("pymol_load", "pymol_fetch", "pymol_delete", "pymol_select", "pymol_do",
+                "pymol_apply_preset") or (
+            name == "pymol_rotate" and arguments.get("selection")) or (
+            name == "pymol_align_many" and arguments.get("transform")):
+        _current_conn().atom_counts.clear()
+
+
+# pymol_do 单条命令和整个脚本返回的输出上限（字符）
+_COMMAND_OUTPUT_LIMIT = 16384
+_SCRIPT_OUTPUT_LIMIT = 65536
+
+# PyMOL端辅助函数的版本，增删或修改辅助函数时递增，已注入旧版本的PyMOL会重新注入
+_CAPTURE_HELPER_VERSION = 4
+
+# 安装到PyMOL端的输出捕获函数和批量调用函数。通过 cmd.do 的 "/" Python行注入，
+# 挂在 cmd 模块上，因此可以经由 XML-RPC 直接调用 cmd.mcp_do_capture / cmd.mcp_call_batch。
+_CAPTURE_HELPER_SOURCE = '''
+def mcp_do_capture(commands, max_chars=16384):
+    import contextlib
+    from pymol import cmd, parsing
+
+    class BoundedBuffer:
+        def __init__(self, limit):
+            self.parts, self.size, self.dropped, self.limit = [], 0, 0, limit
+        def write(self, text):
+            room = max(self.limit - self.size, 0)
+            self.parts.append(text[:room])
+            self.size += min(len(text), room)
+            self.dropped += max(len(text) - room, 0)
+            return len(text)
+        def flush(self):
+            pass
+        def getvalue(self):
+            text = "".join(self.parts)
+            if self.dropped:
+                text += "\\n...[已截断 %d 个字符]" % self.dropped
+            return text
+
+    def call(command):
+        verb, _, rest = command.partition(" ")
+        entry = cmd.keyword.get(verb)
+        if entry is not None and len(entry) > 4 and entry[4] == parsing.STRICT and ";" not in command:
+            try:
+                func = entry[0]
+                args, kwargs = parsing.prepare_call(func, parsing.parse_arg(rest, mode=parsing.STRICT, _self=cmd), parsing.STRICT, _self=cmd)
+            except Exception:
+                pass
+            else:
+                return func(*args, **kwargs)
+        cmd.do(command, echo=0)
+        return None
+
+    results = []
+    for command in commands:
+        buf = BoundedBuffer(max_chars)
+        entry = {"command": command, "output": "", "result": None, "error": None}
+        try:
+            with contextlib.redirect_stdout(buf), contextlib.redirect_stderr(buf):
+                value = call(command)
+            if value is not None:
+                entry["result"] = repr(value)[:max_chars]
+        except Exception as e:
+            entry["error"] = "%s: %s" % (type(e).__name__, e)
+        entry["output"] = buf.getvalue()
+        results.append(entry)
+    return results
+
+def mcp_resource_usage():
+    import os
+    times = os.times()
+    rss = 0
+    try:
+        import psutil
+        rss = psutil.Process().memory_info().rss
+    except Exception:
+        try:
+            with open("/proc/self/statm") as f:
+                rss = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except Exception:
+            pass
+    return {"pid": os.getpid(), "cpu_s": times.user + times.system, "rss_mb": rss / 1048576.0 if rss else None}
+
+def mcp_call_batch(calls):
+    from pymol import cmd
+    errors = []
+    for func, args in calls:
+        try:
+            getattr(cmd, func)(*args)
+            errors.append(None)
+        except Exception as e:
+            errors.append("%s: %s" % (type(e).__name__, e))
+    return errors
+
+def mcp_scene_snapshot():
+    from pymol import cmd
+    enabled = set(cmd.get_names("objects", 1))
+    objects = []
+    for name in cmd.get_names("objects", 0):
+        objects.append({"name": name, "type": cmd.get_type(name), "states": cmd.count_states(name),
+                        "atoms": cmd.count_atoms(name), "enabled": name in enabled})
+    return {"objects": objects, "view": list(cmd.get_view())}
+
+def mcp_align_many(target, mobiles, method="align", atoms="", cycles=5, transform=0):
+    from pymol import cmd
+    func = getattr(cmd, method)
+    results = []
+    for mobile in mobiles:
+        try:
+            r = func("(%s) and %s" % (mobile, atoms) if atoms else mobile, target,
+                     cycles=int(cycles), transform=int(transform))
+            results.append({"target": mobile, "rmsd": round(r[0], 3), "atoms": r[1], "cycles": r[2],
+                            "rmsd_pre": round(r[3], 3), "atoms_pre": r[4]})
+        except Exception as e:
+            results.append({"target": mobile, "error": "%s: %s" % (type(e).__name__, e)})
+    return results
+
+def mcp_list_files(pattern):
+    import glob, os
+    return sorted(glob.glob(os.path.expanduser(pattern), recursive=True)) if pattern else []
+
+def mcp_convert_files(files, output_dir, fmt, split_chain=0, split_state=0, selection="", overwrite=0):
+    import os
+    from pymol import cmd
+    os.makedirs(output_dir, exist_ok=True)
+    results = []
+    for path in files:
+        entry = {"file": path, "outputs": 0, "error": None}
+        stem = os.path.basename(path)
+        for ext in (".gz", ".pdb", ".ent", ".cif", ".mmtf", ".mol2", ".sdf", ".mol", ".xyz", ".pqr"):
+            if stem.lower().endswith(ext):
+                stem = stem[:-len(ext)]
+        single = os.path.join(output_dir, "%s.%s" % (stem, fmt))
+        if not (split_chain or split_state or overwrite) and os.path.exists(single):
+            results.append(entry)
+            continue
+        name = "_mcp_convert"
+        try:
+            cmd.load(path, name, quiet=1)
+            target = "(%s) and (%s)" % (name, selection) if selection else name
+            chains = cmd.get_chains(target) if split_chain else [None]
+            states = range(1, cmd.count_states(name) + 1) if split_state else [0]
+            for chain in chains:
+                for state in states:
+                    suffix = ""
+                    sel = target
+                    if chain is not None:
+                        suffix += "_" + (chain or "blank")
+                        sel = "(%s) and chain '%s'" % (target, chain)
+                    if split_state:
+                        suffix += "_s%d" % state
+                    out = os.path.join(output_dir, "%s%s.%s" % (stem, suffix, fmt))
+                    if overwrite or not os.path.exists(out):
+                        cmd.save(out, sel, state, fmt)
+                        entry["outputs"] += 1
+        except Exception as e:
+            entry["error"] = "%s: %s" % (type(e).__name__, e)
+        finally:
+            cmd.delete(name)
+        results.append(entry)
+    return results
+
+def mcp_render_png(filename="", width=0, height=0, dpi=-1, ray=0):
+    import os, tempfile, xmlrpc.client
+    from pymol import cmd
+    path = filename
+    if not path:
+        fd, path = tempfile.mkstemp(prefix="mcp_preview_", suffix=".png")
+        os.close(fd)
+    try:
+        cmd.png(path, width, height, dpi, ray, quiet=1)
+        if hasattr(cmd, "sync"):
+            # 图形界面模式下 png 在下一次重绘时才写出
+            cmd.sync()
+        with open(path, "rb") as f:
+            return xmlrpc.client.Binary(f.read())
+    finally:
+        if not filename and os.path.exists(path):
+            os.remove(path)
+
+def mcp_ray_png(filename="", width=0, height=0, dpi=-1, antialias=-1):
+    import os, tempfile, xmlrpc.client
+    from pymol import cmd
+    # 光线追踪和保存在同一次调用中完成，中间不会插入其他调用的渲染；
+    # 图像先写到目标目录下的临时文件，由 mcp_commit_png 改名或丢弃
+    directory = os.path.dirname(os.path.abspath(filename)) if filename else None
+    fd, path = tempfile.mkstemp(prefix=".mcp_render_", suffix=".png", dir=directory)
+    os.close(fd)
+    try:
+        cmd.ray(width, height, antialias=antialias, quiet=1)
+        cmd.png(path, dpi=dpi, quiet=1, prior=1)
+        if hasattr(cmd, "sync"):
+            cmd.sync()
+        with open(path, "rb") as f:
+            data = f.read()
+    except Exception:
+        os.remove(path)
+        raise
+    if not filename:
+        os.remove(path)
+        path = ""
+    return {"image": xmlrpc.client.Binary(data), "partial": path}
+
+def mcp_commit_png(partial, filename=""):
+    import os
+    if not partial:
+        return
+    if filename:
+        os.replace(partial, filename)
+    elif os.path.exists(partial):
+        os.remove(partial)
+
+def mcp_gallery_fingerprints(items):
+    import hashlib
+    from pymol import cmd
+    scene = repr([cmd.get(name) for name in ("bg_rgb", "ray_trace_mode", "antialias", "orthoscopic",
+                                             "field_of_view", "ambient", "ray_shadows", "depth_cue")])
+    results = []
+    for name, state in items:
+        digest = hashlib.blake2b(scene.encode(), digest_size=12)
+        try:
+            digest.update(("%s|%s|%d|%d" % (name, cmd.get_type(name), cmd.count_states(name), state)).encode())
+            digest.update(repr(cmd.get_extent(name, state or -1)).encode())
+            coords = cmd.get_coords(name, state or -1)
+            if coords is not None:
+                digest.update(coords.tobytes())
+                atoms = []
+                cmd.iterate(name, "atoms.append((color, reps))", space={"atoms": atoms})
+                digest.update(repr(atoms).encode())
+            results.append(digest.hexdigest())
+        except Exception:
+            # 无法计算指纹的对象不缓存，渲染时再报告错误
+            results.append("")
+    return results
+
+def mcp_render_thumbnails(items, width, height, ray=0):
+    import os, tempfile, xmlrpc.client
+    from pymol import cmd
+    enabled = cmd.get_names("all", 1)
+    view = cmd.get_view()
+    current = cmd.get_state()
+    fd, path = tempfile.mkstemp(prefix="mcp_thumb_", suffix=".ppm")
+    os.close(fd)
+    results = []
+    try:
+        cmd.disable("all")
+        for name, state in items:
+            entry = {"image": None, "error": None}
+            try:
+                cmd.enable(name)
+                if state:
+                    cmd.set("state", state)
+                cmd.orient(name, state=state)
+                cmd.png(path, width, height, ray=int(ray), quiet=1, format=1)
+                if hasattr(cmd, "sync"):
+                    cmd.sync()
+                with open(path, "rb") as f:
+                    entry["image"] = xmlrpc.client.Binary(f.read())
+            except Exception as e:
+                entry["error"] = "%s: %s" % (type(e).__name__, e)
+            finally:
+                cmd.disable(name)
+            results.append(entry)
+    finally:
+        for name in enabled:
+            cmd.enable(name)
+        cmd.set("state", current)
+        cmd.set_view(view)
+        if os.path.exists(path):
+            os.remove(path)
+    return results
+
+from pymol import cmd as _cmd
+_cmd.mcp_gallery_fingerprints = mcp_gallery_fingerprints
+_cmd.mcp_render_thumbnails = mcp_render_thumbnails
+_cmd.mcp_render_png = mcp_render_png
+_cmd.mcp_ray_png = mcp_ray_png
+_cmd.mcp_commit_png = mcp_commit_png
+_cmd.mcp_list_files = mcp_list_files
+_cmd.mcp_convert_files = mcp_convert_files
+_cmd.mcp_align_many = mcp_align_many
+_cmd.mcp_do_capture = mcp_do_capture
+_cmd.mcp_call_batch = mcp_call_batch
+_cmd.mcp_resource_usage = mcp_resource_usage
+_cmd.mcp_scene_snapshot = mcp_scene_snapshot
+''' + f"_cmd.mcp_helper_version = lambda: {_CAPTURE_HELPER_VERSION}\n"
+
+
+def _ensure_capture_helper(cmd, conn: Optional[PyMOLConnection] = None) -> bool:
+    """确保PyMOL端可用输出捕获函数，不可用时返回False（回退到 cmd.do）"""
+    conn = conn or _current_conn()
+    if conn.capture_ready is not None:
+        return conn.capture_ready
+    try:
+        # PyMOL端是旧版本服务器注入的辅助函数时重新注入
+        if cmd.mcp_helper_version() != _CAPTURE_HELPER_VERSION:
+            raise xmlrpc.client.Fault(1, "mcp helpers outdated")
+        conn.capture_ready = True
+    except xmlrpc.client.Fault:
+        encoded = base64.b64encode(_CAPTURE_HELPER_SOURCE.encode("utf-8")).decode("ascii")
+        try:
+            cmd.do(f"/import base64; exec(base64.b64decode('{encoded}').decode('utf-8'))")
+            cmd.mcp_helper_version()
+            conn.capture_ready = True
+        except Exception as e:
+            print(f"无法安装pymol_do输出捕获，回退到cmd.do: {e}", file=sys.stderr)
+            conn.capture_ready = False
+    return conn.capture_ready
+
+
+def _send_batch(cmd, ops, conn: Optional[PyMOLConnection] = None) -> List[Optional[str]]:
+    """用一次RPC执行一组 cmd 调用，返回每个调用的错误（成功为 None）"""
+    if _ensure_capture_helper(cmd, conn):
+        return cmd.mcp_call_batch([[func, list(args)] for func, args in ops])
+    errors = []
+    for func, args in ops:
+        try:
+            getattr(cmd, func)(*args)
+            errors.append(None)
+        except Exception as e:
+            errors.append(str(e))
+    return errors
+
+
+def _attach_write_combiner(conn: PyMOLConnection) -> None:
+    """按 coalesce_window 为连接创建写合并缓冲区"""
+    conn.write_combiner = None
+    if coalesce_window > 0:
+        import pymol_coalesce
+        conn.write_combiner = pymol_coalesce.WriteCombiner(
+            lambda cmd, ops: _send_batch(cmd, ops, conn), conn.get_cmd, coalesce_window
+        )
+
+
+def _coalesce_stats() -> Optional[Dict[str, Any]]:
+    """所有后端写合并缓冲区的累计统计，未开启时为 None"""
+    combiners = [conn.write_combiner for conn in _connections() if conn.write_combiner is not None]
+    if not combiners:
+        return None
+    total = {"window_ms": round(coalesce_window * 1000, 1)}
+    for combiner in combiners:
+        for key, value in combiner.stats().items():
+            if key != "window_ms":
+                total[key] = total.get(key, 0) + value
+    return total
+
+
+def _worker_connection(port: int) -> PyMOLConnection:
+    """工作进程池中某个PyMOL进程的连接"""
+    conn = PyMOLConnection("127.0.0.1", port, compress_threshold=pymol_conn.compress_threshold,
+                           port_attempts=1)
+    _attach_write_combiner(conn)
+    return conn
+
+
+def _load_accounting():
+    """导入资源用量统计模块"""
+    import pymol_accounting
+    return pymol_accounting
+
+
+# 资源用量账本（create_app 创建，--no-accounting 时为 None）和昂贵调用检查
+usage_ledger = None
+cost_guard = None
+# 远程后端每次采样都是一次额外的RPC往返，默认只记录耗时（--remote-accounting 开启）
+remote_accounting = False
+
+
+def _backend_label(conn: PyMOLConnection) -> str:
+    if conn._server is not None and conn._url is None:
+        return "in-process"
+    return (conn._url or f"{conn.host}:{conn.port}").replace("http://", "")
+
+
+def _sample_backend(conn: PyMOLConnection, cmd, allow_rpc: Optional[bool] = None) -> Optional[Dict[str, float]]:
+    """采样PyMOL后端进程的常驻内存和CPU时间
+
+    本机后端第一次采样通过探针取得PyMOL进程号，之后直接读取进程信息，
+    不再占用RPC往返。远程后端只能通过探针采样，每次都要多一次RPC，
+    因此只在 allow_rpc（默认取 remote_accounting）为真时采样。
+    """
+    accounting = _load_accounting()
+    if allow_rpc is None:
+        allow_rpc = remote_accounting
+    try:
+        if conn.usage_mode is None:
+            in_process = conn._server is not None and conn._url is None
+            if not in_process and conn.host not in ("localhost", "127.0.0.1", "::1"):
+                conn.usage_mode = "rpc"
+            else:
+                conn.usage_mode = "none"
+                if _ensure_capture_helper(cmd, conn):
+                    usage = cmd.mcp_resource_usage()
+                    conn.usage_pid = usage["pid"]
+                    local = accounting.process_usage(conn.usage_pid)
+                    conn.usage_mode = "local" if local else "rpc"
+                    return local or usage
+        if conn.usage_mode == "local":
+            return accounting.process_usage(conn.usage_pid)
+        if conn.usage_mode == "rpc" and allow_rpc and _ensure_capture_helper(cmd, conn):
+            return cmd.mcp_resource_usage()
+    except Exception:
+        pass
+    return None
+
+
+# 流量录制器（--record-traffic 时由 create_app 创建）
+traffic_recorder = None
+
+# 管理端点（/admin/* 和 /sessions）的访问令牌（--admin-token 或环境变量 PYMOL_MCP_ADMIN_TOKEN），
+# 未设置时只允许本机访问
+admin_token: Optional[str] = None
+_ADMIN_TOKEN_ENV = "PYMOL_MCP_ADMIN_TOKEN"
+
+
+# 同一时刻只运行一次分析（在事件循环中检查和设置，无需加锁）
+_profiling = False
+
+
+def _admin_allowed(request) -> bool:
+    """设置了令牌时校验 Authorization: Bearer <令牌>，否则只允许来自本机回环地址的请求"""
+    import hmac
+    if admin_token:
+        supplied = request.headers.get("authorization", "")
+        return supplied.startswith("Bearer ") and hmac.compare_digest(supplied[7:].encode(), admin_token.encode())
+    client = request.client
+    return client is not None and client.host in ("127.0.0.1", "::1", "localhost")
+
+
+def _load_presets():
+    """导入场景预设模块"""
+    import pymol_presets
+    return pymol_presets
+
+
+# 场景预设注册表（create_app 按 --presets-dir 创建，直接调用时只有内置预设）
+presets = None
+
+
+def _get_presets():
+    global presets
+    if presets is None:
+        presets = _load_presets().PresetRegistry()
+    return presets
+
+
+def _apply_preset(cmd, preset_name: str, params: Dict[str, Any]) -> str:
+    """展开预设并用一次RPC执行，返回执行摘要"""
+    registry = _get_presets()
+    commands = registry.render(preset_name, params)
+    spatial_cache = _current_conn().spatial_cache
+    if spatial_cache is not None and any(_command_changes_coords(c) for c in commands):
+        spatial_cache.invalidate()
+    start = time.perf_counter()
+    if _ensure_capture_helper(cmd):
+        entries = cmd.mcp_do_capture(list(commands), _COMMAND_OUTPUT_LIMIT)
+    else:
+        cmd.do("\n".join(commands))
+        entries = []
+    elapsed = time.perf_counter() - start
+    registry.record(preset_name, elapsed)
+    errors = [entry for entry in entries if entry.get("error")]
+    text = f"已应用预设 {preset_name}（{len(commands)} 条命令，{elapsed * 1000:.0f} ms）"
+    if errors:
+        text += f"，{len(errors)} 条出错:\n" + "".join(_format_command_result(e) for e in errors)
+    return text
+
+
+def _load_align():
+    """导入多结构比对模块"""
+    import pymol_align
+    return pymol_align
+
+
+def _fit_many(conn: PyMOLConnection, cmd, reference: str, targets: List[str],
+              atoms: List[str], object_names: List[str]) -> List[Dict[str, Any]]:
+    """原子已对应时在服务器端批量Kabsch叠合，坐标取自空间索引缓存"""
+    analysis = _load_analysis()
+    cache = _get_spatial_cache()
+
+    def table(selection: str):
+        data = cache.get(cmd, selection).table if selection in object_names else analysis.fetch_atoms(cmd, selection)
+        return data.with_names(atoms) if atoms else data
+
+    reference_table = table(reference)
+    tables, errors = {}, {}
+    for target in targets:
+        try:
+            tables[target] = table(target)
+        except ValueError as e:
+            errors[target] = {"target": target, "error": str(e)}
+    fitted = {r["target"]: r for r in analysis.rmsd_many(reference_table, tables)}
+    return [fitted.get(target) or errors[target] for target in targets]
+
+
+def _align_on_backends(conn: PyMOLConnection, cmd, reference: str, targets: List[str], method: str,
+                       atoms: List[str], cycles: int, transform: bool) -> Tuple[List[Dict[str, Any]], int]:
+    """用 align/super 比对，返回 (结果, 使用的后端数)
+
+    工作进程池模式下目标较多且不移动结构时，借用空闲的备用进程并行比对：
+    参考结构和分到的目标以PDB文本载入借来的进程，比对后由进程池清空。
+    """
+    align = _load_align()
+    use_helper = _ensure_capture_helper(cmd, conn)
+    helpers = 0 if worker_pool is None or transform else len(targets) // align.MIN_CHUNK - 1
+    if helpers <= 0:
+        return align.align_batch(cmd, reference, targets, method, atoms, cycles, transform, use_helper), 1
+
+    from concurrent.futures import ThreadPoolExecutor
+    with worker_pool.borrow(helpers) as borrowed:
+        if not borrowed:
+            return align.align_batch(cmd, reference, targets, method, atoms, cycles, transform, use_helper), 1
+        chunks = align.split(targets, len(borrowed) + 1)
+        # 借来的进程没有会话的场景：先从会话的PyMOL取出结构
+        reference_pdb = cmd.get_pdbstr(reference)
+        shipped = [[(target, cmd.get_pdbstr(target)) for target in chunk] for chunk in chunks[1:]]
+
+        def run_borrowed(worker, structures):
+            worker_cmd = worker.conn.get_cmd()
+            worker_cmd.read_pdbstr(reference_pdb, "_mcp_reference")
+            for target, pdb in structures:
+                worker_cmd.read_pdbstr(pdb, target)
+            return align.align_batch(worker_cmd, "_mcp_reference", [t for t, _ in structures], method, atoms,
+                                     cycles, False, _ensure_capture_helper(worker_cmd, worker.conn))
+
+        with ThreadPoolExecutor(len(borrowed)) as executor:
+            futures = [executor.submit(run_borrowed, worker, structures)
+                       for worker, structures in zip(borrowed, shipped)]
+            results = align.align_batch(cmd, reference, chunks[0], method, atoms, cycles, False, use_helper)
+            for future in futures:
+                results.extend(future.result())
+    return results, len(borrowed) + 1
+
+
+def _align_many(conn: PyMOLConnection, cmd, arguments: Dict[str, Any]) -> Dict[str, Any]:
+    align = _load_align()
+    reference = arguments["reference"]
+    method = arguments.get("method", "align")
+    if method not in align.METHODS:
+        raise ValueError(f"未知比对方法: {method}（可选 {', '.join(align.METHODS)}）")
+    atoms = list(arguments.get("atoms", ["CA"]))
+    transform = bool(arguments.get("transform", False))
+    object_names = list(cmd.get_names("objects", 0))
+    targets = align.resolve_targets(object_names, reference, arguments.get("targets"), arguments.get("pattern"))
+    if not targets:
+        raise ValueError("没有要比对的目标结构，请给出 targets 或 pattern")
+
+    start = time.perf_counter()
+    if method == "fit":
+        results, backends = _fit_many(conn, cmd, reference, targets, atoms, object_names), 1
+    else:
+        results, backends = _align_on_backends(conn, cmd, reference, targets, method, atoms,
+                                               int(arguments.get("cycles", 5)), transform)
+    body = {"reference": reference, "method": method, "atoms": atoms or "all",
+            "transform": transform and method != "fit", "backends": backends,
+            "elapsed_ms": round((time.perf_counter() - start) * 1000, 1)}
+    body.update(align.page(results, arguments.get("sort", "rmsd"), bool(arguments.get("descending", False)),
+                           int(arguments.get("offset", 0)), int(arguments.get("limit", 50))))
+    return body
+
+
+def _convert_many(conn: PyMOLConnection, cmd, arguments: Dict[str, Any], loop) -> Dict[str, Any]:
+    """批量转换文件格式；工作进程池模式下借用空闲的备用进程并发转换"""
+    import contextlib
+    import pymol_convert
+    options = pymol_convert.ConvertOptions(
+        output_dir=arguments["output_dir"],
+        format=arguments.get("format", "cif"),
+        split_chain=bool(arguments.get("split_chains", False)),
+        split_state=bool(arguments.get("split_states", False)),
+        selection=arguments.get("selection", ""),
+        overwrite=bool(arguments.get("overwrite", False)),
+    )
+    if not _ensure_capture_helper(cmd, conn):
+        raise RuntimeError("批量转换需要在PyMOL端安装辅助函数，但安装失败（见服务器日志）")
+    files = list(arguments.get("inputs") or [])
+    if arguments.get("input_glob"):
+        # 文件在PyMOL所在的机器上，通配符也在PyMOL端展开
+        files += [path for path in cmd.mcp_list_files(arguments["input_glob"]) if path not in files]
+    if not files:
+        raise ValueError("没有要转换的文件，请给出 inputs 或 input_glob")
+
+    extra = max(int(arguments.get("concurrency", 4)) - 1, 0) if worker_pool is not None else 0
+    with (worker_pool.borrow(extra) if extra else contextlib.nullcontext([])) as borrowed:
+        for worker in borrowed:
+            _ensure_capture_helper(worker.conn.get_cmd(), worker.conn)
+        backends = [conn.get_cmd] + [worker.conn.get_cmd for worker in borrowed
+                                     if worker.conn.capture_ready]
+        progress = pymol_convert.run(backends, files, options, int(arguments.get("batch_size", 16)),
+                                     _progress_reporter(loop))
+    return dict(progress.summary(), backends=len(backends), format=options.format,
+                output_dir=options.output_dir)
+
+
+def _representation_requests(name: str, arguments: Dict[str, Any]) -> List[Tuple[str, str]]:
+    """提取工具调用请求的 (表示方式, 选择) 对"""
+    if name == "pymol_show":
+        return [(arguments.get("representation", ""), arguments.get("selection", "all"))]
+    requests = []
+    if name == "pymol_do":
+        for command in _split_commands(arguments.get("command", "")):
+            verb, _, rest = command.partition(" ")
+            if verb.lower() in ("show", "as"):
+                rep, _, selection = rest.partition(",")
+                requests.append((rep.strip(), selection.strip() or "all"))
+    return requests
+
+
+def _count_atoms_cached(conn: PyMOLConnection, cmd, selection: str) -> int:
+    count = conn.atom_counts.get(selection)
+    if count is None:
+        try:
+            count = cmd.count_atoms(selection)
+        except Exception:
+            # 选择无效时交给真正的调用报错
+            count = 0
+        conn.atom_counts[selection] = count
+    return count
+
+
+def _format_command_result(entry: Dict[str, Any]) -> str:
+    """把一条命令的捕获结果格式化为文本"""
+    text = f"> {entry['command']}\n"
+    if entry.get("output"):
+        text += entry["output"].rstrip("\n") + "\n"
+    if entry.get("result") is not None:
+        text += f"结果: {entry['result']}\n"
+    if entry.get("error"):
+        text += f"错误: {entry['error']}\n"
+    return text
+
+
+def _notify(loop, coro) -> None:
+    """从工作线程在事件循环中发送一条通知并等待发送完成"""
+    import asyncio
+    asyncio.run_coroutine_threadsafe(coro, loop).result()
+
+
+def _progress_reporter(loop):
+    """返回向当前请求推送进度和日志通知的函数 report(done, total, message, level)
+
+    客户端没有请求进度通知（progressToken）或不在请求上下文中时返回 None。
+    """
+    try:
+        ctx = get_mcp_server().request_context
+        token = ctx.meta.progressToken if ctx.meta else None
+    except LookupError:
+        return None
+    if loop is None or token is None:
+        return None
+
+    def report(done: int, total: int, message: str, level: str = "info") -> None:
+        _notify(loop, ctx.session.send_progress_notification(
+            token, done, total, message=message, related_request_id=ctx.request_id
+        ))
+        _notify(loop, ctx.session.send_log_message(
+            level, message, logger="pymol", related_request_id=ctx.request_id
+        ))
+    return report
+
+
+def _run_pymol_script(cmd, script: str, loop=None) -> str:
+    """执行 pymol_do 脚本并返回捕获的控制台输出
+
+    客户端请求了进度通知（progressToken）时逐条执行，每条命令的输出
+    立即作为进度和日志通知推送；否则整个脚本在一次RPC中执行。
+    在工作线程中运行，通知通过 loop（事件循环）发送。
+    """
+    if not _ensure_capture_helper(cmd):
+        result = cmd.do(script)
+        return f"执行命令: {script}\n结果: {result}"
+
+    commands = _split_commands(script)
+    report = _progress_reporter(loop)
+
+    chunks: List[str] = []
+    size = 0
+    if report is None:
+        entries = cmd.mcp_do_capture(commands, _COMMAND_OUTPUT_LIMIT)
+    else:
+        entries = []
+        for i, command in enumerate(commands):
+            entry = cmd.mcp_do_capture([command], _COMMAND_OUTPUT_LIMIT)[0]
+            entries.append(entry)
+            report(i + 1, len(commands), _format_command_result(entry),
+                   "error" if entry.get("error") else "info")
+
+    for entry in entries:
+        text = _format_command_result(entry)
+        if size + len(text) > _SCRIPT_OUTPUT_LIMIT:
+            chunks.append(f"...[输出超过 {_SCRIPT_OUTPUT_LIMIT} 个字符，其余 {len(entries) - len(chunks)} 条命令的输出已省略]")
+            break
+        chunks.append(text)
+        size += len(text)
+    errors = sum(1 for e in entries if e.get("error"))
+    summary = f"已执行 {len(entries)} 条命令" + (f"，{errors} 条出错" if errors else "")
+    return summary + "\n" + "".join(chunks)
+
+
+def _lod_limit(key: str) -> Optional[int]:
+    """细节层次策略使用的原子数上限，策略不是 lod 时返回 None"""
+    if cost_guard is None or cost_guard.policy != "lod":
+        return None
+    return cost_guard.rep_limits.get(key)
+
+
+def _show_with_lod(conn: PyMOLConnection, cmd, rep: str, selection: str, loop) -> Optional[str]:
+    """按细节层次策略显示大结构，不需要降级时返回 None
+
+    表面按对象分块生成：PyMOL在对象内任何原子的可见性变化时都会重建整个对象的表面，
+    所以分块的单位是对象（例如按链拆分出的对象），每块用 1x1 光线追踪强制生成并报告进度。
+    """
+    import pymol_lod
+    limit = _lod_limit(rep)
+    if limit is None:
+        return None
+    atoms = _count_atoms_cached(conn, cmd, selection)
+    plan = pymol_lod.plan_show(rep, selection, atoms, limit)
+    if plan is None:
+        return None
+
+    objects = cmd.get_object_list(f"({plan.selection})") or []
+    for setting, value in plan.settings.items():
+        for obj in objects:
+            cmd.set(setting, value, obj)
+    report = _progress_reporter(loop)
+    if plan.chunked and len(objects) > 1:
+        for i, obj in enumerate(objects):
+            cmd.show(plan.rep, f"({plan.selection}) and {obj}")
+            cmd.ray(1, 1)
+            if report is not None:
+                report(i + 1, len(objects), f"已生成 {obj} 的 {rep}")
+        plan.notes.append(f"按 {len(objects)} 个对象分块生成")
+    else:
+        cmd.show(plan.rep, plan.selection)
+    return (f"已显示 {rep} for {selection}（{atoms} 个原子超过上限 {limit}，已降低细节: "
+            f"{'；'.join(plan.notes)}。传入 force=true 可按完整精度显示）")
+
+
+def _render_lod_settings(cmd, force: bool) -> Tuple[Dict[str, Any], int, Optional[int]]:
+    """按细节层次策略，本次渲染需要临时修改的设置，返回 (设置, 重表示原子数, 上限)"""
+    import pymol_lod
+    limit = _lod_limit("render")
+    if force or limit is None:
+        return {}, 0, limit
+    heavy = cmd.count_atoms(pymol_lod.HEAVY_REPS_SELECTION)
+    return pymol_lod.plan_render(heavy, limit), heavy, limit
+
+
+def _render_lod(cmd, force: bool):
+    """渲染前按细节层次策略临时修改设置，返回 (需恢复的原设置, 说明)
+
+    调用方必须持有该连接的 render_lock，否则并发渲染的保存/恢复会交错，把设置永久留在降级值。
+    """
+    settings, heavy, limit = _render_lod_settings(cmd, force)
+    saved = {}
+    for setting, value in settings.items():
+        saved[setting] = cmd.get(setting)
+        cmd.set(setting, value)
+    if not settings:
+        return {}, ""
+    return saved, (f"（{heavy} 个原子以重表示方式显示，超过上限 {limit}，本次渲染临时关闭抗锯齿和阴影；"
+                   "传入 force=true 可按完整质量渲染）")
+
+
+def _restore_settings(cmd, saved: Dict[str, Any]) -> None:
+    for setting, value in saved.items():
+        cmd.set(setting, value)
+
+
+def _load_progressive():
+    """导入渐进式渲染模块"""
+    import pymol_progressive
+    return pymol_progressive
+
+
+# 渐进式渲染的后台精细渲染管理器（首次渐进式渲染时创建）
+progressive_renderer = None
+
+# 不改变场景的工具：调用时不取消进行中的精细渲染（新的渐进式 pymol_png 会取代旧的渲染）。
+# 其中的渲染工具和精细渲染通过连接的 render_lock 依次进行，不会覆盖彼此的图像缓冲区
+_RENDER_SAFE_TOOLS = frozenset({
+    "pymol_save", "pymol_get_names", "pymol_count_atoms", "pymol_get_pdb", "pymol_get_selection_info",
+    "pymol_contacts", "pymol_rmsd", "pymol_neighbors", "pymol_select", "pymol_select_near",
+    "pymol_sasa_summary", "pymol_ray", "pymol_draw", "pymol_png", "pymol_list_presets", "pymol_gallery",
+})
+
+
+def _get_renderer():
+    global progressive_renderer
+    if progressive_renderer is None:
+        progressive_renderer = _load_progressive().ProgressiveRenderer()
+    return progressive_renderer
+
+
+def _cancel_refinement(conn: PyMOLConnection, name: str, arguments: Dict[str, Any]) -> None:
+    """在可能改变场景的工具调用前取消该后端上进行中的精细渲染"""
+    if progressive_renderer is None or name in _RENDER_SAFE_TOOLS:
+        return
+    if name == "pymol_align_many" and not arguments.get("transform"):
+        return
+    progressive_renderer.cancel(id(conn), f"场景被 {name} 修改")
+
+
+def _png_bytes(data) -> bytes:
+    # XML-RPC 返回 xmlrpc.client.Binary，进程内模式直接得到辅助函数的返回值
+    return getattr(data, "data", data)
+
+
+def _ray_png(conn: PyMOLConnection, cmd, job, force: bool) -> Optional[bytes]:
+    """光线追踪并保存PNG，光线追踪期间渲染被取消时不写文件，返回 None
+
+    光线追踪和保存由 mcp_ray_png 在一次调用中完成，并持有连接的 render_lock，
+    前台的渲染工具不会在两者之间覆盖图像缓冲区。细节层次降级只通过 ray 的
+    antialias 参数关闭抗锯齿，不修改全局设置（ray_shadows 保持不变），
+    与前台渲染临时修改和恢复设置不会交错。
+    """
+    settings, _, _ = _render_lod_settings(cmd, force)
+    antialias = int(settings.get("antialias", -1))
+    with conn.render_lock:
+        if job.cancelled:
+            return None
+        result = cmd.mcp_ray_png(job.filename, job.width, job.height, job.dpi, antialias)
+    # 取消时丢弃临时文件，不写出与当前场景不符的图像
+    cmd.mcp_commit_png(result["partial"], "" if job.cancelled else job.filename)
+    return None if job.cancelled else _png_bytes(result["image"])
+
+
+def _refine_png(conn: PyMOLConnection, session_id: str, job, force: bool) -> Optional[bytes]:
+    """后台精细渲染
+
+    工作进程池模式下有空闲的备用进程时，把会话的场景存为 .pse 载入借来的进程
+    渲染，会话自己的进程不被光线追踪占用；否则在会话的PyMOL上渲染。
+    """
+    import contextlib
+    if worker_pool is None:
+        return _ray_png(conn, conn.get_cmd(), job, force)
+    # 持有会话的进程，渲染期间不会被回收
+    with worker_pool.session(session_id), worker_pool.borrow(1) as borrowed:
+        if job.cancelled:
+            return None
+        if not borrowed:
+            return _ray_png(conn, conn.get_cmd(), job, force)
+        import tempfile
+        fd, path = tempfile.mkstemp(prefix="mcp_render_", suffix=".pse")
+        os.close(fd)
+        try:
+            conn.get_cmd().save(path)
+            worker = borrowed[0]
+            worker_cmd = worker.conn.get_cmd()
+            if not _ensure_capture_helper(worker_cmd, worker.conn):
+                raise RuntimeError("无法在借用的PyMOL进程中安装辅助函数")
+            worker_cmd.load(path)
+            return _ray_png(worker.conn, worker_cmd, job, force)
+        finally:
+            with contextlib.suppress(OSError):
+                os.remove(path)
+
+
+def _render_notifier(loop):
+    """返回精细渲染结束时向发起调用的会话推送通知的函数，不在请求上下文中时返回 None"""
+    try:
+        session = get_mcp_server().request_context.session
+    except LookupError:
+        return None
+    if loop is None:
+        return None
+
+    def notify(job) -> None:
+        level = "info" if job.state == "done" else "warning"
+        try:
+            _notify(loop, session.send_resource_updated(job.uri))
+            _notify(loop, session.send_log_message(level, job.info(), logger="pymol.render"))
+        except Exception:
+            # 会话已关闭，结果仍可通过资源读取
+            pass
+    return notify
+
+
+def _progressive_png(conn: PyMOLConnection, cmd, arguments: Dict[str, Any], loop) -> List[Any]:
+    """渐进式PNG：立即返回OpenGL预览，光线追踪的完整图像在后台渲染"""
+    from mcp.types import ImageContent, TextContent
+    progressive = _load_progressive()
+    if not _ensure_capture_helper(cmd, conn):
+        raise RuntimeError("渐进式渲染需要在PyMOL端安装辅助函数，但安装失败（见服务器日志）")
+    width, height = arguments.get("width", 0), arguments.get("height", 0)
+    if not (width and height):
+        viewport = cmd.get_viewport()
+        width, height = width or int(viewport[0]), height or int(viewport[1])
+    preview_w, preview_h = progressive.preview_size(width, height, int(arguments.get("preview_size", 320)))
+    start = time.perf_counter()
+    with conn.render_lock:
+        preview = _png_bytes(cmd.mcp_render_png("", preview_w, preview_h, -1, 0))
+    preview_ms = round((time.perf_counter() - start) * 1000, 1)
+
+    job = progressive.RenderJob(arguments["filename"], width, height, arguments.get("dpi", -1))
+    session_id = _current_session_id()
+    force = arguments.get("force", False)
+    _get_renderer().submit(id(conn), job, lambda job: _refine_png(conn, session_id, job, force),
+                           _render_notifier(loop))
+    text = (f"预览 {preview_w}x{preview_h}（OpenGL，{preview_ms} ms）。光线追踪的 {width}x{height} 图像正在后台渲染，"
+            f"完成后保存到 {job.filename}，并通知资源 {job.uri} 已更新；在此之前修改场景会取消渲染。")
+    return [ImageContent(type="image", data=base64.b64encode(preview).decode("ascii"), mimeType="image/png"),
+            TextContent(type="text", text=text)]
+
+
+def _load_gallery():
+    """导入缩略图画廊模块"""
+    import pymol_gallery
+    return pymol_gallery
+
+
+# 缩略图缓存上限（MB，0 表示不缓存）；缓存在首次生成画廊时创建，所有后端共用
+gallery_cache_mb = 64.0
+thumbnail_cache = None
+
+
+def _get_thumbnail_cache():
+    global thumbnail_cache
+    if thumbnail_cache is None and gallery_cache_mb > 0:
+        thumbnail_cache = _load_gallery().ThumbnailCache(int(gallery_cache_mb * 1048576))
+    return thumbnail_cache
+
+
+def _render_thumbnails(conn: PyMOLConnection, cmd, items, width: int, height: int, ray: bool,
+                       concurrency: int, loop) -> int:
+    """渲染未命中缓存的缩略图，返回使用的后端数
+
+    工作进程池模式下缩略图多于一批时，借用空闲的备用进程：会话的场景存为 .pse，
+    借来的进程在领到第一批时载入，之后与会话自己的进程并行渲染。
+    """
+    import contextlib
+    import math
+    gallery = _load_gallery()
+    report = _progress_reporter(loop)
+    helpers = 0
+    if worker_pool is not None:
+        helpers = min(math.ceil(len(items) / gallery.BATCH_SIZE), max(concurrency, 1)) - 1
+    if helpers <= 0:
+        gallery.render([lambda: cmd], items, width, height, ray, report=report)
+        return 1
+
+    import tempfile
+    with worker_pool.borrow(helpers) as borrowed:
+        if not borrowed:
+            gallery.render([lambda: cmd], items, width, height, ray, report=report)
+            return 1
+        fd, path = tempfile.mkstemp(prefix="mcp_gallery_", suffix=".pse")
+        os.close(fd)
+        try:
+            cmd.save(path)
+
+            def loader(worker):
+                def get_cmd():
+                    worker_cmd = worker.conn.get_cmd()
+                    if not _ensure_capture_helper(worker_cmd, worker.conn):
+                        raise RuntimeError("无法在借用的PyMOL进程中安装辅助函数")
+                    worker_cmd.load(path)
+                    return worker_cmd
+                return get_cmd
+
+            gallery.render([lambda: cmd] + [loader(worker) for worker in borrowed], items, width, height, ray,
+                           report=report)
+        finally:
+            with contextlib.suppress(OSError):
+                os.remove(path)
+        return len(borrowed) + 1
+
+
+def _gallery(conn: PyMOLConnection, cmd, arguments: Dict[str, Any], loop) -> List[Any]:
+    """缩略图画廊：逐个对象（或状态）渲染缩略图，拼成联系表PNG并附JSON索引"""
+    from mcp.types import ImageContent
+    gallery = _load_gallery()
+    if not _ensure_capture_helper(cmd, conn):
+        raise RuntimeError("缩略图画廊需要在PyMOL端安装辅助函数，但安装失败（见服务器日志）")
+    mode = arguments.get("by", "object")
+    items = gallery.resolve_items(list(cmd.get_names("public_objects", 0)), arguments.get("objects"),
+                                  arguments.get("pattern"), mode, cmd.count_states,
+                                  int(arguments.get("max_states", 0)))
+    if not items:
+        raise ValueError("没有要渲染的对象，请先加载结构，或检查 objects / pattern")
+    max_items = min(int(arguments.get("max_items", 64)), gallery.MAX_ITEMS)
+    truncated = max(len(items) - max_items, 0)
+    items = items[:max_items]
+    width = min(max(int(arguments.get("tile_width", 240)), 16), gallery.MAX_TILE)
+    height = min(max(int(arguments.get("tile_height", width)), 16), gallery.MAX_TILE)
+    ray = bool(arguments.get("ray", False))
+
+    start = time.perf_counter()
+    cache = _get_thumbnail_cache()
+    if cache is not None:
+        fingerprints = cmd.mcp_gallery_fingerprints([[item.name, item.state] for item in items])
+        for item, fingerprint in zip(items, fingerprints):
+            item.fingerprint = fingerprint
+            if fingerprint and not arguments.get("refresh"):
+                item.image = cache.get((fingerprint, width, height, ray))
+                item.cached = item.image is not None
+    missing = [item for item in items if item.image is None]
+    backends, note = 0, ""
+    if missing:
+        with conn.render_lock:
+            saved, note = _render_lod(cmd, arguments.get("force", False)) if ray else ({}, "")
+            try:
+                backends = _render_thumbnails(conn, cmd, missing, width, height, ray,
+                                              int(arguments.get("concurrency", 4)), loop)
+            finally:
+                _restore_settings(cmd, saved)
+        if cache is not None:
+            for item in missing:
+                if item.image is not None and item.fingerprint:
+                    cache.put((item.fingerprint, width, height, ray), item.image)
+
+    columns, rows = gallery.layout(len(items), width, height, int(arguments.get("columns", 0)))
+    sheet, index = gallery.tile(items, width, height, columns)
+    png = gallery.encode_png(sheet)
+    body = {
+        "mode": mode,
+        "tile": [width, height],
+        "sheet": [sheet.shape[1], sheet.shape[0]],
+        "columns": columns,
+        "rows": rows,
+        "ray": ray,
+        "rendered": len(missing),
+        "cached": len(items) - len(missing),
+        "failed": sum(1 for item in items if item.error),
+        "truncated": truncated,
+        "backends": backends,
+        "elapsed_ms": round((time.perf_counter() - start) * 1000, 1),
+        "png_bytes": len(png),
+        "items": index,
+    }
+    if note:
+        body["note"] = note.strip("（）")
+    return [ImageContent(type="image", data=base64.b64encode(png).decode("ascii"), mimeType="image/png"),
+            _json_text(body)]
+
+
+def _load_scene():
+    """导入场景资源模块"""
+    import pymol_scene
+    return pymol_scene
+
+
+# 场景变化检查间隔（秒），0 表示不推送变化通知；SceneWatcher 在首次订阅时创建
+scene_poll_interval = 2.0
+scene_watcher = None
+
+
+def _session_connection(session_id: str) -> Optional[PyMOLConnection]:
+    """会话使用的PyMOL连接（工作进程池模式下只返回已绑定的进程，不分配新进程）"""
+    if worker_pool is not None:
+        return worker_pool.bound_connection(session_id)
+    return pymol_conn if pymol_conn._server is not None else None
+
+
+def _scene_snapshot(conn: PyMOLConnection) -> Dict[str, Any]:
+    """取得场景快照，PyMOL端有辅助函数时只需一次RPC"""
+    cmd = conn.get_cmd()
+    if _ensure_capture_helper(cmd, conn):
+        try:
+            return cmd.mcp_scene_snapshot()
+        except xmlrpc.client.Fault:
+            # 旧版本服务器注入的辅助函数中没有 mcp_scene_snapshot
+            pass
+    return _load_scene().snapshot_scene(cmd)
+
+
+def _get_scene_watcher():
+    global scene_watcher
+    if scene_watcher is None:
+        scene_watcher = _load_scene().SceneWatcher(_session_connection, _scene_snapshot, scene_poll_interval)
+    return scene_watcher
+
+
+async def list_resources() -> List[Resource]:
+    """列出可订阅的场景资源"""
+    from mcp.types import Resource
+    return [
+        Resource(uri=uri, name=name, description=description, mimeType="application/json")
+        for uri, (name, description) in _load_scene().RESOURCES.items()
+    ]
+
+
+def _read_render(uri: str) -> list:
+    """渐进式渲染结果：完成时为PNG图像，否则为渲染状态（JSON）"""
+    from mcp.server.lowlevel.helper_types import ReadResourceContents
+    job = _get_renderer().get(uri[len(_load_progressive().RENDER_URI_PREFIX):])
+    if job is None:
+        raise ValueError(f"未知或已过期的渲染结果: {uri}")
+    if job.state == "done" and job.image is not None:
+        return [ReadResourceContents(content=job.image, mime_type="image/png")]
+    return [ReadResourceContents(content=json.dumps(job.info(), ensure_ascii=False), mime_type="application/json")]
+
+
+async def read_resource(uri):
+    """读取当前会话所用PyMOL的场景资源（JSON）或渐进式渲染结果"""
+    import asyncio
+    scene = _load_scene()
+    uri = str(uri)
+    if uri.startswith(_load_progressive().RENDER_URI_PREFIX):
+        return _read_render(uri)
+    if uri not in scene.RESOURCES:
+        raise ValueError(f"未知资源: {uri}")
+    conn = _session_connection(_current_session_id())
+    if conn is None:
+        raise ValueError("未连接到PyMOL（工作进程池模式下会话在第一次调用工具时才分配PyMOL进程）")
+    snapshot = await asyncio.to_thread(_scene_snapshot, conn)
+    body = scene.resource_body(uri, snapshot, conn.scene)
+    return json.dumps(body, ensure_ascii=False, separators=(",", ":"))
+
+
+async def subscribe_resource(uri) -> None:
+    if str(uri).startswith(_load_progressive().RENDER_URI_PREFIX):
+        # 渲染结果的更新通知总是发给发起渲染的会话，无需订阅
+        return
+    session = get_mcp_server().request_context.session
+    await _get_scene_watcher().subscribe(session, _current_session_id(), str(uri))
+
+
+async def unsubscribe_resource(uri) -> None:
+    if str(uri).startswith(_load_progressive().RENDER_URI_PREFIX):
+        return
+    session = get_mcp_server().request_context.session
+    _get_scene_watcher().unsubscribe(session, str(uri))
+
+
+def _json_text(data: Any) -> TextContent:
+    """把结构化结果编码为紧凑的JSON文本"""
+    from mcp.types import TextContent
+    return TextContent(type="text", text=json.dumps(data, ensure_ascii=False, separators=(",", ":")))
 
 
-@app.list_tools()
 async def list_tools() -> List[Tool]:
     """列出所有可用的PyMOL控制工具"""
+    from mcp.types import Tool
     return [
         # 文件操作
         Tool(
@@ -149,6 +1632,59 @@ async def list_tools() -> List[Tool]:
                 "required": ["filename"]
             }
         ),
+        Tool(
+            name="pymol_convert_many",
+            description="批量转换结构文件格式（如整个目录的PDB转为mmCIF），可按链、按状态拆分输出；"
+                        "逐个 load -> save -> delete，内存有界，进度和出错的文件以进度通知报告，返回吞吐量和错误汇总（JSON）",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "inputs": {
+                        "type": "array",
+                        "items": {"type": "string"},
+                        "description": "输入文件路径列表（PyMOL所在机器上的路径）"
+                    },
+                    "input_glob": {
+                        "type": "string",
+                        "description": "输入文件通配符，如 /data/pdb/*.pdb 或 /data/**/*.cif（在PyMOL端展开）"
+                    },
+                    "output_dir": {
+                        "type": "string",
+                        "description": "输出目录（不存在时创建）"
+                    },
+                    "format": {
+                        "type": "string",
+                        "description": "输出格式: cif, pdb, pqr, mol2, sdf, mol, xyz, mmtf, fasta, pse（默认cif）"
+                    },
+                    "split_chains": {
+                        "type": "boolean",
+                        "description": "每条链输出为单独的文件 <名称>_<链>.<格式>（默认false）"
+                    },
+                    "split_states": {
+                        "type": "boolean",
+                        "description": "每个状态输出为单独的文件 <名称>_s<状态>.<格式>（默认false，输出全部状态）"
+                    },
+                    "selection": {
+                        "type": "string",
+                        "description": "只输出每个文件中的这部分原子，如 polymer（可选）"
+                    },
+                    "overwrite": {
+                        "type": "boolean",
+                        "description": "覆盖已存在的输出文件（默认false，跳过）"
+                    },
+                    "concurrency": {
+                        "type": "integer",
+                        "description": "工作进程池模式下同时转换的PyMOL进程数（默认4，借用空闲的备用进程）"
+                    },
+                    "batch_size": {
+                        "type": "integer",
+                        "minimum": 1,
+                        "description": "每次RPC处理的文件数（默认16）"
+                    }
+                },
+                "required": ["output_dir"]
+            }
+        ),
         
         # 显示控制
         Tool(
@@ -165,6 +1701,10 @@ async def list_tools() -> List[Tool]:
                     "selection": {
                         "type": "string",
                         "description": "选择表达式（默认all）"
+                    },
+                    "force": {
+                        "type": "boolean",
+                        "description": "跳过大结构的细节层次保护，按完整精度显示（可能非常慢）"
                     }
                 },
                 "required": ["representation"]
@@ -298,79 +1838,280 @@ async def list_tools() -> List[Tool]:
                     },
                     "expression": {
                         "type": "string",
-                        "description": "选择表达式（如chain A, resi 1-100, name CA）"
+                        "description": "选择表达式（如chain A, resi 1-100, name CA）"
+                    }
+                },
+                "required": ["name", "expression"]
+            }
+        ),
+        Tool(
+            name="pymol_delete",
+            description="删除对象或选择",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "name": {
+                        "type": "string",
+                        "description": "对象或选择名称"
+                    }
+                },
+                "required": ["name"]
+            }
+        ),
+        
+        # 获取信息
+        Tool(
+            name="pymol_get_names",
+            description="获取所有对象名称",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "type": {
+                        "type": "string",
+                        "description": "类型: objects, selections, all",
+                        "enum": ["objects", "selections", "all"]
+                    }
+                }
+            }
+        ),
+        Tool(
+            name="pymol_count_atoms",
+            description="计算原子数量",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "selection": {
+                        "type": "string",
+                        "description": "选择表达式（默认all）"
+                    }
+                }
+            }
+        ),
+        Tool(
+            name="pymol_get_pdb",
+            description="获取PDB格式字符串",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "selection": {
+                        "type": "string",
+                        "description": "选择表达式（默认all）"
+                    }
+                }
+            }
+        ),
+        Tool(
+            name="pymol_get_selection_info",
+            description="获取选择中的链和残基信息",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "selection": {
+                        "type": "string",
+                        "description": "选择表达式（默认为 'sele'）"
+                    }
+                }
+            }
+        ),
+
+        # 几何分析（在MCP服务器端用NumPy计算）
+        Tool(
+            name="pymol_contacts",
+            description="计算两个选择之间（或一个选择内部不同残基之间）的原子接触，按残基对汇总并按最短距离排序，返回JSON",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "selection1": {
+                        "type": "string",
+                        "description": "第一个选择表达式"
+                    },
+                    "selection2": {
+                        "type": "string",
+                        "description": "第二个选择表达式（可选，省略时计算selection1内部接触）"
+                    },
+                    "cutoff": {
+                        "type": "number",
+                        "exclusiveMinimum": 0,
+                        "description": "距离阈值（Å，默认4.0）"
+                    },
+                    "max_results": {
+                        "type": "integer",
+                        "minimum": 0,
+                        "description": "最多返回的残基对数量（默认100）"
                     }
                 },
-                "required": ["name", "expression"]
+                "required": ["selection1"]
             }
         ),
         Tool(
-            name="pymol_delete",
-            description="删除对象或选择",
+            name="pymol_rmsd",
+            description="计算两个选择之间的RMSD（叠合前和Kabsch最优叠合后），不移动任何原子，返回JSON",
             inputSchema={
                 "type": "object",
                 "properties": {
-                    "name": {
+                    "selection1": {
                         "type": "string",
-                        "description": "对象或选择名称"
+                        "description": "第一个选择表达式"
+                    },
+                    "selection2": {
+                        "type": "string",
+                        "description": "第二个选择表达式"
+                    },
+                    "fit": {
+                        "type": "boolean",
+                        "description": "是否计算最优叠合后的RMSD（默认true）"
                     }
                 },
-                "required": ["name"]
+                "required": ["selection1", "selection2"]
             }
         ),
-        
-        # 获取信息
         Tool(
-            name="pymol_get_names",
-            description="获取所有对象名称",
+            name="pymol_neighbors",
+            description="查找距离某个选择（如配体）一定范围内的残基，例如结合口袋残基，按最短距离排序，返回JSON",
             inputSchema={
                 "type": "object",
                 "properties": {
-                    "type": {
+                    "selection": {
                         "type": "string",
-                        "description": "类型: objects, selections, all",
-                        "enum": ["objects", "selections", "all"]
+                        "description": "中心选择表达式（如 resn LIG）"
+                    },
+                    "cutoff": {
+                        "type": "number",
+                        "exclusiveMinimum": 0,
+                        "description": "距离阈值（Å，默认5.0）"
+                    },
+                    "within": {
+                        "type": "string",
+                        "description": "候选原子范围（默认all，自动排除中心选择本身）"
+                    },
+                    "max_results": {
+                        "type": "integer",
+                        "minimum": 0,
+                        "description": "最多返回的残基数量（默认200）"
                     }
-                }
+                },
+                "required": ["selection"]
             }
         ),
         Tool(
-            name="pymol_count_atoms",
-            description="计算原子数量",
+            name="pymol_select_near",
+            description="基于服务器端缓存的空间索引创建邻近选择（相当于 around / byres around），对同一结构反复查询时几乎没有额外开销",
             inputSchema={
                 "type": "object",
                 "properties": {
-                    "selection": {
+                    "name": {
                         "type": "string",
-                        "description": "选择表达式（默认all）"
+                        "description": "要创建的选择名称"
+                    },
+                    "center": {
+                        "type": "string",
+                        "description": "中心选择表达式（如 resn LIG）"
+                    },
+                    "cutoff": {
+                        "type": "number",
+                        "exclusiveMinimum": 0,
+                        "description": "距离阈值（Å，默认5.0）"
+                    },
+                    "byres": {
+                        "type": "boolean",
+                        "description": "是否扩展到完整残基（默认false）"
+                    },
+                    "include_center": {
+                        "type": "boolean",
+                        "description": "结果是否包含中心原子本身（默认false，与 around 一致）"
+                    },
+                    "refresh": {
+                        "type": "boolean",
+                        "description": "强制重建空间索引（在PyMOL界面中手动修改过坐标时使用）"
                     }
-                }
+                },
+                "required": ["name", "center"]
             }
         ),
         Tool(
-            name="pymol_get_pdb",
-            description="获取PDB格式字符串",
+            name="pymol_sasa_summary",
+            description="计算溶剂可及表面积（Shrake-Rupley），返回总量、极性/非极性、按链汇总和暴露最多的残基，JSON格式",
             inputSchema={
                 "type": "object",
                 "properties": {
                     "selection": {
                         "type": "string",
                         "description": "选择表达式（默认all）"
+                    },
+                    "probe": {
+                        "type": "number",
+                        "minimum": 0,
+                        "description": "探针半径（Å，默认1.4）"
+                    },
+                    "top": {
+                        "type": "integer",
+                        "minimum": 0,
+                        "description": "返回暴露最多的残基数量（默认20）"
                     }
                 }
             }
         ),
+
         Tool(
-            name="pymol_get_selection_info",
-            description="获取选择中的链和残基信息",
+            name="pymol_align_many",
+            description="把参考结构与多个目标结构逐一比对，一次返回按RMSD排序、分页的结果表（JSON）。"
+                        "align/super 在PyMOL中比对（工作进程池模式下并行）；原子已对应时（多个构象、NMR模型）"
+                        "用 fit 在服务器端批量Kabsch叠合，速度快得多",
             inputSchema={
                 "type": "object",
                 "properties": {
-                    "selection": {
+                    "reference": {
                         "type": "string",
-                        "description": "选择表达式（默认为 'sele'）"
+                        "description": "参考结构（对象名或选择表达式）"
+                    },
+                    "targets": {
+                        "type": "array",
+                        "items": {"type": "string"},
+                        "description": "目标对象名列表"
+                    },
+                    "pattern": {
+                        "type": "string",
+                        "description": "按通配符选择目标对象，如 model_*（可与 targets 同时使用）"
+                    },
+                    "method": {
+                        "type": "string",
+                        "enum": ["align", "super", "fit"],
+                        "description": "align 序列比对后叠合，super 结构比对后叠合，fit 原子已对应时直接叠合（默认align）"
+                    },
+                    "atoms": {
+                        "type": "array",
+                        "items": {"type": "string"},
+                        "description": "参与比对的原子名（默认[\"CA\"]，空数组表示全部原子）"
+                    },
+                    "cycles": {
+                        "type": "integer",
+                        "description": "align/super 剔除离群原子的循环次数（默认5）"
+                    },
+                    "transform": {
+                        "type": "boolean",
+                        "description": "是否把目标结构移动到叠合位置（默认false，只计算；fit 从不移动）"
+                    },
+                    "sort": {
+                        "type": "string",
+                        "enum": ["rmsd", "atoms", "target"],
+                        "description": "排序字段（默认rmsd）"
+                    },
+                    "descending": {
+                        "type": "boolean",
+                        "description": "是否降序（默认false）"
+                    },
+                    "offset": {
+                        "type": "integer",
+                        "minimum": 0,
+                        "description": "分页起点（默认0）"
+                    },
+                    "limit": {
+                        "type": "integer",
+                        "minimum": 1,
+                        "description": "每页条数（默认50）"
                     }
-                }
+                },
+                "required": ["reference"]
             }
         ),
 
@@ -388,6 +2129,10 @@ async def list_tools() -> List[Tool]:
                     "height": {
                         "type": "integer",
                         "description": "高度（像素）"
+                    },
+                    "force": {
+                        "type": "boolean",
+                        "description": "跳过大结构的细节层次保护，按完整质量渲染"
                     }
                 }
             }
@@ -434,12 +2179,116 @@ async def list_tools() -> List[Tool]:
                     "ray": {
                         "type": "boolean",
                         "description": "是否先进行光线追踪"
+                    },
+                    "progressive": {
+                        "type": "boolean",
+                        "description": "渐进式渲染：立即返回OpenGL预览图，光线追踪的完整图像在后台渲染并保存，"
+                                       "完成后通过资源更新通知推送；在此之前修改场景会取消渲染"
+                    },
+                    "preview_size": {
+                        "type": "integer",
+                        "description": "渐进式渲染预览图的最长边（像素，默认320）"
+                    },
+                    "force": {
+                        "type": "boolean",
+                        "description": "跳过大结构的细节层次保护，按完整质量渲染"
                     }
                 },
                 "required": ["filename"]
             }
         ),
-        
+
+        Tool(
+            name="pymol_gallery",
+            description="为多个对象（或一个对象的多个状态）各渲染一张自动 orient 的缩略图，拼成一张联系表图片返回，"
+                        "并附JSON索引（每格的对象、状态和位置）。其他对象的显示开关、状态和视图在渲染后恢复；"
+                        "缩略图按对象指纹缓存，对象没有变化时直接复用；工作进程池模式下并行渲染",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "objects": {
+                        "type": "array",
+                        "items": {"type": "string"},
+                        "description": "要渲染的对象名列表（与 pattern 都不给时为全部对象）"
+                    },
+                    "pattern": {
+                        "type": "string",
+                        "description": "按通配符选择对象，如 model_*（可与 objects 同时使用）"
+                    },
+                    "by": {
+                        "type": "string",
+                        "enum": ["object", "state"],
+                        "description": "object 每个对象一张，state 每个对象的每个状态一张（默认object）"
+                    },
+                    "max_states": {
+                        "type": "integer",
+                        "description": "by=state 时每个对象最多渲染的状态数（默认0，不限）"
+                    },
+                    "max_items": {
+                        "type": "integer",
+                        "description": "最多渲染的缩略图数（默认64，上限400），多出的在结果中计为 truncated"
+                    },
+                    "tile_width": {
+                        "type": "integer",
+                        "description": "缩略图宽度（像素，默认240）"
+                    },
+                    "tile_height": {
+                        "type": "integer",
+                        "description": "缩略图高度（像素，默认与宽度相同）"
+                    },
+                    "columns": {
+                        "type": "integer",
+                        "description": "联系表列数（默认自动，接近正方形）"
+                    },
+                    "ray": {
+                        "type": "boolean",
+                        "description": "是否光线追踪每张缩略图（默认false，OpenGL绘制）"
+                    },
+                    "refresh": {
+                        "type": "boolean",
+                        "description": "忽略缓存重新渲染（修改了指纹不包含的对象设置后使用）"
+                    },
+                    "concurrency": {
+                        "type": "integer",
+                        "description": "工作进程池模式下最多同时使用的PyMOL进程数（默认4）"
+                    },
+                    "force": {
+                        "type": "boolean",
+                        "description": "ray=true 时跳过大结构的细节层次保护，按完整质量渲染"
+                    }
+                }
+            }
+        ),
+
+        # 场景预设
+        Tool(
+            name="pymol_apply_preset",
+            description="应用命名的场景预设（如 publication、ligand_pocket、chain_rainbow），"
+                        "整套样式命令在一次调用中执行。可用预设及参数见 pymol_list_presets",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "name": {
+                        "type": "string",
+                        "description": "预设名称"
+                    },
+                    "params": {
+                        "type": "object",
+                        "description": "预设参数（可选，未给出的参数使用默认值），如 {\"ligand\": \"resn HEM\", \"cutoff\": 6}"
+                    }
+                },
+                "required": ["name"]
+            }
+        ),
+        Tool(
+            name="pymol_list_presets",
+            description="列出可用的场景预设及其参数和默认值（JSON）",
+            inputSchema={
+                "type": "object",
+                "properties": {}
+            }
+        ),
+
         # 执行任意命令
         Tool(
             name="pymol_do",
@@ -555,7 +2404,7 @@ async def list_tools() -> List[Tool]:
                 "properties": {
                     "command": {
                         "type": "string",
-                        "description": "PyMOL命令字符串，支持完整的PyMOL命令语法。可以是单条命令或多条命令用分号分隔。例如: 'remove solvent; color marine, chain A; show sticks, organic'"
+                        "description": "PyMOL命令字符串，支持完整的PyMOL命令语法。可以是单条命令，也可以是多行脚本或用分号分隔的多条命令。例如: 'remove solvent; color marine, chain A; show sticks, organic'。每条命令的控制台输出、返回值和错误都会被捕获并返回"
                     }
                 },
                 "required": ["command"]
@@ -564,15 +2413,108 @@ async def list_tools() -> List[Tool]:
     ]
 
 
-@app.call_tool()
+def _admission_backend(session_id: str) -> Optional[str]:
+    """按工具的并发上限针对的后端：工作进程池模式下是会话绑定的PyMOL进程
+
+    尚未绑定的会话首次调用时会分到自己的备用进程，暂以会话ID区分；
+    单个PyMOL时所有调用共用一个后端，返回 None。
+    """
+    if worker_pool is None:
+        return None
+    conn = worker_pool.bound_connection(session_id)
+    return _backend_label(conn) if conn is not None else f"session:{session_id}"
+
+
 async def call_tool(name: str, arguments: Dict[str, Any]) -> List[TextContent]:
-    """处理工具调用"""
-    if pymol_conn._server is None:
+    """处理工具调用
+
+    调用先经过准入控制（并发上限、排队上限、按会话限速），然后在
+    线程池中执行：XML-RPC调用是阻塞的，放在事件循环里会让所有请求串行，
+    排队深度和并发上限也就失去意义。
+    """
+    import asyncio
+    from mcp.types import TextContent
+    if worker_pool is None and pymol_conn._server is None:
         return [TextContent(type="text", text="错误: 未连接到PyMOL。请确保PyMOL已启动并启用了XML-RPC服务器（pymol -R）")]
     
+    session_id = _current_session_id()
+    start = time.perf_counter()
     try:
-        cmd = pymol_conn.get_cmd()
-        
+        async with _get_admission().admit(session_id, name, _admission_backend(session_id)):
+            result = await asyncio.to_thread(
+                _call_tool_on_backend, name, arguments, asyncio.get_running_loop(), session_id
+            )
+    except _load_admission().AdmissionRejected as e:
+        result = [TextContent(type="text", text=f"错误: {e.detail}\n{json.dumps(e.to_dict(), ensure_ascii=False)}")]
+    if traffic_recorder is not None:
+        # 耗时包含准入排队，与客户端看到的延迟一致
+        traffic_recorder.record(session_id, name, arguments, time.perf_counter() - start, result)
+    return result
+
+
+def _call_tool_on_backend(name: str, arguments: Dict[str, Any], loop, session_id: str) -> List[TextContent]:
+    """在工作线程中选择PyMOL后端（工作进程池模式下为会话绑定的进程）并执行工具调用"""
+    from mcp.types import TextContent
+    # SQLite 会话存储的写入可能等待其他worker进程的锁，不能放在事件循环中
+    session_store.touch(session_id, name)
+    worker = None
+    if worker_pool is not None:
+        try:
+            worker = worker_pool.acquire(session_id)
+        except RuntimeError as e:
+            return [TextContent(type="text", text=f"错误: {e}")]
+        token = _backend.set(worker.conn)
+    try:
+        conn = _current_conn()
+        warnings = []
+        # lod 策略下 pymol_show 由细节层次策略处理，不再单独警告
+        if cost_guard is not None and not (cost_guard.policy == "lod" and name == "pymol_show"):
+            warnings = cost_guard.check(
+                _representation_requests(name, arguments),
+                lambda selection: _count_atoms_cached(conn, conn.get_cmd(), selection),
+            )
+            if warnings and cost_guard.policy == "reject":
+                return [TextContent(type="text", text="错误: 调用可能非常昂贵，已拒绝执行:\n" + "\n".join(warnings))]
+
+        before = _sample_backend(conn, conn.get_cmd()) if usage_ledger is not None else None
+        start = time.perf_counter()
+        result = _call_tool_sync(name, arguments, loop)
+        if usage_ledger is not None:
+            usage_ledger.record(session_id, name, _backend_label(conn), time.perf_counter() - start,
+                                before, _sample_backend(conn, conn.get_cmd()))
+        if warnings:
+            result.append(TextContent(type="text", text="警告: 调用可能非常昂贵:\n" + "\n".join(warnings)))
+        combiner = conn.write_combiner
+        if combiner is not None:
+            # 合并后延迟发送的操作在PyMOL端出错时，报告给之后的调用
+            errors = combiner.take_errors()
+            if errors:
+                result.append(TextContent(type="text", text="之前合并发送的操作出错:\n" + "\n".join(errors)))
+    finally:
+        if worker is not None:
+            _backend.reset(token)
+            worker_pool.release(worker)
+    if worker is not None:
+        notice = worker_pool.take_notice(session_id)
+        if notice:
+            result.append(TextContent(type="text", text=notice))
+    return result
+
+
+def _call_tool_sync(name: str, arguments: Dict[str, Any], loop=None) -> List[TextContent]:
+    """在工作线程中执行一次工具调用"""
+    from mcp.types import TextContent
+    try:
+        conn = _current_conn()
+        cmd = conn.get_cmd()
+        if conn.write_combiner is not None:
+            import pymol_coalesce
+            cmd = pymol_coalesce.CoalescingCmd(cmd, conn.write_combiner)
+        _invalidate_spatial_cache(name, arguments)
+        _invalidate_selection_cache(name, arguments)
+        _invalidate_atom_counts(name, arguments)
+        _cancel_refinement(conn, name, arguments)
+
         # 文件操作
         if name == "pymol_load":
             filename = arguments["filename"]
@@ -598,20 +2540,24 @@ async def call_tool(name: str, arguments: Dict[str, Any]) -> List[TextContent]:
         elif name == "pymol_show":
             rep = arguments["representation"]
             selection = arguments.get("selection", "all")
-            cmd.show(rep, selection)
+            if not arguments.get("force"):
+                text = _show_with_lod(conn, cmd, rep, selection, loop)
+                if text is not None:
+                    return [TextContent(type="text", text=text)]
+            cmd.show(rep, _resolve_selection(conn, cmd, selection))
             return [TextContent(type="text", text=f"已显示 {rep} for {selection}")]
         
         elif name == "pymol_hide":
             rep = arguments.get("representation", "all")
             selection = arguments.get("selection", "all")
-            cmd.hide(rep, selection)
+            cmd.hide(rep, _resolve_selection(conn, cmd, selection))
             return [TextContent(type="text", text=f"已隐藏 {rep} for {selection}")]
         
         # 颜色控制
         elif name == "pymol_color":
             color = arguments["color"]
             selection = arguments.get("selection", "all")
-            cmd.color(color, selection)
+            cmd.color(color, _resolve_selection(conn, cmd, selection))
             return [TextContent(type="text", text=f"已将 {selection} 设置为 {color} 颜色")]
         
         elif name == "pymol_bg_color":
@@ -623,12 +2569,12 @@ async def call_tool(name: str, arguments: Dict[str, Any]) -> List[TextContent]:
         elif name == "pymol_zoom":
             selection = arguments.get("selection", "all")
             buffer = arguments.get("buffer", 0.0)
-            cmd.zoom(selection, buffer)
+            cmd.zoom(_resolve_selection(conn, cmd, selection), buffer)
             return [TextContent(type="text", text=f"已缩放到: {selection}")]
         
         elif name == "pymol_orient":
             selection = arguments.get("selection", "all")
-            cmd.orient(selection)
+            cmd.orient(_resolve_selection(conn, cmd, selection))
             return [TextContent(type="text", text=f"已定向到: {selection}")]
         
         elif name == "pymol_rotate":
@@ -666,7 +2612,7 @@ async def call_tool(name: str, arguments: Dict[str, Any]) -> List[TextContent]:
         
         elif name == "pymol_count_atoms":
             selection = arguments.get("selection", "all")
-            count = cmd.count_atoms(selection)
+            count = cmd.count_atoms(_resolve_selection(conn, cmd, selection))
             return [TextContent(type="text", text=f"{selection} 中的原子数: {count}")]
         
         elif name == "pymol_get_pdb":
@@ -685,9 +2631,11 @@ async def call_tool(name: str, arguments: Dict[str, Any]) -> List[TextContent]:
             4. 返回包含的链列表、每条链的原子数和残基范围
             """
             selection = arguments.get("selection", "sele")
+            # 下面按链反复引用该选择，复杂表达式先物化为隐藏选择
+            target = _resolve_selection(conn, cmd, selection)
 
             # 获取总原子数
-            total_atoms = cmd.count_atoms(selection)
+            total_atoms = cmd.count_atoms(target)
 
             if total_atoms == 0:
                 return [TextContent(type="text", text=f"选择 '{selection}' 为空，没有选中任何原子")]
@@ -696,12 +2644,12 @@ async def call_tool(name: str, arguments: Dict[str, Any]) -> List[TextContent]:
             chains_info = {}
             possible_chains = list("ABCDEFGHIJKLMNOPQRSTUVWXYZ")
             for chain_id in possible_chains:
-                chain_count = cmd.count_atoms(f"({selection}) and chain {chain_id}")
+                chain_count = cmd.count_atoms(f"({target}) and chain {chain_id}")
                 if chain_count > 0:
                     chains_info[chain_id] = {"atom_count": chain_count}
 
             # 获取 PDB 文本，提取残基信息
-            pdb_str = cmd.get_pdbstr(selection)
+            pdb_str = cmd.get_pdbstr(target)
             lines = pdb_str.split("\n")
 
             # 解析每个原子的信息
@@ -749,33 +2697,130 @@ async def call_tool(name: str, arguments: Dict[str, Any]) -> List[TextContent]:
 
             return [TextContent(type="text", text=result_text)]
 
+        # 几何分析：坐标一次性取回，在服务器端向量化计算
+        elif name == "pymol_contacts":
+            analysis = _load_analysis()
+            selection1 = arguments["selection1"]
+            selection2 = arguments.get("selection2", "")
+            table1 = analysis.fetch_atoms(cmd, selection1)
+            table2 = analysis.fetch_atoms(cmd, selection2) if selection2 else None
+            result = analysis.contacts(
+                table1, table2,
+                cutoff=float(arguments.get("cutoff", 4.0)),
+                max_results=int(arguments.get("max_results", 100)),
+            )
+            return [_json_text(result)]
+
+        elif name == "pymol_rmsd":
+            analysis = _load_analysis()
+            table1 = analysis.fetch_atoms(cmd, arguments["selection1"])
+            table2 = analysis.fetch_atoms(cmd, arguments["selection2"])
+            result = analysis.rmsd(table1, table2, fit=bool(arguments.get("fit", True)))
+            return [_json_text(result)]
+
+        elif name == "pymol_neighbors":
+            analysis = _load_analysis()
+            selection = arguments["selection"]
+            within = arguments.get("within", "all")
+            center = analysis.fetch_atoms(cmd, selection)
+            if len(center) == 0:
+                return [TextContent(type="text", text=f"选择 '{selection}' 为空，没有选中任何原子")]
+            candidates = analysis.fetch_atoms(cmd, f"({within}) and not ({selection})")
+            result = analysis.neighbors(
+                center, candidates,
+                cutoff=float(arguments.get("cutoff", 5.0)),
+                max_results=int(arguments.get("max_results", 200)),
+            )
+            return [_json_text(result)]
+
+        elif name == "pymol_select_near":
+            cache = _get_spatial_cache()
+            if arguments.get("refresh", False):
+                cache.invalidate()
+            sel_name = arguments["name"]
+            center = arguments["center"]
+            cutoff = float(arguments.get("cutoff", 5.0))
+            hits = cache.select_near(
+                cmd, center, cutoff,
+                byres=bool(arguments.get("byres", False)),
+                include_center=bool(arguments.get("include_center", False)),
+            )
+            analysis = _load_analysis()
+            expression = " or ".join(
+                f"({obj} and index {analysis.index_ranges(idx)})" for obj, idx in hits.items()
+            ) or "none"
+            cmd.select(sel_name, expression)
+            count = sum(len(idx) for idx in hits.values())
+            return [TextContent(type="text", text=f"已创建选择 '{sel_name}': {center} 周围 {cutoff}Å 内 {count} 个原子")]
+
+        elif name == "pymol_sasa_summary":
+            analysis = _load_analysis()
+            table = analysis.fetch_atoms(cmd, arguments.get("selection", "all"))
+            result = analysis.sasa_summary(
+                table,
+                probe=float(arguments.get("probe", 1.4)),
+                top=int(arguments.get("top", 20)),
+            )
+            return [_json_text(result)]
+
+        elif name == "pymol_align_many":
+            return [_json_text(_align_many(conn, cmd, arguments))]
+
+        elif name == "pymol_convert_many":
+            return [_json_text(_convert_many(conn, cmd, arguments, loop))]
+
         # 高级功能
         elif name == "pymol_ray":
             width = arguments.get("width", 0)
             height = arguments.get("height", 0)
-            cmd.ray(width, height)
-            return [TextContent(type="text", text=f"已完成光线追踪渲染 ({width}x{height})")]
+            with conn.render_lock:
+                saved, note = _render_lod(cmd, arguments.get("force", False))
+                try:
+                    cmd.ray(width, height)
+                finally:
+                    _restore_settings(cmd, saved)
+            return [TextContent(type="text", text=f"已完成光线追踪渲染 ({width}x{height}){note}")]
         
         elif name == "pymol_draw":
             width = arguments.get("width", 0)
             height = arguments.get("height", 0)
-            cmd.draw(width, height)
+            with conn.render_lock:
+                cmd.draw(width, height)
             return [TextContent(type="text", text=f"已绘制视图 ({width}x{height})")]
         
         elif name == "pymol_png":
+            if arguments.get("progressive"):
+                return _progressive_png(conn, cmd, arguments, loop)
             filename = arguments["filename"]
             width = arguments.get("width", 0)
             height = arguments.get("height", 0)
             dpi = arguments.get("dpi", -1)
             ray = arguments.get("ray", False)
-            cmd.png(filename, width, height, dpi=dpi, ray=int(ray))
-            return [TextContent(type="text", text=f"已保存PNG: {filename}")]
+            with conn.render_lock:
+                saved, note = _render_lod(cmd, arguments.get("force", False))
+                try:
+                    cmd.png(filename, width, height, dpi=dpi, ray=int(ray))
+                finally:
+                    _restore_settings(cmd, saved)
+            return [TextContent(type="text", text=f"已保存PNG: {filename}{note}")]
+
+        elif name == "pymol_gallery":
+            return _gallery(conn, cmd, arguments, loop)
         
+        # 场景预设
+        elif name == "pymol_apply_preset":
+            text = _apply_preset(cmd, arguments["name"], arguments.get("params") or {})
+            return [TextContent(type="text", text=text)]
+
+        elif name == "pymol_list_presets":
+            registry = _get_presets()
+            return [_json_text({"presets": registry.list(), "errors": registry.errors})]
+
         # 执行任意命令
         elif name == "pymol_do":
             command = arguments["command"]
-            result = cmd.do(command)
-            return [TextContent(type="text", text=f"执行命令: {command}\n结果: {result}")]
+            text = _run_pymol_script(cmd, command, loop)
+            return [TextContent(type="text", text=text)]
         
         else:
             return [TextContent(type="text", text=f"未知工具: {name}")]
@@ -784,8 +2829,230 @@ async def call_tool(name: str, arguments: Dict[str, Any]) -> List[TextContent]:
         return [TextContent(type="text", text=f"错误: {str(e)}")]
 
 
-def create_starlette_app(mcp_server: Server, sse_transport: SseServerTransport) -> Starlette:
-    """创建Starlette应用"""
+class _RequestTooLarge(Exception):
+    """压缩请求体或解压后的请求体超过上限"""
+
+
+class CompressionMiddleware:
+    """HTTP压缩协商中间件（gzip / deflate）
+
+    - 请求体带 Content-Encoding 时先解压，再交给 /messages/ 或 /mcp 处理；
+      压缩数据和解压结果都不能超过 max_request_size，否则返回 413（防止压缩炸弹）
+    - 普通响应不小于 minimum_size 时整体压缩，小响应原样发送
+    - SSE 等流式响应逐块压缩并 Z_SYNC_FLUSH，保证每个事件立即送达
+    """
+
+    def __init__(self, app, minimum_size: int = 1024, compresslevel: int = 6,
+                 max_request_size: int = 16 * 1024 * 1024):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.compresslevel = compresslevel
+        self.max_request_size = max_request_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        from starlette.datastructures import Headers
+        from starlette.responses import Response
+
+        headers = Headers(scope=scope)
+        if headers.get("content-encoding", "").lower() in ("gzip", "deflate"):
+            try:
+                scope, receive = await self._decompress_request(scope, receive, headers)
+            except zlib.error:
+                await Response("无效的压缩请求体", status_code=400)(scope, receive, send)
+                return
+            except _RequestTooLarge:
+                await Response(f"请求体超过上限 ({self.max_request_size} 字节)",
+                               status_code=413)(scope, receive, send)
+                return
+
+        encoding = self._negotiate(headers.get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        await _CompressedResponse(send, encoding, self.minimum_size, self.compresslevel).run(
+            self.app, scope, receive
+        )
+
+    @staticmethod
+    def _negotiate(accept_encoding: str) -> Optional[str]:
+        offered = {}
+        for part in accept_encoding.lower().split(","):
+            token, _, params = part.strip().partition(";")
+            q = 1.0
+            if params.strip().startswith("q="):
+                try:
+                    q = float(params.strip()[2:])
+                except ValueError:
+                    q = 0.0
+            offered[token.strip()] = q
+        for encoding in ("gzip", "deflate"):
+            if offered.get(encoding, 0.0) > 0:
+                return encoding
+        return None
+
+    async def _decompress_request(self, scope, receive, headers):
+        limit = self.max_request_size
+        wbits = 31 if headers["content-encoding"].lower() == "gzip" else 15
+        decompressor = zlib.decompressobj(wbits)
+        chunks, wire, size = [], 0, 0
+        while True:
+            message = await receive()
+            data = message.get("body", b"")
+            wire += len(data)
+            if wire > limit:
+                raise _RequestTooLarge()
+            # 边收边解压，输出最多比剩余额度多一个字节，超出即拒绝，不会先展开整个压缩炸弹
+            chunk = decompressor.decompress(data, limit - size + 1)
+            size += len(chunk)
+            if size > limit or decompressor.unconsumed_tail:
+                raise _RequestTooLarge()
+            chunks.append(chunk)
+            if not message.get("more_body", False):
+                break
+        if not decompressor.eof:
+            raise zlib.error("压缩数据不完整")
+        raw = b"".join(chunks)
+        transport_stats["http_request"].record(len(raw), wire)
+
+        scope = dict(scope)
+        scope["headers"] = [
+            (k, v) for k, v in scope["headers"]
+            if k not in (b"content-encoding", b"content-length")
+        ] + [(b"content-length", str(len(raw)).encode())]
+        delivered = False
+
+        async def replay():
+            nonlocal delivered
+            if not delivered:
+                delivered = True
+                return {"type": "http.request", "body": raw, "more_body": False}
+            return await receive()
+
+        return scope, replay
+
+
+class _CompressedResponse:
+    """单个响应的压缩状态"""
+
+    def __init__(self, send, encoding: str, minimum_size: int, compresslevel: int):
+        self.send = send
+        self.encoding = encoding
+        self.minimum_size = minimum_size
+        self.compresslevel = compresslevel
+        self.start_message = None
+        self.compressor = None
+        self.passthrough = False
+
+    async def run(self, app, scope, receive):
+        await app(scope, receive, self.on_send)
+
+    def _compressor(self):
+        wbits = 31 if self.encoding == "gzip" else 15
+        return zlib.compressobj(self.compresslevel, zlib.DEFLATED, wbits)
+
+    async def _start(self, compressed_length: Optional[int]):
+        from starlette.datastructures import MutableHeaders
+
+        headers = MutableHeaders(raw=self.start_message["headers"])
+        headers["Content-Encoding"] = self.encoding
+        headers.add_vary_header("Accept-Encoding")
+        if compressed_length is None:
+            del headers["Content-Length"]
+        else:
+            headers["Content-Length"] = str(compressed_length)
+        await self.send(self.start_message)
+
+    async def on_send(self, message):
+        if message["type"] == "http.response.start":
+            from starlette.datastructures import Headers
+
+            self.start_message = message
+            headers = Headers(raw=message["headers"])
+            self.passthrough = "content-encoding" in headers
+            if self.passthrough:
+                await self.send(message)
+            return
+        if message["type"] != "http.response.body" or self.passthrough:
+            await self.send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        stats = transport_stats["http_response"]
+
+        if self.compressor is None and self.start_message is not None:
+            if not more_body:
+                # 完整响应：小于阈值时不压缩
+                if len(body) < self.minimum_size:
+                    stats.record(len(body), len(body))
+                    await self.send(self.start_message)
+                    await self.send(message)
+                else:
+                    compressor = self._compressor()
+                    data = compressor.compress(body) + compressor.flush()
+                    stats.record(len(body), len(data))
+                    await self._start(len(data))
+                    await self.send({"type": "http.response.body", "body": data})
+                self.start_message = None
+                return
+            # 流式响应（如SSE）：逐块压缩
+            self.compressor = self._compressor()
+            await self._start(None)
+            self.start_message = None
+
+        if more_body:
+            data = self.compressor.compress(body) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+        else:
+            data = self.compressor.compress(body) + self.compressor.flush()
+        stats.record(len(body), len(data))
+        await self.send({"type": "http.response.body", "body": data, "more_body": more_body})
+
+
+class _StreamableHTTPEndpoint:
+    """把请求转交给 StreamableHTTPSessionManager 的ASGI端点"""
+
+    def __init__(self, session_manager):
+        self.session_manager = session_manager
+
+    async def __call__(self, scope, receive, send):
+        await self.session_manager.handle_request(scope, receive, send)
+
+
+def create_starlette_app(mcp_server: Server, sse_transport: Optional[SseServerTransport],
+                         compress_min_size: Optional[int] = 1024,
+                         streamable_http: bool = False,
+                         max_request_size: int = 16 * 1024 * 1024) -> Starlette:
+    """创建Starlette应用
+
+    sse_transport 为 None 时不提供 /sse 和 /messages/ 端点。
+    streamable_http=True 时在 /mcp 提供无状态的 Streamable HTTP 传输：
+    每个请求独立处理，不依赖进程内的连接状态，因此可以运行多个
+    uvicorn worker 或放在负载均衡之后。
+    compress_min_size 为HTTP响应压缩阈值（字节），None 表示关闭压缩。
+    max_request_size 为压缩请求体解压前后的大小上限（字节）。
+    """
+    import asyncio
+    from contextlib import asynccontextmanager
+    from starlette.applications import Starlette
+    from starlette.middleware import Middleware
+    from starlette.requests import Request
+    from starlette.responses import Response, JSONResponse
+    from starlette.routing import Route, Mount
+
+    session_manager = None
+    if streamable_http:
+        from mcp.server.streamable_http_manager import StreamableHTTPSessionManager
+        session_manager = StreamableHTTPSessionManager(app=mcp_server, stateless=True)
+
+    transports = []
+    if sse_transport is not None:
+        transports.append("sse")
+    if session_manager is not None:
+        transports.append("streamable-http")
     
     async def handle_sse(request: Request):
         """处理SSE连接请求"""
@@ -795,7 +3062,7 @@ def create_starlette_app(mcp_server: Server, sse_transport: SseServerTransport)
             await mcp_server.run(
                 read_stream,
                 write_stream,
-                mcp_server.create_initialization_options()
+                _initialization_options(mcp_server)
             )
         return Response()
     
@@ -803,71 +3070,435 @@ def create_starlette_app(mcp_server: Server, sse_transport: SseServerTransport)
         """健康检查端点"""
         return JSONResponse({
             "status": "ok",
-            "pymol_connected": pymol_conn._server is not None,
-            "server": "pymol-controller"
+            "pymol_connected": _pymol_connected(),
+            "server": "pymol-controller",
+            "pid": os.getpid()
+        })
+    
+    async def metrics(request: Request):
+        """传输统计端点"""
+        return JSONResponse({
+            "transport": {name: stats.as_dict() for name, stats in transport_stats.items()},
+            "admission": _get_admission().stats(),
+            "coalesce": _coalesce_stats(),
+            "workers": worker_pool.stats() if worker_pool is not None else None,
+            "presets": presets.stats() if presets is not None else None,
+            "selection_cache": _selection_cache_stats(),
+            "scene": scene_watcher.stats() if scene_watcher is not None else None,
+            "progressive": progressive_renderer.stats() if progressive_renderer is not None else None,
+            "gallery_cache": thumbnail_cache.stats() if thumbnail_cache is not None else None,
+            "traffic": traffic_recorder.stats() if traffic_recorder is not None else None,
         })
+
+    def admin_only(endpoint):
+        """管理端点（/admin/* 和 /sessions）只接受本机请求，或携带管理令牌的请求"""
+        async def guarded(request: Request):
+            if not _admin_allowed(request):
+                return JSONResponse({"error": "禁止访问：仅限本机，或携带 Authorization: Bearer <admin令牌>"},
+                                    status_code=403)
+            return await endpoint(request)
+        return guarded
+
+    async def usage(request: Request):
+        """资源用量端点：按会话、工具和后端汇总的CPU时间和内存增长"""
+        if usage_ledger is None:
+            return JSONResponse({"error": "资源用量统计未开启"}, status_code=404)
+        top = request.query_params.get("top")
+        snapshot = usage_ledger.snapshot(int(top) if top and top.isdigit() else None)
+        def sample_backends():
+            return {
+                _backend_label(conn): _sample_backend(conn, conn.get_cmd(), allow_rpc=True) if conn._server is not None else None
+                for conn in _connections()
+            }
+        snapshot["backends"] = await asyncio.to_thread(sample_backends)
+        if cost_guard is not None:
+            snapshot["cost_guard"] = {
+                "policy": cost_guard.policy,
+                "rep_limits": cost_guard.rep_limits,
+                "flagged": cost_guard.flagged,
+            }
+        return JSONResponse(snapshot)
+
+    async def profile(request: Request):
+        """采样分析端点：采样N秒，返回折叠栈或按类别汇总的JSON（含事件循环延迟）"""
+        global _profiling
+        if _profiling:
+            return JSONResponse({"error": "已有分析正在进行，请稍后重试"}, status_code=409)
+        import math
+        params = request.query_params
+        # 参数在采样之前全部校验，避免白白等完整个采样窗口才报错
+        try:
+            seconds = float(params.get("seconds", 10))
+            interval = float(params.get("interval_ms", 10)) / 1000
+            top = int(params.get("top", 20))
+        except ValueError:
+            return JSONResponse({"error": "seconds 和 interval_ms 必须是数字，top 必须是整数"}, status_code=400)
+        if not (math.isfinite(seconds) and math.isfinite(interval)) or seconds <= 0 or interval <= 0 or top < 0:
+            return JSONResponse({"error": "seconds 和 interval_ms 必须是有限的正数，top 不能为负"}, status_code=400)
+        fmt = params.get("format", "json")
+        if fmt not in ("json", "collapsed"):
+            return JSONResponse({"error": f"未知格式: {fmt}（可选 json、collapsed）"}, status_code=400)
+
+        import pymol_profiler
+        _profiling = True
+        try:
+            profiler, monitor = await pymol_profiler.profile(seconds, interval, params.get("idle") == "1")
+        finally:
+            _profiling = False
+        if fmt == "collapsed":
+            return Response(profiler.collapsed(), media_type="text/plain; charset=utf-8", headers={
+                "Content-Disposition": f'attachment; filename="pymol-mcp-{os.getpid()}.collapsed"',
+            })
+        return JSONResponse(dict(profiler.summary(top), pid=os.getpid(),
+                                 loop_lag=monitor.summary()))
+
+    async def sessions(request: Request):
+        """会话列表端点：会话ID可以用来向该会话发送消息，因此与管理端点一样限制访问"""
+        records = await asyncio.to_thread(session_store.list)
+        return JSONResponse({"count": len(records), "sessions": records})
     
     async def root(request: Request):
         """根路径 - 显示服务器信息"""
+        endpoints = {}
+        if sse_transport is not None:
+            endpoints["/sse"] = "SSE连接端点 (用于MCP客户端连接)"
+            endpoints["/messages/"] = "消息发送端点 (POST请求)"
+        if session_manager is not None:
+            endpoints["/mcp"] = "Streamable HTTP端点 (无状态，支持多worker)"
+        endpoints.update({
+            "/health": "健康检查端点",
+            "/metrics": "传输统计端点",
+            "/sessions": "会话列表端点 (仅限本机或携带管理令牌)",
+            "/admin/usage": "资源用量端点 (按会话/工具/后端，仅限本机或携带管理令牌)",
+            "/admin/profile": "采样分析端点 (?seconds=10&format=json|collapsed，仅限本机或携带管理令牌)"
+        })
         return JSONResponse({
             "name": "PyMOL MCP Server",
             "version": "1.0.0",
-            "endpoints": {
-                "/sse": "SSE连接端点 (用于MCP客户端连接)",
-                "/messages/": "消息发送端点 (POST请求)",
-                "/health": "健康检查端点"
-            },
-            "transport": "sse",
-            "pymol_connected": pymol_conn._server is not None
+            "endpoints": endpoints,
+            "transport": "+".join(transports),
+            "pymol_connected": _pymol_connected()
         })
     
     routes = [
         Route("/", endpoint=root, methods=["GET"]),
-        Route("/sse", endpoint=handle_sse, methods=["GET"]),
         Route("/health", endpoint=health_check, methods=["GET"]),
-        Mount("/messages/", app=sse_transport.handle_post_message),
+        Route("/metrics", endpoint=metrics, methods=["GET"]),
+        Route("/sessions", endpoint=admin_only(sessions), methods=["GET"]),
+        Route("/admin/usage", endpoint=admin_only(usage), methods=["GET"]),
+        Route("/admin/profile", endpoint=admin_only(profile), methods=["GET"]),
     ]
+    if sse_transport is not None:
+        routes += [
+            Route("/sse", endpoint=handle_sse, methods=["GET"]),
+            Mount("/messages/", app=sse_transport.handle_post_message),
+        ]
+    if session_manager is not None:
+        routes.append(Route("/mcp", endpoint=_StreamableHTTPEndpoint(session_manager),
+                            methods=["GET", "POST", "DELETE"]))
+
+    @asynccontextmanager
+    async def lifespan(app):
+        try:
+            if session_manager is None:
+                yield
+            else:
+                async with session_manager.run():
+                    yield
+        finally:
+            if traffic_recorder is not None:
+                # 写出gzip文件尾，之后的调用（如果有）追加为新的一段
+                traffic_recorder.close()
     
-    return Starlette(routes=routes)
+    middleware = []
+    if compress_min_size is not None:
+        middleware.append(Middleware(CompressionMiddleware, minimum_size=compress_min_size,
+                                     max_request_size=max_request_size))
+    return Starlette(routes=routes, middleware=middleware, lifespan=lifespan)
 
 
-async def main():
+# 多worker模式下，主进程通过该环境变量把配置传给各worker进程中的 create_app
+_CONFIG_ENV = "PYMOL_MCP_CONFIG"
+
+
+def create_app(config: Optional[Dict[str, Any]] = None) -> Starlette:
+    """按配置创建完整的ASGI应用
+
+    多worker模式下由 uvicorn 作为工厂函数在每个worker进程中调用，
+    此时配置从环境变量 PYMOL_MCP_CONFIG 读取。
+    """
+    global session_store, admission, coalesce_window, worker_pool, usage_ledger, cost_guard, presets, remote_accounting
+    global selection_cache_size, scene_poll_interval, scene_watcher, traffic_recorder, admin_token
+    global gallery_cache_mb, thumbnail_cache
+    if config is None:
+        config = json.loads(os.environ.get(_CONFIG_ENV, "{}"))
+
+    pymol_conn.host = config.get("pymol_host", "localhost")
+    pymol_conn.port = config.get("pymol_port", 9123)
+    pymol_conn.compress_threshold = config.get("rpc_compress_min_size", 4096)
+    session_store = _load_sessions().open_session_store(config.get("session_store", "memory"))
+    admission_module = _load_admission()
+    # --tool-limit 覆盖默认的按工具并发上限，0 表示不单独限制
+    tool_limits = dict(admission_module.DEFAULT_TOOL_LIMITS, **config.get("tool_limits", {}))
+    admission = admission_module.AdmissionController(
+        max_in_flight=config.get("max_in_flight", 4),
+        max_queue=config.get("max_queue", 32),
+        max_wait=config.get("max_queue_wait", 30.0),
+        rate=config.get("rate_limit", 10.0),
+        burst=config.get("rate_burst", 20.0),
+        tool_limits={tool: n for tool, n in tool_limits.items() if n > 0},
+    )
+
+    accounting = _load_accounting()
+    usage_ledger = accounting.UsageLedger() if config.get("accounting", True) else None
+    remote_accounting = config.get("remote_accounting", False)
+    # --rep-atom-limit 覆盖默认的按表示方式原子数上限，0 表示不限
+    rep_limits = dict(accounting.DEFAULT_REP_LIMITS, **config.get("rep_atom_limits", {}))
+    cost_guard = accounting.CostGuard(
+        {rep: n for rep, n in rep_limits.items() if n > 0},
+        policy=config.get("expensive_call_policy", "lod"),
+    )
+
+    presets = _load_presets().PresetRegistry(config.get("presets_dir"))
+
+    admin_token = config.get("admin_token") or os.environ.get(_ADMIN_TOKEN_ENV) or None
+
+    if traffic_recorder is not None:
+        traffic_recorder.close()
+        traffic_recorder = None
+    if config.get("record_traffic"):
+        import pymol_traffic
+        traffic_recorder = pymol_traffic.TrafficRecorder(config["record_traffic"],
+                                                         anonymize=config.get("record_anonymize", False))
+
+    coalesce_window = config.get("coalesce_window_ms", 0) / 1000
+    selection_cache_size = config.get("selection_cache", 32)
+    gallery_cache_mb = config.get("gallery_cache_mb", 64.0)
+    thumbnail_cache = None
+    scene_poll_interval = config.get("scene_poll_interval", 2.0)
+    scene_watcher = None
+    _attach_write_combiner(pymol_conn)
+
+    if worker_pool is not None:
+        worker_pool.stop()
+        worker_pool = None
+    if config.get("pymol_workers", 0) > 0:
+        # 由服务器启动并监管无界面PyMOL进程，不连接外部PyMOL
+        import pymol_workers
+        command = None
+        if config.get("pymol_exe"):
+            command = [config["pymol_exe"]] + pymol_workers.DEFAULT_COMMAND[1:]
+        worker_pool = pymol_workers.WorkerPool(
+            _worker_connection,
+            size=config["pymol_workers"],
+            spares=config.get("pymol_spares", 1),
+            command=command,
+            base_port=config.get("pymol_port", 9123),
+            max_calls=config.get("worker_max_calls") or None,
+            max_rss_mb=config.get("worker_max_rss_mb") or None,
+            idle_timeout=config.get("worker_idle_timeout", 1800),
+        )
+        worker_pool.start()
+    elif config.get("pymol_cmd") is not None:
+        # 由PyMOL插件在PyMOL进程内启动（pymol_inprocess），直接调用 cmd
+        pymol_conn.attach(config["pymol_cmd"])
+    # 尝试连接到PyMOL
+    elif not pymol_conn.connect():
+        print("警告: 无法连接到PyMOL。请确保PyMOL已启动并启用了XML-RPC服务器。", file=sys.stderr)
+        print("启动命令: pymol -R 或 pymol --rpc-server", file=sys.stderr)
+        print("服务器将继续运行，等待PyMOL连接...", file=sys.stderr)
+
+    transport = config.get("transport", "both")
+    sse = None
+    if transport in ("sse", "both"):
+        from mcp.server.sse import SseServerTransport
+        sse = SseServerTransport("/messages/")
+    return create_starlette_app(
+        get_mcp_server(), sse,
+        compress_min_size=config.get("compress_min_size", 1024),
+        streamable_http=transport in ("streamable-http", "both"),
+        max_request_size=config.get("max_request_size", 16 * 1024 * 1024),
+    )
+
+
+def check_connection() -> int:
+    """--check 快速路径：只验证PyMOL连接，不导入MCP/HTTP依赖，也不启动uvicorn"""
+    start = time.perf_counter()
+    if pymol_conn.connect():
+        names = pymol_conn.get_cmd().get_names("objects", 0)
+        elapsed = (time.perf_counter() - start) * 1000
+        print(f"PyMOL连接正常 ({elapsed:.0f} ms)，当前对象数: {len(names)}")
+        return 0
+    print(f"无法连接到PyMOL: {pymol_conn.host}:{pymol_conn.port}-{pymol_conn.port + 4}", file=sys.stderr)
+    return 1
+
+
+def main() -> None:
     """主函数 - 启动HTTP MCP服务器"""
     parser = argparse.ArgumentParser(description="PyMOL MCP HTTP服务器")
     parser.add_argument("--host", default="127.0.0.1", help="绑定地址 (默认: 127.0.0.1)")
     parser.add_argument("--port", type=int, default=3000, help="监听端口 (默认: 3000)")
     parser.add_argument("--pymol-host", default="localhost", help="PyMOL XML-RPC主机")
     parser.add_argument("--pymol-port", type=int, default=9123, help="PyMOL XML-RPC端口")
+    parser.add_argument("--compress-min-size", type=int, default=1024,
+                        help="HTTP响应gzip/deflate压缩阈值，字节 (默认: 1024，负数表示关闭)")
+    parser.add_argument("--max-request-size", type=int, default=16 * 1024 * 1024,
+                        help="压缩请求体解压前后的大小上限，字节，超出返回413 (默认: 16777216)")
+    parser.add_argument("--rpc-compress-min-size", type=int, default=4096,
+                        help="发往PyMOL的XML-RPC请求gzip压缩阈值，字节 (默认: 4096，负数表示关闭)")
+    parser.add_argument("--transport", choices=["sse", "streamable-http", "both"], default="both",
+                        help="MCP传输方式 (默认: both，即同时提供 /sse 和 /mcp)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="uvicorn worker进程数 (默认: 1，大于1时需要 --transport streamable-http)")
+    parser.add_argument("--session-store", default="memory",
+                        help="会话状态存储: memory 或 sqlite:<路径> (多worker时应使用sqlite)")
+    parser.add_argument("--max-in-flight", type=int, default=4,
+                        help="同时执行的工具调用上限 (默认: 4)")
+    parser.add_argument("--max-queue", type=int, default=32,
+                        help="排队等待的工具调用上限，超出时立即拒绝 (默认: 32)")
+    parser.add_argument("--max-queue-wait", type=float, default=30.0,
+                        help="工具调用最长排队时间，秒 (默认: 30)")
+    parser.add_argument("--rate-limit", type=float, default=10.0,
+                        help="每个会话每秒允许的工具调用数，0表示不限速 (默认: 10，--workers 大于1时须为0)")
+    parser.add_argument("--rate-burst", type=float, default=20.0,
+                        help="每个会话允许的突发调用数 (默认: 20)")
+    parser.add_argument("--tool-limit", action="append", default=[], metavar="TOOL=N",
+                        help="单个工具的并发上限（工作进程池模式下按PyMOL进程分别计算），可重复，如 pymol_ray=1 (0表示不单独限制)")
+    parser.add_argument("--coalesce-window", type=float, default=0, metavar="MS",
+                        help="视图/颜色操作写合并窗口，毫秒 (默认: 0，即关闭)")
+    parser.add_argument("--pymol-workers", type=int, default=0,
+                        help="由服务器启动并监管的无界面PyMOL进程数上限，每个会话独占一个 "
+                             "(默认: 0，即连接外部PyMOL；端口从 --pymol-port 开始分配)")
+    parser.add_argument("--pymol-spares", type=int, default=1,
+                        help="保持预热的备用PyMOL进程数 (默认: 1)")
+    parser.add_argument("--pymol-exe", default="pymol", help="PyMOL可执行文件 (默认: pymol)")
+    parser.add_argument("--worker-max-calls", type=int, default=1000,
+                        help="PyMOL进程处理多少次调用后回收，0表示不限 (默认: 1000)")
+    parser.add_argument("--worker-max-rss-mb", type=float, default=2048,
+                        help="PyMOL进程内存超过该值（MB）时回收，0表示不限 (默认: 2048)")
+    parser.add_argument("--worker-idle-timeout", type=float, default=1800,
+                        help="会话空闲多少秒后释放其PyMOL进程 (默认: 1800)")
+    parser.add_argument("--no-accounting", action="store_true",
+                        help="不统计每次调用的PyMOL资源用量 (默认统计，见 /admin/usage)")
+    parser.add_argument("--remote-accounting", action="store_true",
+                        help="远程PyMOL也在每次调用前后通过RPC采样内存和CPU (默认只记录耗时)")
+    parser.add_argument("--rep-atom-limit", action="append", default=[], metavar="REP=N",
+                        help="表示方式的原子数上限，可重复，如 surface=150000 (0表示不限)")
+    parser.add_argument("--expensive-call-policy", choices=["lod", "warn", "reject"], default="lod",
+                        help="超过原子数上限的调用: lod 自动降低显示/渲染细节，warn 照常执行并警告，"
+                             "reject 拒绝 (默认: lod)")
+    parser.add_argument("--selection-cache", type=int, default=32, metavar="N",
+                        help="反复使用的复杂选择表达式物化为隐藏命名选择，每个PyMOL最多缓存N个 "
+                             "(默认: 32，0表示关闭)")
+    parser.add_argument("--gallery-cache-mb", type=float, default=64.0, metavar="MB",
+                        help="pymol_gallery 按对象指纹缓存缩略图的内存上限 (默认: 64，0表示不缓存)")
+    parser.add_argument("--scene-poll-interval", type=float, default=2.0, metavar="SECONDS",
+                        help="有客户端订阅场景资源时检查场景变化的间隔，秒 (默认: 2，0表示不推送变化通知)")
+    parser.add_argument("--presets-dir", default=None,
+                        help="场景预设目录（*.json / *.yaml，修改后自动重新加载），同名预设覆盖内置预设")
+    parser.add_argument("--record-traffic", default=None, metavar="PATH",
+                        help="把每次工具调用（工具名、参数、耗时、响应大小）录制到该文件，.gz 结尾时压缩，"
+                             "用 pymol_traffic.py 回放；多worker时路径中须含 {pid}")
+    parser.add_argument("--record-anonymize", action="store_true",
+                        help="录制时把路径、选择表达式、对象名等字符串替换为散列值")
+    parser.add_argument("--admin-token", default=None,
+                        help=f"管理端点 /admin/* 和 /sessions 的访问令牌（请求头 Authorization: Bearer <令牌>），"
+                             f"也可用环境变量 {_ADMIN_TOKEN_ENV} 设置；未设置时只允许本机访问")
+    parser.add_argument("--check", action="store_true",
+                        help="只检查PyMOL连接后退出（退出码0表示成功），不启动HTTP服务器")
     args = parser.parse_args()
     
     # 配置PyMOL连接
     pymol_conn.host = args.pymol_host
     pymol_conn.port = args.pymol_port
+    pymol_conn.compress_threshold = args.rpc_compress_min_size if args.rpc_compress_min_size >= 0 else None
+
+    if args.check:
+        sys.exit(check_connection())
+
+    if args.workers > 1:
+        # SSE会话绑定在建立连接的进程里，POST可能落到其他worker上
+        if args.transport != "streamable-http":
+            parser.error("--workers 大于1时只支持 --transport streamable-http")
+        if args.pymol_workers > 0:
+            parser.error("--pymol-workers 不能与 --workers 同时使用（每个worker进程会各自启动一组PyMOL）")
+        if args.rate_limit > 0:
+            # 令牌桶在各进程内维护，N个worker时每个会话的实际限速为N倍
+            parser.error("--workers 大于1时按会话限速在各进程分别计算，实际上限会放大为worker数倍；"
+                         "请加 --rate-limit 0，改由负载均衡或网关限速")
+        if args.record_traffic and "{pid}" not in args.record_traffic:
+            parser.error("--workers 大于1时 --record-traffic 的路径中须含 {pid}（每个worker进程写各自的文件）")
+        if args.session_store == "memory":
+            print("警告: 多worker模式下 memory 会话存储不会在进程间共享，建议使用 sqlite:<路径>",
+                  file=sys.stderr)
+
+    def parse_limits(option, items, metavar):
+        limits = {}
+        for item in items:
+            key, _, limit = item.partition("=")
+            if not key or not limit.isdigit():
+                parser.error(f"{option} 格式应为 {metavar}=N: {item}")
+            limits[key] = int(limit)
+        return limits
+
+    tool_limits = parse_limits("--tool-limit", args.tool_limit, "TOOL")
+    rep_atom_limits = parse_limits("--rep-atom-limit", args.rep_atom_limit, "REP")
+
+    config = {
+        "pymol_host": args.pymol_host,
+        "pymol_port": args.pymol_port,
+        "rpc_compress_min_size": pymol_conn.compress_threshold,
+        "compress_min_size": args.compress_min_size if args.compress_min_size >= 0 else None,
+        "max_request_size": args.max_request_size,
+        "transport": args.transport,
+        "session_store": args.session_store,
+        "max_in_flight": args.max_in_flight,
+        "max_queue": args.max_queue,
+        "max_queue_wait": args.max_queue_wait,
+        "rate_limit": args.rate_limit,
+        "rate_burst": args.rate_burst,
+        "tool_limits": tool_limits,
+        "coalesce_window_ms": args.coalesce_window,
+        "pymol_workers": args.pymol_workers,
+        "pymol_spares": args.pymol_spares,
+        "pymol_exe": args.pymol_exe,
+        "worker_max_calls": args.worker_max_calls,
+        "worker_max_rss_mb": args.worker_max_rss_mb,
+        "worker_idle_timeout": args.worker_idle_timeout,
+        "accounting": not args.no_accounting,
+        "remote_accounting": args.remote_accounting,
+        "rep_atom_limits": rep_atom_limits,
+        "expensive_call_policy": args.expensive_call_policy,
+        "presets_dir": args.presets_dir,
+        "selection_cache": args.selection_cache,
+        "scene_poll_interval": args.scene_poll_interval,
+        "gallery_cache_mb": args.gallery_cache_mb,
+        "record_traffic": args.record_traffic,
+        "record_anonymize": args.record_anonymize,
+        "admin_token": args.admin_token,
+    }
     
-    # 尝试连接到PyMOL
-    if not pymol_conn.connect():
-        print("警告: 无法连接到PyMOL。请确保PyMOL已启动并启用了XML-RPC服务器。", file=sys.stderr)
-        print("启动命令: pymol -R 或 pymol --rpc-server", file=sys.stderr)
-        print("服务器将继续运行，等待PyMOL连接...", file=sys.stderr)
-    
-    # 创建SSE传输
-    sse = SseServerTransport("/messages/")
-    
-    # 创建Starlette应用
-    starlette_app = create_starlette_app(app, sse)
-    
+    import uvicorn
+
     print(f"\n🚀 PyMOL MCP HTTP服务器已启动!")
     print(f"   监听地址: http://{args.host}:{args.port}")
-    print(f"   SSE端点:  http://{args.host}:{args.port}/sse")
+    if args.transport in ("sse", "both"):
+        print(f"   SSE端点:  http://{args.host}:{args.port}/sse")
+    if args.transport in ("streamable-http", "both"):
+        print(f"   HTTP端点: http://{args.host}:{args.port}/mcp")
     print(f"   健康检查: http://{args.host}:{args.port}/health")
-    print(f"\n在MCP客户端中使用此URL配置: http://{args.host}:{args.port}/sse")
+    if args.workers > 1:
+        print(f"   Worker数: {args.workers}")
     print("")
     
-    # 启动Uvicorn服务器
-    config = uvicorn.Config(starlette_app, host=args.host, port=args.port, log_level="info")
-    server = uvicorn.Server(config)
-    await server.serve()
+    # 启动Uvicorn服务器（uvicorn.run 自行管理事件循环）
+    if args.workers > 1:
+        os.environ[_CONFIG_ENV] = json.dumps(config)
+        uvicorn.run("pymol_mcp_server:create_app", factory=True, host=args.host, port=args.port,
+                    workers=args.workers, log_level="info")
+    else:
+        uvicorn.run(create_app(config), host=args.host, port=args.port, log_level="info")
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    main()
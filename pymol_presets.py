@@ -0,0 +1,288 @@
+"""
+PyMOL MCP 场景预设
+
+智能体经常重复搭建同样的外观（发表用白底、配体口袋、按链彩虹色），
+每次要十几次工具调用。预设把这些步骤写成带参数的PyMOL脚本：
+
+    ligand_pocket:
+      description: 配体结合口袋
+      params: {ligand: organic, cutoff: 5}
+      script: |
+        select pocket, byres (polymer within {cutoff} of ({ligand}))
+        show sticks, pocket
+
+预设从目录中的 JSON / YAML 文件加载（YAML 需要 PyYAML），文件修改后自动重新加载；
+同名预设覆盖内置预设。每个预设只编译一次（拆分命令、检查参数占位符），
+按参数展开的命令列表也会缓存，应用时通过 mcp_do_capture 一次RPC执行。
+"""
+
+import os
+import string
+import threading
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+# 内置预设（格式与预设文件相同）
+BUILTIN_PRESETS: Dict[str, Dict[str, Any]] = {
+    "publication": {
+        "description": "发表用样式：白色透明背景、卡通加配体棍状、高质量光线追踪设置",
+        "params": {"selection": "all"},
+        "script": """
+            bg_color white
+            set ray_opaque_background, 0
+            set antialias, 2
+            set ray_trace_mode, 1
+            set depth_cue, 0
+            set specular, 0.25
+            set cartoon_fancy_helices, 1
+            hide everything, {selection}
+            show cartoon, {selection}
+            show sticks, ({selection}) and organic
+            orient {selection}
+        """,
+    },
+    "ligand_pocket": {
+        "description": "配体结合口袋：配体周围 cutoff 埃内的残基显示为棍状，蛋白半透明卡通",
+        "params": {"ligand": "organic", "cutoff": 5, "name": "pocket"},
+        "script": """
+            hide everything
+            show cartoon, polymer
+            set cartoon_transparency, 0.6
+            select {name}, byres (polymer within {cutoff} of ({ligand}))
+            show sticks, {name} and not name N+C+O
+            show sticks, {ligand}
+            color grey70, {name} and elem C
+            color yellow, ({ligand}) and elem C
+            distance {name}_hbonds, {ligand}, {name}, mode=2
+            hide labels, {name}_hbonds
+            orient {ligand}
+            zoom {name}, 2
+        """,
+    },
+    "chain_rainbow": {
+        "description": "按链着色：每条链从N端到C端彩虹渐变，卡通显示",
+        "params": {"selection": "all"},
+        "script": """
+            hide everything, {selection}
+            show cartoon, {selection}
+            util.chainbow {selection}
+            orient {selection}
+        """,
+    },
+}
+
+# 预设文件扩展名
+_JSON_SUFFIXES = (".json",)
+_YAML_SUFFIXES = (".yaml", ".yml")
+
+_formatter = string.Formatter()
+
+
+@dataclass
+class Preset:
+    """编译后的预设：命令模板列表和参数默认值（None 表示必填）"""
+    name: str
+    description: str
+    params: Dict[str, Any]
+    commands: Tuple[str, ...]
+    source: str = "builtin"
+
+    def render(self, values: Dict[str, Any]) -> Tuple[str, ...]:
+        """用参数展开命令模板"""
+        unknown = set(values) - set(self.params)
+        if unknown:
+            raise ValueError(f"预设 {self.name} 没有参数: {', '.join(sorted(unknown))}")
+        merged = {}
+        for param, default in self.params.items():
+            value = values.get(param, default)
+            if value is None:
+                raise ValueError(f"预设 {self.name} 缺少必填参数: {param}")
+            if isinstance(value, bool):
+                value = int(value)
+            value = str(value)
+            # 参数值只能是单条命令中的一部分，不能借此注入其他命令
+            if ";" in value or "\n" in value:
+                raise ValueError(f"预设参数 {param} 的值不能包含分号或换行: {value!r}")
+            merged[param] = value
+        return tuple(command.format(**merged) for command in self.commands)
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "description": self.description,
+            "params": self.params,
+            "commands": len(self.commands),
+            "source": self.source,
+        }
+
+
+def compile_preset(name: str, spec: Dict[str, Any], source: str = "builtin") -> Preset:
+    """检查预设定义并编译为命令模板列表"""
+    if not isinstance(spec, dict):
+        raise ValueError(f"预设 {name} 的定义应为映射")
+    script = spec.get("script")
+    if isinstance(script, str):
+        lines = script.splitlines()
+    elif isinstance(script, list) and all(isinstance(line, str) for line in script):
+        lines = [part for line in script for part in line.splitlines()]
+    else:
+        raise ValueError(f"预设 {name} 缺少 script（字符串或字符串列表）")
+    commands = tuple(line.strip() for line in lines if line.strip() and not line.strip().startswith("#"))
+    if not commands:
+        raise ValueError(f"预设 {name} 的 script 为空")
+
+    params = spec.get("params") or {}
+    if not isinstance(params, dict):
+        raise ValueError(f"预设 {name} 的 params 应为 参数名: 默认值 映射")
+    for command in commands:
+        try:
+            fields = {f for _, f, _, _ in _formatter.parse(command) if f is not None}
+        except ValueError as e:
+            raise ValueError(f"预设 {name} 的命令格式错误: {command}: {e}")
+        undeclared = fields - set(params)
+        if undeclared:
+            raise ValueError(f"预设 {name} 使用了未声明的参数: {', '.join(sorted(undeclared))}")
+    return Preset(name, str(spec.get("description", "")), dict(params), commands, source)
+
+
+def _read_preset_file(path: str) -> Dict[str, Any]:
+    with open(path, encoding="utf-8") as f:
+        text = f.read()
+    if path.endswith(_YAML_SUFFIXES):
+        try:
+            import yaml
+        except ImportError:
+            raise ValueError("读取YAML预设需要PyYAML: pip install pyyaml")
+        data = yaml.safe_load(text) or {}
+    else:
+        import json
+        data = json.loads(text)
+    if not isinstance(data, dict):
+        raise ValueError("预设文件的顶层应为 预设名: 定义 映射")
+    return data
+
+
+class PresetRegistry:
+    """预设注册表：内置预设加上目录中的预设文件，文件修改后自动重新加载
+
+    check_interval 为检查文件修改时间的最小间隔（秒）；render_cache 为按参数
+    展开结果的缓存条数。
+    """
+
+    def __init__(self, directory: Optional[str] = None, check_interval: float = 1.0,
+                 render_cache: int = 256):
+        self.directory = directory
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._presets: Dict[str, Preset] = {}
+        self._mtimes: Dict[str, int] = {}
+        self._checked = 0.0
+        self.errors: Dict[str, str] = {}
+        self.reloads = 0
+        self._render_cache: "OrderedDict[tuple, Tuple[str, ...]]" = OrderedDict()
+        self._render_cache_size = render_cache
+        self.hits = 0
+        self.misses = 0
+        self._latency: Dict[str, Deque[float]] = {}
+        self._calls: Dict[str, int] = {}
+        self._load(self._scan())
+
+    def _scan(self) -> Dict[str, int]:
+        if not self.directory or not os.path.isdir(self.directory):
+            return {}
+        mtimes = {}
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and entry.name.endswith(_JSON_SUFFIXES + _YAML_SUFFIXES):
+                mtimes[entry.path] = entry.stat().st_mtime_ns
+        return mtimes
+
+    def _load(self, mtimes: Dict[str, int]) -> None:
+        presets = {name: compile_preset(name, spec) for name, spec in BUILTIN_PRESETS.items()}
+        errors = {}
+        for path in sorted(mtimes):
+            try:
+                for name, spec in _read_preset_file(path).items():
+                    presets[name] = compile_preset(name, spec, os.path.basename(path))
+            except Exception as e:
+                # 出错的文件保留上一次成功加载的预设
+                errors[path] = str(e)
+                presets.update({name: p for name, p in self._presets.items()
+                                if p.source == os.path.basename(path)})
+        self._presets = presets
+        self._mtimes = mtimes
+        self.errors = errors
+        self._render_cache.clear()
+
+    def refresh(self, force: bool = False) -> None:
+        """文件有增删或修改时重新加载"""
+        now = time.monotonic()
+        with self._lock:
+            if not force and now - self._checked < self.check_interval:
+                return
+            self._checked = now
+            mtimes = self._scan()
+            if force or mtimes != self._mtimes:
+                self._load(mtimes)
+                self.reloads += 1
+
+    def get(self, name: str) -> Preset:
+        self.refresh()
+        preset = self._presets.get(name)
+        if preset is None:
+            raise ValueError(f"未知预设: {name}（可用: {', '.join(sorted(self._presets))}）")
+        return preset
+
+    def list(self) -> List[Dict[str, Any]]:
+        self.refresh()
+        return [preset.describe() for _, preset in sorted(self._presets.items())]
+
+    def render(self, name: str, values: Optional[Dict[str, Any]] = None) -> Tuple[str, ...]:
+        """返回预设按参数展开后的命令列表（结果缓存）"""
+        preset = self.get(name)
+        values = values or {}
+        key = (id(preset), tuple(sorted((k, repr(v)) for k, v in values.items())))
+        with self._lock:
+            commands = self._render_cache.get(key)
+            if commands is not None:
+                self._render_cache.move_to_end(key)
+                self.hits += 1
+                return commands
+            self.misses += 1
+        commands = preset.render(values)
+        with self._lock:
+            self._render_cache[key] = commands
+            if len(self._render_cache) > self._render_cache_size:
+                self._render_cache.popitem(last=False)
+        return commands
+
+    def record(self, name: str, seconds: float) -> None:
+        """记录一次预设应用的耗时"""
+        with self._lock:
+            samples = self._latency.get(name)
+            if samples is None:
+                samples = self._latency[name] = deque(maxlen=512)
+            samples.append(seconds)
+            self._calls[name] = self._calls.get(name, 0) + 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            latency = {}
+            for name, samples in self._latency.items():
+                ordered = sorted(samples)
+                latency[name] = {
+                    "calls": self._calls[name],
+                    "mean_ms": round(sum(ordered) / len(ordered) * 1000, 2),
+                    "p50_ms": round(ordered[len(ordered) // 2] * 1000, 2),
+                    "p95_ms": round(ordered[min(int(len(ordered) * 0.95), len(ordered) - 1)] * 1000, 2),
+                    "max_ms": round(ordered[-1] * 1000, 2),
+                }
+            return {
+                "directory": self.directory,
+                "presets": len(self._presets),
+                "reloads": self.reloads,
+                "errors": dict(self.errors),
+                "render_cache": {"size": len(self._render_cache), "hits": self.hits, "misses": self.misses},
+                "latency": latency,
+            }
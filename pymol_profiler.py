@@ -0,0 +1,256 @@
+"""
+PyMOL MCP 采样分析器
+
+服务器变慢时，GET /admin/profile 在运行中的服务器上采样N秒，回答时间花在哪里：
+事件循环、JSON序列化、XML-RPC编码/解码，还是等待PyMOL返回。
+
+    - 一个后台线程按固定间隔用 sys._current_frames() 读取所有线程的调用栈，
+      不插桩、不修改被分析的代码，开销只与采样频率和线程数有关（每次采样只持有
+      GIL 读取栈帧），结束时报告采样线程自身占用的CPU时间
+    - 同时在事件循环中运行一个定时协程，测量事件循环延迟（定时器实际唤醒时间
+      与预定时间之差）
+    - 结果为折叠栈（collapsed stacks，可直接交给 flamegraph.pl 或 speedscope
+      生成火焰图），或按类别汇总的JSON
+
+叶子帧为等待函数的线程记为空闲（事件循环等待 I/O、线程池等待任务），默认不计入
+折叠栈；其余调用栈从叶子帧向上匹配 _RULES，第一个匹配的规则决定类别。
+"""
+
+import asyncio
+import math
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+# 单次分析的最长时间（秒）和最小采样间隔（秒）
+MAX_SECONDS = 60.0
+MIN_INTERVAL = 0.001
+
+# 每个调用栈最多保留的帧数（从叶子帧算起）
+MAX_DEPTH = 96
+
+CATEGORIES = ("pymol_wait", "xmlrpc", "json", "event_loop", "other", "idle")
+
+# 叶子帧为这些 (文件路径片段, 函数名集合) 时线程处于空闲等待；线程池的空闲线程阻塞在
+# C 实现的队列上，叶子帧就是 _worker
+_IDLE_LEAVES: Tuple[Tuple[str, frozenset], ...] = (
+    ("selectors.py", frozenset({"select"})),
+    ("threading.py", frozenset({"wait"})),
+    ("queue.py", frozenset({"get"})),
+    ("concurrent/futures/thread.py", frozenset({"_worker"})),
+)
+
+# (类别, 文件路径片段, 函数名集合或 None 表示任意函数, 栈中必须出现的文件路径片段或 None)
+_RULES: Tuple[Tuple[str, str, Optional[frozenset], Optional[str]], ...] = (
+    # XML-RPC 请求中的套接字读写即等待PyMOL执行命令并返回
+    ("pymol_wait", "socket.py", None, "xmlrpc/client.py"),
+    ("pymol_wait", "http/client.py", frozenset({"getresponse", "begin", "_read_status", "readline"}),
+     "xmlrpc/client.py"),
+    ("xmlrpc", "xmlrpc/client.py", None, None),
+    ("xmlrpc", "gzip.py", None, "xmlrpc/client.py"),
+    ("json", "json/", None, None),
+    ("json", "pydantic", None, None),
+)
+
+
+def _short_filename(filename: str) -> str:
+    """site-packages 和标准库中的文件只保留包内路径"""
+    filename = filename.replace("\\", "/")
+    for marker in ("site-packages/", "dist-packages/"):
+        if marker in filename:
+            return filename.rsplit(marker, 1)[1]
+    match = re.search(r"/lib/python\d+\.\d+/(.+)$", filename)
+    if match:
+        return match.group(1)
+    return os.path.basename(filename)
+
+
+def _thread_label(name: str) -> str:
+    # 线程池的线程名带编号（asyncio_3、ThreadPoolExecutor-0_2），合并为一类
+    return re.sub(r"[-_]\d+$", "", re.sub(r"[-_]\d+$", "", name)) or name
+
+
+def categorize(stack: List[Tuple[str, str]], loop_thread: bool) -> str:
+    """stack 为从根到叶子的 (文件, 函数) 列表"""
+    if stack:
+        leaf_file, leaf_func = stack[-1]
+        if any(fragment in leaf_file and leaf_func in funcs for fragment, funcs in _IDLE_LEAVES):
+            return "idle"
+    files = "\n".join(filename for filename, _ in stack)
+    for filename, func in reversed(stack):
+        for category, fragment, funcs, requires in _RULES:
+            if fragment in filename and (funcs is None or func in funcs) and (
+                    requires is None or requires in files):
+                return category
+    return "event_loop" if loop_thread else "other"
+
+
+class SamplingProfiler:
+    """在后台线程中定时采样所有线程的调用栈"""
+
+    def __init__(self, interval: float = 0.01, loop_thread_id: Optional[int] = None,
+                 include_idle: bool = False):
+        self.interval = max(interval, MIN_INTERVAL)
+        self.loop_thread_id = loop_thread_id
+        self.include_idle = include_idle
+        self.stacks: Counter = Counter()
+        self.categories: Counter = Counter()
+        self.threads: Counter = Counter()
+        self.samples = 0
+        self.sampler_cpu_s = 0.0
+        self.elapsed_s = 0.0
+        self._started = 0.0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._labels: Dict[Any, str] = {}
+        self._stack_cache: Dict[Any, Tuple[str, str]] = {}
+
+    def _label(self, code) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            label = self._labels[code] = f"{code.co_name} ({_short_filename(code.co_filename)})"
+        return label
+
+    def _sample(self) -> None:
+        me = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            stack = []
+            while frame is not None and len(stack) < MAX_DEPTH:
+                stack.append(frame.f_code)
+                frame = frame.f_back
+            stack.reverse()
+            loop_thread = ident == self.loop_thread_id
+            key = (tuple(stack), loop_thread)
+            cached = self._stack_cache.get(key)
+            if cached is None:
+                # 同一调用栈会被反复采到，类别和折叠后的帧名只计算一次
+                category = categorize([(code.co_filename.replace("\\", "/"), code.co_name) for code in stack],
+                                      loop_thread)
+                cached = self._stack_cache[key] = (category, ";".join(self._label(code) for code in stack))
+            category, frames = cached
+            thread = "event-loop" if loop_thread else _thread_label(names.get(ident, str(ident)))
+            self.categories[category] += 1
+            self.threads[(thread, category)] += 1
+            if category != "idle" or self.include_idle:
+                self.stacks[f"{thread};{frames}"] += 1
+        self.samples += 1
+
+    def _run(self) -> None:
+        cpu_start = time.thread_time()
+        next_sample = time.perf_counter()
+        while not self._stop.is_set():
+            self._sample()
+            next_sample += self.interval
+            delay = next_sample - time.perf_counter()
+            if delay < 0:
+                # 采样跟不上（线程很多或GIL竞争激烈）时不补采，避免加重负载
+                next_sample = time.perf_counter()
+                delay = 0
+            self._stop.wait(delay)
+        self.sampler_cpu_s = time.thread_time() - cpu_start
+
+    def start(self) -> None:
+        self._started = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name="pymol-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.elapsed_s = time.perf_counter() - self._started
+
+    def collapsed(self) -> str:
+        """折叠栈格式：每行 "线程;帧;帧... 次数"，根帧在前"""
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def summary(self, top: int = 20) -> Dict[str, Any]:
+        total = sum(self.categories.values()) or 1
+        busy = total - self.categories.get("idle", 0)
+        threads: Dict[str, Dict[str, int]] = {}
+        for (thread, category), count in sorted(self.threads.items()):
+            threads.setdefault(thread, {})[category] = count
+        return {
+            "samples": self.samples,
+            "interval_ms": round(self.interval * 1000, 2),
+            "elapsed_s": round(self.elapsed_s, 2),
+            "sampler_cpu_s": round(self.sampler_cpu_s, 3),
+            "overhead_pct": round(self.sampler_cpu_s / self.elapsed_s * 100, 2) if self.elapsed_s else None,
+            # 各类别占非空闲线程样本的比例
+            "busy_share": {category: round(self.categories.get(category, 0) / busy, 3) if busy else 0.0
+                           for category in CATEGORIES if category != "idle"},
+            "thread_samples": dict(self.categories),
+            "threads": threads,
+            "top_stacks": [{"stack": stack.split(";"), "samples": count}
+                           for stack, count in self.stacks.most_common(top)],
+        }
+
+
+class LoopLagMonitor:
+    """测量事件循环延迟：定时 sleep，记录实际唤醒比预定晚了多少"""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.lags: List[float] = []
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self.lags.append(max(loop.time() - expected, 0.0))
+
+    def start(self) -> None:
+        self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    def summary(self) -> Dict[str, Any]:
+        lags = sorted(self.lags)
+        if not lags:
+            return {"samples": 0}
+
+        def quantile(q: float) -> float:
+            return round(lags[min(int(len(lags) * q), len(lags) - 1)] * 1000, 2)
+
+        return {
+            "samples": len(lags),
+            "interval_ms": round(self.interval * 1000, 2),
+            "p50_ms": quantile(0.5),
+            "p99_ms": quantile(0.99),
+            "max_ms": round(lags[-1] * 1000, 2),
+            # 延迟超过 50ms 的次数：此期间所有SSE推送和新请求都被推迟
+            "stalls_over_50ms": sum(1 for lag in lags if lag > 0.05),
+        }
+
+
+async def profile(seconds: float, interval: float = 0.01, include_idle: bool = False) -> Tuple[SamplingProfiler,
+                                                                                                  LoopLagMonitor]:
+    """在当前事件循环所在的进程中采样 seconds 秒"""
+    if not (math.isfinite(seconds) and math.isfinite(interval)):
+        raise ValueError("seconds 和 interval 必须是有限的数")
+    seconds = min(max(seconds, 0.1), MAX_SECONDS)
+    profiler = SamplingProfiler(interval, threading.get_ident(), include_idle)
+    monitor = LoopLagMonitor()
+    profiler.start()
+    monitor.start()
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        await monitor.stop()
+        profiler.stop()
+    return profiler, monitor
@@ -0,0 +1,145 @@
+"""
+PyMOL MCP 渐进式渲染
+
+pymol_png 传入 progressive: true 时，先用 OpenGL 绘制一张低分辨率预览，
+随工具结果立即返回（不到一秒）；光线追踪的完整图像在后台渲染，完成后
+保存到指定文件，并以 pymol://render/<id> 资源更新通知和日志通知推送给
+发起调用的会话，读取该资源得到PNG。
+
+每个PyMOL后端最多一个进行中的精细渲染：新的渲染请求、或者在渲染完成前
+修改场景的工具调用都会取消它。尚未开始的渲染直接丢弃；已经在光线追踪的
+渲染无法中途打断，但结果会被丢弃，不会写出与当前场景不符的图像。
+"""
+
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Optional, Tuple
+
+RENDER_URI_PREFIX = "pymol://render/"
+
+
+def preview_size(width: int, height: int, max_side: int) -> Tuple[int, int]:
+    """按比例缩小到最长边不超过 max_side 的预览尺寸"""
+    scale = min(max_side / max(width, height, 1), 1.0)
+    return max(int(width * scale), 1), max(int(height * scale), 1)
+
+
+@dataclass
+class RenderJob:
+    filename: str
+    width: int
+    height: int
+    dpi: float = -1
+    id: str = field(default_factory=lambda: uuid.uuid4().hex[:12])
+    # pending -> running -> done / failed；任何未完成的阶段都可能变为 cancelled
+    state: str = "pending"
+    created: float = field(default_factory=time.time)
+    finished: Optional[float] = None
+    image: Optional[bytes] = field(default=None, repr=False)
+    error: Optional[str] = None
+
+    @property
+    def uri(self) -> str:
+        return RENDER_URI_PREFIX + self.id
+
+    @property
+    def cancelled(self) -> bool:
+        return self.state == "cancelled"
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            "render_id": self.id,
+            "uri": self.uri,
+            "state": self.state,
+            "filename": self.filename,
+            "width": self.width,
+            "height": self.height,
+            "elapsed_ms": round((self.finished - self.created) * 1000) if self.finished else None,
+            "error": self.error,
+        }
+
+
+class ProgressiveRenderer:
+    """按后端管理后台精细渲染
+
+    refine(job) 在后台线程中执行光线追踪并返回PNG数据（被取消时返回 None），
+    notify(job) 在渲染结束（完成、失败或取消）后调用。grace 秒内的取消不会
+    占用PyMOL：在此期间修改场景的调用直接丢弃尚未开始的渲染。
+    """
+
+    def __init__(self, grace: float = 0.2, keep: int = 8):
+        self.grace = grace
+        self.keep = keep
+        self._lock = threading.Lock()
+        self._active: Dict[Any, RenderJob] = {}
+        self._jobs: "OrderedDict[str, RenderJob]" = OrderedDict()
+        self.counts = {"submitted": 0, "done": 0, "failed": 0, "cancelled": 0}
+        self.last_refine_ms: Optional[float] = None
+
+    def submit(self, key: Any, job: RenderJob, refine: Callable[[RenderJob], Optional[bytes]],
+               notify: Optional[Callable[[RenderJob], None]] = None) -> RenderJob:
+        self.cancel(key, "被新的渲染请求取代")
+        with self._lock:
+            self._active[key] = job
+            self._jobs[job.id] = job
+            while len(self._jobs) > self.keep:
+                # 只保留最近的结果（PNG数据在内存中）
+                self._jobs.popitem(last=False)
+            self.counts["submitted"] += 1
+        threading.Thread(target=self._run, args=(key, job, refine, notify),
+                         name=f"pymol-render-{job.id}", daemon=True).start()
+        return job
+
+    def _run(self, key: Any, job: RenderJob, refine, notify) -> None:
+        time.sleep(self.grace)
+        with self._lock:
+            cancelled = job.cancelled
+            if not cancelled:
+                job.state = "running"
+        if cancelled:
+            return self._finish(key, job, notify)
+        start = time.perf_counter()
+        image = error = None
+        try:
+            image = refine(job)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        with self._lock:
+            if not job.cancelled:
+                if error is not None:
+                    job.state, job.error = "failed", error
+                else:
+                    job.state, job.image = "done", image
+                    self.last_refine_ms = round((time.perf_counter() - start) * 1000, 1)
+        self._finish(key, job, notify)
+
+    def _finish(self, key: Any, job: RenderJob, notify) -> None:
+        with self._lock:
+            job.finished = time.time()
+            self.counts[job.state] += 1
+            if self._active.get(key) is job:
+                del self._active[key]
+        if notify is not None:
+            notify(job)
+
+    def cancel(self, key: Any, reason: str) -> Optional[RenderJob]:
+        """取消后端 key 上进行中的渲染，返回被取消的任务"""
+        with self._lock:
+            job = self._active.get(key)
+            if job is None or job.state not in ("pending", "running"):
+                return None
+            job.state = "cancelled"
+            job.error = reason
+            return job
+
+    def get(self, job_id: str) -> Optional[RenderJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self.counts, active=len(self._active), grace_s=self.grace,
+                        last_refine_ms=self.last_refine_ms)
@@ -1,17 +1,21 @@
 """
 PyMOL RPC Launcher Plugin
 =========================
-一键启动 XML-RPC 服务器，供 MCP 外部连接使用。
+一键启动 XML-RPC 服务器，供 MCP 外部连接使用；
+或者直接在 PyMOL 进程内启动 MCP 服务器，不经过 XML-RPC。
 
 安装方法:
 1. PyMOL 菜单: Plugin -> Plugin Manager -> Install New Plugin
 2. 选择此文件 (pymol_rpc_launcher.py)
 3. 安装后在 Plugin 菜单中点击 "Launch RPC Server" 即可
+4. 或点击 "Start MCP Server (in-process)"，需要PyMOL的Python环境中能导入
+   pymol_mcp_server（安装本项目，或把环境变量 PYMOL_MCP_HOME 设为其所在目录）
 
 作者: pymol-ai-mcp
 版本: 1.0.0
 """
 
+import os
 import sys
 import tkinter as tk
 from tkinter import messagebox
@@ -26,7 +30,68 @@ def __init_plugin__(app=None):
     
     # 添加菜单项
     addmenuitemqt('Launch RPC Server', launch_rpc)
+    addmenuitemqt('Start MCP Server (in-process)', start_inprocess_mcp_server)
     print("[RPC Plugin] Installed: Plugin -> Launch RPC Server")
+    print("[RPC Plugin] Installed: Plugin -> Start MCP Server (in-process)")
+
+    # 也可以在PyMOL命令行中输入 start_mcp_server [port]
+    from pymol import cmd
+    cmd.extend("start_mcp_server", lambda port=MCP_PORT: start_inprocess_mcp_server(int(port)))
+
+
+# 进程内MCP服务器的监听地址；每个PyMOL进程只启动一个
+MCP_HOST = "127.0.0.1"
+MCP_PORT = 3000
+_mcp_server = None
+
+
+def start_inprocess_mcp_server(port=MCP_PORT):
+    """在PyMOL进程内启动MCP服务器，工具调用直接调用 pymol.cmd，不经过XML-RPC"""
+    global _mcp_server
+    if _mcp_server is not None and _mcp_server.running:
+        show_info_dialog(
+            "MCP Server Already Running",
+            f"In-process MCP server is already running!\n\n"
+            f"SSE endpoint: {_mcp_server.url}/sse\n"
+            f"HTTP endpoint: {_mcp_server.url}/mcp"
+        )
+        return
+
+    home = os.environ.get("PYMOL_MCP_HOME")
+    if home and home not in sys.path:
+        sys.path.insert(0, home)
+    try:
+        import pymol_inprocess
+    except ImportError as e:
+        show_error_dialog(
+            "Import Error",
+            f"Failed to import the MCP server:\n{e}\n\n"
+            f"Install pymol-ai-controller into PyMOL's Python, or set\n"
+            f"PYMOL_MCP_HOME to the directory containing pymol_mcp_server.py"
+        )
+        return
+
+    try:
+        server = pymol_inprocess.InProcessServer(MCP_HOST, port)
+        server.start()
+    except Exception as e:
+        show_error_dialog("Error", f"Failed to start in-process MCP server:\n{e}")
+        return
+    _mcp_server = server
+
+    print("=" * 60)
+    print("[MCP] In-process MCP server is running (no XML-RPC)")
+    print(f"[MCP] SSE endpoint:  {server.url}/sse")
+    print(f"[MCP] HTTP endpoint: {server.url}/mcp")
+    print("=" * 60)
+    show_info_dialog(
+        "MCP Server Started",
+        f"In-process MCP server started successfully!\n\n"
+        f"SSE endpoint: {server.url}/sse\n"
+        f"HTTP endpoint: {server.url}/mcp\n\n"
+        f"Configure your MCP client with the URL above.\n"
+        f"No separate pymol_mcp_server.py process is needed."
+    )
 
 
 def start_rpc_server():
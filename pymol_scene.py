@@ -0,0 +1,209 @@
+"""
+PyMOL MCP 场景资源与变化通知
+
+把PyMOL场景作为可订阅的MCP资源提供给客户端，代替轮询 pymol_get_names /
+pymol_count_atoms：
+
+    pymol://scene           对象列表和视图（含版本号和最近一次变化）
+    pymol://scene/objects   对象名称、类型、状态数、原子数、是否显示
+    pymol://scene/view      视图矩阵
+
+有客户端订阅时，SceneWatcher 定期取一次轻量的场景快照（PyMOL端一次RPC），
+与上一次比较；只有对象增删、状态数或原子数变化、显示开关或视图变化时，
+才向订阅了受影响资源的会话推送 resources/updated 通知。人在PyMOL界面中的
+操作和其他会话的修改都会被发现。
+"""
+
+import asyncio
+import contextvars
+import time
+import weakref
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Optional, Set
+
+SCENE_URI = "pymol://scene"
+OBJECTS_URI = "pymol://scene/objects"
+VIEW_URI = "pymol://scene/view"
+
+RESOURCES = {
+    SCENE_URI: ("scene", "PyMOL场景：对象列表和视图，含版本号和最近一次变化"),
+    OBJECTS_URI: ("scene-objects", "PyMOL对象：名称、类型、状态数、原子数、是否显示"),
+    VIEW_URI: ("scene-view", "PyMOL视图矩阵（18个数）"),
+}
+
+# 比较视图时保留的小数位，忽略浮点噪声
+_VIEW_DIGITS = 2
+
+
+def snapshot_scene(cmd) -> Dict[str, Any]:
+    """逐项调用 cmd 取得场景快照（PyMOL端没有 mcp_scene_snapshot 时的回退）"""
+    enabled = set(cmd.get_names("objects", 1))
+    objects = []
+    for name in cmd.get_names("objects", 0):
+        objects.append({
+            "name": name,
+            "type": cmd.get_type(name),
+            "states": cmd.count_states(name),
+            "atoms": cmd.count_atoms(name),
+            "enabled": name in enabled,
+        })
+    return {"objects": objects, "view": list(cmd.get_view())}
+
+
+def diff_scenes(old: Dict[str, Any], new: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """比较两个快照，没有变化时返回 None"""
+    before = {obj["name"]: obj for obj in old["objects"]}
+    after = {obj["name"]: obj for obj in new["objects"]}
+    changes: Dict[str, Any] = {}
+    added = [name for name in after if name not in before]
+    removed = [name for name in before if name not in after]
+    if added:
+        changes["added"] = added
+    if removed:
+        changes["removed"] = removed
+    for key in ("states", "atoms", "enabled"):
+        changed = {name: [before[name][key], obj[key]] for name, obj in after.items()
+                   if name in before and before[name][key] != obj[key]}
+        if changed:
+            changes[key] = changed
+    if [round(v, _VIEW_DIGITS) for v in old["view"]] != [round(v, _VIEW_DIGITS) for v in new["view"]]:
+        changes["view"] = True
+    return changes or None
+
+
+def affected_uris(changes: Dict[str, Any]) -> Set[str]:
+    uris = {SCENE_URI}
+    if set(changes) - {"view"}:
+        uris.add(OBJECTS_URI)
+    if "view" in changes:
+        uris.add(VIEW_URI)
+    return uris
+
+
+@dataclass
+class SceneState:
+    """一个PyMOL后端最近一次的快照；version 在每次变化时加一"""
+    snapshot: Dict[str, Any]
+    version: int = 0
+    changes: Optional[Dict[str, Any]] = None
+    changed_at: Optional[float] = None
+
+    def update(self, snapshot: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        changes = diff_scenes(self.snapshot, snapshot)
+        self.snapshot = snapshot
+        if changes:
+            self.version += 1
+            self.changes = changes
+            self.changed_at = time.time()
+        return changes
+
+
+def resource_body(uri: str, snapshot: Dict[str, Any], state: Optional[SceneState]) -> Dict[str, Any]:
+    """资源内容：当前快照的相应部分加上版本号"""
+    body: Dict[str, Any] = {"version": state.version if state else 0}
+    if uri in (SCENE_URI, OBJECTS_URI):
+        body["objects"] = snapshot["objects"]
+    if uri in (SCENE_URI, VIEW_URI):
+        body["view"] = snapshot["view"]
+    if uri == SCENE_URI and state is not None:
+        body["changes"] = state.changes
+        body["changed_at"] = state.changed_at
+    return body
+
+
+class SceneWatcher:
+    """按订阅定期比较场景并推送变化通知
+
+    resolve(session_id) 返回会话使用的PyMOL连接（没有时为 None）；
+    snapshot(conn) 在工作线程中取得快照；连接的 scene 属性保存上一次的 SceneState。
+    订阅按会话对象弱引用保存，会话结束后自动消失。
+    """
+
+    def __init__(self, resolve: Callable[[str], Any], snapshot: Callable[[Any], Dict[str, Any]],
+                 interval: float = 2.0):
+        self.resolve = resolve
+        self.snapshot = snapshot
+        self.interval = interval
+        self._subscribers: "weakref.WeakKeyDictionary[Any, tuple]" = weakref.WeakKeyDictionary()
+        self._task: Optional[asyncio.Task] = None
+        self.polls = 0
+        self.notifications = 0
+        self.errors = 0
+        self.last_poll_ms: Optional[float] = None
+
+    async def subscribe(self, session, session_id: str, uri: str) -> None:
+        if uri not in RESOURCES:
+            raise ValueError(f"未知资源: {uri}")
+        entry = self._subscribers.get(session)
+        if entry is None:
+            entry = self._subscribers[session] = (session_id, set())
+        entry[1].add(uri)
+        conn = self.resolve(session_id)
+        if conn is not None and conn.scene is None:
+            # 订阅时先取基准快照，之后的变化都能被发现
+            try:
+                conn.scene = SceneState(await asyncio.to_thread(self.snapshot, conn))
+            except Exception:
+                self.errors += 1
+        if self.interval > 0 and (self._task is None or self._task.done()):
+            # 在空的上下文中创建任务：否则任务会复制当前请求的上下文，
+            # 一直持有这次订阅的会话，弱引用也就不会消失
+            loop = asyncio.get_running_loop()
+            self._task = contextvars.Context().run(loop.create_task, self._run())
+
+    def unsubscribe(self, session, uri: str) -> None:
+        entry = self._subscribers.get(session)
+        if entry is not None:
+            entry[1].discard(uri)
+            if not entry[1]:
+                del self._subscribers[session]
+
+    async def _run(self) -> None:
+        while len(self._subscribers):
+            await asyncio.sleep(self.interval)
+            await self.poll()
+
+    async def poll(self) -> None:
+        """对有订阅的每个后端取一次快照，有变化时通知订阅者"""
+        groups: Dict[int, tuple] = {}
+        for session, (session_id, uris) in list(self._subscribers.items()):
+            conn = self.resolve(session_id)
+            if conn is not None:
+                groups.setdefault(id(conn), (conn, []))[1].append((session, uris))
+
+        start = time.perf_counter()
+        for conn, subscribers in groups.values():
+            try:
+                snapshot = await asyncio.to_thread(self.snapshot, conn)
+            except Exception:
+                self.errors += 1
+                continue
+            if conn.scene is None:
+                conn.scene = SceneState(snapshot)
+                continue
+            changes = conn.scene.update(snapshot)
+            if not changes:
+                continue
+            uris = affected_uris(changes)
+            for session, subscribed in subscribers:
+                for uri in sorted(subscribed & uris):
+                    try:
+                        await session.send_resource_updated(uri)
+                        self.notifications += 1
+                    except Exception:
+                        # 会话已断开
+                        self._subscribers.pop(session, None)
+                        break
+        self.polls += 1
+        self.last_poll_ms = round((time.perf_counter() - start) * 1000, 2)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "interval_s": self.interval,
+            "subscribers": len(self._subscribers),
+            "subscriptions": sum(len(uris) for _, uris in self._subscribers.values()),
+            "polls": self.polls,
+            "notifications": self.notifications,
+            "errors": self.errors,
+            "last_poll_ms": self.last_poll_ms,
+        }
@@ -0,0 +1,111 @@
+"""
+PyMOL MCP 选择表达式缓存
+
+智能体经常把同一个复杂选择（如 "(chain A and resi 100-200) and not solvent"）
+反复传给 pymol_color、pymol_show、pymol_zoom、pymol_count_atoms，PyMOL 每次都要
+重新解析并在所有原子上求值。这里统计表达式的使用次数，第二次使用时把它物化为
+隐藏的命名选择（名称以下划线开头，不出现在对象面板中），之后的调用改为引用该名称。
+
+命名选择是创建时的快照，因此：
+
+    - 加载、删除、修改坐标、创建命名选择等调用之后整体失效（见 invalidate）
+    - 含有随显示状态变化的关键字（rep、color、enabled、visible、sele 等）的表达式不缓存
+    - 超过 max_age 秒的条目在下次使用时重新物化，以跟上在PyMOL界面中的手动修改
+
+隐藏选择的名称循环使用，PyMOL端最多同时保留 max_entries 个。
+"""
+
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+# 出现这些词的表达式结果会随显示状态或鼠标选择变化，不能缓存
+VOLATILE_TOKENS = frozenset({
+    "rep", "color", "enabled", "e.", "visible", "v.",
+    "sele", "pk1", "pk2", "pk3", "pk4", "pkmol", "pkresi", "pkchain", "pkobject",
+})
+
+_TOKEN_RE = re.compile(r"[^\s()]+")
+
+
+def cacheable(expression: str) -> bool:
+    """判断表达式是否值得缓存：不是单个名称，且不含随显示状态变化的关键字"""
+    tokens = _TOKEN_RE.findall(expression.lower())
+    if len(tokens) < 2:
+        return False
+    return not any(token in VOLATILE_TOKENS for token in tokens)
+
+
+class SelectionCache:
+    """单个PyMOL后端的选择表达式缓存"""
+
+    def __init__(self, max_entries: int = 32, min_uses: int = 2, max_age: float = 60.0,
+                 prefix: str = "_mcp_sel", tracked: int = 1024):
+        self.max_entries = max_entries
+        self.min_uses = min_uses
+        self.max_age = max_age
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        # 表达式 -> (隐藏选择名称, 物化时间)
+        self._entries: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        # 表达式 -> 使用次数（只保留最近的 tracked 个）
+        self._uses: "OrderedDict[str, int]" = OrderedDict()
+        self._tracked = tracked
+        self._free = [f"{prefix}{i}" for i in range(max_entries - 1, -1, -1)]
+        self.hits = 0
+        self.materialized = 0
+        self.invalidations = 0
+
+    def resolve(self, cmd, expression: str) -> str:
+        """返回调用时应使用的选择：已缓存的隐藏选择名称，或原表达式"""
+        expression = expression.strip()
+        if self.max_entries <= 0 or not cacheable(expression):
+            return expression
+        with self._lock:
+            entry = self._entries.get(expression)
+            if entry is not None and time.monotonic() - entry[1] <= self.max_age:
+                self._entries.move_to_end(expression)
+                self.hits += 1
+                return entry[0]
+            uses = self._uses.pop(expression, 0) + 1
+            self._uses[expression] = uses
+            if len(self._uses) > self._tracked:
+                self._uses.popitem(last=False)
+            if uses < self.min_uses:
+                return expression
+
+            if entry is not None:
+                sel_name = self._entries.pop(expression)[0]
+            elif self._free:
+                sel_name = self._free.pop()
+            else:
+                sel_name = self._entries.popitem(last=False)[1][0]
+            try:
+                cmd.select(sel_name, expression, 0)
+            except Exception:
+                # 表达式无效时交给真正的调用报错
+                self._free.append(sel_name)
+                return expression
+            self._entries[expression] = (sel_name, time.monotonic())
+            self.materialized += 1
+            return sel_name
+
+    def invalidate(self) -> None:
+        """对象、坐标或命名选择变化后丢弃所有缓存（隐藏选择名称留待复用）"""
+        with self._lock:
+            if not self._entries:
+                return
+            self._free.extend(name for name, _ in reversed(self._entries.values()))
+            self._entries.clear()
+            self.invalidations += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "materialized": self.materialized,
+                "invalidations": self.invalidations,
+            }
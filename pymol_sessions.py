@@ -0,0 +1,192 @@
+"""
+PyMOL MCP 会话状态存储
+
+会话记录（创建时间、最近活动、调用次数）不放在服务器进程的全局变量里，
+而是通过 SessionStore 接口存取，这样多个 uvicorn worker 进程可以共享同一份
+记录：
+
+    - MemorySessionStore:  进程内字典，单进程默认使用
+    - SQLiteSessionStore:  本地SQLite文件，多个worker进程共享
+
+用 open_session_store("memory") 或 open_session_store("sqlite:/path/sessions.db") 创建。
+
+工作进程绑定、限速令牌桶、选择缓存等状态与本进程中的PyMOL连接或事件循环
+绑定，无法在进程间共享，仍由各自的模块在进程内维护。因此N个worker进程时
+按会话的限速实际为N倍，服务器在多worker时要求关闭限速（--rate-limit 0），
+由前面的负载均衡或网关限速；托管的PyMOL进程池也不能与多worker同时使用。
+"""
+
+import abc
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+
+class SessionStore(abc.ABC):
+    """会话记录存储接口"""
+
+    # 超过该时长（秒）无活动的会话会被清理
+    max_idle: float = 24 * 3600
+
+    @abc.abstractmethod
+    def touch(self, session_id: str, tool: Optional[str] = None) -> None:
+        """记录一次会话活动；tool 不为空时调用次数加一"""
+
+    @abc.abstractmethod
+    def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """返回会话记录，不存在时返回 None"""
+
+    @abc.abstractmethod
+    def delete(self, session_id: str) -> None:
+        """删除会话记录"""
+
+    @abc.abstractmethod
+    def list(self) -> List[Dict[str, Any]]:
+        """返回所有会话记录，按最近活动时间倒序"""
+
+    @abc.abstractmethod
+    def prune(self) -> int:
+        """清理空闲超时的会话，返回清理数量"""
+
+    def close(self) -> None:
+        pass
+
+
+class MemorySessionStore(SessionStore):
+    """进程内会话存储"""
+
+    def __init__(self, max_idle: Optional[float] = None):
+        if max_idle is not None:
+            self.max_idle = max_idle
+        self._sessions: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._touches = 0
+
+    def _record(self, session_id: str, now: float) -> Dict[str, Any]:
+        record = self._sessions.get(session_id)
+        if record is None:
+            record = {"session_id": session_id, "created": now, "last_seen": now, "calls": 0}
+            self._sessions[session_id] = record
+        return record
+
+    def touch(self, session_id: str, tool: Optional[str] = None) -> None:
+        now = time.time()
+        with self._lock:
+            record = self._record(session_id, now)
+            record["last_seen"] = now
+            if tool:
+                record["calls"] += 1
+            self._touches += 1
+            prune = self._touches % 256 == 0
+        if prune:
+            self.prune()
+
+    def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            record = self._sessions.get(session_id)
+            return dict(record) if record else None
+
+    def delete(self, session_id: str) -> None:
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def list(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            records = [dict(r) for r in self._sessions.values()]
+        return sorted(records, key=lambda r: r["last_seen"], reverse=True)
+
+    def prune(self) -> int:
+        cutoff = time.time() - self.max_idle
+        with self._lock:
+            stale = [sid for sid, r in self._sessions.items() if r["last_seen"] < cutoff]
+            for sid in stale:
+                del self._sessions[sid]
+        return len(stale)
+
+
+class SQLiteSessionStore(SessionStore):
+    """基于本地SQLite文件的会话存储，可被多个worker进程共享"""
+
+    def __init__(self, path: str, max_idle: Optional[float] = None):
+        import sqlite3
+
+        if max_idle is not None:
+            self.max_idle = max_idle
+        self.path = path
+        self._lock = threading.Lock()
+        self._touches = 0
+        self._db = sqlite3.connect(path, timeout=10, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            " session_id TEXT PRIMARY KEY,"
+            " created REAL NOT NULL,"
+            " last_seen REAL NOT NULL,"
+            " calls INTEGER NOT NULL DEFAULT 0)"
+        )
+
+    def _execute(self, sql: str, params=()):
+        with self._lock:
+            return self._db.execute(sql, params).fetchall()
+
+    @staticmethod
+    def _row(row) -> Dict[str, Any]:
+        session_id, created, last_seen, calls = row
+        return {
+            "session_id": session_id,
+            "created": created,
+            "last_seen": last_seen,
+            "calls": calls,
+        }
+
+    def touch(self, session_id: str, tool: Optional[str] = None) -> None:
+        now = time.time()
+        calls = 1 if tool else 0
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO sessions (session_id, created, last_seen, calls) VALUES (?, ?, ?, ?)"
+                " ON CONFLICT(session_id) DO UPDATE SET last_seen = excluded.last_seen,"
+                " calls = calls + excluded.calls",
+                (session_id, now, now, calls),
+            )
+            self._touches += 1
+            prune = self._touches % 256 == 0
+        if prune:
+            self.prune()
+
+    def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        rows = self._execute(
+            "SELECT session_id, created, last_seen, calls FROM sessions WHERE session_id = ?",
+            (session_id,),
+        )
+        return self._row(rows[0]) if rows else None
+
+    def delete(self, session_id: str) -> None:
+        self._execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+
+    def list(self) -> List[Dict[str, Any]]:
+        rows = self._execute(
+            "SELECT session_id, created, last_seen, calls FROM sessions ORDER BY last_seen DESC"
+        )
+        return [self._row(row) for row in rows]
+
+    def prune(self) -> int:
+        with self._lock:
+            cursor = self._db.execute(
+                "DELETE FROM sessions WHERE last_seen < ?", (time.time() - self.max_idle,)
+            )
+            return cursor.rowcount
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+def open_session_store(spec: str = "memory") -> SessionStore:
+    """按描述创建会话存储: "memory" 或 "sqlite:<路径>" """
+    if spec == "memory":
+        return MemorySessionStore()
+    if spec.startswith("sqlite:"):
+        return SQLiteSessionStore(spec[len("sqlite:"):])
+    raise ValueError(f"未知的会话存储: {spec}（可用: memory, sqlite:<路径>）")
@@ -0,0 +1,366 @@
+"""
+PyMOL MCP 浸泡测试（长时间负载下的资源泄漏检测）
+
+在本进程中启动模拟PyMOL后端（pymol_fake）和MCP服务器，由独立的负载进程
+反复打开、使用、关闭成千上万个 SSE 会话并发送混合的工具调用，同时定期采样
+服务器进程的：
+
+    - 常驻内存（RSS）和打开的文件描述符数
+    - 事件循环中的 asyncio 任务数和线程数
+    - 与会话相关的对象：ServerSession 实例、SSE传输中的会话、会话存储记录、
+      限速令牌桶、场景订阅
+
+负载停止并稳定后再与负载开始前的空闲状态比较，并按类型统计增长的对象数
+（每个会话泄漏的对象）。资源持续增长时以退出码 1 结束：
+
+    python pymol_soak.py --duration 3600 --clients 8
+    python pymol_soak.py --duration 300 --config '{"coalesce_window_ms": 20}'
+
+负载进程与服务器进程分开，客户端自身的内存不会计入测量结果。
+"""
+
+import argparse
+import asyncio
+import gc
+import json
+import multiprocessing
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# 负载中使用的复杂选择表达式（会触发选择表达式缓存）
+_SELECTIONS = ["all", "chain A", "(chain A and resi 1-100) and not solvent",
+               "byres (chain B within 5 of chain A)", "polymer and not hydro"]
+
+# 在负载进程中被反复获取和删除的对象名，场景大小保持有界
+_OBJECTS = ["soak1", "soak2", "soak3"]
+
+
+def _mixed_call(rnd: random.Random) -> Tuple[str, Dict[str, Any]]:
+    """按生产流量的大致比例随机生成一次工具调用"""
+    roll = rnd.random()
+    selection = rnd.choice(_SELECTIONS)
+    if roll < 0.20:
+        return "pymol_get_selection_info", {"selection": selection}
+    if roll < 0.35:
+        return "pymol_count_atoms", {"selection": selection}
+    if roll < 0.50:
+        return "pymol_color", {"color": rnd.choice(["red", "marine", "grey70"]), "selection": selection}
+    if roll < 0.60:
+        return "pymol_show", {"representation": rnd.choice(["cartoon", "sticks", "surface"]),
+                              "selection": selection}
+    if roll < 0.70:
+        return rnd.choice([("pymol_zoom", {"selection": selection}), ("pymol_orient", {}),
+                           ("pymol_rotate", {"axis": "y", "angle": 30}), ("pymol_reset", {})])
+    if roll < 0.78:
+        return "pymol_do", {"command": "hide everything; show cartoon; color grey70, chain A\n"
+                                       "select pocket, byres (polymer within 5 of organic)"}
+    if roll < 0.84:
+        return "pymol_apply_preset", {"name": rnd.choice(["publication", "chain_rainbow", "ligand_pocket"])}
+    if roll < 0.90:
+        return "pymol_ray", {"width": 320, "height": 240}
+    if roll < 0.95:
+        return "pymol_fetch", {"code": "1abc", "name": rnd.choice(_OBJECTS)}
+    if roll < 0.98:
+        return "pymol_delete", {"name": rnd.choice(_OBJECTS)}
+    return "pymol_get_pdb", {"selection": selection}
+
+
+async def _client_loop(url: str, deadline: float, calls_per_session: int, subscribe_ratio: float,
+                       rnd: random.Random, totals: Dict[str, int]) -> None:
+    from mcp import ClientSession
+    from mcp.client.sse import sse_client
+
+    while time.monotonic() < deadline:
+        try:
+            async with sse_client(url + "/sse") as streams:
+                async with ClientSession(streams[0], streams[1]) as session:
+                    await session.initialize()
+                    if rnd.random() < subscribe_ratio:
+                        await session.subscribe_resource("pymol://scene")
+                    for _ in range(rnd.randint(1, calls_per_session)):
+                        name, arguments = _mixed_call(rnd)
+                        result = await session.call_tool(name, arguments)
+                        totals["calls"] += 1
+                        text = result.content[0].text if result.content else ""
+                        if result.isError or text.startswith("错误"):
+                            totals["errors"] += 1
+            totals["sessions"] += 1
+        except Exception:
+            totals["failures"] += 1
+
+
+def _load_process(url: str, seconds: float, clients: int, calls_per_session: int,
+                  subscribe_ratio: float, seed: int, counters) -> None:
+    """负载进程：clients 个并发客户端循环打开会话、调用工具、关闭会话"""
+    totals = {"sessions": 0, "calls": 0, "errors": 0, "failures": 0}
+
+    async def run():
+        deadline = time.monotonic() + seconds
+        reporter = asyncio.ensure_future(report())
+        await asyncio.gather(*(
+            _client_loop(url, deadline, calls_per_session, subscribe_ratio,
+                         random.Random(seed * 1000 + i), totals)
+            for i in range(clients)
+        ))
+        reporter.cancel()
+
+    reported = dict(totals)
+
+    def flush():
+        with counters.get_lock():
+            for i, key in enumerate(("sessions", "calls", "errors", "failures")):
+                counters[i] += totals[key] - reported[key]
+                reported[key] = totals[key]
+
+    async def report():
+        while True:
+            await asyncio.sleep(1)
+            flush()
+
+    asyncio.run(run())
+    flush()
+
+
+def _slope_per_hour(samples: List[Dict[str, Any]], key: str) -> float:
+    """最小二乘拟合 key 随时间的增长率（每小时）"""
+    points = [(s["t"], s[key]) for s in samples if s.get(key) is not None]
+    if len(points) < 3:
+        return 0.0
+    n = len(points)
+    mean_t = sum(t for t, _ in points) / n
+    mean_v = sum(v for _, v in points) / n
+    var = sum((t - mean_t) ** 2 for t, _ in points)
+    if var == 0:
+        return 0.0
+    return sum((t - mean_t) * (v - mean_v) for t, v in points) / var * 3600
+
+
+class SoakMonitor:
+    """在MCP服务器进程内采样资源占用"""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, server_module):
+        self.loop = loop
+        self.server = server_module
+        self.started = time.monotonic()
+
+    def _tasks(self) -> int:
+        async def count():
+            return len(asyncio.all_tasks())
+        return asyncio.run_coroutine_threadsafe(count(), self.loop).result(10)
+
+    @staticmethod
+    def _fds() -> Optional[int]:
+        for path in ("/proc/self/fd", "/dev/fd"):
+            try:
+                return len(os.listdir(path))
+            except OSError:
+                continue
+        return None
+
+    def _session_objects(self) -> Dict[str, int]:
+        from mcp.server.session import ServerSession
+        from mcp.server.sse import SseServerTransport
+        counts = {"server_sessions": 0, "sse_sessions": 0}
+        for obj in gc.get_objects():
+            if isinstance(obj, ServerSession):
+                counts["server_sessions"] += 1
+            elif isinstance(obj, SseServerTransport):
+                counts["sse_sessions"] += len(obj._read_stream_writers)
+        return counts
+
+    def sample(self) -> Dict[str, Any]:
+        from pymol_accounting import process_usage
+        usage = process_usage(os.getpid()) or {}
+        server = self.server
+        sample = {
+            "t": round(time.monotonic() - self.started, 1),
+            "rss_mb": round(usage["rss_mb"], 1) if usage.get("rss_mb") else None,
+            "fds": self._fds(),
+            "tasks": self._tasks(),
+            "threads": threading.active_count(),
+            "session_store": len(server.session_store.list()),
+            "rate_buckets": server.admission.stats()["rate_limit"]["sessions"] if server.admission else 0,
+            "scene_subscribers": server.scene_watcher.stats()["subscribers"] if server.scene_watcher else 0,
+        }
+        sample.update(self._session_objects())
+        return sample
+
+    @staticmethod
+    def type_counts() -> Counter:
+        gc.collect()
+        return Counter(type(obj).__qualname__ for obj in gc.get_objects())
+
+
+def _run_load(url: str, seconds: float, args, seed: int, counters,
+              on_sample: Optional[Callable[[], None]] = None) -> None:
+    ctx = multiprocessing.get_context("spawn")
+    procs = [
+        ctx.Process(target=_load_process, daemon=True,
+                    args=(url, seconds, args.clients, args.calls_per_session,
+                          args.subscribe_ratio, seed + i, counters))
+        for i in range(args.load_procs)
+    ]
+    for proc in procs:
+        proc.start()
+    next_sample = time.monotonic()
+    while any(proc.is_alive() for proc in procs):
+        if on_sample is not None and time.monotonic() >= next_sample:
+            on_sample()
+            next_sample += args.sample_interval
+        time.sleep(0.2)
+    for proc in procs:
+        proc.join()
+
+
+def _settle(monitor: SoakMonitor, seconds: float) -> Dict[str, Any]:
+    """等待负载结束后的连接和任务收尾，然后采样空闲状态"""
+    time.sleep(seconds)
+    gc.collect()
+    monitor.server.session_store.prune()
+    return monitor.sample()
+
+
+def evaluate(samples: List[Dict[str, Any]], idle_before: Dict[str, Any], idle_after: Dict[str, Any],
+             growth: List[Tuple[str, int]], sessions: int, args) -> List[str]:
+    """根据采样结果判断是否存在泄漏，返回失败原因"""
+    failures = []
+    rss_slope = _slope_per_hour(samples, "rss_mb")
+    rss_values = [s["rss_mb"] for s in samples if s.get("rss_mb") is not None]
+    if rss_values and rss_slope > args.max_rss_growth and rss_values[-1] - rss_values[0] > args.rss_slack:
+        failures.append(f"RSS持续增长: {rss_slope:.1f} MB/小时（上限 {args.max_rss_growth}），"
+                        f"负载期间增长 {rss_values[-1] - rss_values[0]:.1f} MB")
+    for key, slack in (("fds", args.fd_slack), ("tasks", args.task_slack), ("threads", args.thread_slack)):
+        before, after = idle_before.get(key), idle_after.get(key)
+        if before is not None and after is not None and after - before > slack:
+            failures.append(f"负载结束后 {key} 未回落: {before} -> {after}（允许 +{slack}）")
+    for key in ("server_sessions", "sse_sessions", "scene_subscribers"):
+        if idle_after[key] > idle_before[key]:
+            failures.append(f"会话结束后仍有 {idle_after[key] - idle_before[key]} 个 {key} 未释放")
+    if sessions:
+        for type_name, count in growth:
+            if count >= max(args.object_slack, sessions * args.leak_ratio):
+                failures.append(f"{type_name} 对象增加 {count} 个（每个会话 {count / sessions:.2f} 个）")
+    return failures
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="PyMOL MCP 浸泡测试：长时间打开/关闭SSE会话并检测资源泄漏")
+    parser.add_argument("--duration", type=float, default=3600, help="负载持续时间，秒 (默认: 3600)")
+    parser.add_argument("--warmup", type=float, default=30,
+                        help="预热负载时间，秒；预热后的空闲状态作为比较基准 (默认: 30)")
+    parser.add_argument("--settle", type=float, default=35,
+                        help="负载结束后等待收尾的时间，秒；应大于准入排队超时，已取消的排队计时器"
+                             "在到期前仍引用请求上下文 (默认: 35)")
+    parser.add_argument("--session-max-idle", type=float, default=60,
+                        help="会话记录的空闲保留时间，秒；默认24小时会让记录数随会话数增长 (默认: 60)")
+    parser.add_argument("--load-procs", type=int, default=2, help="负载进程数 (默认: 2)")
+    parser.add_argument("--clients", type=int, default=4, help="每个负载进程的并发客户端数 (默认: 4)")
+    parser.add_argument("--calls-per-session", type=int, default=20,
+                        help="每个会话最多的工具调用数 (默认: 20)")
+    parser.add_argument("--subscribe-ratio", type=float, default=0.2,
+                        help="订阅场景资源的会话比例 (默认: 0.2)")
+    parser.add_argument("--sample-interval", type=float, default=10, help="采样间隔，秒 (默认: 10)")
+    parser.add_argument("--port", type=int, default=3900, help="MCP服务器端口 (默认: 3900)")
+    parser.add_argument("--pymol-port", type=int, default=9950, help="模拟PyMOL后端端口 (默认: 9950)")
+    parser.add_argument("--latency-ms", type=float, default=1.0, help="模拟后端每次调用的延迟，毫秒 (默认: 1)")
+    parser.add_argument("--ray-latency-ms", type=float, default=20.0,
+                        help="模拟后端 ray/png 的延迟，毫秒 (默认: 20)")
+    parser.add_argument("--config", default="{}",
+                        help="传给 create_app 的额外配置（JSON），用于对特定功能做浸泡测试")
+    parser.add_argument("--max-rss-growth", type=float, default=20.0,
+                        help="允许的RSS增长率，MB/小时 (默认: 20)")
+    parser.add_argument("--rss-slack", type=float, default=32.0,
+                        help="负载期间允许的RSS总增长，MB (默认: 32)")
+    parser.add_argument("--fd-slack", type=int, default=8, help="允许多出的文件描述符数 (默认: 8)")
+    parser.add_argument("--task-slack", type=int, default=4, help="允许多出的asyncio任务数 (默认: 4)")
+    parser.add_argument("--thread-slack", type=int, default=8, help="允许多出的线程数 (默认: 8)")
+    parser.add_argument("--object-slack", type=int, default=200,
+                        help="同一类型对象增长数低于该值时不视为泄漏 (默认: 200)")
+    parser.add_argument("--leak-ratio", type=float, default=0.5,
+                        help="每个会话平均增长超过该数量的对象类型视为泄漏 (默认: 0.5)")
+    parser.add_argument("--report", default=None, help="把完整报告（含所有采样）写入该JSON文件")
+    args = parser.parse_args(argv)
+
+    import uvicorn
+    import pymol_fake
+    import pymol_mcp_server as server
+
+    pymol_fake.serve_fake_pymol(args.pymol_port, latency=args.latency_ms / 1000,
+                                ray_latency=args.ray_latency_ms / 1000)
+    config = {"pymol_port": args.pymol_port, "transport": "sse", "scene_poll_interval": 0.5}
+    config.update(json.loads(args.config))
+    app = server.create_app(config)
+    server.session_store.max_idle = args.session_max_idle
+    uv = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=args.port, log_level="warning"))
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_until_complete, args=(uv.serve(),), name="soak-server",
+                     daemon=True).start()
+    while not uv.started:
+        time.sleep(0.05)
+    url = f"http://127.0.0.1:{args.port}"
+
+    monitor = SoakMonitor(loop, server)
+    counters = multiprocessing.get_context("spawn").Array("q", 4)
+
+    def totals() -> Dict[str, int]:
+        return dict(zip(("sessions", "calls", "errors", "failures"), counters[:]))
+
+    print(f"预热 {args.warmup:g} 秒...", file=sys.stderr)
+    _run_load(url, args.warmup, args, 1, counters)
+    idle_before = _settle(monitor, args.settle)
+    types_before = monitor.type_counts()
+    warm = totals()
+
+    samples: List[Dict[str, Any]] = []
+
+    def on_sample():
+        sample = monitor.sample()
+        sample.update({key: value - warm[key] for key, value in totals().items()})
+        samples.append(sample)
+        print(f"  t={sample['t']:>7}s rss={sample['rss_mb']}MB fds={sample['fds']} tasks={sample['tasks']} "
+              f"threads={sample['threads']} sessions={sample['sessions']} calls={sample['calls']} "
+              f"errors={sample['errors']} live={sample['server_sessions']}", file=sys.stderr)
+
+    print(f"负载 {args.duration:g} 秒: {args.load_procs} 个进程 x {args.clients} 个客户端", file=sys.stderr)
+    _run_load(url, args.duration, args, 100, counters, on_sample)
+    idle_after = _settle(monitor, args.settle)
+    types_after = monitor.type_counts()
+    run = {key: value - warm[key] for key, value in totals().items()}
+
+    growth = [(name, types_after[name] - types_before[name]) for name in types_after
+              if types_after[name] > types_before[name]]
+    growth.sort(key=lambda item: item[1], reverse=True)
+    failures = evaluate(samples, idle_before, idle_after, growth, run["sessions"], args)
+
+    uv.should_exit = True
+    report = {
+        "passed": not failures,
+        "failures": failures,
+        "totals": run,
+        "rss_mb_per_hour": round(_slope_per_hour(samples, "rss_mb"), 2),
+        "fds_per_hour": round(_slope_per_hour(samples, "fds"), 2),
+        "idle_before": idle_before,
+        "idle_after": idle_after,
+        "object_growth": dict(growth[:20]),
+        "metrics": {
+            "admission": server.admission.stats(),
+            "presets": server.presets.stats() if server.presets else None,
+            "selection_cache": server._selection_cache_stats(),
+            "scene": server.scene_watcher.stats() if server.scene_watcher else None,
+        },
+    }
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(dict(report, samples=samples), f, ensure_ascii=False, indent=2)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    print("通过" if not failures else "失败:\n  " + "\n  ".join(failures), file=sys.stderr)
+    sys.exit(0 if not failures else 1)
+
+
+if __name__ == "__main__":
+    main()
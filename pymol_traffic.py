@@ -0,0 +1,515 @@
+"""
+PyMOL MCP 流量录制与回放
+
+合成负载（pymol_soak）无法还原生产流量的混合比例：成批的 pymol_get_selection_info、
+集中的渲染请求、长短不一的 pymol_do 脚本。服务器以 --record-traffic 启动时，
+每次工具调用的工具名、参数、耗时（含准入排队）和响应大小写入一行JSON（.gz 结尾时
+gzip压缩），--record-anonymize 把文件路径、选择表达式、对象名等字符串替换为
+一致的散列值（同一个值总是得到同一个散列，缓存命中规律不变）：
+
+    python pymol_mcp_server.py --record-traffic traffic.jsonl.gz --record-anonymize
+
+回放按原始时间间隔（或 --speed 倍速，0 表示不等待）重新发出调用，每个原始会话
+一个 SSE 会话，会话内的调用依次发出；--fake 在子进程中启动模拟PyMOL后端和当前
+代码的MCP服务器，不需要真实PyMOL：
+
+    python pymol_traffic.py replay traffic.jsonl.gz --fake --speed 4 --output build-b.json
+    python pymol_traffic.py replay traffic.jsonl.gz --url http://127.0.0.1:3000
+
+比较两次回放（或录制文件本身记录的耗时）的按工具延迟分布，p90 变慢超过阈值时
+以退出码 1 结束，可以放在CI中做性能回归检查：
+
+    python pymol_traffic.py compare build-a.json build-b.json --threshold 1.2
+"""
+
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+TRACE_FORMAT = "pymol-mcp-traffic"
+TRACE_VERSION = 1
+
+# 回放时提前于会话第一次调用建立连接的时间（秒）
+CONNECT_LEAD = 1.0
+
+# 录制时记住的会话数（超过后最久未调用的会话再次出现时得到新编号）
+MAX_SESSIONS = 10000
+
+# 含文件路径的参数：匿名化时保留扩展名（PyMOL按扩展名识别格式）
+_PATH_KEYS = frozenset({"filename", "output_dir", "inputs", "input_glob"})
+
+# 取值来自固定集合、不含用户数据的参数，匿名化时保留
+_KEEP_KEYS = frozenset({"representation", "color", "axis", "method", "format", "sort"})
+_KEEP_TOOL_KEYS = {"pymol_apply_preset": frozenset({"name"})}
+
+# 这些命令的第二个词是设置名，保留（服务器据此判断 set state 等是否改变坐标）
+_SETTING_VERBS = frozenset({"set", "unset", "get"})
+
+
+def _open(path: str, mode: str):
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+class Anonymizer:
+    """把参数中的字符串替换为加盐散列
+
+    盐每次录制随机生成且不写入文件，短的取值（链名、残基号）也无法被穷举还原。
+    """
+
+    def __init__(self, salt: Optional[bytes] = None):
+        self.salt = salt or os.urandom(16)
+
+    def token(self, value: str) -> str:
+        return "a" + hashlib.blake2b(value.encode("utf-8"), key=self.salt, digest_size=5).hexdigest()
+
+    def path(self, value: str) -> str:
+        stem, ext = os.path.splitext(value)
+        if ext.lower() == ".gz":
+            stem, inner = os.path.splitext(stem)
+            ext = inner + ext
+        return "anon/" + self.token(stem) + ext
+
+    def script(self, script: str) -> str:
+        """pymol_do 脚本：保留每条命令的动词（和设置名），其余部分散列"""
+        commands = []
+        for line in script.splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith("/"):
+                commands.append("/" + self.token(line))
+                continue
+            for command in (c.strip() for c in line.split(";")):
+                if not command:
+                    continue
+                words = command.replace(",", " ").split()
+                keep = 2 if words[0].lower() in _SETTING_VERBS else 1
+                rest = " ".join(words[keep:])
+                commands.append(" ".join(words[:keep] + ([self.token(rest)] if rest else [])))
+        return "\n".join(commands)
+
+    def value(self, key: str, value: Any) -> Any:
+        if isinstance(value, str):
+            return self.path(value) if key in _PATH_KEYS else self.token(value)
+        if isinstance(value, list):
+            return [self.value(key, v) for v in value]
+        if isinstance(value, dict):
+            return {k: self.value(k, v) for k, v in value.items()}
+        return value
+
+    def arguments(self, tool: str, arguments: Dict[str, Any]) -> Dict[str, Any]:
+        keep = _KEEP_KEYS | _KEEP_TOOL_KEYS.get(tool, frozenset())
+        result = {}
+        for key, value in arguments.items():
+            if key in keep:
+                result[key] = value
+            elif tool == "pymol_do" and key == "command" and isinstance(value, str):
+                result[key] = self.script(value)
+            else:
+                result[key] = self.value(key, value)
+        return result
+
+
+def response_size(content: Iterable[Any]) -> int:
+    """工具结果的大小（文本的UTF-8字节数加图像数据的长度）"""
+    size = 0
+    for item in content:
+        text = getattr(item, "text", None)
+        if text:
+            size += len(text.encode("utf-8"))
+        data = getattr(item, "data", None)
+        if data:
+            size += len(data)
+    return size
+
+
+def is_error(content: Sequence[Any]) -> bool:
+    text = getattr(content[0], "text", "") if content else ""
+    return bool(text) and text.startswith("错误")
+
+
+class TrafficRecorder:
+    """把工具调用追加写入录制文件（每次调用一行JSON）
+
+    在事件循环中调用 record，写入经过缓冲，由定时器最多每 flush_interval 秒刷新一次。
+    """
+
+    def __init__(self, path: str, anonymize: bool = False, flush_interval: float = 1.0):
+        self.path = path.replace("{pid}", str(os.getpid()))
+        self.anonymizer = Anonymizer() if anonymize else None
+        self.flush_interval = flush_interval
+        self.records = 0
+        self._lock = threading.Lock()
+        self._file = None
+        self._timer: Optional[threading.Timer] = None
+        self._sessions: "OrderedDict[str, str]" = OrderedDict()
+        self._next_session = 0
+
+    def _session_token(self, session_id: str) -> str:
+        # 会话标识可能是客户端地址或自报的 X-Client-Id，总是替换为短编号；
+        # 只记住最近的会话，长时间录制时映射表不增长
+        token = self._sessions.get(session_id)
+        if token is None:
+            self._next_session += 1
+            token = self._sessions[session_id] = f"s{self._next_session}"
+            if len(self._sessions) > MAX_SESSIONS:
+                self._sessions.popitem(last=False)
+        else:
+            self._sessions.move_to_end(session_id)
+        return token
+
+    def record(self, session_id: str, tool: str, arguments: Dict[str, Any], seconds: float,
+               content: Sequence[Any]) -> None:
+        args = self.anonymizer.arguments(tool, arguments) if self.anonymizer else arguments
+        entry = {
+            "ts": round(time.time() - seconds, 3),
+            "s": None,
+            "tool": tool,
+            "args": args,
+            "ms": round(seconds * 1000, 2),
+            "bytes": response_size(content),
+        }
+        if is_error(content):
+            entry["err"] = 1
+        with self._lock:
+            entry["s"] = self._session_token(session_id)
+            if self._file is None:
+                self._file = _open(self.path, "a")
+                header = {"format": TRACE_FORMAT, "version": TRACE_VERSION, "started": round(time.time(), 3),
+                          "pid": os.getpid(), "anonymized": self.anonymizer is not None}
+                self._file.write(json.dumps(header) + "\n")
+            self._file.write(json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n")
+            self.records += 1
+            if self._timer is None:
+                # 缓冲的记录最迟 flush_interval 秒后写出，服务器被强行终止时最多丢失这段时间的记录
+                self._timer = threading.Timer(self.flush_interval, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self) -> None:
+        with self._lock:
+            self._timer = None
+            if self._file is not None:
+                self._file.flush()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {"path": self.path, "records": self.records, "anonymized": self.anonymizer is not None}
+
+
+def load_trace(paths: Sequence[str]) -> List[Dict[str, Any]]:
+    """读取一个或多个录制文件（例如多worker各自的文件），按时间排序
+
+    每个文件中的会话编号加上文件序号前缀，不同进程的会话不会合并。
+    """
+    records = []
+    for index, path in enumerate(paths):
+        segment = 0
+        with _open(path, "r") as f:
+            try:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    entry = json.loads(line)
+                    if entry.get("format") == TRACE_FORMAT:
+                        # 服务器每次启动追加一个新段，会话编号从头开始
+                        segment += 1
+                        continue
+                    entry["s"] = f"{index}.{segment}.{entry['s']}"
+                    records.append(entry)
+            except (EOFError, ValueError):
+                # 服务器被强行终止时文件末尾不完整，保留已读到的记录
+                print(f"警告: {path} 末尾不完整，已忽略", file=sys.stderr)
+    records.sort(key=lambda entry: entry["ts"])
+    return records
+
+
+def _percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    position = (len(ordered) - 1) * q
+    low = int(position)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (position - low)
+
+
+def summarize(calls: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    """按工具汇总调用次数、错误数、平均响应大小和延迟分位数"""
+    by_tool: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+    everything = []
+    for call in calls:
+        by_tool[call["tool"]].append(call)
+        everything.append(call)
+
+    def stats(group: List[Dict[str, Any]]) -> Dict[str, Any]:
+        latencies = [c["ms"] for c in group]
+        return {
+            "calls": len(group),
+            "errors": sum(1 for c in group if c.get("err")),
+            "bytes_mean": round(sum(c.get("bytes", 0) for c in group) / len(group)) if group else 0,
+            "p50_ms": round(_percentile(latencies, 0.5), 2),
+            "p90_ms": round(_percentile(latencies, 0.9), 2),
+            "p99_ms": round(_percentile(latencies, 0.99), 2),
+            "max_ms": round(max(latencies), 2) if latencies else 0.0,
+        }
+
+    return {"overall": stats(everything),
+            "tools": {tool: stats(group) for tool, group in sorted(by_tool.items())}}
+
+
+async def _replay_session(url: str, calls: List[Dict[str, Any]], t0: float, start: float, speed: float,
+                          results: List[Dict[str, Any]]) -> None:
+    import asyncio
+    from mcp import ClientSession
+    from mcp.client.sse import sse_client
+
+    def due(call):
+        return start + (call["ts"] - t0) / speed if speed > 0 else start
+
+    loop = asyncio.get_running_loop()
+    # 提前建立连接：原始流量中会话在第一次调用之前就已经建立
+    await asyncio.sleep(max(due(calls[0]) - CONNECT_LEAD - loop.time(), 0))
+    done = 0
+    try:
+        async with sse_client(url + "/sse") as streams:
+            async with ClientSession(streams[0], streams[1]) as session:
+                await session.initialize()
+                for call in calls:
+                    await asyncio.sleep(max(due(call) - loop.time(), 0))
+                    issued = loop.time()
+                    try:
+                        result = await session.call_tool(call["tool"], call["args"])
+                        content, failed = result.content, result.isError or is_error(result.content)
+                    except Exception as e:
+                        content, failed, exception = [], True, f"{type(e).__name__}: {e}"
+                    else:
+                        exception = None
+                    entry = {
+                        "tool": call["tool"],
+                        "ms": round((loop.time() - issued) * 1000, 2),
+                        "bytes": response_size(content),
+                        "recorded_ms": call.get("ms"),
+                        # 会话中前一个调用太慢时，之后的调用晚于原始时间发出
+                        "behind_ms": round(max(issued - due(call), 0) * 1000, 1),
+                    }
+                    if failed:
+                        entry["err"] = 1
+                    if exception:
+                        entry["exception"] = exception
+                    results.append(entry)
+                    done += 1
+    except Exception as e:
+        # 无法建立会话或连接中断：该会话其余的调用记为出错
+        for call in calls[done:]:
+            results.append({"tool": call["tool"], "ms": 0.0, "bytes": 0, "recorded_ms": call.get("ms"),
+                            "err": 1, "exception": f"{type(e).__name__}: {e}"})
+
+
+async def replay(records: List[Dict[str, Any]], url: str, speed: float = 1.0) -> List[Dict[str, Any]]:
+    """按录制的时间重新发出调用，返回每次调用的结果"""
+    import asyncio
+    sessions: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+    for record in records:
+        sessions[record["s"]].append(record)
+    results: List[Dict[str, Any]] = []
+    if not records:
+        return results
+    start = asyncio.get_running_loop().time() + CONNECT_LEAD
+    await asyncio.gather(*(_replay_session(url, calls, records[0]["ts"], start, speed, results)
+                           for calls in sessions.values()))
+    return results
+
+
+class _FakeStack:
+    """在子进程中启动模拟PyMOL后端和当前代码的MCP服务器"""
+
+    def __init__(self, port: int, pymol_port: int, server_args: Sequence[str], latency_ms: float,
+                 ray_latency_ms: float):
+        import subprocess
+        here = os.path.dirname(os.path.abspath(__file__))
+        self.url = f"http://127.0.0.1:{port}"
+        self.processes = [
+            subprocess.Popen([sys.executable, os.path.join(here, "pymol_fake.py"), "--port", str(pymol_port),
+                              "--latency-ms", str(latency_ms), "--ray-latency-ms", str(ray_latency_ms)],
+                             stdout=subprocess.DEVNULL),
+            subprocess.Popen([sys.executable, os.path.join(here, "pymol_mcp_server.py"), "--port", str(port),
+                              "--pymol-port", str(pymol_port), "--transport", "sse", *server_args],
+                             stdout=subprocess.DEVNULL),
+        ]
+
+    def wait_ready(self, timeout: float = 30.0) -> None:
+        import urllib.request
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if any(p.poll() is not None for p in self.processes):
+                raise RuntimeError("模拟后端或MCP服务器启动失败")
+            try:
+                with urllib.request.urlopen(self.url + "/health", timeout=1) as response:
+                    if json.load(response).get("pymol_connected"):
+                        return
+            except OSError:
+                pass
+            time.sleep(0.2)
+        raise RuntimeError("等待MCP服务器启动超时")
+
+    def stop(self) -> None:
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            try:
+                process.wait(10)
+            except Exception:
+                process.kill()
+
+
+def _load_summary(path: str) -> Dict[str, Any]:
+    """读取回放结果的汇总；给出录制文件时汇总其中记录的耗时"""
+    try:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        if isinstance(data, dict) and "summary" in data:
+            return data["summary"]
+    except (ValueError, UnicodeDecodeError):
+        pass
+    return summarize(load_trace([path]))
+
+
+def compare(baseline: Dict[str, Any], candidate: Dict[str, Any], threshold: float = 1.2,
+            min_delta_ms: float = 5.0, min_calls: int = 20) -> Dict[str, Any]:
+    """比较两次汇总的按工具延迟
+
+    p90 变慢超过 threshold 倍且超过 min_delta_ms 视为回归；两边调用数都不少于
+    min_calls 的工具才判断，样本太少时 p90 本身就不稳定。
+    """
+    rows, regressions = [], []
+    for tool in sorted(set(baseline["tools"]) | set(candidate["tools"])):
+        a, b = baseline["tools"].get(tool), candidate["tools"].get(tool)
+        if a is None or b is None:
+            rows.append({"tool": tool, "only_in": "baseline" if b is None else "candidate"})
+            continue
+        row = {"tool": tool, "calls": [a["calls"], b["calls"]]}
+        for key in ("p50_ms", "p90_ms", "p99_ms"):
+            row[key] = [a[key], b[key]]
+            row[key.replace("_ms", "_ratio")] = round(b[key] / a[key], 2) if a[key] > 0 else None
+        if (min(a["calls"], b["calls"]) >= min_calls and b["p90_ms"] > a["p90_ms"] * threshold
+                and b["p90_ms"] - a["p90_ms"] > min_delta_ms):
+            regressions.append(f"{tool}: p90 {a['p90_ms']} -> {b['p90_ms']} ms")
+        rows.append(row)
+    return {"threshold": threshold, "regressions": regressions, "tools": rows,
+            "overall": {key: [baseline["overall"][key], candidate["overall"][key]]
+                        for key in ("calls", "errors", "p50_ms", "p90_ms", "p99_ms")}}
+
+
+def _print_summary(summary: Dict[str, Any]) -> None:
+    print(f"{'工具':<28}{'调用':>7}{'错误':>6}{'p50':>9}{'p90':>9}{'p99':>9}{'max':>9}", file=sys.stderr)
+    for tool, s in list(summary["tools"].items()) + [("(全部)", summary["overall"])]:
+        print(f"{tool:<28}{s['calls']:>7}{s['errors']:>6}{s['p50_ms']:>9}{s['p90_ms']:>9}{s['p99_ms']:>9}"
+              f"{s['max_ms']:>9}", file=sys.stderr)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="PyMOL MCP 流量回放与延迟分布比较")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    replay_parser = commands.add_parser("replay", help="按录制的时间重新发出工具调用")
+    replay_parser.add_argument("traces", nargs="+", help="录制文件（--record-traffic 写出，可给出多个）")
+    replay_parser.add_argument("--url", default="http://127.0.0.1:3000", help="MCP服务器地址 (默认: %(default)s)")
+    replay_parser.add_argument("--speed", type=float, default=1.0,
+                               help="回放倍速，2 表示两倍速，0 表示不等待原始间隔 (默认: 1)")
+    replay_parser.add_argument("--tools", default=None, help="只回放这些工具（逗号分隔）")
+    replay_parser.add_argument("--limit", type=int, default=0, help="只回放前N个调用 (默认: 全部)")
+    replay_parser.add_argument("--fake", action="store_true",
+                               help="在子进程中启动模拟PyMOL后端和当前代码的MCP服务器，忽略 --url")
+    replay_parser.add_argument("--port", type=int, default=3950, help="--fake 时MCP服务器端口 (默认: 3950)")
+    replay_parser.add_argument("--pymol-port", type=int, default=9980, help="--fake 时模拟后端端口 (默认: 9980)")
+    replay_parser.add_argument("--latency-ms", type=float, default=1.0, help="--fake 时每次调用的延迟 (默认: 1)")
+    replay_parser.add_argument("--ray-latency-ms", type=float, default=50.0,
+                               help="--fake 时 ray/png 的延迟 (默认: 50)")
+    replay_parser.add_argument("--server-args", default="",
+                               help="--fake 时传给 pymol_mcp_server.py 的额外参数，如 \"--coalesce-window 20\"")
+    replay_parser.add_argument("--output", default=None, help="把每次调用的结果和汇总写入该JSON文件")
+
+    compare_parser = commands.add_parser("compare", help="比较两次回放（或录制文件）的按工具延迟分布")
+    compare_parser.add_argument("baseline", help="基准：回放结果JSON或录制文件")
+    compare_parser.add_argument("candidate", help="对比：回放结果JSON或录制文件")
+    compare_parser.add_argument("--threshold", type=float, default=1.2,
+                                help="p90 超过基准的倍数视为回归 (默认: 1.2)")
+    compare_parser.add_argument("--min-delta-ms", type=float, default=5.0,
+                                help="p90 增加少于该值时不视为回归 (默认: 5)")
+    compare_parser.add_argument("--min-calls", type=int, default=20,
+                                help="调用数少于该值的工具不做判断 (默认: 20)")
+    args = parser.parse_args(argv)
+
+    if args.command == "compare":
+        result = compare(_load_summary(args.baseline), _load_summary(args.candidate),
+                         args.threshold, args.min_delta_ms, args.min_calls)
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+        print("没有性能回归" if not result["regressions"] else
+              "性能回归:\n  " + "\n  ".join(result["regressions"]), file=sys.stderr)
+        sys.exit(1 if result["regressions"] else 0)
+
+    import asyncio
+    import shlex
+    records = load_trace(args.traces)
+    if args.tools:
+        wanted = set(args.tools.split(","))
+        records = [r for r in records if r["tool"] in wanted]
+    if args.limit > 0:
+        records = records[:args.limit]
+    url, stack = args.url.rstrip("/"), None
+    if args.fake:
+        stack = _FakeStack(args.port, args.pymol_port, shlex.split(args.server_args), args.latency_ms,
+                           args.ray_latency_ms)
+        url = stack.url
+    try:
+        if stack is not None:
+            stack.wait_ready()
+        span = records[-1]["ts"] - records[0]["ts"] if records else 0
+        print(f"回放 {len(records)} 个调用（{len({r['s'] for r in records})} 个会话，原始时长 {span:.1f} 秒，"
+              f"{args.speed:g} 倍速）-> {url}", file=sys.stderr)
+        started = time.perf_counter()
+        results = asyncio.run(replay(records, url, args.speed))
+        elapsed = time.perf_counter() - started
+    finally:
+        if stack is not None:
+            stack.stop()
+
+    summary = summarize(results)
+    report = {
+        "traces": args.traces,
+        "url": None if args.fake else url,
+        "fake": args.fake,
+        "speed": args.speed,
+        "elapsed_s": round(elapsed, 2),
+        "behind_ms_max": max((r.get("behind_ms", 0) for r in results), default=0),
+        "summary": summary,
+        "recorded": summarize(records),
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(dict(report, calls=results), f, ensure_ascii=False)
+    _print_summary(summary)
+    print(json.dumps({k: v for k, v in report.items() if k not in ("summary", "recorded")}, ensure_ascii=False),
+          file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
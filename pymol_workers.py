@@ -0,0 +1,486 @@
+"""
+PyMOL MCP 无界面工作进程池
+
+由MCP服务器启动并监管多个无界面PyMOL进程（pymol -cKq，在分配的端口上
+启动XML-RPC服务器），不再需要手动运行 pymol -R 或点击插件菜单：
+
+    - 每个会话首次调用工具时绑定一个空闲的工作进程，之后的调用都发往它
+    - 始终保持若干个预热好的备用进程，新会话无需等待PyMOL启动
+    - 进程崩溃时自动补充；受影响的会话在下一次调用时收到提示
+    - 调用次数达到上限或内存超限的进程会被回收：当前场景保存为 .pse，
+      由新进程载入后再切换，会话感知不到
+    - 空闲超时的会话释放其工作进程
+"""
+
+import atexit
+import os
+import queue
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+# 启动无界面PyMOL并在指定端口上启动XML-RPC服务器：
+# -c 不启动GUI，-K 执行完启动命令后保持运行，-q 不打印启动信息
+DEFAULT_COMMAND = [
+    "pymol", "-cKq", "-d",
+    "/import pymol.rpc; pymol.rpc.launch_XMLRPC('127.0.0.1', {port}, 1)",
+]
+
+
+def _port_free(port: int) -> bool:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        try:
+            s.bind(("127.0.0.1", port))
+        except OSError:
+            return False
+    return True
+
+
+def process_rss_mb(pid: int) -> Optional[float]:
+    """进程常驻内存（MB），无法获取时返回 None"""
+    from pymol_accounting import process_usage
+    usage = process_usage(pid)
+    return usage["rss_mb"] if usage else None
+
+
+class PyMOLWorker:
+    """一个受监管的PyMOL进程及其XML-RPC连接"""
+
+    def __init__(self, port: int, process: subprocess.Popen, conn):
+        self.port = port
+        self.process = process
+        self.conn = conn
+        self.started = time.time()
+        self.calls = 0
+        self.busy = 0
+        self.sessions: set = set()
+        # 正在回收：新的调用等待切换到替代进程
+        self.retiring = False
+
+    @property
+    def pid(self) -> int:
+        return self.process.pid
+
+    def alive(self) -> bool:
+        return self.process.poll() is None
+
+    def stop(self, timeout: float = 5.0) -> None:
+        if not self.alive():
+            return
+        self.process.terminate()
+        try:
+            self.process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+
+    def info(self) -> Dict[str, Any]:
+        rss = process_rss_mb(self.pid) if self.alive() else None
+        return {
+            "pid": self.pid,
+            "port": self.port,
+            "alive": self.alive(),
+            "uptime": round(time.time() - self.started, 1),
+            "calls": self.calls,
+            "busy": self.busy,
+            "sessions": sorted(self.sessions),
+            "rss_mb": round(rss, 1) if rss is not None else None,
+        }
+
+
+class WorkerPool:
+    """无界面PyMOL工作进程池
+
+    connection_factory(port) 返回该端口的PyMOL连接对象（需提供 connect()
+    和 get_cmd()）。size 为进程总数上限，spares 为保持预热的备用进程数。
+    """
+
+    def __init__(self, connection_factory: Callable[[int], Any], size: int = 4, spares: int = 1,
+                 command: Optional[List[str]] = None, base_port: int = 9200,
+                 max_calls: Optional[int] = 1000, max_rss_mb: Optional[float] = 2048,
+                 idle_timeout: float = 1800, startup_timeout: float = 60, check_interval: float = 5):
+        self.connection_factory = connection_factory
+        self.size = size
+        self.spares = min(spares, size)
+        self.command = list(command or DEFAULT_COMMAND)
+        self.base_port = base_port
+        self.max_calls = max_calls
+        self.max_rss_mb = max_rss_mb
+        self.idle_timeout = idle_timeout
+        self.startup_timeout = startup_timeout
+        self.check_interval = check_interval
+
+        self._cond = threading.Condition()
+        self._workers: List[PyMOLWorker] = []
+        self._spares: List[PyMOLWorker] = []
+        self._starting = 0
+        self._ports: set = set()
+        self._bindings: Dict[str, PyMOLWorker] = {}
+        self._last_used: Dict[str, float] = {}
+        self._notices: Dict[str, str] = {}
+        self._stopped = threading.Event()
+        self._supervisor: Optional[threading.Thread] = None
+        self.restarts = {"crashed": 0, "max_calls": 0, "memory": 0, "idle": 0}
+        self.spawn_failures = 0
+
+    # ---- 启动与停止 ----
+
+    def start(self) -> None:
+        """在后台启动备用进程和监管线程"""
+        with self._cond:
+            self._replenish()
+        self._supervisor = threading.Thread(target=self._supervise, name="pymol-supervisor", daemon=True)
+        self._supervisor.start()
+        atexit.register(self.stop)
+
+    def stop(self) -> None:
+        self._stopped.set()
+        with self._cond:
+            workers, self._workers, self._spares = self._workers, [], []
+            self._bindings.clear()
+            self._cond.notify_all()
+        for worker in workers:
+            worker.stop()
+
+    def _allocate_port(self) -> int:
+        port = self.base_port
+        while port in self._ports or not _port_free(port):
+            port += 1
+        self._ports.add(port)
+        return port
+
+    def _spawn_async(self) -> None:
+        """在后台启动一个新的备用进程（调用方持有锁）"""
+        self._starting += 1
+        port = self._allocate_port()
+        threading.Thread(target=self._spawn, args=(port,), daemon=True).start()
+
+    def _spawn(self, port: int) -> None:
+        worker = None
+        try:
+            worker = self._launch(port)
+        except Exception as e:
+            print(f"PyMOL工作进程启动失败 (端口 {port}): {e}", file=sys.stderr)
+        with self._cond:
+            self._starting -= 1
+            if worker is None:
+                self.spawn_failures += 1
+                self._ports.discard(port)
+            elif self._stopped.is_set():
+                worker.stop()
+            else:
+                self._workers.append(worker)
+                self._spares.append(worker)
+            self._cond.notify_all()
+
+    def _launch(self, port: int) -> PyMOLWorker:
+        """启动PyMOL进程并等待其XML-RPC服务器可用"""
+        args = [part.replace("{port}", str(port)) for part in self.command]
+        process = subprocess.Popen(
+            args, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, start_new_session=True
+        )
+        conn = self.connection_factory(port)
+        deadline = time.monotonic() + self.startup_timeout
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(f"进程已退出，退出码 {process.returncode}")
+            if conn.connect():
+                return PyMOLWorker(port, process, conn)
+            time.sleep(0.2)
+        process.kill()
+        process.wait()
+        raise RuntimeError(f"{self.startup_timeout:g} 秒内未能连接")
+
+    def _replenish(self) -> None:
+        """补足备用进程（调用方持有锁）"""
+        while (len(self._spares) + self._starting < self.spares
+               and len(self._workers) + self._starting < self.size):
+            self._spawn_async()
+
+    # ---- 会话路由 ----
+
+    def acquire(self, session_id: str) -> PyMOLWorker:
+        """返回会话绑定的工作进程（首次调用时分配备用进程）并标记为忙"""
+        deadline = time.monotonic() + self.startup_timeout
+        with self._cond:
+            failures = self.spawn_failures
+            while True:
+                if self._stopped.is_set():
+                    raise RuntimeError("PyMOL工作进程池已停止")
+                worker = self._bindings.get(session_id)
+                if worker is None and self._spares:
+                    worker = self._spares.pop(0)
+                    worker.sessions.add(session_id)
+                    self._bindings[session_id] = worker
+                    self._replenish()
+                if worker is not None and not worker.retiring:
+                    break
+                if worker is None:
+                    if self.spawn_failures > failures:
+                        raise RuntimeError("PyMOL工作进程启动失败，请检查 --pymol-exe 和服务器日志")
+                    self._replenish()
+                    if not self._starting and len(self._workers) >= self.size:
+                        raise RuntimeError(f"没有空闲的PyMOL工作进程（已达上限 {self.size}），请稍后重试")
+                    if not self._starting:
+                        self._spawn_async()
+                # 等待新进程启动完成，或等待回收中的进程切换完成
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise RuntimeError("等待PyMOL工作进程超时")
+                self._cond.wait(remaining)
+            worker.busy += 1
+            worker.calls += 1
+            self._last_used[session_id] = time.time()
+            return worker
+
+    def release(self, worker: PyMOLWorker) -> None:
+        with self._cond:
+            worker.busy -= 1
+            self._cond.notify_all()
+
+    @contextmanager
+    def session(self, session_id: str):
+        worker = self.acquire(session_id)
+        try:
+            yield worker
+        finally:
+            self.release(worker)
+
+    @contextmanager
+    def borrow(self, count: int):
+        """临时借用最多 count 个空闲的备用进程做一次性计算（如并行结构比对）
+
+        借出期间不补充备用进程；归还时清空其场景，进程仍作为备用进程使用。
+        没有空闲备用进程时得到空列表。
+        """
+        with self._cond:
+            borrowed = self._spares[:max(count, 0)]
+            del self._spares[:len(borrowed)]
+            for worker in borrowed:
+                worker.busy += 1
+                worker.calls += 1
+        try:
+            yield borrowed
+        finally:
+            for worker in borrowed:
+                try:
+                    worker.conn.get_cmd().reinitialize()
+                except Exception:
+                    # 进程已崩溃时由监管线程处理
+                    pass
+            with self._cond:
+                for worker in borrowed:
+                    worker.busy -= 1
+                    if worker in self._workers and not worker.retiring:
+                        self._spares.append(worker)
+                self._replenish()
+                self._cond.notify_all()
+
+    def take_notice(self, session_id: str) -> Optional[str]:
+        """取出需要告知该会话的事件（例如其工作进程崩溃）"""
+        with self._cond:
+            return self._notices.pop(session_id, None)
+
+    def bound_connection(self, session_id: str) -> Optional[Any]:
+        """会话已绑定的工作进程的连接，不分配新进程也不计入调用"""
+        with self._cond:
+            worker = self._bindings.get(session_id)
+            return worker.conn if worker is not None else None
+
+    def connections(self) -> List[Any]:
+        with self._cond:
+            return [worker.conn for worker in self._workers]
+
+    # ---- 监管 ----
+
+    def _supervise(self) -> None:
+        while not self._stopped.wait(self.check_interval):
+            try:
+                self.check()
+            except Exception as e:
+                print(f"PyMOL工作进程检查失败: {e}", file=sys.stderr)
+
+    def _remove(self, worker: PyMOLWorker) -> None:
+        """从池中移除工作进程并解除其会话绑定（调用方持有锁）"""
+        if worker in self._workers:
+            self._workers.remove(worker)
+        if worker in self._spares:
+            self._spares.remove(worker)
+        for session_id in worker.sessions:
+            if self._bindings.get(session_id) is worker:
+                del self._bindings[session_id]
+        self._ports.discard(worker.port)
+        self._cond.notify_all()
+
+    def check(self) -> None:
+        """检查一次所有工作进程：补充崩溃的进程、释放空闲会话、回收超限进程"""
+        now = time.time()
+        recycle = []
+        idle = []
+        with self._cond:
+            for worker in list(self._workers):
+                if not worker.alive():
+                    self.restarts["crashed"] += 1
+                    print(f"PyMOL工作进程 {worker.pid} 已退出，退出码 {worker.process.returncode}", file=sys.stderr)
+                    for session_id in worker.sessions:
+                        self._notices[session_id] = "注意: 该会话的PyMOL工作进程意外退出，已切换到新的进程，之前的场景已丢失"
+                    self._remove(worker)
+
+            for session_id, last_used in list(self._last_used.items()):
+                worker = self._bindings.get(session_id)
+                if worker is None:
+                    del self._last_used[session_id]
+                elif now - last_used > self.idle_timeout and worker.busy == 0 and not worker.retiring:
+                    del self._last_used[session_id]
+                    del self._bindings[session_id]
+                    worker.sessions.discard(session_id)
+                    if not worker.sessions:
+                        self.restarts["idle"] += 1
+                        self._remove(worker)
+                        idle.append(worker)
+
+            for worker in self._workers:
+                if worker.busy or worker.retiring:
+                    continue
+                if self.max_calls and worker.calls >= self.max_calls:
+                    reason = "max_calls"
+                elif self.max_rss_mb and (process_rss_mb(worker.pid) or 0) > self.max_rss_mb:
+                    reason = "memory"
+                else:
+                    continue
+                worker.retiring = True
+                if worker in self._spares:
+                    self._spares.remove(worker)
+                recycle.append((worker, reason))
+
+            self._replenish()
+
+        for worker in idle:
+            worker.stop()
+        for worker, reason in recycle:
+            self._recycle(worker, reason)
+
+    def _recycle(self, old: PyMOLWorker, reason: str) -> None:
+        """用新进程替换 old：保存场景，在新进程中载入，再切换会话绑定"""
+        self.restarts[reason] += 1
+        notice = None
+        path = None
+        try:
+            with self._cond:
+                new = self._spares.pop(0) if self._spares and old.sessions else None
+                if not old.sessions:
+                    # 备用进程没有场景，直接替换
+                    self._remove(old)
+                    self._replenish()
+            if not old.sessions:
+                old.stop()
+                return
+            if new is None:
+                with self._cond:
+                    port = self._allocate_port()
+                try:
+                    new = self._launch(port)
+                except Exception:
+                    with self._cond:
+                        self._ports.discard(port)
+                    raise
+                with self._cond:
+                    self._workers.append(new)
+
+            try:
+                cmd = old.conn.get_cmd()
+                combiner = getattr(old.conn, "write_combiner", None)
+                if combiner is not None:
+                    combiner.flush(cmd)
+                fd, path = tempfile.mkstemp(prefix="pymol-mcp-", suffix=".pse")
+                os.close(fd)
+                cmd.save(path)
+                new.conn.get_cmd().load(path)
+            except Exception as e:
+                notice = f"注意: 该会话的PyMOL工作进程已重启，但场景未能迁移: {e}"
+        except Exception as e:
+            # 无法启动替代进程：保留旧进程，下次检查时重试
+            print(f"PyMOL工作进程 {old.pid} 回收失败: {e}", file=sys.stderr)
+            with self._cond:
+                old.retiring = False
+                self._cond.notify_all()
+            return
+        finally:
+            if path is not None and os.path.exists(path):
+                os.remove(path)
+
+        with self._cond:
+            for session_id in old.sessions:
+                self._bindings[session_id] = new
+                if notice:
+                    self._notices[session_id] = notice
+            new.sessions |= old.sessions
+            self._remove(old)
+            self._replenish()
+        old.stop()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            workers = list(self._workers)
+            summary = {
+                "size": self.size,
+                "spares": len(self._spares),
+                "starting": self._starting,
+                "sessions": len(self._bindings),
+                "restarts": dict(self.restarts),
+                "spawn_failures": self.spawn_failures,
+            }
+        summary["workers"] = [worker.info() for worker in workers]
+        return summary
+
+
+def run_batches(backends: Sequence[Callable[[], Any]], batches: Sequence[Any],
+                call: Callable[[Any, Any], Any], fail: Callable[[Any, str], Any],
+                done: Callable[[Any, Any], None], name: str = "pymol-batch") -> None:
+    """在多个PyMOL后端上并发处理一组批次（批量转换、缩略图画廊等共用）
+
+    backends 为返回 cmd 代理的函数，在该后端领到第一批时才调用（借来的进程可以在此
+    载入场景）；backends[0] 在调用线程中运行，其余每个一个线程，从共享队列中取批次。
+    每批得到 call(cmd, batch) 的结果，出错时为 fail(batch, 错误信息) 的结果（整批失败，
+    例如PyMOL进程崩溃，继续处理其他批次），再交给 done(batch, 结果)；done 可能在多个
+    线程中调用。借来的后端连不上时把这批放回队列、不再领取，由其他后端处理。
+    """
+    pending: "queue.Queue[Any]" = queue.Queue()
+    for batch in batches:
+        pending.put(batch)
+
+    def work(get_cmd: Callable[[], Any], primary: bool) -> None:
+        cmd = None
+        while True:
+            try:
+                batch = pending.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                if cmd is None:
+                    try:
+                        cmd = get_cmd()
+                    except Exception:
+                        if primary:
+                            raise
+                        pending.put(batch)
+                        return
+                result = call(cmd, batch)
+            except Exception as e:
+                result = fail(batch, f"{type(e).__name__}: {e}")
+            done(batch, result)
+
+    threads = [threading.Thread(target=work, args=(get_cmd, False), name=f"{name}-{k}", daemon=True)
+               for k, get_cmd in enumerate(backends[1:], 1)]
+    for thread in threads:
+        thread.start()
+    work(backends[0], True)
+    for thread in threads:
+        thread.join()
+    # 处理借来的后端在主后端结束后才放回的批次
+    work(backends[0], True)
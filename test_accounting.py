@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+资源用量统计回归测试
+
+检查 pymol_accounting.UsageLedger 的差值计算、按会话/工具/后端汇总、
+会话淘汰合并到 "(evicted)" 和快照排序；CostGuard 的超限判断，以及
+lod/warn/reject 三种策略在工具调用中的效果；远程后端默认不逐次采样。
+用一个记录调用的假 cmd 代替PyMOL。
+
+使用方法:
+    python test_accounting.py
+    或: python -m pytest test_accounting.py
+"""
+
+import os
+import sys
+
+import pymol_accounting
+import pymol_mcp_server as server
+from pymol_accounting import CostGuard, UsageLedger
+
+
+def test_ledger_records_deltas_per_table():
+    ledger = UsageLedger()
+    entry = ledger.record("s1", "pymol_ray", "w1", 2.0,
+                          {"cpu_s": 10.0, "rss_mb": 100.0}, {"cpu_s": 11.5, "rss_mb": 160.0})
+    assert entry["cpu_s"] == 1.5 and entry["rss_delta_mb"] == 60.0 and entry["rss_mb"] == 160.0
+    # 内存下降不计入增长；缺少采样时只记录耗时
+    ledger.record("s1", "pymol_ray", "w1", 1.0, {"cpu_s": 11.5, "rss_mb": 160.0}, {"cpu_s": 12.0, "rss_mb": 120.0})
+    entry = ledger.record("s2", "pymol_show", "w1", 0.5, None, None)
+    assert entry["cpu_s"] is None and entry["rss_mb"] is None
+
+    snapshot = ledger.snapshot()
+    ray = snapshot["by_tool"]["pymol_ray"]
+    assert ray["calls"] == 2 and ray["wall_s"] == 3.0 and ray["cpu_s"] == 2.0
+    assert ray["rss_growth_mb"] == 60.0 and ray["max_rss_delta_mb"] == 60.0 and ray["peak_rss_mb"] == 160.0
+    assert snapshot["by_backend"]["w1"]["calls"] == 3
+    assert snapshot["by_session"]["s2"] == {"calls": 1, "wall_s": 0.5, "cpu_s": 0.0, "rss_growth_mb": 0.0,
+                                            "max_rss_delta_mb": 0.0, "peak_rss_mb": 0.0}
+    assert len(snapshot["recent"]) == 3
+
+
+def test_ledger_evicts_old_sessions_and_sorts_snapshot():
+    ledger = UsageLedger(recent=2, max_sessions=3)
+    for k in range(5):
+        ledger.record(f"s{k}", "pymol_ray", "w1", 1.0, {"cpu_s": 0.0}, {"cpu_s": float(k * k)})
+    sessions = ledger.snapshot()["by_session"]
+    # 最早的会话合并到一行，表中的条目数不超过上限
+    assert len(sessions) == 3 and set(sessions) == {"s3", "s4", UsageLedger.EVICTED}
+    assert sessions[UsageLedger.EVICTED]["calls"] == 3
+    # 按CPU时间降序，top 限制条目数
+    top = ledger.snapshot(top=2)
+    assert list(top["by_session"]) == ["s4", "s3"]
+    assert [e["session_id"] for e in top["recent"]] == ["s3", "s4"]
+    # 被淘汰的会话再次出现时重新计数，"(evicted)" 行不会被自己淘汰
+    ledger.record("s0", "pymol_ray", "w1", 1.0, None, None)
+    ledger.record("s5", "pymol_ray", "w1", 1.0, None, None)
+    sessions = ledger.snapshot()["by_session"]
+    assert UsageLedger.EVICTED in sessions and sessions["s0"]["calls"] == 1
+    assert sum(totals["calls"] for totals in sessions.values()) == 7
+
+
+def test_cost_guard_check():
+    try:
+        CostGuard(policy="ignore")
+        raise AssertionError("应当拒绝未知策略")
+    except ValueError:
+        pass
+    guard = CostGuard({"surface": 1000}, policy="warn")
+    atoms = {"big": 5000, "small": 10}
+    assert guard.check([("surface", "small"), ("sticks", "big")], atoms.get) == []
+    assert guard.flagged == 0
+    problems = guard.check([("surface", "big"), ("surface", "small")], atoms.get)
+    assert len(problems) == 1 and "5000" in problems[0] and "1000" in problems[0]
+    assert guard.flagged == 1
+
+
+class _FakeCmd:
+    """记录 show 调用；count_atoms 按选择表达式返回固定的原子数"""
+
+    def __init__(self):
+        self.atoms = {"big": 10 ** 6, "small": 100}
+        self.shown = []
+        self.settings = {}
+        self.usage_calls = 0
+
+    def count_atoms(self, selection="all"):
+        return self.atoms.get(selection, 0)
+
+    def show(self, rep, selection):
+        self.shown.append((rep, selection))
+
+    def get_object_list(self, selection):
+        return ["big"]
+
+    def set(self, setting, value, obj=""):
+        self.settings[setting] = value
+
+    def mcp_helper_version(self):
+        return server._CAPTURE_HELPER_VERSION
+
+    def mcp_resource_usage(self):
+        self.usage_calls += 1
+        return {"pid": os.getpid(), "rss_mb": 1.0, "cpu_s": 0.0}
+
+
+def _call(name, arguments, policy):
+    fake = _FakeCmd()
+    server.pymol_conn.attach(fake)
+    server.pymol_conn.capture_ready = None
+    server.pymol_conn.write_combiner = None
+    server.worker_pool = None
+    server.cost_guard = CostGuard(policy=policy)
+    try:
+        result = server._call_tool_on_backend(name, arguments, None, "test-session")
+    finally:
+        server.cost_guard = None
+    return fake, "\n".join(content.text for content in result)
+
+
+def test_reject_policy_skips_expensive_call():
+    fake, text = _call("pymol_show", {"representation": "surface", "selection": "big"}, "reject")
+    assert text.startswith("错误: 调用可能非常昂贵") and fake.shown == []
+    fake, text = _call("pymol_show", {"representation": "surface", "selection": "small"}, "reject")
+    assert fake.shown == [("surface", "small")] and "警告" not in text
+
+
+def test_warn_policy_runs_and_warns():
+    fake, text = _call("pymol_show", {"representation": "surface", "selection": "big"}, "warn")
+    assert fake.shown == [("surface", "big")]
+    assert "警告: 调用可能非常昂贵" in text and fake.settings == {}
+
+
+def test_lod_policy_reduces_detail():
+    fake, text = _call("pymol_show", {"representation": "surface", "selection": "big"}, "lod")
+    assert fake.shown == [("surface", "big")]
+    assert fake.settings == {"surface_quality": -2} and "已降低细节" in text
+    assert "警告" not in text
+    # force=true 跳过降级
+    fake, text = _call("pymol_show", {"representation": "surface", "selection": "big", "force": True}, "lod")
+    assert fake.settings == {} and fake.shown == [("surface", "big")]
+
+
+def test_remote_backend_is_not_sampled_per_call():
+    fake = _FakeCmd()
+    conn = server.PyMOLConnection(host="10.0.0.5")
+    conn._server = fake
+    conn._url = "http://10.0.0.5:9123"
+    assert not server.remote_accounting
+    for _ in range(3):
+        assert server._sample_backend(conn, fake) is None
+    assert fake.usage_calls == 0
+    # 管理端点显式要求时才采样
+    assert server._sample_backend(conn, fake, allow_rpc=True)["rss_mb"] == 1.0
+    assert fake.usage_calls == 1
+
+
+def test_local_backend_probes_once():
+    fake = _FakeCmd()
+    server.pymol_conn.attach(fake)
+    server.pymol_conn.capture_ready = None
+    conn = server.pymol_conn
+    for _ in range(3):
+        usage = server._sample_backend(conn, fake)
+        assert usage is not None and usage["cpu_s"] >= 0
+    if pymol_accounting.process_usage(os.getpid()) is not None:
+        assert conn.usage_mode == "local" and fake.usage_calls == 1
+
+
+if __name__ == "__main__":
+    failed = 0
+    for name, test in list(globals().items()):
+        if not name.startswith("test_") or not callable(test):
+            continue
+        try:
+            test()
+            print(f"✓ {name}")
+        except AssertionError as e:
+            failed += 1
+            print(f"✗ {name}: {e}")
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""
+准入控制回归测试
+
+检查 pymol_admission.AdmissionController 的全局和按工具并发上限
+（含工作进程池模式下按后端分别计算）、FIFO排队、排队已满/超时拒绝、
+取消排队中的调用后名额不泄漏，以及按会话的令牌桶限速（排队已满被拒绝时不消耗令牌）。
+
+使用方法:
+    python test_admission.py
+    或: python -m pytest test_admission.py
+"""
+
+import asyncio
+import sys
+
+from pymol_admission import AdmissionController, AdmissionRejected
+
+
+class _Tracker:
+    """记录同时执行的调用数峰值和获准执行的顺序"""
+
+    def __init__(self):
+        self.running = 0
+        self.peak = 0
+        self.order = []
+
+    async def call(self, controller, session, tool, label, backend=None, seconds=0.02):
+        async with controller.admit(session, tool, backend):
+            self.order.append(label)
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+            await asyncio.sleep(seconds)
+            self.running -= 1
+
+
+async def _settle():
+    """让新建的任务走到持有名额或排队的位置（wait_for 内部还要再调度一次）"""
+    await asyncio.sleep(0.01)
+
+
+def _assert_idle(controller):
+    stats = controller.stats()
+    assert stats["in_flight"] == 0 and stats["queued"] == 0, stats
+    assert all(t["in_flight"] == 0 and t["queued"] == 0 for t in stats["tools"].values()), stats
+
+
+def test_global_limit_and_fifo_order():
+    async def main():
+        controller = AdmissionController(max_in_flight=2, rate=None)
+        tracker = _Tracker()
+        await asyncio.gather(*(tracker.call(controller, "s", "pymol_count_atoms", k, seconds=0.01 * (k % 2 + 1))
+                               for k in range(8)))
+        assert tracker.peak == 2
+        assert tracker.order == list(range(8))
+        assert controller.stats()["admitted"] == 8
+        _assert_idle(controller)
+
+    asyncio.run(main())
+
+
+def test_tool_limit_without_backend_is_shared():
+    async def main():
+        controller = AdmissionController(max_in_flight=8, rate=None)
+        tracker = _Tracker()
+        await asyncio.gather(*(tracker.call(controller, f"s{k}", "pymol_ray", k) for k in range(4)))
+        assert tracker.peak == 1
+        assert tracker.order == [0, 1, 2, 3]
+        _assert_idle(controller)
+
+    asyncio.run(main())
+
+
+def test_tool_limit_is_per_backend():
+    async def main():
+        controller = AdmissionController(max_in_flight=8, rate=None)
+        overall = _Tracker()
+        per_backend = {"w1": _Tracker(), "w2": _Tracker(), "w3": _Tracker()}
+
+        async def call(k):
+            backend = f"w{k % 3 + 1}"
+            async with controller.admit(f"s{k}", "pymol_ray", backend):
+                for tracker in (overall, per_backend[backend]):
+                    tracker.running += 1
+                    tracker.peak = max(tracker.peak, tracker.running)
+                await asyncio.sleep(0.02)
+                for tracker in (overall, per_backend[backend]):
+                    tracker.running -= 1
+
+        await asyncio.gather(*(call(k) for k in range(9)))
+        # 同一后端内串行，不同后端之间并行
+        assert overall.peak == 3
+        assert all(t.peak == 1 for t in per_backend.values())
+        # 空闲的按后端名额已被丢弃
+        assert controller.stats()["tools"] == {}
+        _assert_idle(controller)
+
+    asyncio.run(main())
+
+
+def test_queue_full_and_tool_queue_full_rejections():
+    async def main():
+        controller = AdmissionController(max_in_flight=1, max_queue=2, tool_queue=1, rate=None)
+        release = asyncio.Event()
+
+        async def hold(tool, backend=None):
+            async with controller.admit("s", tool, backend):
+                await release.wait()
+
+        holder = asyncio.create_task(hold("pymol_ray", "w1"))
+        await _settle()
+        waiter = asyncio.create_task(hold("pymol_ray", "w1"))
+        await _settle()
+
+        try:
+            async with controller.admit("s", "pymol_ray", "w1"):
+                pass
+            raise AssertionError("应当拒绝")
+        except AdmissionRejected as e:
+            assert e.reason == "tool_queue_full"
+            assert e.to_dict()["status"] == 429 and e.retry_after > 0
+
+        # 另一个后端的 pymol_ray 不受 w1 排队的影响，但会排在全局上限处
+        other = asyncio.create_task(hold("pymol_ray", "w2"))
+        await _settle()
+        assert controller.queued() == 2
+        try:
+            async with controller.admit("s", "pymol_count_atoms"):
+                pass
+            raise AssertionError("应当拒绝")
+        except AdmissionRejected as e:
+            assert e.reason == "queue_full"
+
+        release.set()
+        await asyncio.gather(holder, waiter, other)
+        assert controller.rejected == {"tool_queue_full": 1, "queue_full": 1}
+        _assert_idle(controller)
+
+    asyncio.run(main())
+
+
+def test_queue_timeout_and_cancellation_release_slots():
+    async def main():
+        controller = AdmissionController(max_in_flight=1, max_wait=0.05, rate=None)
+        release = asyncio.Event()
+
+        async def hold():
+            async with controller.admit("s", "pymol_ray"):
+                await release.wait()
+
+        holder = asyncio.create_task(hold())
+        await _settle()
+        try:
+            async with controller.admit("s", "pymol_ray"):
+                pass
+            raise AssertionError("应当超时")
+        except AdmissionRejected as e:
+            assert e.reason == "queue_timeout"
+
+        cancelled = asyncio.create_task(hold())
+        await _settle()
+        assert controller.queued() == 1
+        cancelled.cancel()
+        await asyncio.gather(cancelled, return_exceptions=True)
+        assert controller.queued() == 0
+
+        release.set()
+        await holder
+        _assert_idle(controller)
+        # 名额没有泄漏：之后的调用立即通过
+        async with controller.admit("s", "pymol_ray"):
+            assert controller.stats()["in_flight"] == 1
+
+    asyncio.run(main())
+
+
+def test_rate_limit_per_session():
+    async def main():
+        controller = AdmissionController(rate=1.0, burst=3)
+        for _ in range(3):
+            async with controller.admit("a", "pymol_count_atoms"):
+                pass
+        try:
+            async with controller.admit("a", "pymol_count_atoms"):
+                pass
+            raise AssertionError("应当限速")
+        except AdmissionRejected as e:
+            assert e.reason == "rate_limited"
+            assert 0 < e.retry_after <= 1.0
+        # 其他会话有自己的令牌桶
+        async with controller.admit("b", "pymol_count_atoms"):
+            pass
+        assert controller.stats()["rate_limit"]["sessions"] == 2
+
+    asyncio.run(main())
+
+
+def test_queue_full_rejection_keeps_rate_token():
+    async def main():
+        controller = AdmissionController(max_in_flight=1, max_queue=1, tool_limits={}, rate=0.001, burst=3)
+        release = asyncio.Event()
+
+        async def hold(session):
+            async with controller.admit(session, "pymol_count_atoms"):
+                await release.wait()
+
+        holder = asyncio.create_task(hold("other"))
+        await _settle()
+        waiter = asyncio.create_task(hold("other"))
+        await _settle()
+        # 排队已满时的拒绝不消耗令牌：突发数为3的会话被拒绝多次后仍能调用3次
+        for _ in range(5):
+            try:
+                async with controller.admit("a", "pymol_count_atoms"):
+                    pass
+                raise AssertionError("应当拒绝")
+            except AdmissionRejected as e:
+                assert e.reason == "queue_full"
+        release.set()
+        await asyncio.gather(holder, waiter)
+        for _ in range(3):
+            async with controller.admit("a", "pymol_count_atoms"):
+                pass
+        try:
+            async with controller.admit("a", "pymol_count_atoms"):
+                pass
+            raise AssertionError("应当限速")
+        except AdmissionRejected as e:
+            assert e.reason == "rate_limited"
+        assert controller.rejected == {"queue_full": 5, "rate_limited": 1}
+        _assert_idle(controller)
+
+    asyncio.run(main())
+
+
+if __name__ == "__main__":
+    failed = 0
+    for name, test in list(globals().items()):
+        if not name.startswith("test_") or not callable(test):
+            continue
+        try:
+            test()
+            print(f"✓ {name}")
+        except AssertionError as e:
+            failed += 1
+            print(f"✗ {name}: {e}")
+    sys.exit(1 if failed else 0)
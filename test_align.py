@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+多结构比对回归测试
+
+检查 pymol_align 的目标解析（显式名称加通配符、去重、排除参考结构）、
+按后端顺序分块，以及结果排序和分页的边界：整页、最后一页不足、
+offset 超出结果数、出错的目标单独列出且不占分页名额。
+
+使用方法:
+    python test_align.py
+    或: python -m pytest test_align.py
+"""
+
+import sys
+
+from pymol_align import page, resolve_targets, split
+
+
+def _results(count, failed=()):
+    results = [{"target": f"m{k:02d}", "rmsd": round(1.0 + (k * 7 % count) / 10, 3), "atoms": 100 - k}
+               for k in range(count)]
+    results += [{"target": name, "error": "Selector-Error"} for name in failed]
+    return results
+
+
+def _walk(results, limit, **kwargs):
+    """按 next_offset 逐页读取，返回每页的目标列表"""
+    pages, offset = [], 0
+    while offset is not None:
+        body = page(results, offset=offset, limit=limit, **kwargs)
+        pages.append([r["target"] for r in body["results"]])
+        offset = body["next_offset"]
+        assert len(pages) <= len(results) + 1, "next_offset 没有前进"
+    return pages
+
+
+def test_resolve_targets_and_split():
+    names = ["ref", "m1", "m2", "x1", "m3"]
+    assert resolve_targets(names, "ref", ["x1", "m2"], "m*") == ["x1", "m2", "m1", "m3"]
+    assert resolve_targets(names, "ref", None, "*") == ["m1", "m2", "x1", "m3"]
+    assert resolve_targets(names, "ref", ["ref"], None) == []
+    assert split(list("abcdefg"), 3) == [list("abc"), list("de"), list("fg")]
+    assert split(list("ab"), 5) == [["a"], ["b"]]
+    assert split([], 3) == [[]]
+
+
+def test_pages_cover_results_exactly_once():
+    results = _results(10)
+    ordered = [r["target"] for r in sorted(results, key=lambda r: r["rmsd"])]
+    for limit in (1, 3, 5, 10, 50):
+        pages = _walk(results, limit)
+        assert [t for p in pages for t in p] == ordered, limit
+        # 结果数是每页条数的整数倍时不会多出一个空页
+        assert all(pages) and len(pages) == -(-10 // limit)
+
+
+def test_page_boundaries():
+    results = _results(10)
+    last = page(results, offset=8, limit=5)
+    assert len(last["results"]) == 2 and last["next_offset"] is None
+    full = page(results, offset=5, limit=5)
+    assert len(full["results"]) == 5 and full["next_offset"] is None
+    assert page(results, offset=4, limit=5)["next_offset"] == 9
+    beyond = page(results, offset=25, limit=5)
+    assert beyond["results"] == [] and beyond["next_offset"] is None and beyond["total"] == 10
+    # 负的 offset 按 0 处理
+    assert page(results, offset=-3, limit=2)["results"] == page(results, limit=2)["results"]
+    assert page([], limit=5) == {"total": 0, "offset": 0, "limit": 5, "next_offset": None,
+                                 "results": [], "failed": []}
+    for limit in (0, -1):
+        try:
+            page(results, limit=limit)
+            raise AssertionError("应当拒绝")
+        except ValueError:
+            pass
+
+
+def test_failed_targets_are_listed_separately():
+    results = _results(4, failed=["bad1", "bad2"])
+    body = page(results, limit=2)
+    assert body["total"] == 4 and body["next_offset"] == 2
+    assert [r["target"] for r in body["failed"]] == ["bad1", "bad2"]
+    # 每一页都附带全部出错的目标，正常结果的分页不受影响
+    assert _walk(results, 2, sort="target") == [["m00", "m01"], ["m02", "m03"]]
+
+
+def test_sort_keys_and_order():
+    results = _results(6)
+    by_atoms = page(results, sort="atoms", descending=True, limit=6)["results"]
+    assert [r["atoms"] for r in by_atoms] == [100, 99, 98, 97, 96, 95]
+    by_target = page(results, sort="target", limit=3, offset=3)["results"]
+    assert [r["target"] for r in by_target] == ["m03", "m04", "m05"]
+    by_rmsd = [r["rmsd"] for r in page(results, limit=6)["results"]]
+    assert by_rmsd == sorted(by_rmsd)
+    try:
+        page(results, sort="score")
+        raise AssertionError("应当拒绝")
+    except ValueError:
+        pass
+
+
+if __name__ == "__main__":
+    failed = 0
+    for name, test in list(globals().items()):
+        if not name.startswith("test_") or not callable(test):
+            continue
+        try:
+            test()
+            print(f"✓ {name}")
+        except AssertionError as e:
+            failed += 1
+            print(f"✗ {name}: {e}")
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+"""
+几何分析回归测试
+
+用 O(n²) 暴力计算核对 pymol_analysis 的向量化实现：网格索引的原子对、
+接触和近邻统计、Kabsch RMSD、Shrake-Rupley SASA、index区间写法，
+以及空间索引缓存的失效逻辑。不需要运行中的PyMOL。
+
+使用方法:
+    python test_analysis.py
+    或: python -m pytest test_analysis.py
+"""
+
+import sys
+from types import SimpleNamespace
+
+import numpy as np
+
+import pymol_analysis as pa
+
+
+def _random_table(n, seed=0, box=20.0, per_residue=5, chain="A"):
+    """n 个随机原子，每 per_residue 个原子一个残基"""
+    rng = np.random.default_rng(seed)
+    resi = np.array([str(k // per_residue + 1) for k in range(n)])
+    return pa.AtomTable(
+        coords=rng.uniform(0.0, box, size=(n, 3)),
+        name=np.array([f"C{k % per_residue}" for k in range(n)]),
+        resn=np.full(n, "ALA"),
+        resi=resi,
+        chain=np.full(n, chain),
+        elem=np.full(n, "C"),
+    )
+
+
+def _brute_pairs(a, b, cutoff):
+    d = np.linalg.norm(a[:, None, :] - b[None, :, :], axis=-1)
+    return d <= cutoff, d
+
+
+def _rotation(seed=1):
+    q, _ = np.linalg.qr(np.random.default_rng(seed).normal(size=(3, 3)))
+    return q if np.linalg.det(q) > 0 else -q
+
+
+def test_self_pairs_match_brute_force():
+    coords = _random_table(400).coords
+    for cell_size, cutoff in ((4.0, 4.0), (2.5, 4.0), (6.0, 3.0)):
+        i, j, d = pa.CellList(coords, cell_size).self_pairs(cutoff)
+        within, dist = _brute_pairs(coords, coords, cutoff)
+        expected = {(a, b) for a, b in zip(*np.nonzero(np.triu(within, k=1)))}
+        assert set(zip(i.tolist(), j.tolist())) == expected
+        assert len(i) == len(expected), "原子对重复"
+        assert np.allclose(d, dist[i, j])
+
+
+def test_query_pairs_match_brute_force():
+    index_coords = _random_table(300, seed=2).coords
+    points = _random_table(120, seed=3, box=25.0).coords - 2.5
+    i, j, d = pa.CellList(index_coords, 3.0).query_pairs(points, 5.0)
+    within, dist = _brute_pairs(points, index_coords, 5.0)
+    assert set(zip(i.tolist(), j.tolist())) == set(zip(*np.nonzero(within)))
+    assert len(i) == int(within.sum())
+    assert np.allclose(d, dist[i, j])
+
+
+def test_contacts_match_brute_force():
+    table1 = _random_table(200, seed=4, chain="A")
+    table2 = _random_table(150, seed=5, chain="B")
+    result = pa.contacts(table1, table2, cutoff=4.0, max_results=10_000)
+    within, dist = _brute_pairs(table1.coords, table2.coords, 4.0)
+    assert result["atom_contacts"] == int(within.sum())
+
+    res1, res2 = table1.residue_labels(), table2.residue_labels()
+    expected = {}
+    for a, b in zip(*np.nonzero(within)):
+        key = (res1[a], res2[b])
+        best, count = expected.get(key, (np.inf, 0))
+        expected[key] = (min(best, dist[a, b]), count + 1)
+    assert result["residue_contacts"] == len(expected)
+    for row in result["contacts"]:
+        best, count = expected[(row["residue1"], row["residue2"])]
+        assert row["atom_pairs"] == count
+        assert abs(row["min_distance"] - round(float(best), 2)) < 1e-9
+    distances = [row["min_distance"] for row in result["contacts"]]
+    assert distances == sorted(distances)
+
+
+def test_self_contacts_skip_same_residue():
+    table = _random_table(250, seed=6)
+    result = pa.contacts(table, None, cutoff=4.0, max_results=10_000)
+    within, _ = _brute_pairs(table.coords, table.coords, 4.0)
+    labels = table.residue_labels()
+    other_residue = labels[:, None] != labels[None, :]
+    assert result["atom_contacts"] == int(np.triu(within & other_residue, k=1).sum())
+    pairs = {tuple(sorted((labels[x], labels[y]))) for x, y in zip(*np.nonzero(within & other_residue))}
+    assert result["residue_contacts"] == len(pairs)
+
+
+def test_neighbors_match_brute_force():
+    candidates = _random_table(300, seed=7)
+    center = candidates.subset(np.arange(10))
+    result = pa.neighbors(center, candidates, cutoff=5.0, max_results=10_000)
+    within, dist = _brute_pairs(center.coords, candidates.coords, 5.0)
+    labels = candidates.residue_labels()
+    hit_atoms = np.nonzero(within.any(axis=0))[0]
+    assert result["atoms_within"] == len(hit_atoms)
+    assert {row["residue"] for row in result["residues"]} == set(labels[hit_atoms])
+    for row in result["residues"]:
+        mask = labels == row["residue"]
+        best = dist[:, mask][within[:, mask]].min()
+        assert abs(row["min_distance"] - round(float(best), 2)) < 1e-9
+
+
+def test_kabsch_rmsd_of_rigid_copy_is_zero():
+    coords = _random_table(50, seed=8).coords
+    moved = coords @ _rotation().T + np.array([3.0, -7.0, 11.0])
+    assert float(pa.kabsch_rmsd(moved, coords)) < 1e-6
+    # 批量输入：第二个构象加入噪声后RMSD应大于0
+    noisy = moved + np.random.default_rng(9).normal(scale=0.5, size=moved.shape)
+    batch = pa.kabsch_rmsd(np.stack([moved, noisy]), coords[np.newaxis])
+    assert batch.shape == (2,)
+    assert batch[0] < 1e-6 < batch[1]
+
+
+def test_kabsch_rmsd_does_not_allow_reflection():
+    coords = _random_table(30, seed=10).coords
+    mirrored = coords * np.array([-1.0, 1.0, 1.0])
+    assert float(pa.kabsch_rmsd(mirrored, coords)) > 0.1
+
+
+def test_rmsd_reports_fit_and_no_fit():
+    table = _random_table(40, seed=11)
+    moved = table.subset(np.arange(len(table)))
+    moved.coords = table.coords @ _rotation(12).T + 5.0
+    result = pa.rmsd(moved, table)
+    assert result["atoms"] == 40 and result["matched_by"] == "order"
+    assert result["rmsd_fit"] == 0.0
+    assert result["rmsd_no_fit"] > 1.0
+
+
+def test_shrake_rupley_isolated_and_buried_atoms():
+    single = _random_table(1, seed=13)
+    area = pa.shrake_rupley(single, probe=1.4, n_points=200)
+    assert np.isclose(area[0], 4 * np.pi * (1.70 + 1.4) ** 2)
+
+    # 中心原子被六个相邻原子包围，暴露面积应明显小于孤立时
+    offsets = np.vstack([np.zeros(3), np.eye(3) * 1.5, -np.eye(3) * 1.5])
+    cluster = _random_table(7, seed=14)
+    cluster.coords = offsets + 10.0
+    area = pa.shrake_rupley(cluster, probe=1.4, n_points=200)
+    assert area[0] < 0.05 * 4 * np.pi * (1.70 + 1.4) ** 2
+    assert np.all(area[1:] > area[0])
+
+
+def test_shrake_rupley_matches_brute_force():
+    table = _random_table(60, seed=15, box=12.0)
+    probe, n_points = 1.4, 64
+    area = pa.shrake_rupley(table, probe=probe, n_points=n_points, batch=16)
+    radii = table.radii() + probe
+    sphere = pa._sphere_points(n_points)
+    expected = np.empty(len(table))
+    for k in range(len(table)):
+        points = table.coords[k] + radii[k] * sphere
+        d = np.linalg.norm(points[:, None, :] - table.coords[None, :, :], axis=-1)
+        others = np.arange(len(table)) != k
+        exposed = ~(d[:, others] < radii[others]).any(axis=1)
+        expected[k] = exposed.sum() / n_points * 4 * np.pi * radii[k] ** 2
+    assert np.allclose(area, expected)
+
+
+def test_index_ranges():
+    assert pa.index_ranges([]) == ""
+    assert pa.index_ranges([7]) == "7"
+    assert pa.index_ranges([1, 2, 3, 4, 5, 9, 12, 13, 14]) == "1-5+9+12-14"
+    # 未排序和重复的输入先去重排序
+    assert pa.index_ranges([14, 3, 2, 2, 1, 9]) == "1-3+9+14"
+
+
+def _raises_value_error(func, *args, **kwargs):
+    try:
+        func(*args, **kwargs)
+    except ValueError as e:
+        return str(e)
+    raise AssertionError(f"{func.__name__}{args} 应当抛出 ValueError")
+
+
+def test_invalid_parameters_are_rejected():
+    table = _random_table(20, seed=18)
+    for cutoff in (0, -1.0, float("nan"), float("inf")):
+        assert "cutoff" in _raises_value_error(pa.contacts, table, None, cutoff=cutoff)
+        assert "cutoff" in _raises_value_error(pa.contacts, table, table, cutoff=cutoff)
+        assert "cutoff" in _raises_value_error(pa.neighbors, table, table, cutoff=cutoff)
+        assert "cutoff" in _raises_value_error(pa.CellList(table.coords, 4.0).query_pairs, table.coords, cutoff)
+    assert "cell_size" in _raises_value_error(pa.CellList, table.coords, 0)
+    assert "max_results" in _raises_value_error(pa.contacts, table, None, max_results=-1)
+    assert "max_results" in _raises_value_error(pa.neighbors, table, table, max_results=-1)
+    assert "probe" in _raises_value_error(pa.shrake_rupley, table, probe=-0.5)
+    assert "top" in _raises_value_error(pa.sasa_summary, table, top=-1)
+    assert "cutoff" in _raises_value_error(pa.SpatialIndexCache().select_near, None, "a`1", 0)
+    # 边界值仍然有效
+    assert pa.contacts(table, None, max_results=0)["contacts"] == []
+    assert pa.shrake_rupley(table, probe=0).sum() > 0
+
+
+class _FakeCmd:
+    """进程内模式的最小 cmd：对象为 {名字: AtomTable}，index从1开始"""
+
+    in_process = True
+
+    def __init__(self, objects):
+        self.objects = objects
+        self.model_calls = 0
+
+    def get_model(self, selection, state=-1):
+        self.model_calls += 1
+        table = self.objects[selection]
+        atoms = [
+            SimpleNamespace(coord=list(table.coords[k]), name=str(table.name[k]), resn=str(table.resn[k]),
+                            resi=str(table.resi[k]), chain=str(table.chain[k]), symbol=str(table.elem[k]))
+            for k in range(len(table))
+        ]
+        return SimpleNamespace(atom=atoms)
+
+    def identify(self, selection, mode=0):
+        if selection in self.objects:
+            return [(selection, k + 1) for k in range(len(self.objects[selection]))]
+        # 测试中 center 写成 "对象`index"
+        obj, idx = selection.split("`")
+        return [(obj, int(idx))]
+
+    def get_names(self, kind="objects", enabled_only=0):
+        return list(self.objects)
+
+
+def test_spatial_index_cache_hits_and_invalidation():
+    a, b = _random_table(80, seed=16), _random_table(60, seed=17, chain="B")
+    cmd = _FakeCmd({"a": a, "b": b})
+    cache = pa.SpatialIndexCache(cell_size=4.0)
+
+    near = cache.select_near(cmd, "a`1", 6.0)
+    assert cache.stats() == {"objects": 2, "hits": 1, "misses": 2}
+    for name, table in (("a", a), ("b", b)):
+        within = np.linalg.norm(table.coords - a.coords[0], axis=1) <= 6.0
+        expected = np.nonzero(within)[0] + 1
+        if name == "a":
+            expected = expected[expected != 1]
+        assert np.array_equal(near.get(name, np.zeros(0, dtype=np.int64)), expected)
+
+    cache.select_near(cmd, "a`1", 6.0)
+    assert cmd.model_calls == 2, "缓存命中时不应重新取坐标"
+
+    # 移动对象 b 后只失效 b：a 仍命中缓存，b 的查询结果反映新坐标
+    b.coords = b.coords + 100.0
+    cache.invalidate("b")
+    assert len(cache) == 1
+    near = cache.select_near(cmd, "a`1", 6.0)
+    assert cmd.model_calls == 3
+    assert "b" not in near
+
+    cache.invalidate()
+    assert len(cache) == 0
+    cache.get(cmd, "a")
+    assert cmd.model_calls == 4
+
+
+if __name__ == "__main__":
+    failed = 0
+    for name, test in list(globals().items()):
+        if not name.startswith("test_") or not callable(test):
+            continue
+        try:
+            test()
+            print(f"✓ {name}")
+        except AssertionError as e:
+            failed += 1
+            print(f"✗ {name}: {e}")
+    sys.exit(1 if failed else 0)
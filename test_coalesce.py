@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+写合并回归测试
+
+检查 pymol_coalesce.reduce_ops 的化简规则，并用一个简单的视图/颜色
+状态模型核对：随机操作序列化简前后的净效果相同。还覆盖 WriteCombiner
+的定时发送和 CoalescingCmd 在读取前先发送缓冲区的顺序保证。
+
+使用方法:
+    python test_coalesce.py
+    或: python -m pytest test_coalesce.py
+"""
+
+import math
+import random
+import sys
+import time
+
+from pymol_coalesce import CoalescingCmd, WriteCombiner, reduce_ops
+
+
+def _rotation(axis, angle):
+    c, s = round(math.cos(math.radians(angle)), 12), round(math.sin(math.radians(angle)), 12)
+    i, j = {"x": (1, 2), "y": (2, 0), "z": (0, 1)}[axis]
+    m = [[1.0 if r == k else 0.0 for k in range(3)] for r in range(3)]
+    m[i][i], m[i][j], m[j][i], m[j][j] = c, -s, s, c
+    return m
+
+
+def _matmul(a, b):
+    return [[sum(a[r][k] * b[k][col] for k in range(3)) for col in range(3)] for r in range(3)]
+
+
+def _apply(ops):
+    """操作序列的净效果：(视图基准, 最后一次zoom, 累计旋转, 每个选择的颜色, 背景色)"""
+    base, zoom, rot = None, None, _rotation("x", 0)
+    colors, bg = {}, None
+    for func, args in ops:
+        if func in ("reset", "orient"):
+            base, zoom, rot = (func, args), None, _rotation("x", 0)
+        elif func == "zoom":
+            zoom = args
+        elif func == "turn":
+            rot = _matmul(_rotation(*args), rot)
+        elif func == "color":
+            colors[args[1:]] = args[0]
+        elif func == "bg_color":
+            bg = args
+    rot = tuple(round(v, 9) + 0.0 for row in rot for v in row)
+    return base, zoom, rot, colors, bg
+
+
+def test_view_reset_drops_previous_view_ops():
+    ops = [("zoom", ("all",)), ("turn", ("x", 30)), ("color", ("red", "chain A")), ("orient", ("lig",))]
+    assert reduce_ops(ops) == [("color", ("red", "chain A")), ("orient", ("lig",))]
+    assert reduce_ops([("turn", ("y", 10)), ("reset", ())]) == [("reset", ())]
+
+
+def test_zoom_keeps_only_last_zoom_and_earlier_turns():
+    ops = [("zoom", ("a",)), ("turn", ("y", 90)), ("zoom", ("b",))]
+    assert reduce_ops(ops) == [("turn", ("y", 90)), ("zoom", ("b",))]
+
+
+def test_turns_merge_across_color_ops():
+    ops = [("turn", ("x", 90)), ("color", ("red", "all")), ("turn", ("x", 45))]
+    assert reduce_ops(ops) == [("color", ("red", "all")), ("turn", ("x", 135))]
+    # 合计为360度整数倍时整个 turn 消失
+    assert reduce_ops([("turn", ("z", 270)), ("turn", ("z", 90))]) == []
+    # 不同轴不合并
+    ops = [("turn", ("x", 90)), ("turn", ("y", 90))]
+    assert reduce_ops(ops) == ops
+
+
+def test_color_and_bg_color_keep_last_per_target():
+    ops = [("color", ("red", "chain A")), ("color", ("blue", "chain B")),
+           ("bg_color", ("black",)), ("color", ("green", "chain A")), ("bg_color", ("white",))]
+    assert reduce_ops(ops) == [("color", ("blue", "chain B")), ("color", ("green", "chain A")),
+                               ("bg_color", ("white",))]
+
+
+def test_random_sequences_keep_net_effect():
+    rng = random.Random(0)
+    makers = [
+        lambda: ("reset", ()),
+        lambda: ("orient", (rng.choice(["all", "lig"]),)),
+        lambda: ("zoom", (rng.choice(["all", "lig", "chain A"]),)),
+        lambda: ("turn", (rng.choice("xyz"), rng.choice([30, 90, 180, 270, -90]))),
+        lambda: ("color", (rng.choice(["red", "blue"]), rng.choice(["all", "chain A", "lig"]))),
+        lambda: ("bg_color", (rng.choice(["black", "white"]),)),
+    ]
+    for _ in range(500):
+        ops = [rng.choice(makers)() for _ in range(rng.randint(0, 12))]
+        reduced = reduce_ops(ops)
+        assert _apply(reduced) == _apply(ops), ops
+        assert len(reduced) <= len(ops)
+
+
+class _FakeCmd:
+    def __init__(self):
+        self.calls = []
+
+    def get_view(self):
+        self.calls.append(("get_view", ()))
+        return (0.0,) * 18
+
+
+def _send(cmd, ops):
+    cmd.calls.extend(ops)
+    return [None] * len(ops)
+
+
+def test_coalescing_cmd_flushes_before_reads():
+    cmd = _FakeCmd()
+    combiner = WriteCombiner(_send, lambda: cmd, window=10.0)
+    proxy = CoalescingCmd(cmd, combiner)
+    proxy.zoom("all")
+    proxy.turn("x", 90)
+    proxy.turn("x", 90)
+    proxy.zoom("lig")
+    assert cmd.calls == []
+    proxy.get_view()
+    assert cmd.calls == [("turn", ("x", 180)), ("zoom", ("lig",)), ("get_view", ())]
+    assert combiner.stats()["received"] == 4
+    assert combiner.stats()["sent"] == 2
+    assert combiner.stats()["buffered"] == 0
+
+
+def test_combiner_flushes_after_window_and_reports_errors():
+    cmd = _FakeCmd()
+    combiner = WriteCombiner(lambda c, ops: [f"bad {ops[0][0]}"], lambda: cmd, window=0.01)
+    combiner.add("bg_color", ("black",))
+    deadline = time.monotonic() + 2.0
+    while combiner.stats()["flushes"] == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert combiner.stats()["flushes"] == 1
+    assert combiner.take_errors() == ["bg_color('black',): bad bg_color"]
+    assert combiner.take_errors() == []
+
+
+if __name__ == "__main__":
+    failed = 0
+    for name, test in list(globals().items()):
+        if not name.startswith("test_") or not callable(test):
+            continue
+        try:
+            test()
+            print(f"✓ {name}")
+        except AssertionError as e:
+            failed += 1
+            print(f"✗ {name}: {e}")
+    sys.exit(1 if failed else 0)
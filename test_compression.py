@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+压缩传输回归测试
+
+检查 HTTP 的 CompressionMiddleware（请求体解压、解压上限、响应压缩协商、
+流式响应逐块刷新）和发往 PyMOL 的 CompressingTransport（大请求体 gzip、
+gzip 响应解压），XML-RPC 部分对模拟后端 pymol_fake 做一次真实往返。
+
+使用方法:
+    python test_compression.py
+    或: python -m pytest test_compression.py
+"""
+
+import asyncio
+import gzip
+import socket
+import sys
+import xmlrpc.client
+import zlib
+
+import pymol_mcp_server as server
+from pymol_mcp_server import CompressingTransport, CompressionMiddleware
+
+
+async def _echo_app(scope, receive, send):
+    """回显请求体，并在响应头中报告收到的 Content-Length"""
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body", False):
+            break
+    length = dict(scope["headers"]).get(b"content-length", b"")
+    await send({"type": "http.response.start", "status": 200,
+                "headers": [(b"content-type", b"application/octet-stream"), (b"x-length", length)]})
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _stream_app(scope, receive, send):
+    await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", b"text/event-stream")]})
+    for k in range(3):
+        await send({"type": "http.response.body", "body": b"data: %d\n\n" % k, "more_body": True})
+    await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+def _request(app, body, headers=(), chunk=65536):
+    """用 ASGI 直接调用 app，请求体按 chunk 分块送达，返回 (状态, 响应头, 各个响应体消息)"""
+    chunks = [body[k:k + chunk] for k in range(0, len(body), chunk)] or [b""]
+    messages = [{"type": "http.request", "body": c, "more_body": k < len(chunks) - 1}
+                for k, c in enumerate(chunks)]
+    sent = []
+
+    async def receive():
+        return messages.pop(0) if messages else {"type": "http.disconnect"}
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "method": "POST", "path": "/messages/", "query_string": b"",
+             "headers": [(k.lower().encode(), v.encode()) for k, v in headers]}
+    asyncio.run(app(scope, receive, send))
+    start = sent[0]
+    return start["status"], {k.decode(): v.decode() for k, v in start["headers"]}, \
+        [m.get("body", b"") for m in sent[1:]]
+
+
+def test_gzip_and_deflate_request_round_trip():
+    app = CompressionMiddleware(_echo_app, minimum_size=1 << 30)
+    payload = b'{"jsonrpc": "2.0", "method": "tools/call"}' * 500
+    for encoding, data in (("gzip", gzip.compress(payload)), ("deflate", zlib.compress(payload))):
+        status, headers, bodies = _request(app, data, [("Content-Encoding", encoding)], chunk=100)
+        assert status == 200
+        assert b"".join(bodies) == payload
+        assert headers["x-length"] == str(len(payload))
+
+
+def test_decompressed_size_limit_returns_413():
+    app = CompressionMiddleware(_echo_app, max_request_size=64 * 1024)
+    # 约 100 字节的压缩数据展开为 10 MB
+    bomb = gzip.compress(b"\0" * (10 * 1024 * 1024))
+    assert len(bomb) < 64 * 1024
+    status, _, bodies = _request(app, bomb, [("Content-Encoding", "gzip")], chunk=16)
+    assert status == 413, b"".join(bodies)
+    # 刚好在上限内的请求体照常通过
+    status, _, bodies = _request(app, gzip.compress(b"x" * 64 * 1024), [("Content-Encoding", "gzip")])
+    assert status == 200 and len(b"".join(bodies)) == 64 * 1024
+
+
+def test_compressed_size_limit_returns_413():
+    app = CompressionMiddleware(_echo_app, max_request_size=1024)
+    incompressible = bytes(range(256)) * 64
+    status, _, _ = _request(app, zlib.compress(incompressible), [("Content-Encoding", "deflate")], chunk=256)
+    assert status == 413
+
+
+def test_invalid_or_truncated_body_returns_400():
+    app = CompressionMiddleware(_echo_app)
+    status, _, _ = _request(app, b"not gzip at all", [("Content-Encoding", "gzip")])
+    assert status == 400
+    status, _, _ = _request(app, gzip.compress(b"x" * 1000)[:-12], [("Content-Encoding", "gzip")])
+    assert status == 400
+
+
+def test_response_compression_negotiation():
+    app = CompressionMiddleware(_echo_app, minimum_size=100)
+    payload = b"abc" * 1000
+    status, headers, bodies = _request(app, payload, [("Accept-Encoding", "br, gzip;q=0.5")])
+    assert headers["content-encoding"] == "gzip"
+    assert gzip.decompress(b"".join(bodies)) == payload
+    assert headers["content-length"] == str(len(b"".join(bodies)))
+    # 小响应和不接受压缩的客户端原样发送
+    for body, accept in ((b"tiny", "gzip"), (payload, "gzip;q=0"), (payload, "")):
+        _, headers, bodies = _request(app, body, [("Accept-Encoding", accept)])
+        assert "content-encoding" not in headers and b"".join(bodies) == body
+
+
+def test_streaming_response_flushes_each_chunk():
+    app = CompressionMiddleware(_stream_app, minimum_size=1 << 30)
+    _, headers, bodies = _request(app, b"", [("Accept-Encoding", "deflate")])
+    assert headers["content-encoding"] == "deflate" and "content-length" not in headers
+    decompressor = zlib.decompressobj()
+    events = [decompressor.decompress(body) for body in bodies]
+    # 每个事件在自己的消息中就能完整解压，不等后续数据
+    assert events[:3] == [b"data: 0\n\n", b"data: 1\n\n", b"data: 2\n\n"]
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def test_xmlrpc_transport_gzip_round_trip():
+    import pymol_fake
+    port = _free_port()
+    fake = pymol_fake.serve_fake_pymol(port, latency=0, ray_latency=0)
+    try:
+        stats = server.transport_stats["xmlrpc_request"]
+        before = (stats.messages, stats.compressed)
+        proxy = xmlrpc.client.ServerProxy(f"http://127.0.0.1:{port}", allow_none=True,
+                                          transport=CompressingTransport(encode_threshold=1024))
+        pdb = pymol_fake._make_pdb(500)
+        proxy.read_pdbstr(pdb, "big")
+        assert "big" in proxy.get_names("objects")
+        # 大请求体压缩发送，小请求体原样发送
+        assert stats.messages - before[0] == 2
+        assert stats.compressed - before[1] == 1
+        # 关闭压缩时从不压缩
+        plain = xmlrpc.client.ServerProxy(f"http://127.0.0.1:{port}", allow_none=True,
+                                          transport=CompressingTransport(encode_threshold=None))
+        plain.read_pdbstr(pdb, "big2")
+        assert stats.compressed - before[1] == 1
+    finally:
+        fake.shutdown()
+        fake.server_close()
+
+
+class _FakeResponse:
+    def __init__(self, body, encoding=""):
+        self._body = body
+        self._encoding = encoding
+
+    def read(self):
+        return self._body
+
+    def getheader(self, name, default=""):
+        return self._encoding if name == "Content-Encoding" and self._encoding else default
+
+
+def test_xmlrpc_transport_decodes_gzip_response():
+    body = xmlrpc.client.dumps(({"objects": ["a", "b"]},), methodresponse=True).encode()
+    transport = CompressingTransport()
+    assert transport.parse_response(_FakeResponse(gzip.compress(body), "gzip")) == ({"objects": ["a", "b"]},)
+    assert transport.parse_response(_FakeResponse(body)) == ({"objects": ["a", "b"]},)
+
+
+if __name__ == "__main__":
+    failed = 0
+    for name, test in list(globals().items()):
+        if not name.startswith("test_") or not callable(test):
+            continue
+        try:
+            test()
+            print(f"✓ {name}")
+        except AssertionError as e:
+            failed += 1
+            print(f"✗ {name}: {e}")
+    sys.exit(1 if failed else 0)
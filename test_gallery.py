@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+缩略图画廊回归测试
+
+检查 pymol_gallery 的条目解析、联系表布局（缩略图数不是列数整数倍时最后一行
+留空）、每格的位置索引、尺寸不符的缩略图居中裁剪、PPM解析和PNG编码
+（按PNG规范自行解码核对像素），缩略图缓存的淘汰，以及用假 cmd 分批渲染。
+
+使用方法:
+    python test_gallery.py
+    或: python -m pytest test_gallery.py
+"""
+
+import struct
+import sys
+import zlib
+
+import numpy as np
+
+from pymol_gallery import (PADDING, SHEET_BACKGROUND, GalleryItem, ThumbnailCache, encode_png, layout,
+                           parse_ppm, render, resolve_items, tile)
+
+
+def _ppm(image, comment=b""):
+    height, width, _ = image.shape
+    return b"P6\n" + comment + b"%d %d\n255\n" % (width, height) + image.astype(np.uint8).tobytes()
+
+
+def _solid(height, width, value):
+    return np.full((height, width, 3), value, dtype=np.uint8)
+
+
+def _decode_png(data):
+    """按PNG规范解码 8 位 RGB、无隔行的图像（只支持 None/Sub/Up 滤波）"""
+    assert data[:8] == b"\x89PNG\r\n\x1a\n"
+    position, chunks = 8, []
+    while position < len(data):
+        length, kind = struct.unpack(">I4s", data[position:position + 8])
+        payload = data[position + 8:position + 8 + length]
+        crc, = struct.unpack(">I", data[position + 8 + length:position + 12 + length])
+        assert crc == zlib.crc32(kind + payload) & 0xFFFFFFFF, kind
+        chunks.append((kind, payload))
+        position += 12 + length
+    assert [kind for kind, _ in chunks] == [b"IHDR", b"IDAT", b"IEND"]
+    width, height, depth, color, _, _, interlace = struct.unpack(">IIBBBBB", chunks[0][1])
+    assert (depth, color, interlace) == (8, 2, 0)
+    raw = np.frombuffer(zlib.decompress(chunks[1][1]), dtype=np.uint8).reshape(height, width * 3 + 1)
+    rows = np.zeros((height, width * 3), dtype=np.uint8)
+    for y in range(height):
+        kind, line = raw[y, 0], raw[y, 1:]
+        if kind == 0:
+            rows[y] = line
+        elif kind == 1:
+            row = line.astype(np.int64)
+            for x in range(3, width * 3):
+                row[x] = (row[x] + row[x - 3]) % 256
+            rows[y] = row
+        elif kind == 2:
+            rows[y] = line + (rows[y - 1] if y else 0)
+        else:
+            raise AssertionError(f"不支持的滤波类型 {kind}")
+    return rows.reshape(height, width, 3)
+
+
+def test_resolve_items():
+    names = ["ref", "m1", "m2", "x1"]
+    assert [i.name for i in resolve_items(names, None, None)] == names
+    assert [i.name for i in resolve_items(names, ["x1", "m1"], "m*")] == ["x1", "m1", "m2"]
+    states = {"m1": 3, "m2": 0}
+    items = resolve_items(names, None, "m*", mode="state", count_states=states.get, max_states=2)
+    assert [(i.name, i.state) for i in items] == [("m1", 1), ("m1", 2), ("m2", 1)]
+    try:
+        resolve_items(names, None, None, mode="chain")
+        raise AssertionError("应当拒绝")
+    except ValueError:
+        pass
+
+
+def test_layout():
+    assert layout(0, 100, 100) == (0, 0)
+    assert layout(1, 100, 100) == (1, 1)
+    # 未指定列数时接近正方形
+    assert layout(9, 100, 100) == (3, 3)
+    assert layout(10, 100, 100) == (4, 3)
+    assert layout(8, 200, 100) == (2, 4)
+    # 列数多于缩略图数时收缩到一行
+    assert layout(3, 100, 100, columns=5) == (3, 1)
+    assert layout(7, 100, 100, columns=3) == (3, 3)
+
+
+def test_tile_with_partial_last_row():
+    tile_w, tile_h = 6, 4
+    items = [GalleryItem(f"m{k}", image=_solid(tile_h, tile_w, 10 * (k + 1))) for k in range(7)]
+    items[2].image, items[2].error = None, "Selector-Error"
+    items[5].cached = True
+    sheet, index = tile(items, tile_w, tile_h, columns=3)
+    assert sheet.shape == (3 * (tile_h + PADDING) + PADDING, 3 * (tile_w + PADDING) + PADDING, 3)
+    assert [(e["row"], e["col"]) for e in index] == [(0, 0), (0, 1), (0, 2), (1, 0), (1, 1), (1, 2), (2, 0)]
+    for entry, item in zip(index, items):
+        x, y = entry["x"], entry["y"]
+        assert (x, y) == (PADDING + entry["col"] * (tile_w + PADDING), PADDING + entry["row"] * (tile_h + PADDING))
+        cell = sheet[y:y + tile_h, x:x + tile_w]
+        expected = SHEET_BACKGROUND if item.image is None else (item.image[0, 0, 0],) * 3
+        assert (cell == expected).all(), entry
+    assert index[2]["error"] == "Selector-Error" and index[5]["cached"] and not index[0]["cached"]
+    assert "state" not in index[0]
+    # 最后一行剩下的两格和所有间隔都是背景色
+    last_y = index[6]["y"]
+    assert (sheet[last_y:last_y + tile_h, index[6]["x"] + tile_w:] == SHEET_BACKGROUND).all()
+    assert (sheet[:PADDING] == SHEET_BACKGROUND).all() and (sheet[:, :PADDING] == SHEET_BACKGROUND).all()
+
+
+def test_tile_centers_and_crops_mismatched_images():
+    small = GalleryItem("small", state=2, image=_solid(2, 4, 200))
+    large = GalleryItem("large", image=np.arange(5 * 8 * 3, dtype=np.uint8).reshape(5, 8, 3))
+    sheet, index = tile([small, large], 6, 4, columns=2)
+    x, y = index[0]["x"], index[0]["y"]
+    cell = sheet[y:y + 4, x:x + 6]
+    assert (cell[1:3, 1:5] == 200).all() and (cell[0] == SHEET_BACKGROUND).all()
+    assert index[0]["state"] == 2
+    x, y = index[1]["x"], index[1]["y"]
+    assert (sheet[y:y + 4, x:x + 6] == large.image[:4, :6]).all()
+
+
+def test_png_round_trip():
+    rng = np.random.default_rng(0)
+    for shape in ((1, 1, 3), (3, 5, 3), (17, 9, 3)):
+        image = rng.integers(0, 256, size=shape, dtype=np.uint8)
+        assert (_decode_png(encode_png(image)) == image).all(), shape
+    sheet, _ = tile([GalleryItem("a", image=_solid(4, 6, 7))] * 3, 6, 4, columns=2)
+    assert (_decode_png(encode_png(sheet, level=1)) == sheet).all()
+
+
+def test_parse_ppm():
+    image = np.arange(2 * 3 * 3, dtype=np.uint8).reshape(2, 3, 3)
+    assert (parse_ppm(_ppm(image)) == image).all()
+    assert (parse_ppm(_ppm(image, comment=b"# PyMOL\n")) == image).all()
+    for data in (b"\x89PNG....", b"P6\n3 2\n65535\n" + bytes(36)):
+        try:
+            parse_ppm(data)
+            raise AssertionError("应当拒绝")
+        except ValueError:
+            pass
+
+
+def test_thumbnail_cache_evicts_least_recently_used():
+    image = _solid(10, 10, 0)
+    cache = ThumbnailCache(max_bytes=image.nbytes * 2)
+    keys = [(f"fp{k}", 10, 10, False) for k in range(3)]
+    cache.put(keys[0], image)
+    cache.put(keys[1], image)
+    assert cache.get(keys[0]) is image
+    cache.put(keys[2], image)
+    assert cache.get(keys[1]) is None and cache.get(keys[0]) is image and cache.get(keys[2]) is image
+    # 超过容量的单张图像不缓存
+    cache.put(("huge", 100, 100, False), _solid(100, 100, 0))
+    stats = cache.stats()
+    assert stats["entries"] == 2 and (stats["hits"], stats["misses"]) == (3, 1)
+
+
+class _FakeCmd:
+    def __init__(self):
+        self.batches = []
+
+    def mcp_render_thumbnails(self, items, width, height, ray):
+        self.batches.append([name for name, _ in items])
+        return [{"error": "Selector-Error"} if name == "bad" else
+                {"image": b"not a ppm"} if name == "garbled" else
+                {"image": _ppm(_solid(height, width, state))} for name, state in items]
+
+
+def test_render_batches_and_records_errors():
+    primary, spare = _FakeCmd(), _FakeCmd()
+    items = [GalleryItem(f"m{k}", state=k) for k in range(9)] + [GalleryItem("bad"), GalleryItem("garbled")]
+    progress = []
+    render([lambda: primary, lambda: spare], items, 6, 4, batch_size=4,
+           report=lambda done, total, message: progress.append((done, total)))
+    # 两个后端时每批缩小到让每个后端至少分到两批
+    batches = primary.batches + spare.batches
+    assert sorted(name for batch in batches for name in batch) == sorted(item.name for item in items)
+    assert max(len(batch) for batch in batches) == 3
+    assert sorted(progress)[-1] == (11, 11)
+    for item in items[:9]:
+        assert item.error is None and (item.image == item.state).all() and item.image.shape == (4, 6, 3)
+    assert items[9].error == "Selector-Error" and items[9].image is None
+    assert "PPM" in items[10].error
+
+
+if __name__ == "__main__":
+    failed = 0
+    for name, test in list(globals().items()):
+        if not name.startswith("test_") or not callable(test):
+            continue
+        try:
+            test()
+            print(f"✓ {name}")
+        except AssertionError as e:
+            failed += 1
+            print(f"✗ {name}: {e}")
+    sys.exit(1 if failed else 0)
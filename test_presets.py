@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+场景预设回归测试
+
+检查 pymol_presets 的预设编译（未声明参数、空脚本）、参数展开和校验
+（分号、换行不能借参数值注入命令）、从目录加载 JSON / YAML 预设、
+按文件修改时间热重载（出错的文件保留上一次成功加载的预设），
+以及按参数缓存展开结果。应用预设部分用一个记录 mcp_do_capture 调用的假 cmd
+代替PyMOL。
+
+使用方法:
+    python test_presets.py
+    或: python -m pytest test_presets.py
+"""
+
+import json
+import os
+import sys
+import tempfile
+
+import pymol_mcp_server as server
+from pymol_presets import BUILTIN_PRESETS, PresetRegistry, compile_preset
+
+
+def _raises_value_error(func, *args):
+    try:
+        func(*args)
+    except ValueError as e:
+        return str(e)
+    raise AssertionError(f"应当抛出 ValueError: {args}")
+
+
+def _write(path, text, mtime_ns=None):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+    if mtime_ns is not None:
+        # 文件系统的时间精度可能很粗，显式设置修改时间保证变化可见
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def test_compile_checks_script_and_params():
+    preset = compile_preset("demo", {"params": {"sel": "all"},
+                                     "script": "# 注释\n  hide everything  \n\nshow sticks, {sel}\n"})
+    assert preset.commands == ("hide everything", "show sticks, {sel}")
+    assert compile_preset("list", {"script": ["bg_color white", "orient"]}).commands == ("bg_color white", "orient")
+    assert "未声明" in _raises_value_error(compile_preset, "bad", {"script": "show sticks, {sel}"})
+    assert "为空" in _raises_value_error(compile_preset, "bad", {"script": "# 只有注释"})
+    _raises_value_error(compile_preset, "bad", {"params": {}})
+    _raises_value_error(compile_preset, "bad", {"script": "zoom {sel", "params": {"sel": "all"}})
+    _raises_value_error(compile_preset, "bad", ["not", "a", "mapping"])
+    # 内置预设都能编译
+    for name, spec in BUILTIN_PRESETS.items():
+        compile_preset(name, spec)
+
+
+def test_render_validates_parameters():
+    preset = compile_preset("pocket", {"params": {"ligand": None, "cutoff": 5, "flag": True},
+                                       "script": "select p, polymer within {cutoff} of {ligand}\nset x, {flag}"})
+    assert preset.render({"ligand": "HEM"}) == ("select p, polymer within 5 of HEM", "set x, 1")
+    assert "缺少必填参数" in _raises_value_error(preset.render, {})
+    assert "没有参数" in _raises_value_error(preset.render, {"ligand": "HEM", "color": "red"})
+    for value in ("HEM; delete all", "HEM\ndelete all"):
+        assert "分号或换行" in _raises_value_error(preset.render, {"ligand": value})
+
+
+def test_loads_json_and_yaml_files():
+    with tempfile.TemporaryDirectory() as directory:
+        _write(os.path.join(directory, "a.json"), json.dumps({
+            "json_preset": {"description": "来自JSON", "script": "bg_color black"},
+        }))
+        _write(os.path.join(directory, "b.yaml"),
+               "yaml_preset:\n  params: {sel: all}\n  script: |\n    show cartoon, {sel}\n"
+               "publication:\n  script: bg_color grey\n")
+        _write(os.path.join(directory, "notes.txt"), "不是预设文件")
+        registry = PresetRegistry(directory)
+        listed = {entry["name"]: entry for entry in registry.list()}
+        assert listed["json_preset"]["source"] == "a.json"
+        assert listed["yaml_preset"]["source"] == "b.yaml"
+        # 同名预设覆盖内置预设，其他内置预设仍可用
+        assert listed["publication"]["source"] == "b.yaml"
+        assert registry.render("publication") == ("bg_color grey",)
+        assert listed["chain_rainbow"]["source"] == "builtin"
+        assert registry.render("yaml_preset", {"sel": "chain A"}) == ("show cartoon, chain A",)
+        assert registry.errors == {}
+        assert "未知预设" in _raises_value_error(registry.get, "missing")
+
+
+def test_hot_reload_on_mtime_change():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "p.json")
+        _write(path, json.dumps({"mine": {"script": "bg_color black"}}), mtime_ns=10 ** 18)
+        registry = PresetRegistry(directory, check_interval=0)
+        assert registry.render("mine") == ("bg_color black",)
+
+        _write(path, json.dumps({"mine": {"script": "bg_color white"}}), mtime_ns=10 ** 18 + 10 ** 9)
+        assert registry.render("mine") == ("bg_color white",)
+        assert registry.reloads == 1
+
+        # 文件出错时记录错误，保留上一次成功加载的预设
+        _write(path, "{not json", mtime_ns=10 ** 18 + 2 * 10 ** 9)
+        assert registry.render("mine") == ("bg_color white",)
+        assert path in registry.errors
+        _write(path, json.dumps({"mine": {"script": "bg_color red"}}), mtime_ns=10 ** 18 + 3 * 10 ** 9)
+        assert registry.render("mine") == ("bg_color red",) and registry.errors == {}
+
+        # 删除文件后其中的预设随之消失；修改时间不变时不重新加载
+        os.remove(path)
+        _raises_value_error(registry.get, "mine")
+        reloads = registry.reloads
+        registry.refresh()
+        assert registry.reloads == reloads
+
+
+def test_check_interval_limits_rescans():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "p.json")
+        _write(path, json.dumps({"mine": {"script": "bg_color black"}}), mtime_ns=10 ** 18)
+        registry = PresetRegistry(directory, check_interval=3600)
+        registry.refresh(force=True)
+        _write(path, json.dumps({"mine": {"script": "bg_color white"}}), mtime_ns=10 ** 18 + 10 ** 9)
+        assert registry.render("mine") == ("bg_color black",)
+        registry.refresh(force=True)
+        assert registry.render("mine") == ("bg_color white",)
+
+
+def test_render_cache_keys_on_parameter_values():
+    registry = PresetRegistry(render_cache=2)
+    first = registry.render("chain_rainbow", {"selection": "chain A"})
+    assert registry.render("chain_rainbow", {"selection": "chain A"}) is first
+    assert (registry.hits, registry.misses) == (1, 1)
+    # 不同的参数值、不同的值类型分别缓存
+    assert registry.render("chain_rainbow", {"selection": "chain B"}) != first
+    assert registry.render("ligand_pocket", {"cutoff": 5}) == registry.render("ligand_pocket", {"cutoff": "5"})
+    assert (registry.hits, registry.misses) == (1, 4)
+    # 超过容量时淘汰最久未用的条目
+    assert registry.stats()["render_cache"]["size"] == 2
+    registry.render("chain_rainbow", {"selection": "chain A"})
+    assert registry.misses == 5
+    # 参数校验失败不写入缓存
+    _raises_value_error(registry.render, "chain_rainbow", {"selection": "all; delete all"})
+    _raises_value_error(registry.render, "chain_rainbow", {"selection": "all; delete all"})
+    assert registry.misses == 7
+
+
+class _FakeCmd:
+    """记录通过 mcp_do_capture 执行的命令批次"""
+
+    def __init__(self):
+        self.batches = []
+
+    def mcp_helper_version(self):
+        return server._CAPTURE_HELPER_VERSION
+
+    def mcp_do_capture(self, commands, max_chars=16384):
+        self.batches.append(commands)
+        return [{"command": c, "output": "", "error": "Selector-Error" if "bogus" in c else None}
+                for c in commands]
+
+
+def test_apply_preset_runs_one_batch():
+    fake = _FakeCmd()
+    server.pymol_conn.attach(fake)
+    server.pymol_conn.capture_ready = None
+    original = server.presets
+    server.presets = registry = PresetRegistry()
+    try:
+        text = server._apply_preset(fake, "chain_rainbow", {"selection": "chain A"})
+        assert fake.batches == [list(registry.render("chain_rainbow", {"selection": "chain A"}))]
+        assert text.startswith("已应用预设 chain_rainbow（4 条命令")
+        text = server._apply_preset(fake, "chain_rainbow", {"selection": "bogus"})
+        assert "4 条出错" in text and len(fake.batches) == 2
+        assert registry.stats()["latency"]["chain_rainbow"]["calls"] == 2
+    finally:
+        server.presets = original
+
+
+if __name__ == "__main__":
+    failed = 0
+    for name, test in list(globals().items()):
+        if not name.startswith("test_") or not callable(test):
+            continue
+        try:
+            test()
+            print(f"✓ {name}")
+        except AssertionError as e:
+            failed += 1
+            print(f"✗ {name}: {e}")
+    sys.exit(1 if failed else 0)
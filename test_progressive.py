@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+"""
+渐进式渲染回归测试
+
+后台精细渲染和前台渲染工具共用同一个PyMOL的图像缓冲区和渲染设置。
+这里用一个模拟图像缓冲区的假 cmd（每次调用像真实PyMOL一样独占执行）检查：
+精细渲染进行中调用前台 pymol_png，两者的图像都不会被对方覆盖，
+细节层次降级临时修改的设置最终都会恢复。另外直接检查 ProgressiveRenderer：
+宽限期内取消的渲染不占用PyMOL，光线追踪中取消的渲染结果被丢弃，
+新的请求取代旧的请求，出错和只保留最近结果。
+
+使用方法:
+    python test_progressive.py
+    或: python -m pytest test_progressive.py
+"""
+
+import sys
+import threading
+import time
+
+import pymol_accounting
+import pymol_mcp_server as server
+from pymol_progressive import ProgressiveRenderer, RenderJob, preview_size
+
+
+class _RenderCmd:
+    """模拟PyMOL的图像缓冲区：ray/png 写缓冲区，保存时写出缓冲区当前的内容"""
+
+    def __init__(self, ray_seconds=0.3):
+        self.ray_seconds = ray_seconds
+        self._lock = threading.Lock()
+        self.settings = {"antialias": "2", "ray_shadows": "1"}
+        self.buffer = None
+        self.files = {}
+        self.calls = []
+
+    def _ray(self, width, height, antialias=-1):
+        time.sleep(self.ray_seconds)
+        if antialias < 0:
+            antialias = int(self.settings["antialias"])
+        self.buffer = ("ray", width, height, antialias, self.settings["ray_shadows"])
+
+    def ray(self, width=0, height=0, antialias=-1, quiet=1):
+        with self._lock:
+            self.calls.append("ray")
+            self._ray(width, height, antialias)
+
+    def png(self, filename, width=0, height=0, dpi=-1, ray=0, quiet=1, prior=0):
+        with self._lock:
+            self.calls.append("png")
+            if ray:
+                self._ray(width, height)
+            elif not prior and (width or height):
+                self.buffer = ("draw", width, height)
+            self.files[filename] = self.buffer
+
+    def get(self, setting):
+        with self._lock:
+            return self.settings[setting]
+
+    def set(self, setting, value):
+        with self._lock:
+            self.settings[setting] = str(value)
+
+    def count_atoms(self, selection="all"):
+        return 10 ** 6
+
+    def get_viewport(self):
+        return [640, 480]
+
+    def mcp_helper_version(self):
+        return server._CAPTURE_HELPER_VERSION
+
+    def mcp_render_png(self, filename="", width=0, height=0, dpi=-1, ray=0):
+        with self._lock:
+            self.calls.append("mcp_render_png")
+            if ray:
+                self._ray(width, height)
+            elif width or height:
+                self.buffer = ("draw", width, height)
+            if filename:
+                self.files[filename] = self.buffer
+            return repr(self.buffer).encode()
+
+    def mcp_ray_png(self, filename="", width=0, height=0, dpi=-1, antialias=-1):
+        with self._lock:
+            self.calls.append("mcp_ray_png")
+            self._ray(width, height, antialias)
+            partial = filename + ".partial"
+            self.files[partial] = self.buffer
+            return {"image": repr(self.buffer).encode(), "partial": partial}
+
+    def mcp_commit_png(self, partial, filename=""):
+        with self._lock:
+            image = self.files.pop(partial)
+            if filename:
+                self.files[filename] = image
+
+
+def _ray_started(fake):
+    return any(call in ("ray", "mcp_ray_png") for call in fake.calls)
+
+
+def _setup(fake):
+    server.pymol_conn.attach(fake)
+    server.pymol_conn.capture_ready = None
+    server.pymol_conn.write_combiner = None
+    server.worker_pool = None
+    server.cost_guard = pymol_accounting.CostGuard(policy="lod")
+    server.progressive_renderer = None
+
+
+def test_foreground_png_during_refinement():
+    fake = _RenderCmd()
+    _setup(fake)
+    try:
+        server._call_tool_sync("pymol_png", {"filename": "full.png", "width": 800, "height": 600,
+                                             "progressive": True})
+        renderer = server.progressive_renderer
+        job = next(iter(renderer._jobs.values()))
+        # 等精细渲染开始光线追踪，再调用前台的 pymol_png
+        deadline = time.monotonic() + 5
+        while not _ray_started(fake) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert job.state == "running"
+        server._call_tool_sync("pymol_png", {"filename": "quick.png", "width": 100, "height": 80, "ray": True})
+        while job.state == "running" and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        # 精细渲染没有被取消，两张图像各自是自己请求的尺寸
+        assert job.state == "done", job.info()
+        assert fake.files["full.png"][:3] == ("ray", 800, 600)
+        assert job.image == repr(fake.files["full.png"]).encode()
+        assert fake.files["quick.png"][:3] == ("ray", 100, 80)
+        # 前台渲染按细节层次降级，精细渲染只通过 ray 参数关闭抗锯齿，不改全局设置
+        assert fake.files["quick.png"][3:] == (0, "0")
+        assert fake.files["full.png"][3:] == (0, "1")
+        assert fake.settings == {"antialias": "2", "ray_shadows": "1"}
+        assert not any(name.endswith(".partial") for name in fake.files)
+    finally:
+        server.cost_guard = None
+
+
+def test_cancelled_refinement_writes_no_file():
+    fake = _RenderCmd()
+    _setup(fake)
+    try:
+        server._call_tool_sync("pymol_png", {"filename": "full.png", "width": 800, "height": 600,
+                                             "progressive": True})
+        job = next(iter(server.progressive_renderer._jobs.values()))
+        deadline = time.monotonic() + 5
+        while not _ray_started(fake) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        # 修改场景的调用取消正在光线追踪的渲染，结果被丢弃
+        server._cancel_refinement(server.pymol_conn, "pymol_color", {})
+        while job.finished is None and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert job.state == "cancelled" and job.image is None
+        assert "full.png" not in fake.files
+        assert not any(name.endswith(".partial") for name in fake.files)
+    finally:
+        server.cost_guard = None
+
+
+class _Refine:
+    """可控的精细渲染：started 在开始光线追踪时置位，放行 release 后返回图像"""
+
+    def __init__(self, image=b"PNG", error=None):
+        self.image = image
+        self.error = error
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.calls = 0
+
+    def __call__(self, job):
+        self.calls += 1
+        self.started.set()
+        self.release.wait(5)
+        if self.error:
+            raise self.error
+        return self.image
+
+
+class _Notified:
+    def __init__(self):
+        self.jobs = []
+        self.event = threading.Event()
+
+    def __call__(self, job):
+        self.jobs.append((job.id, job.state))
+        self.event.set()
+
+
+def test_preview_size():
+    assert preview_size(1600, 1200, 400) == (400, 300)
+    assert preview_size(300, 900, 450) == (150, 450)
+    assert preview_size(200, 100, 400) == (200, 100)
+    assert preview_size(0, 0, 400) == (1, 1)
+
+
+def test_cancel_within_grace_skips_refine():
+    renderer = ProgressiveRenderer(grace=0.2)
+    refine, notified = _Refine(), _Notified()
+    job = renderer.submit("conn", RenderJob("a.png", 800, 600), refine, notified)
+    assert renderer.cancel("conn", "场景已修改") is job
+    assert notified.event.wait(5)
+    # 尚未开始的渲染直接丢弃，不占用PyMOL
+    assert refine.calls == 0
+    assert job.state == "cancelled" and job.error == "场景已修改" and job.image is None
+    assert notified.jobs == [(job.id, "cancelled")]
+    assert renderer.stats()["cancelled"] == 1 and renderer.stats()["active"] == 0
+    # 已结束的任务不能再取消
+    assert renderer.cancel("conn", "再次取消") is None
+
+
+def test_cancel_while_running_discards_stale_result():
+    renderer = ProgressiveRenderer(grace=0)
+    refine, notified = _Refine(), _Notified()
+    job = renderer.submit("conn", RenderJob("a.png", 800, 600), refine, notified)
+    assert refine.started.wait(5) and job.state == "running"
+    renderer.cancel("conn", "场景已修改")
+    refine.release.set()
+    assert notified.event.wait(5)
+    # 光线追踪无法打断，但完成后的图像与当前场景不符，被丢弃
+    assert refine.calls == 1
+    assert job.state == "cancelled" and job.image is None
+    assert renderer.stats()["done"] == 0 and renderer.last_refine_ms is None
+    assert renderer.get(job.id) is job and job.info()["elapsed_ms"] is not None
+
+
+def test_new_request_supersedes_and_errors_are_reported():
+    renderer = ProgressiveRenderer(grace=0.05)
+    first, second = _Refine(), _Refine(image=b"NEW")
+    notified = _Notified()
+    old = renderer.submit("conn", RenderJob("a.png", 800, 600), first, notified)
+    new = renderer.submit("conn", RenderJob("a.png", 800, 600), second, notified)
+    # 不同后端的渲染互不影响
+    failing = _Refine(error=RuntimeError("ray failed"))
+    other = renderer.submit("worker-2", RenderJob("b.png", 100, 100), failing)
+    second.release.set()
+    failing.release.set()
+    deadline = time.monotonic() + 5
+    while (new.finished is None or other.finished is None) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert old.state == "cancelled" and old.error == "被新的渲染请求取代" and first.calls == 0
+    assert new.state == "done" and new.image == b"NEW"
+    assert other.state == "failed" and other.error == "RuntimeError: ray failed"
+    stats = renderer.stats()
+    assert (stats["submitted"], stats["done"], stats["failed"], stats["cancelled"]) == (3, 1, 1, 1)
+    assert stats["active"] == 0 and stats["last_refine_ms"] is not None
+
+
+def test_keeps_only_recent_jobs():
+    renderer = ProgressiveRenderer(grace=0, keep=2)
+    jobs = []
+    for k in range(3):
+        refine = _Refine(image=b"%d" % k)
+        refine.release.set()
+        jobs.append(renderer.submit(f"conn{k}", RenderJob(f"{k}.png", 10, 10), refine))
+    assert renderer.get(jobs[0].id) is None
+    assert [renderer.get(job.id) for job in jobs[1:]] == jobs[1:]
+
+
+if __name__ == "__main__":
+    failed = 0
+    for name, test in list(globals().items()):
+        if not name.startswith("test_") or not callable(test):
+            continue
+        try:
+            test()
+            print(f"✓ {name}")
+        except AssertionError as e:
+            failed += 1
+            print(f"✗ {name}: {e}")
+    sys.exit(1 if failed else 0)
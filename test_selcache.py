@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+选择表达式缓存回归测试
+
+检查 pymol_selcache 的可缓存判断、第 min_uses 次使用时物化、命中、
+LRU淘汰时隐藏选择名称的复用、整体失效和 max_age 过期。
+用一个记录 select 调用的假 cmd 代替PyMOL。
+
+使用方法:
+    python test_selcache.py
+    或: python -m pytest test_selcache.py
+"""
+
+import sys
+from types import SimpleNamespace
+
+import pymol_selcache
+from pymol_selcache import SelectionCache, cacheable
+
+
+class _FakeCmd:
+    def __init__(self):
+        self.selections = {}
+        self.calls = 0
+
+    def select(self, name, expression, enable=0):
+        self.calls += 1
+        if "bogus" in expression:
+            raise Exception("Invalid selection")
+        self.selections[name] = expression
+
+
+def test_cacheable():
+    assert cacheable("chain A and resi 100-200")
+    assert cacheable("(chain A) and not solvent")
+    assert not cacheable("1abc")
+    assert not cacheable("  (1abc)  ")
+    assert not cacheable("rep cartoon and chain A")
+    assert not cacheable("sele and chain A")
+    assert not cacheable("chain A and e. C")
+    assert not cacheable("chain A and (pk1)")
+
+
+def test_materializes_on_second_use_then_hits():
+    cmd, cache = _FakeCmd(), SelectionCache(max_entries=4)
+    expression = "chain A and resi 1-10"
+    assert cache.resolve(cmd, expression) == expression
+    assert cmd.calls == 0
+    name = cache.resolve(cmd, " " + expression + " ")
+    assert name.startswith("_mcp_sel") and cmd.selections[name] == expression
+    assert cache.resolve(cmd, expression) == name
+    assert cmd.calls == 1
+    assert cache.stats() == {"entries": 1, "hits": 1, "materialized": 1, "invalidations": 0}
+
+
+def test_uncacheable_and_disabled_pass_through():
+    cmd = _FakeCmd()
+    for cache, expression in ((SelectionCache(), "1abc"), (SelectionCache(), "visible and chain A"),
+                              (SelectionCache(max_entries=0), "chain A and resi 5")):
+        for _ in range(3):
+            assert cache.resolve(cmd, expression) == expression.strip()
+    assert cmd.calls == 0
+
+
+def test_invalid_expression_is_not_cached():
+    cmd, cache = _FakeCmd(), SelectionCache(max_entries=1)
+    for _ in range(3):
+        assert cache.resolve(cmd, "bogus and chain A") == "bogus and chain A"
+    # 失败后名称归还，后续表达式仍能物化
+    cache.resolve(cmd, "chain B and resi 1")
+    assert cache.resolve(cmd, "chain B and resi 1") == "_mcp_sel0"
+    assert cache.stats()["entries"] == 1
+
+
+def test_lru_eviction_reuses_bounded_names():
+    cmd, cache = _FakeCmd(), SelectionCache(max_entries=3)
+    expressions = [f"chain A and resi {k}" for k in range(6)]
+    names = {}
+    for expression in expressions:
+        cache.resolve(cmd, expression)
+        names[expression] = cache.resolve(cmd, expression)
+    assert set(names.values()) == {f"_mcp_sel{i}" for i in range(3)}
+    assert cache.stats()["entries"] == 3
+    # 最近的三个仍命中；最早的已被淘汰，再次使用时重新物化
+    for expression in expressions[3:]:
+        assert cache.resolve(cmd, expression) == names[expression]
+    calls = cmd.calls
+    renamed = cache.resolve(cmd, expressions[0])
+    assert cmd.calls == calls + 1
+    assert cmd.selections[renamed] == expressions[0]
+    assert len(cmd.selections) == 3
+
+
+def test_invalidate_frees_names():
+    cmd, cache = _FakeCmd(), SelectionCache(max_entries=2)
+    for expression in ("chain A and resi 1", "chain A and resi 2"):
+        cache.resolve(cmd, expression)
+        cache.resolve(cmd, expression)
+    cache.invalidate()
+    cache.invalidate()
+    assert cache.stats()["entries"] == 0 and cache.stats()["invalidations"] == 1
+    # 已经用过两次的表达式失效后下次使用直接重新物化
+    calls = cmd.calls
+    name = cache.resolve(cmd, "chain A and resi 1")
+    assert name.startswith("_mcp_sel") and cmd.calls == calls + 1
+    assert cache.resolve(cmd, "chain A and resi 1") == name
+    assert cmd.calls == calls + 1
+
+
+def test_expired_entries_rematerialize():
+    now = [1000.0]
+    # 只替换本模块看到的 time，不影响全局的 time.monotonic
+    original = pymol_selcache.time
+    pymol_selcache.time = SimpleNamespace(monotonic=lambda: now[0])
+    try:
+        cmd, cache = _FakeCmd(), SelectionCache(max_entries=2, max_age=60.0)
+        expression = "chain A and resi 1"
+        cache.resolve(cmd, expression)
+        name = cache.resolve(cmd, expression)
+        now[0] += 30.0
+        assert cache.resolve(cmd, expression) == name and cmd.calls == 1
+        now[0] += 61.0
+        assert cache.resolve(cmd, expression) == name
+        assert cmd.calls == 2
+        assert cache.stats()["materialized"] == 2
+    finally:
+        pymol_selcache.time = original
+
+
+if __name__ == "__main__":
+    failed = 0
+    for name, test in list(globals().items()):
+        if not name.startswith("test_") or not callable(test):
+            continue
+        try:
+            test()
+            print(f"✓ {name}")
+        except AssertionError as e:
+            failed += 1
+            print(f"✗ {name}: {e}")
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+会话存储回归测试
+
+检查 pymol_sessions 的内存和 SQLite 会话存储：记录和调用计数、按最近活动排序、
+空闲清理，多线程同时 touch 时计数不丢失（每 256 次清理一次），
+SQLite 文件在多个存储实例间共享；以及多 worker 时服务器拒绝按会话限速。
+
+使用方法:
+    python test_sessions.py
+    或: python -m pytest test_sessions.py
+"""
+
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import pymol_mcp_server as server
+from pymol_sessions import MemorySessionStore, SQLiteSessionStore, open_session_store
+
+
+def _check_store(store):
+    store.touch("a")
+    store.touch("a", "pymol_ray")
+    store.touch("b", "pymol_zoom")
+    assert store.get("a")["calls"] == 1 and store.get("b")["calls"] == 1
+    assert store.get("missing") is None
+    assert [r["session_id"] for r in store.list()] == ["b", "a"]
+    store.delete("b")
+    assert store.get("b") is None
+
+    store.max_idle = 0.05
+    time.sleep(0.1)
+    store.touch("fresh")
+    assert store.prune() == 1
+    assert [r["session_id"] for r in store.list()] == ["fresh"]
+
+
+def _concurrent_touches(store, threads=8, calls=100):
+    def run(k):
+        for _ in range(calls):
+            store.touch(f"s{k % 2}", "pymol_zoom")
+
+    workers = [threading.Thread(target=run, args=(k,)) for k in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    assert store.get("s0")["calls"] + store.get("s1")["calls"] == threads * calls
+    assert store._touches == threads * calls
+
+
+def test_memory_store():
+    _check_store(MemorySessionStore())
+    _concurrent_touches(MemorySessionStore())
+
+
+def test_sqlite_store_is_shared():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "sessions.db")
+        store = open_session_store("sqlite:" + path)
+        try:
+            assert isinstance(store, SQLiteSessionStore)
+            _check_store(store)
+            store.max_idle = 3600
+            # 另一个进程打开同一个文件时看到同样的记录
+            other = SQLiteSessionStore(path)
+            other.touch("fresh", "pymol_show")
+            assert store.get("fresh")["calls"] == 1
+            other.close()
+            _concurrent_touches(SQLiteSessionStore(path, max_idle=3600))
+        finally:
+            store.close()
+    try:
+        open_session_store("redis://localhost")
+        raise AssertionError("应当拒绝")
+    except ValueError:
+        pass
+
+
+def _main(*argv):
+    original = sys.argv
+    sys.argv = ["pymol_mcp_server.py", *argv]
+    try:
+        with contextlib.redirect_stderr(io.StringIO()) as stderr:
+            server.main()
+    except SystemExit as e:
+        return e.code, stderr.getvalue()
+    finally:
+        sys.argv = original
+    raise AssertionError("应当退出")
+
+
+def test_multiple_workers_require_rate_limit_off():
+    code, message = _main("--transport", "streamable-http", "--workers", "2")
+    assert code == 2 and "--rate-limit 0" in message
+    code, message = _main("--transport", "streamable-http", "--workers", "2", "--pymol-workers", "2",
+                          "--rate-limit", "0")
+    assert code == 2 and "--pymol-workers" in message
+
+
+if __name__ == "__main__":
+    failed = 0
+    for name, test in list(globals().items()):
+        if not name.startswith("test_") or not callable(test):
+            continue
+        try:
+            test()
+            print(f"✓ {name}")
+        except AssertionError as e:
+            failed += 1
+            print(f"✗ {name}: {e}")
+    sys.exit(1 if failed else 0)
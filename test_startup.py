@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+启动时间回归测试
+
+检查 pymol_mcp_server 的导入开销没有超出预算，并且导入模块和
+--check 快速路径都不会加载 MCP SDK、Starlette、Uvicorn 等重量级依赖。
+
+使用方法:
+    python test_startup.py
+    或: python -m pytest test_startup.py
+"""
+
+import os
+import subprocess
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# 导入 pymol_mcp_server 的累计耗时预算（毫秒）
+IMPORT_BUDGET_MS = 200
+
+# 这些依赖只应在真正启动HTTP服务器或处理请求时导入
+HEAVY_MODULES = ("mcp", "starlette", "uvicorn", "numpy")
+
+
+def _run(code, *args):
+    return subprocess.run(
+        [sys.executable, *args, "-c", code],
+        cwd=HERE, capture_output=True, text=True, timeout=60,
+    )
+
+
+def measure_import_ms():
+    """用 -X importtime 测量导入 pymol_mcp_server 的累计耗时（毫秒）"""
+    result = _run("import pymol_mcp_server", "-X", "importtime")
+    for line in result.stderr.splitlines():
+        parts = [p.strip() for p in line.split("|")]
+        if len(parts) == 3 and parts[2] == "pymol_mcp_server":
+            return int(parts[1]) / 1000
+    raise RuntimeError(f"无法解析 importtime 输出:\n{result.stderr[-2000:]}")
+
+
+def test_import_time_budget():
+    elapsed = min(measure_import_ms() for _ in range(3))
+    print(f"导入 pymol_mcp_server: {elapsed:.1f} ms (预算 {IMPORT_BUDGET_MS} ms)")
+    assert elapsed <= IMPORT_BUDGET_MS
+
+
+def test_import_is_lazy():
+    code = (
+        "import sys, pymol_mcp_server\n"
+        f"heavy = [m for m in sys.modules if m.split('.')[0] in {HEAVY_MODULES!r}]\n"
+        "print(','.join(heavy))\n"
+    )
+    result = _run(code)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == "", f"导入时加载了重量级模块: {result.stdout.strip()}"
+
+
+def test_check_fast_path():
+    # 连接一个不存在的PyMOL：应快速失败且不加载重量级模块
+    code = (
+        "import sys, pymol_mcp_server as m\n"
+        "sys.argv = ['pymol_mcp_server', '--check', '--pymol-port', '1']\n"
+        "try:\n"
+        "    m.main()\n"
+        "except SystemExit as e:\n"
+        "    heavy = [n for n in sys.modules if n.split('.')[0] in "
+        f"{HEAVY_MODULES!r}]\n"
+        "    print(e.code, ','.join(heavy))\n"
+    )
+    result = _run(code)
+    assert result.stdout.split() == ["1"], result.stdout + result.stderr
+
+
+if __name__ == "__main__":
+    failed = 0
+    for test in (test_import_time_budget, test_import_is_lazy, test_check_fast_path):
+        try:
+            test()
+            print(f"✓ {test.__name__}")
+        except AssertionError as e:
+            failed += 1
+            print(f"✗ {test.__name__}: {e}")
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""
+流量录制与回放回归测试
+
+检查 pymol_traffic 的参数匿名化（散列一致、保留扩展名和命令动词）、
+录制文件的写入（文件头、会话编号、gzip）、多文件和多段读取及末尾不完整的文件、
+按工具的延迟分位数汇总、回归判断的阈值，以及服务器不可达时回放把调用记为出错。
+
+使用方法:
+    python test_traffic.py
+    或: python -m pytest test_traffic.py
+"""
+
+import asyncio
+import contextlib
+import gzip
+import io
+import json
+import os
+import socket
+import sys
+import tempfile
+from types import SimpleNamespace
+
+import pymol_traffic
+from pymol_traffic import (Anonymizer, TrafficRecorder, compare, is_error, load_trace, replay,
+                           response_size, summarize)
+
+
+def _text(text):
+    return SimpleNamespace(type="text", text=text)
+
+
+def test_anonymizer_is_consistent_and_keeps_structure():
+    anonymizer = Anonymizer(salt=b"0" * 16)
+    assert anonymizer.token("chain A") == anonymizer.token("chain A") != anonymizer.token("chain B")
+    assert Anonymizer(salt=b"1" * 16).token("chain A") != anonymizer.token("chain A")
+    # 文件路径保留扩展名（含 .pdb.gz 这样的双扩展名）
+    assert anonymizer.path("/data/1abc.pdb").endswith(".pdb")
+    assert anonymizer.path("/data/1abc.cif.gz").endswith(".cif.gz")
+    assert anonymizer.path("/data/1abc.pdb") == anonymizer.path("/data/1abc.pdb")
+
+    args = anonymizer.arguments("pymol_show", {"representation": "sticks", "selection": "resn HEM",
+                                               "force": True})
+    assert args["representation"] == "sticks" and args["force"] is True
+    assert args["selection"] == anonymizer.token("resn HEM")
+    args = anonymizer.arguments("pymol_batch_convert", {"inputs": ["a.pdb", "b.cif"], "options": {"name": "x"}})
+    assert [os.path.splitext(p)[1] for p in args["inputs"]] == [".pdb", ".cif"]
+    assert args["options"] == {"name": anonymizer.token("x")}
+    assert anonymizer.arguments("pymol_apply_preset", {"name": "publication"})["name"] == "publication"
+
+
+def test_anonymizer_script_keeps_verbs_and_setting_names():
+    anonymizer = Anonymizer(salt=b"0" * 16)
+    script = anonymizer.script("load /secret/1abc.pdb\n\nset cartoon_transparency, 0.5; orient\n/print('x')")
+    lines = script.splitlines()
+    assert lines[0] == "load " + anonymizer.token("/secret/1abc.pdb")
+    assert lines[1].startswith("set cartoon_transparency ")
+    assert lines[2] == "orient"
+    assert lines[3].startswith("/a") and "print" not in lines[3]
+    args = anonymizer.arguments("pymol_do", {"command": "zoom chain A"})
+    assert args["command"].startswith("zoom ") and "chain" not in args["command"]
+
+
+def test_response_size_and_error_detection():
+    content = [_text("你好"), SimpleNamespace(type="image", data="QUJD")]
+    assert response_size(content) == len("你好".encode("utf-8")) + 4
+    assert is_error([_text("错误: 未连接到PyMOL")])
+    assert not is_error([_text("已显示 sticks")]) and not is_error([])
+
+
+def test_recorder_writes_header_sessions_and_gzip():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "trace-{pid}.jsonl.gz")
+        recorder = TrafficRecorder(path, anonymize=True, flush_interval=60)
+        recorder.record("10.0.0.1:5000", "pymol_show", {"selection": "chain A", "representation": "cartoon"},
+                        0.25, [_text("已显示 cartoon")])
+        recorder.record("client-b", "pymol_load_structure", {"filename": "/x/1abc.pdb"}, 0.01,
+                        [_text("错误: 文件不存在")])
+        recorder.record("10.0.0.1:5000", "pymol_zoom", {}, 0.002, [_text("ok")])
+        recorder.close()
+        assert recorder.path == os.path.join(directory, f"trace-{os.getpid()}.jsonl.gz")
+        assert recorder.stats()["records"] == 3
+
+        with gzip.open(recorder.path, "rt", encoding="utf-8") as f:
+            lines = [json.loads(line) for line in f]
+        header, entries = lines[0], lines[1:]
+        assert header["format"] == pymol_traffic.TRACE_FORMAT and header["anonymized"] is True
+        # 会话标识替换为短编号，同一会话得到同一编号
+        assert [e["s"] for e in entries] == ["s1", "s2", "s1"]
+        assert entries[0]["ms"] == 250.0 and entries[0]["args"]["representation"] == "cartoon"
+        assert entries[0]["args"]["selection"] != "chain A"
+        assert entries[1]["err"] == 1 and "err" not in entries[0]
+        assert entries[1]["args"]["filename"].endswith(".pdb") and "/x/" not in entries[1]["args"]["filename"]
+
+
+def test_recorder_forgets_old_sessions():
+    original = pymol_traffic.MAX_SESSIONS
+    pymol_traffic.MAX_SESSIONS = 2
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            recorder = TrafficRecorder(os.path.join(directory, "t.jsonl"))
+            for session in ("a", "b", "a", "c", "b"):
+                recorder.record(session, "pymol_zoom", {}, 0.0, [])
+            recorder.close()
+            with open(recorder.path, encoding="utf-8") as f:
+                sessions = [json.loads(line).get("s") for line in f][1:]
+            # "b" 在 "c" 出现时被淘汰，再次出现时得到新编号；映射表不超过上限
+            assert sessions == ["s1", "s2", "s1", "s3", "s4"]
+            assert len(recorder._sessions) == 2
+    finally:
+        pymol_traffic.MAX_SESSIONS = original
+
+
+def _write_trace(path, segments):
+    with open(path, "w", encoding="utf-8") as f:
+        for entries in segments:
+            f.write(json.dumps({"format": pymol_traffic.TRACE_FORMAT, "version": 1}) + "\n")
+            for entry in entries:
+                f.write(json.dumps(entry) + "\n")
+
+
+def test_load_trace_merges_files_and_segments():
+    with tempfile.TemporaryDirectory() as directory:
+        first, second = os.path.join(directory, "w1.jsonl"), os.path.join(directory, "w2.jsonl")
+        _write_trace(first, [[{"ts": 3.0, "s": "s1", "tool": "pymol_ray", "ms": 5}],
+                             [{"ts": 1.0, "s": "s1", "tool": "pymol_zoom", "ms": 1}]])
+        _write_trace(second, [[{"ts": 2.0, "s": "s1", "tool": "pymol_show", "ms": 2}]])
+        # 服务器被强行终止时最后一行不完整
+        with open(second, "a", encoding="utf-8") as f:
+            f.write('{"ts": 4.0, "s": "s1", "to')
+        records = load_trace([first, second])
+        assert [r["tool"] for r in records] == ["pymol_zoom", "pymol_show", "pymol_ray"]
+        # 不同文件、不同启动段的同名会话互不合并
+        assert [r["s"] for r in records] == ["0.2.s1", "1.1.s1", "0.1.s1"]
+
+
+def test_summarize_percentiles_per_tool():
+    calls = [{"tool": "pymol_ray", "ms": float(ms), "bytes": 100} for ms in range(1, 11)]
+    calls.append({"tool": "pymol_zoom", "ms": 2.0, "err": 1})
+    summary = summarize(calls)
+    ray = summary["tools"]["pymol_ray"]
+    assert ray["calls"] == 10 and ray["errors"] == 0 and ray["bytes_mean"] == 100
+    assert ray["p50_ms"] == 5.5 and ray["p90_ms"] == 9.1 and ray["max_ms"] == 10.0
+    assert summary["tools"]["pymol_zoom"]["errors"] == 1
+    assert summary["overall"]["calls"] == 11
+    assert summarize([])["overall"]["calls"] == 0
+
+
+def _summary(tools):
+    return summarize({"tool": tool, "ms": ms} for tool, latencies in tools.items() for ms in latencies)
+
+
+def test_compare_flags_only_significant_regressions():
+    baseline = _summary({"pymol_ray": [100.0] * 30, "pymol_zoom": [1.0] * 30, "pymol_png": [10.0] * 5,
+                         "pymol_old": [1.0] * 30})
+    candidate = _summary({"pymol_ray": [150.0] * 30, "pymol_zoom": [3.0] * 30, "pymol_png": [50.0] * 5,
+                          "pymol_new": [1.0] * 30})
+    result = compare(baseline, candidate, threshold=1.2, min_delta_ms=5.0, min_calls=20)
+    # pymol_zoom 变慢3倍但只多 2 ms，pymol_png 样本太少，都不算回归
+    assert result["regressions"] == ["pymol_ray: p90 100.0 -> 150.0 ms"]
+    rows = {row["tool"]: row for row in result["tools"]}
+    assert rows["pymol_ray"]["p90_ratio"] == 1.5
+    assert rows["pymol_old"] == {"tool": "pymol_old", "only_in": "baseline"}
+    assert rows["pymol_new"] == {"tool": "pymol_new", "only_in": "candidate"}
+    assert compare(baseline, baseline)["regressions"] == []
+
+
+def test_compare_command_reads_replay_reports_and_traces():
+    with tempfile.TemporaryDirectory() as directory:
+        trace = os.path.join(directory, "trace.jsonl")
+        _write_trace(trace, [[{"ts": float(k), "s": "s1", "tool": "pymol_ray", "ms": 100.0} for k in range(30)]])
+        report = os.path.join(directory, "build-b.json")
+        with open(report, "w", encoding="utf-8") as f:
+            json.dump({"summary": _summary({"pymol_ray": [200.0] * 30})}, f)
+        for args, code in (([trace, trace], 0), ([trace, report], 1)):
+            try:
+                with contextlib.redirect_stdout(io.StringIO()):
+                    pymol_traffic.main(["compare", *args])
+                raise AssertionError("应当以退出码结束")
+            except SystemExit as e:
+                assert e.code == code, (args, e.code)
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def test_replay_marks_calls_failed_when_server_unreachable():
+    records = [{"ts": 0.0, "s": "a", "tool": "pymol_zoom", "args": {}, "ms": 1.0},
+               {"ts": 0.1, "s": "a", "tool": "pymol_ray", "args": {}, "ms": 5.0},
+               {"ts": 0.2, "s": "b", "tool": "pymol_zoom", "args": {}, "ms": 1.0}]
+    results = asyncio.run(replay(records, f"http://127.0.0.1:{_free_port()}", speed=0))
+    assert sorted(r["tool"] for r in results) == ["pymol_ray", "pymol_zoom", "pymol_zoom"]
+    assert all(r["err"] == 1 and r["exception"] for r in results)
+    assert asyncio.run(replay([], "http://127.0.0.1:1")) == []
+
+
+if __name__ == "__main__":
+    failed = 0
+    for name, test in list(globals().items()):
+        if not name.startswith("test_") or not callable(test):
+            continue
+        try:
+            test()
+            print(f"✓ {name}")
+        except AssertionError as e:
+            failed += 1
+            print(f"✗ {name}: {e}")
+    sys.exit(1 if failed else 0)
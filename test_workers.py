@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+"""
+PyMOL工作进程池回归测试
+
+用一个不启动真实PyMOL的桩启动器（假进程加记录场景的假 cmd）检查
+pymol_workers.WorkerPool 的会话绑定和释放、备用进程补充和上限、借用备用进程、
+通过 .pse 保存/载入回收超限进程、check() 对退出进程和空闲会话的监管，
+以及 run_batches 的出错处理。
+
+使用方法:
+    python test_workers.py
+    或: python -m pytest test_workers.py
+"""
+
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+
+from pymol_workers import PyMOLWorker, WorkerPool, run_batches
+
+# 假进程号取在 Linux 的 pid_max 之外，不会读到真实进程的内存
+_pids = itertools.count(2 ** 23)
+
+
+class _FakeProcess:
+    def __init__(self):
+        self.pid = next(_pids)
+        self.returncode = None
+
+    def poll(self):
+        return self.returncode
+
+    def terminate(self):
+        if self.returncode is None:
+            self.returncode = -15
+
+    def kill(self):
+        self.returncode = -9
+
+    def wait(self, timeout=None):
+        return self.returncode
+
+
+class _FakeCmd:
+    """场景只是一个对象名列表，save/load 通过 .pse 文件传递"""
+
+    def __init__(self):
+        self.objects = []
+        self.reinitialized = 0
+        self.fail_load = False
+        self.saved = []
+
+    def save(self, path):
+        self.saved.append(path)
+        with open(path, "w") as f:
+            json.dump(self.objects, f)
+
+    def load(self, path):
+        if self.fail_load:
+            raise IOError("无法读取场景")
+        with open(path) as f:
+            self.objects.extend(json.load(f))
+
+    def reinitialize(self):
+        self.reinitialized += 1
+        self.objects = []
+
+
+class _FakeConn:
+    def __init__(self):
+        self.cmd = _FakeCmd()
+
+    def connect(self):
+        return True
+
+    def get_cmd(self):
+        return self.cmd
+
+
+class _StubPool(WorkerPool):
+    """_launch 换成桩启动器：立即得到一个假进程"""
+
+    def __init__(self, fail=False, **kwargs):
+        kwargs.setdefault("max_rss_mb", None)
+        kwargs.setdefault("check_interval", 3600)
+        kwargs.setdefault("startup_timeout", 5)
+        super().__init__(lambda port: _FakeConn(), **kwargs)
+        self.fail = fail
+        self.launched = []
+
+    def _launch(self, port):
+        if self.fail:
+            raise RuntimeError("找不到 pymol")
+        worker = PyMOLWorker(port, _FakeProcess(), self.connection_factory(port))
+        self.launched.append(worker)
+        return worker
+
+
+def _wait_spares(pool, count):
+    deadline = time.monotonic() + 5
+    while time.monotonic() < deadline:
+        stats = pool.stats()
+        if stats["spares"] >= count and stats["starting"] == 0:
+            return
+        time.sleep(0.01)
+    raise AssertionError(f"备用进程未补足: {pool.stats()}")
+
+
+def test_acquire_binds_session_and_replenishes_spares():
+    pool = _StubPool(size=3, spares=1)
+    pool.start()
+    try:
+        _wait_spares(pool, 1)
+        first = pool.acquire("a")
+        assert pool.acquire("a") is first
+        assert first.busy == 2 and first.calls == 2 and first.sessions == {"a"}
+        pool.release(first)
+        pool.release(first)
+        assert first.busy == 0
+        assert pool.bound_connection("a") is first.conn and pool.bound_connection("x") is None
+
+        _wait_spares(pool, 1)
+        with pool.session("b") as second:
+            assert second is not first
+        _wait_spares(pool, 1)
+        third = pool.acquire("c")
+        pool.release(third)
+        # 三个进程都已绑定会话，达到上限后不再启动新进程
+        assert len(pool.launched) == 3 and pool.stats()["spares"] == 0
+        try:
+            pool.acquire("d")
+            raise AssertionError("应当拒绝")
+        except RuntimeError as e:
+            assert "已达上限" in str(e)
+        assert len(pool.connections()) == 3 and pool.stats()["sessions"] == 3
+    finally:
+        pool.stop()
+    try:
+        pool.acquire("a")
+        raise AssertionError("停止后应当拒绝")
+    except RuntimeError as e:
+        assert "已停止" in str(e)
+    assert all(not worker.alive() for worker in pool.launched)
+
+
+def test_spawn_failure_is_reported():
+    pool = _StubPool(fail=True, size=2, spares=1)
+    pool.start()
+    try:
+        try:
+            pool.acquire("a")
+            raise AssertionError("应当报告启动失败")
+        except RuntimeError as e:
+            assert "启动失败" in str(e)
+        assert pool.spawn_failures >= 1
+    finally:
+        pool.stop()
+
+
+def test_borrow_returns_spares_with_clean_scene():
+    pool = _StubPool(size=2, spares=2)
+    pool.start()
+    try:
+        _wait_spares(pool, 2)
+        with pool.borrow(5) as borrowed:
+            assert len(borrowed) == 2
+            assert pool.stats()["spares"] == 0
+            for worker in borrowed:
+                assert worker.busy == 1
+                worker.conn.cmd.objects.append("tmp")
+            # 没有空闲备用进程时借到空列表；进程数已达上限，不会为此启动新进程
+            with pool.borrow(1) as none:
+                assert none == []
+        _wait_spares(pool, 2)
+        for worker in borrowed:
+            assert worker.busy == 0 and worker.conn.cmd.reinitialized == 1
+            assert worker.conn.cmd.objects == []
+        assert len(pool.launched) == 2
+        # 归还的进程仍可作为备用进程绑定会话
+        assert pool.acquire("a") in borrowed
+    finally:
+        pool.stop()
+
+
+def test_recycle_moves_scene_through_pse():
+    pool = _StubPool(size=3, spares=1, max_calls=2)
+    pool.start()
+    try:
+        _wait_spares(pool, 1)
+        old = pool.acquire("a")
+        old.conn.cmd.objects.append("1abc")
+        pool.release(old)
+        pool.release(pool.acquire("a"))
+        _wait_spares(pool, 1)
+
+        pool.check()
+        new = pool.acquire("a")
+        pool.release(new)
+        assert new is not old and not old.alive()
+        assert new.conn.cmd.objects == ["1abc"] and new.sessions == {"a"}
+        assert pool.restarts["max_calls"] == 1
+        assert pool.take_notice("a") is None
+        # 临时的 .pse 文件已删除
+        assert old.conn.cmd.saved and not any(os.path.exists(p) for p in old.conn.cmd.saved)
+        assert old not in pool._workers
+    finally:
+        pool.stop()
+
+
+def test_recycle_reports_failed_migration():
+    pool = _StubPool(size=3, spares=1, max_calls=1)
+    pool.start()
+    try:
+        _wait_spares(pool, 1)
+        old = pool.acquire("a")
+        pool.release(old)
+        _wait_spares(pool, 1)
+        pool._spares[0].conn.cmd.fail_load = True
+        pool.check()
+        new = pool.acquire("a")
+        pool.release(new)
+        assert new is not old
+        assert "场景未能迁移" in pool.take_notice("a")
+    finally:
+        pool.stop()
+
+
+def test_check_replaces_dead_worker_and_notifies_session():
+    pool = _StubPool(size=2, spares=1)
+    pool.start()
+    try:
+        _wait_spares(pool, 1)
+        worker = pool.acquire("a")
+        pool.release(worker)
+        worker.process.returncode = -11
+        pool.check()
+        assert pool.restarts["crashed"] == 1
+        assert pool.bound_connection("a") is None
+        _wait_spares(pool, 1)
+        replacement = pool.acquire("a")
+        pool.release(replacement)
+        assert replacement is not worker
+        assert "意外退出" in pool.take_notice("a")
+        assert pool.take_notice("a") is None
+    finally:
+        pool.stop()
+
+
+def test_check_releases_idle_sessions():
+    pool = _StubPool(size=2, spares=1, idle_timeout=0)
+    pool.start()
+    try:
+        _wait_spares(pool, 1)
+        worker = pool.acquire("a")
+        time.sleep(0.01)
+        # 正在执行的调用不会被当成空闲
+        pool.check()
+        assert pool.bound_connection("a") is worker.conn
+        pool.release(worker)
+        pool.check()
+        assert pool.bound_connection("a") is None and not worker.alive()
+        assert pool.restarts["idle"] == 1
+    finally:
+        pool.stop()
+
+
+def test_run_batches_isolates_failing_batches():
+    results = {}
+    lock = threading.Lock()
+
+    def call(cmd, batch):
+        if batch == 3:
+            raise ValueError("坏批次")
+        return (cmd, batch * 10)
+
+    def done(batch, result):
+        with lock:
+            results[batch] = result
+
+    def broken():
+        raise ConnectionError("借来的进程连不上")
+
+    run_batches([lambda: "primary", lambda: "spare", broken], range(8), call,
+                lambda batch, error: ("failed", error), done)
+    assert sorted(results) == list(range(8))
+    assert results[3] == ("failed", "ValueError: 坏批次")
+    assert all(results[b][1] == b * 10 and results[b][0] in ("primary", "spare") for b in results if b != 3)
+
+    # 主后端连不上时每一批都按失败处理，不会丢批次
+    results.clear()
+    run_batches([broken, broken], [1, 2], call, lambda batch, error: ("failed", error), done)
+    assert results == {1: ("failed", "ConnectionError: 借来的进程连不上"),
+                       2: ("failed", "ConnectionError: 借来的进程连不上")}
+
+if __name__ == "__main__":
+    failed = 0
+    for name, test in list(globals().items()):
+        if not name.startswith("test_") or not callable(test):
+            continue
+        try:
+            test()
+            print(f"✓ {name}")
+        except AssertionError as e:
+            failed += 1
+            print(f"✗ {name}: {e}")
+    sys.exit(1 if failed else 0)